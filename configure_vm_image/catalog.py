@@ -0,0 +1,501 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import time
+
+from configure_vm_image.common.codes import CATALOG_ERROR, CATALOG_ERROR_MSG, SUCCESS
+from configure_vm_image.common.defaults import (
+    CATALOG_IMAGE_REGEX,
+    CATALOG_PATH,
+    CATALOG_TIMEOUT,
+    IMAGE_CHECKSUM_TYPE,
+)
+from configure_vm_image.result import Result
+from configure_vm_image.store import file_checksum
+
+CATALOG_SCHEMA_VERSION = 1
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    root TEXT,
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT,
+    virtual_size INTEGER,
+    backing_file TEXT,
+    digest TEXT,
+    digest_type TEXT,
+    scanned_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_root ON images (root);
+CREATE INDEX IF NOT EXISTS images_digest ON images (digest);
+CREATE TABLE IF NOT EXISTS configurations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_path TEXT NOT NULL,
+    base_digest TEXT,
+    seed_digest TEXT,
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    configured_at REAL NOT NULL,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS configurations_base_seed
+    ON configurations (base_digest, seed_digest, configured_at);
+CREATE INDEX IF NOT EXISTS configurations_image_path
+    ON configurations (image_path, configured_at);
+"""
+
+# The magic numbers that the image formats are recognized by,
+# as the offset and the bytes at the offset
+IMAGE_FORMAT_MAGICS = (
+    ("qcow2", 0, b"QFI\xfb"),
+    ("vmdk", 0, b"KDMV"),
+    ("vhdx", 0, b"vhdxfile"),
+    ("vdi", 64, b"\x7f\x10\xda\xbe"),
+    ("iso", 0x8001, b"CD001"),
+)
+IMAGE_PROBE_SIZE = 0x8006
+
+
+def stat_key(stat):
+    """The fields of a stat result that identify the version of a file,
+    which changes whenever the file is replaced or written to"""
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def probe_image(path):
+    """Probes the format of the image from its header, together with the
+    virtual size and backing file of qcow2 images, without running qemu-img.
+    Images that are not recognized are probed as raw."""
+    probe = {"format": "raw", "virtual_size": None, "backing_file": None}
+    with open(path, "rb") as fh:
+        header = fh.read(IMAGE_PROBE_SIZE)
+        for image_format, offset, magic in IMAGE_FORMAT_MAGICS:
+            if header.startswith(magic, offset):
+                probe["format"] = image_format
+                break
+        if probe["format"] == "raw":
+            probe["virtual_size"] = os.fstat(fh.fileno()).st_size
+        elif probe["format"] == "qcow2" and len(header) >= 32:
+            backing_file_offset, backing_file_size = struct.unpack(">QI", header[8:20])
+            probe["virtual_size"] = struct.unpack(">Q", header[24:32])[0]
+            if backing_file_offset and backing_file_size:
+                fh.seek(backing_file_offset)
+                probe["backing_file"] = fh.read(backing_file_size).decode(
+                    "utf-8", errors="replace"
+                )
+    return probe
+
+
+def digest_seed(seed_paths, seed_template_values=None):
+    """Calculates the digest of a cloud-init seed from the content of its
+    files and the values that they are rendered with, which identifies the
+    configuration that an image was configured with"""
+    digest = hashlib.sha256()
+    for key in sorted(seed_paths):
+        path = seed_paths[key]
+        if not path or not os.path.exists(path):
+            continue
+        digest.update(key.encode("utf-8") + b"\0")
+        with open(path, "rb") as fh:
+            digest.update(hashlib.sha256(fh.read()).digest())
+    if seed_template_values:
+        digest.update(json.dumps(seed_template_values, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def walk_files(root, name_pattern):
+    """Yields the (path, stat) of the files below the root whose name matches
+    the pattern, where the stat is taken from the directory listing when
+    the filesystem provides it. Symbolic links are not followed."""
+    try:
+        entries = list(os.scandir(root))
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path, name_pattern)
+            elif entry.is_file(follow_symlinks=False) and name_pattern.match(
+                entry.name
+            ):
+                yield entry.path, entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+
+
+class Catalog:
+    """A persistent SQLite index of the images below a set of roots, which
+    records the stat of each image together with its probed format and digest,
+    and the provenance of the images that were configured. The probe and digest
+    of an image are kept for as long as its stat is unchanged, such that
+    a rescan only stats the files and a digest is only calculated once
+    for each version of an image. Each operation uses its own connection,
+    such that the catalog can be shared by concurrent jobs and processes."""
+
+    def __init__(self, path=CATALOG_PATH, timeout=CATALOG_TIMEOUT):
+        self.path = os.path.expanduser(path)
+        self.timeout = timeout
+        self._created = False
+
+    def _connect(self):
+        if not self._created:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        connection.row_factory = sqlite3.Row
+        if not self._created:
+            # The write ahead log lets the readers continue while a scan writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version < CATALOG_SCHEMA_VERSION:
+                connection.executescript(CATALOG_SCHEMA)
+                connection.execute(
+                    "PRAGMA user_version={}".format(CATALOG_SCHEMA_VERSION)
+                )
+                connection.commit()
+            self._created = True
+        return connection
+
+    def _execute(self, query, parameters=()):
+        connection = self._connect()
+        try:
+            with connection:
+                return [dict(row) for row in connection.execute(query, parameters)]
+        finally:
+            connection.close()
+
+    def _upsert(self, connection, path, stat, root=None, probe=None, digest=None):
+        device, inode, size, mtime_ns = stat_key(stat)
+        probe = probe or {}
+        connection.execute(
+            """INSERT INTO images (path, root, device, inode, size, mtime_ns,
+            format, virtual_size, backing_file, digest, digest_type, scanned_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET root = COALESCE(excluded.root, root),
+            device = excluded.device, inode = excluded.inode, size = excluded.size,
+            mtime_ns = excluded.mtime_ns, format = excluded.format,
+            virtual_size = excluded.virtual_size, backing_file = excluded.backing_file,
+            digest = excluded.digest, digest_type = excluded.digest_type,
+            scanned_at = excluded.scanned_at""",
+            (
+                path,
+                root,
+                device,
+                inode,
+                size,
+                mtime_ns,
+                probe.get("format"),
+                probe.get("virtual_size"),
+                probe.get("backing_file"),
+                digest[1] if digest else None,
+                digest[0] if digest else None,
+                time.time(),
+            ),
+        )
+
+    def scan(self, roots, name_regex=CATALOG_IMAGE_REGEX, probe=True):
+        """Indexes the images below the roots whose names match the name_regex.
+        Only the images that are new or whose stat has changed are probed, and
+        their digests are dropped until they are requested again, whereas an
+        unchanged image that was registered keeps its digest. Images that
+        were indexed below a root but no longer exist are removed.
+        Returns the number of images that were added, updated, unchanged and removed."""
+        name_pattern = re.compile(name_regex)
+        summary = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        connection = self._connect()
+        try:
+            with connection:
+                for root in roots:
+                    root = os.path.realpath(os.path.expanduser(root))
+                    indexed = {
+                        row["path"]: (
+                            row["device"],
+                            row["inode"],
+                            row["size"],
+                            row["mtime_ns"],
+                        )
+                        for row in connection.execute(
+                            """SELECT path, device, inode, size, mtime_ns
+                            FROM images WHERE root = ?""",
+                            (root,),
+                        )
+                    }
+                    for path, stat in walk_files(root, name_pattern):
+                        known = indexed.pop(path, None)
+                        if known is None:
+                            # The image might have been registered without a
+                            # root, or indexed below another root
+                            row = connection.execute(
+                                """SELECT device, inode, size, mtime_ns
+                                FROM images WHERE path = ?""",
+                                (path,),
+                            ).fetchone()
+                            if row is not None:
+                                known = tuple(row)
+                                if known == stat_key(stat):
+                                    connection.execute(
+                                        """UPDATE images SET root = COALESCE(root, ?)
+                                        WHERE path = ?""",
+                                        (root, path),
+                                    )
+                        if known == stat_key(stat):
+                            summary["unchanged"] += 1
+                            continue
+                        image_probe = None
+                        if probe:
+                            try:
+                                image_probe = probe_image(path)
+                            except OSError:
+                                pass
+                        self._upsert(
+                            connection, path, stat, root=root, probe=image_probe
+                        )
+                        summary["added" if known is None else "updated"] += 1
+                    for path in indexed:
+                        connection.execute("DELETE FROM images WHERE path = ?", (path,))
+                        summary["removed"] += 1
+        finally:
+            connection.close()
+        return summary
+
+    def get(self, path):
+        """Returns the indexed entry of the image, regardless of
+        whether the image has changed since it was indexed"""
+        rows = self._execute(
+            "SELECT * FROM images WHERE path = ?", (os.path.realpath(path),)
+        )
+        if not rows:
+            return None
+        return rows[0]
+
+    def lookup(self, path):
+        """Returns the indexed entry of the image if the image is unchanged
+        since it was indexed, which only requires it to be stat'ed"""
+        entry = self.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(entry["path"])
+        except OSError:
+            return None
+        if stat_key(stat) != (
+            entry["device"],
+            entry["inode"],
+            entry["size"],
+            entry["mtime_ns"],
+        ):
+            return None
+        return entry
+
+    def register(self, path, digest=None, digest_type=IMAGE_CHECKSUM_TYPE, probe=True):
+        """Indexes the image at path with its current stat, where a digest that
+        is already known, e.g. from the image store, is recorded without
+        calculating it. The probe and digest of an unchanged image are kept."""
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        entry = self.lookup(path)
+        if entry is not None:
+            image_probe = {
+                "format": entry["format"],
+                "virtual_size": entry["virtual_size"],
+                "backing_file": entry["backing_file"],
+            }
+            if digest is None and entry["digest"]:
+                digest = entry["digest"]
+                digest_type = entry["digest_type"]
+        elif probe:
+            image_probe = probe_image(path)
+        else:
+            image_probe = None
+        connection = self._connect()
+        try:
+            with connection:
+                self._upsert(
+                    connection,
+                    path,
+                    stat,
+                    probe=image_probe,
+                    digest=(digest_type, digest) if digest else None,
+                )
+        finally:
+            connection.close()
+        return self.get(path)
+
+    def digest(self, path, digest_type=IMAGE_CHECKSUM_TYPE):
+        """Returns the digest of the image, which is only calculated
+        if the image has changed since its digest was recorded"""
+        entry = self.lookup(path)
+        if entry and entry["digest"] and entry["digest_type"] == digest_type:
+            return entry["digest"]
+        digest = file_checksum(os.path.realpath(path), digest_type)
+        self.register(path, digest=digest, digest_type=digest_type)
+        return digest
+
+    def record_configuration(
+        self, image_path, base_digest=None, seed_digest=None, details=None
+    ):
+        """Records that the image was configured from the base image with the
+        base_digest and the seed with the seed_digest, together with the stat
+        of the configured image, such that it can be found while unchanged"""
+        image_path = os.path.realpath(image_path)
+        stat = os.stat(image_path)
+        device, inode, size, mtime_ns = stat_key(stat)
+        self.register(image_path)
+        self._execute(
+            """INSERT INTO configurations (image_path, base_digest, seed_digest,
+            device, inode, size, mtime_ns, configured_at, details)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                image_path,
+                base_digest,
+                seed_digest,
+                device,
+                inode,
+                size,
+                mtime_ns,
+                time.time(),
+                json.dumps(details or {}, sort_keys=True),
+            ),
+        )
+
+    def configurations(self, image_path=None, base_digest=None, seed_digest=None):
+        """Lists the recorded configurations, the latest first"""
+        conditions, parameters = [], []
+        if image_path is not None:
+            conditions.append("image_path = ?")
+            parameters.append(os.path.realpath(image_path))
+        if base_digest is not None:
+            conditions.append("base_digest = ?")
+            parameters.append(base_digest)
+        if seed_digest is not None:
+            conditions.append("seed_digest = ?")
+            parameters.append(seed_digest)
+        query = "SELECT * FROM configurations"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY configured_at DESC, id DESC"
+        configurations = self._execute(query, parameters)
+        for configuration in configurations:
+            configuration["details"] = json.loads(configuration["details"] or "{}")
+        return configurations
+
+    def latest_configured(self, base_digest, seed_digest=None):
+        """Returns the latest configuration of the base image with the seed,
+        whose image still exists unchanged since it was configured,
+        or None if there is no such image"""
+        for configuration in self.configurations(
+            base_digest=base_digest, seed_digest=seed_digest
+        ):
+            try:
+                stat = os.stat(configuration["image_path"])
+            except OSError:
+                continue
+            if stat_key(stat) == (
+                configuration["device"],
+                configuration["inode"],
+                configuration["size"],
+                configuration["mtime_ns"],
+            ):
+                return configuration
+        return None
+
+    def images(self, root=None, image_format=None, digest=None):
+        """Lists the indexed images, optionally only those below the root,
+        of the image format, or with the digest"""
+        conditions, parameters = [], []
+        if root is not None:
+            conditions.append("root = ?")
+            parameters.append(os.path.realpath(os.path.expanduser(root)))
+        if image_format is not None:
+            conditions.append("format = ?")
+            parameters.append(image_format)
+        if digest is not None:
+            conditions.append("digest = ?")
+            parameters.append(digest)
+        query = "SELECT * FROM images"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return self._execute(query + " ORDER BY path", parameters)
+
+
+def catalog_images(
+    roots=None,
+    catalog_path=CATALOG_PATH,
+    name_regex=CATALOG_IMAGE_REGEX,
+    image_format=None,
+    digests=False,
+    base_digest=None,
+    seed_digest=None,
+    verbose=False,
+    event_handler=None,
+):
+    """Rescans the roots into the catalog and lists the indexed images,
+    optionally only those of the image format. The digests of the images below
+    the roots are only calculated when digests is set, which is skipped for the
+    images whose digest is recorded. With a base_digest, the latest image that
+    was configured from the base image, with the seed_digest if given, is found instead.
+    """
+    result = Result(event_handler=event_handler)
+    catalog = Catalog(catalog_path)
+    roots = roots or []
+    try:
+        if roots:
+            summary = catalog.scan(roots, name_regex=name_regex)
+            result.add_event(
+                "Indexed {} new, {} changed and {} unchanged image(s), "
+                "and removed {} image(s)",
+                summary["added"],
+                summary["updated"],
+                summary["unchanged"],
+                summary["removed"],
+            )
+        if digests:
+            for root in roots:
+                for entry in catalog.images(root=root, image_format=image_format):
+                    if entry["digest"]:
+                        continue
+                    digest = catalog.digest(entry["path"])
+                    if verbose:
+                        result.add_event(
+                            "Calculated the digest: {} of: {}", digest, entry["path"]
+                        )
+
+        if base_digest:
+            configuration = catalog.latest_configured(
+                base_digest, seed_digest=seed_digest
+            )
+            if configuration is None:
+                return result.finish(
+                    CATALOG_ERROR,
+                    CATALOG_ERROR_MSG,
+                    catalog.path,
+                    "no unchanged image was configured from the base: {} "
+                    "with the seed: {}".format(base_digest, seed_digest or "any"),
+                )
+            result.image_path = configuration["image_path"]
+            result.set("images", [configuration])
+            return result.finish(
+                SUCCESS,
+                "Found the configured image: {}",
+                configuration["image_path"],
+            )
+
+        images = []
+        if roots:
+            for root in roots:
+                images.extend(catalog.images(root=root, image_format=image_format))
+        else:
+            images = catalog.images(image_format=image_format)
+        result.set("images", images)
+    except (OSError, sqlite3.Error, re.error) as err:
+        return result.finish(CATALOG_ERROR, CATALOG_ERROR_MSG, catalog.path, err)
+    return result.finish(
+        SUCCESS, "Found {} image(s) in the catalog: {}", len(images), catalog.path
+    )
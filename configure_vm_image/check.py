@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import time
+
+from configure_vm_image.catalog import stat_key
+from configure_vm_image.common.defaults import IMAGE_CHECK_CACHE_PATH
+from configure_vm_image.host import load_probe_cache, save_probe_cache
+from configure_vm_image.utils.io import which
+from configure_vm_image.utils.job import run_async
+
+CHECK_STATUS_OK = "ok"
+CHECK_STATUS_LEAKED = "leaked"
+CHECK_STATUS_CORRUPT = "corrupt"
+CHECK_STATUS_UNSUPPORTED = "unsupported"
+
+# The checks that are running, such that the concurrent jobs
+# of a session that configure copies of the same base image share one check
+_running_checks = {}
+
+
+def check_image_command(image_path, image_format):
+    return ["qemu-img", "check", "-f", image_format, "--output=json", image_path]
+
+
+def image_version(image_path):
+    """The version of the image, which changes whenever it is written to"""
+    stat = os.stat(image_path)
+    return "{}:{}".format(os.uname().nodename, ":".join(map(str, stat_key(stat))))
+
+
+def parse_check(output, error=""):
+    """Parses the JSON output of qemu-img check into the outcome of the check,
+    or returns None if the check could not be completed. Leaked clusters only
+    waste space, whereas corruptions and check errors make the image unusable."""
+    if "does not support checks" in error:
+        return {"status": CHECK_STATUS_UNSUPPORTED}
+    try:
+        report = json.loads(output)
+    except ValueError:
+        return None
+    if not isinstance(report, dict):
+        return None
+    check = {
+        "status": CHECK_STATUS_OK,
+        "corruptions": report.get("corruptions", 0),
+        "leaks": report.get("leaks", 0),
+        "check_errors": report.get("check-errors", 0),
+    }
+    if check["corruptions"] or check["check_errors"]:
+        check["status"] = CHECK_STATUS_CORRUPT
+    elif check["leaks"]:
+        check["status"] = CHECK_STATUS_LEAKED
+    return check
+
+
+def check_succeeded(check):
+    return check["status"] != CHECK_STATUS_CORRUPT
+
+
+async def _run_check(image_path, image_format, version, cache_path):
+    success, results = await run_async(check_image_command(image_path, image_format))
+    check = parse_check(results["output"], results["error"])
+    if check is None:
+        return False, results["error"] or results["output"]
+    check["version"] = version
+    check["checked_at"] = time.time()
+    # The image might have been replaced while it was checked
+    if image_version(image_path) == version:
+        cache = load_probe_cache(cache_path)
+        cache[image_path] = check
+        save_probe_cache(cache_path, cache)
+    return True, check
+
+
+async def check_integrity(image_path, image_format, cache_path=IMAGE_CHECK_CACHE_PATH):
+    """Checks the integrity of the image with qemu-img check, which validates
+    the header and the L1, L2 and refcount tables of the formats that support it.
+    The outcome is cached by the device, inode, size and modification time of
+    the image, such that an image is only checked again once it has changed.
+    Returns (success, check) where check is the outcome with whether it was
+    cached, None if qemu-img is not installed, or an error message on failure."""
+    image_path = os.path.realpath(image_path)
+    try:
+        version = image_version(image_path)
+    except OSError as err:
+        return False, str(err)
+
+    check = load_probe_cache(cache_path).get(image_path)
+    if isinstance(check, dict) and check.get("version") == version:
+        return True, dict(check, cached=True)
+    if not which("qemu-img"):
+        return True, None
+
+    key = (image_path, version)
+    if key not in _running_checks:
+        _running_checks[key] = asyncio.ensure_future(
+            _run_check(image_path, image_format, version, cache_path)
+        )
+        _running_checks[key].add_done_callback(lambda _: _running_checks.pop(key, None))
+    # The check is shielded, since it is shared with the other jobs
+    # that wait for it, which must not be cancelled along with this one
+    success, check = await asyncio.shield(_running_checks[key])
+    if not success:
+        return False, check
+    return True, dict(check, cached=False)
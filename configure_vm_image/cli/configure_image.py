@@ -1,7 +1,5 @@
 import argparse
-import asyncio
-import inspect
-import json
+import importlib
 import sys
 
 from configure_vm_image._version import __version__
@@ -10,18 +8,41 @@ from configure_vm_image.cli.helpers import (
     strip_argument_group_prefix,
 )
 from configure_vm_image.common.codes import (
+    CANCELLED_ERROR,
+    CANCELLED_ERROR_MSG,
     JSON_DUMP_ERROR,
     JSON_DUMP_ERROR_MSG,
     SUCCESS,
 )
-from configure_vm_image.common.defaults import CONFIGURE_ARGUMENT
+from configure_vm_image.common.defaults import (
+    CATALOG_ARGUMENT,
+    CONFIGURE_ARGUMENT,
+    COORDINATOR_ARGUMENT,
+    EVENT_RESULT,
+    FETCH_ARGUMENT,
+    GC_ARGUMENT,
+    OUTPUT_FORMAT_JSON,
+    OUTPUT_FORMAT_NDJSON,
+    WORKER_ARGUMENT,
+)
 from configure_vm_image.common.utils import error_print, to_str
 
 SCRIPT_NAME = __file__
+# The operations that are selected by the first argument, where the configure
+# operation is run when no operation is given. An image whose path is the name
+# of an operation is configured by giving the configure operation explicitly.
+OPERATIONS = {
+    "configure": CONFIGURE_ARGUMENT,
+    "gc": GC_ARGUMENT,
+    "coordinator": COORDINATOR_ARGUMENT,
+    "worker": WORKER_ARGUMENT,
+    "fetch": FETCH_ARGUMENT,
+    "catalog": CATALOG_ARGUMENT,
+}
 
 
 def import_from_module(module_path, module_name, func_name):
-    module = __import__(module_path, fromlist=[module_name])
+    module = importlib.import_module(module_path)
     return getattr(module, func_name)
 
 
@@ -72,8 +93,21 @@ def cli_exec(arguments):
     action_kwargs = strip_argument_group_prefix(action_kwargs, argument_groups)
 
     action_args = positional_arguments
+    # asyncio and inspect are deferred until an operation is executed, such that
+    # --help, --version and argument errors do not pay for their import time
+    import inspect
+
     if inspect.iscoroutinefunction(func):
-        return asyncio.run(func(*action_args, **action_kwargs))
+        import asyncio
+
+        from configure_vm_image.utils.job import cancel_on_signals
+
+        # SIGINT and SIGTERM cancel the operation, which lets it tear down
+        # the VM it might have started before the CLI exits
+        try:
+            return asyncio.run(cancel_on_signals(func(*action_args, **action_kwargs)))
+        except asyncio.CancelledError:
+            return CANCELLED_ERROR, {"msg": CANCELLED_ERROR_MSG.format(func_name)}
     return func(*action_args, **action_kwargs)
 
 
@@ -87,15 +121,63 @@ def add_base_cli_operations(parser):
     )
 
 
+def print_ndjson(event):
+    import json
+
+    # Flushed such that a supervisor that reads the output
+    # over a pipe receives each event as soon as it happens
+    print(
+        json.dumps(event, separators=(",", ":"), default=to_str),
+        flush=True,
+    )
+
+
+def print_ndjson_event(event):
+    print_ndjson(event.asdict())
+
+
+def print_ndjson_result(return_code, result):
+    event = {"event": EVENT_RESULT}
+    if hasattr(result, "asdict"):
+        event.update(result.asdict(events=False))
+    else:
+        event["msg"] = result.get("msg", "")
+    event["return_code"] = return_code
+    if return_code == SUCCESS:
+        event["status"] = "success"
+    else:
+        event["status"] = "failed"
+    try:
+        print_ndjson(event)
+    except Exception as err:
+        error_print(JSON_DUMP_ERROR_MSG.format(err))
+        return JSON_DUMP_ERROR
+    return return_code
+
+
 def main(args):
+    operation, argument_group, prog = "configure", CONFIGURE_ARGUMENT, SCRIPT_NAME
+    epilog = (
+        "Run '{0} gc --help' for how to remove the VMs and scratch files left behind "
+        "by earlier configurations, '{0} coordinator --help' and '{0} worker --help' "
+        "for how to configure images across multiple hosts, '{0} fetch --help' for "
+        "how to fetch base images into the image store, and '{0} catalog --help' "
+        "for how to index and query the images.".format(SCRIPT_NAME)
+    )
+    if args and args[0] in OPERATIONS:
+        operation, args = args[0], args[1:]
+        argument_group = OPERATIONS[operation]
+        prog, epilog = "{} {}".format(SCRIPT_NAME, operation), None
+
     parser = argparse.ArgumentParser(
-        prog=SCRIPT_NAME,
+        prog=prog,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog,
     )
     # Add the basic CLI functions
     add_base_cli_operations(parser)
-    # Add the configure image CLI
-    add_cli_operations(parser, "configure")
+    # Add the operation CLI
+    add_cli_operations(parser, operation)
 
     parsed_args = parser.parse_args(args)
     # Convert to a dictionary
@@ -105,17 +187,31 @@ def main(args):
         raise ValueError("Missing function to execute in prepared arguments")
 
     func = arguments.pop("func")
+    output_format = arguments.pop(
+        "{}_output".format(argument_group), OUTPUT_FORMAT_JSON
+    )
+    if output_format == OUTPUT_FORMAT_NDJSON:
+        arguments["{}_event_handler".format(argument_group)] = print_ndjson_event
     return_code, result_dict = func(arguments)
 
+    if output_format == OUTPUT_FORMAT_NDJSON:
+        return print_ndjson_result(return_code, result_dict)
+
     response = {}
     if return_code == SUCCESS:
         response["status"] = "success"
     else:
         response["status"] = "failed"
-    if arguments.get("{}_verbose".format(CONFIGURE_ARGUMENT), False):
+    if arguments.get("{}_verbose".format(argument_group), False):
         response["outputs"] = result_dict.get("verbose_outputs", [])
     response["msg"] = result_dict.get("msg", "")
     response["return_code"] = return_code
+    # The payloads of the operation, e.g. the plan or the exported images
+    for key, value in getattr(result_dict, "data", {}).items():
+        if value is not None:
+            response[key] = value
+
+    import json
 
     try:
         output = json.dumps(response, indent=4, sort_keys=True, default=to_str)
@@ -3,8 +3,10 @@ import os
 from configure_vm_image.cli.parsers.configure import configure_group
 from configure_vm_image.common.defaults import (
     CLOUD_INIT_DIR,
-    RES_DIR,
-    TMP_DIR,
+    COMPLETION_MODE_CONSOLE,
+    CONFIGURE_IMAGE_TMP_DIR,
+    IMAGE_LOCK_TIMEOUT,
+    TEMPLATE_PROFILE_AUTO,
 )
 from configure_vm_image.common.utils import expand_path
 from configure_vm_image.configure import configure_vm_image
@@ -33,19 +35,23 @@ def corc_configure_vm_cli_exec(args):
     config_network_config_path = args.get(
         "config_network_config_path", os.path.join(CLOUD_INIT_DIR, "network-config")
     )
-    cloud_init_iso_output_path = args.get(
-        "cloud_init_iso_output_path", os.path.join(CLOUD_INIT_DIR, "cidata.iso")
-    )
-    configure_vm_name = args.get("configure_vm_name", "configure-vm-image")
-    configure_vm_log_path = args.get(
-        "configure_vm_log_path", os.path.join(TMP_DIR, "configure-vm.log")
-    )
-    configure_vm_template_path = args.get(
-        "configure_vm_template_path",
-        os.path.join(RES_DIR, "configure-vm-template.xml.j2"),
-    )
+    cloud_init_iso_output_path = args.get("cloud_init_iso_output_path", None)
+    cloud_init_iso_cache_dir = args.get("cloud_init_iso_cache_dir", None)
+    seed_template_values = args.get("seed_template_values", None)
+    configure_vm_name = args.get("configure_vm_name", None)
+    configure_vm_log_path = args.get("configure_vm_log_path", None)
+    configure_vm_template_path = args.get("configure_vm_template_path", None)
+    template_profile = args.get("template_profile", TEMPLATE_PROFILE_AUTO)
     configure_vm_template_values = args.get("configure_vm_template_values", {})
     reset_operations = args.get("reset_operations", "defaults,-ssh-userdir")
+    timeout = args.get("timeout", None)
+    phase_timeouts = args.get("phase_timeouts", None)
+    scratch_dir = args.get("scratch_dir", CONFIGURE_IMAGE_TMP_DIR)
+    keep_scratch_dir = args.get("keep_scratch_dir", False)
+    completion_mode = args.get("completion_mode", COMPLETION_MODE_CONSOLE)
+    image_lock = args.get("image_lock", True)
+    lock_timeout = args.get("lock_timeout", IMAGE_LOCK_TIMEOUT)
+    plan = args.get("plan", False)
     verbose = args.get("verbose", False)
 
     return configure_vm_image(
@@ -55,11 +61,34 @@ def corc_configure_vm_cli_exec(args):
         meta_data_path=expand_path(config_meta_data_path),
         vendor_data_path=expand_path(config_vendor_data_path),
         network_config_path=expand_path(config_network_config_path),
-        cloud_init_iso_output_path=expand_path(cloud_init_iso_output_path),
+        cloud_init_iso_output_path=(
+            expand_path(cloud_init_iso_output_path)
+            if cloud_init_iso_output_path
+            else None
+        ),
+        cloud_init_iso_cache_dir=(
+            expand_path(cloud_init_iso_cache_dir) if cloud_init_iso_cache_dir else None
+        ),
+        seed_template_values=seed_template_values,
         configure_vm_name=configure_vm_name,
-        configure_vm_log_path=expand_path(configure_vm_log_path),
-        configure_vm_template_path=expand_path(configure_vm_template_path),
+        configure_vm_log_path=(
+            expand_path(configure_vm_log_path) if configure_vm_log_path else None
+        ),
+        configure_vm_template_path=(
+            expand_path(configure_vm_template_path)
+            if configure_vm_template_path
+            else None
+        ),
+        template_profile=template_profile,
         configure_vm_template_values=configure_vm_template_values,
         reset_operations=reset_operations,
+        timeout=timeout,
+        phase_timeouts=phase_timeouts,
+        scratch_dir=expand_path(scratch_dir),
+        keep_scratch_dir=keep_scratch_dir,
+        completion_mode=completion_mode,
+        image_lock=image_lock,
+        lock_timeout=lock_timeout,
+        plan=plan,
         verbose=verbose,
     )
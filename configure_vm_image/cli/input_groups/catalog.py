@@ -0,0 +1,9 @@
+from configure_vm_image.cli.parsers.catalog import catalog_group
+from configure_vm_image.common.defaults import CATALOG_ARGUMENT
+
+
+def catalog_groups(parser):
+    catalog_group(parser)
+
+    argument_groups = [CATALOG_ARGUMENT]
+    return argument_groups
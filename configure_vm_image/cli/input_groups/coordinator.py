@@ -0,0 +1,9 @@
+from configure_vm_image.cli.parsers.coordinator import coordinator_group
+from configure_vm_image.common.defaults import COORDINATOR_ARGUMENT
+
+
+def coordinator_groups(parser):
+    coordinator_group(parser)
+
+    argument_groups = [COORDINATOR_ARGUMENT]
+    return argument_groups
@@ -0,0 +1,9 @@
+from configure_vm_image.cli.parsers.fetch import fetch_group
+from configure_vm_image.common.defaults import FETCH_ARGUMENT
+
+
+def fetch_groups(parser):
+    fetch_group(parser)
+
+    argument_groups = [FETCH_ARGUMENT]
+    return argument_groups
@@ -0,0 +1,9 @@
+from configure_vm_image.cli.parsers.gc import gc_group
+from configure_vm_image.common.defaults import GC_ARGUMENT
+
+
+def gc_groups(parser):
+    gc_group(parser)
+
+    argument_groups = [GC_ARGUMENT]
+    return argument_groups
@@ -0,0 +1,9 @@
+from configure_vm_image.cli.parsers.worker import worker_group
+from configure_vm_image.common.defaults import WORKER_ARGUMENT
+
+
+def worker_groups(parser):
+    worker_group(parser)
+
+    argument_groups = [WORKER_ARGUMENT]
+    return argument_groups
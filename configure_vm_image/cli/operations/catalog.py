@@ -0,0 +1,5 @@
+from configure_vm_image.catalog import catalog_images
+
+
+def catalog_operation(*args, **kwargs):
+    return catalog_images(*args, **kwargs)
@@ -0,0 +1,5 @@
+from configure_vm_image.cluster import coordinate
+
+
+async def coordinator_operation(*args, **kwargs):
+    return await coordinate(*args, **kwargs)
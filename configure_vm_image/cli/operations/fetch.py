@@ -0,0 +1,5 @@
+from configure_vm_image.store import fetch_image
+
+
+async def fetch_operation(*args, **kwargs):
+    return await fetch_image(*args, **kwargs)
@@ -0,0 +1,5 @@
+from configure_vm_image.gc import collect_garbage
+
+
+async def gc_operation(*args, **kwargs):
+    return await collect_garbage(*args, **kwargs)
@@ -0,0 +1,5 @@
+from configure_vm_image.cluster import work
+
+
+async def worker_operation(*args, **kwargs):
+    return await work(*args, **kwargs)
@@ -0,0 +1,85 @@
+from configure_vm_image.common.defaults import (
+    CATALOG_ARGUMENT,
+    CATALOG_IMAGE_REGEX,
+    CATALOG_PATH,
+    OUTPUT_FORMAT_JSON,
+    OUTPUT_FORMATS,
+)
+
+
+def catalog_group(parser):
+    catalog_group_ = parser.add_argument_group(
+        title="Index and query the images in the catalog"
+    )
+    catalog_group_.add_argument(
+        "--root",
+        "-r",
+        dest="{}_roots".format(CATALOG_ARGUMENT),
+        action="append",
+        default=None,
+        help="""A directory whose images are indexed in the catalog, which can be given
+        multiple times. Only the images that are new or have changed since the last scan
+        are probed, and the images that no longer exist are removed.""",
+    )
+    catalog_group_.add_argument(
+        "--catalog-path",
+        "-cp",
+        dest="{}_catalog_path".format(CATALOG_ARGUMENT),
+        default=CATALOG_PATH,
+        help="The path to the catalog database.",
+    )
+    catalog_group_.add_argument(
+        "--name-regex",
+        "-nr",
+        dest="{}_name_regex".format(CATALOG_ARGUMENT),
+        default=CATALOG_IMAGE_REGEX,
+        help="""The regular expression that the names of the images below the --root
+        directories match.""",
+    )
+    catalog_group_.add_argument(
+        "--image-format",
+        "-if",
+        dest="{}_image_format".format(CATALOG_ARGUMENT),
+        default=None,
+        help="Only list the images of the probed format, e.g. qcow2.",
+    )
+    catalog_group_.add_argument(
+        "--digests",
+        dest="{}_digests".format(CATALOG_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="""Flag to calculate the digests of the images below the --root
+        directories, which is only done for the images whose digest is not recorded.""",
+    )
+    catalog_group_.add_argument(
+        "--base-digest",
+        "-bd",
+        dest="{}_base_digest".format(CATALOG_ARGUMENT),
+        default=None,
+        help="""Find the latest image that was configured from the base image with the
+        digest, and is unchanged since.""",
+    )
+    catalog_group_.add_argument(
+        "--seed-digest",
+        "-sd",
+        dest="{}_seed_digest".format(CATALOG_ARGUMENT),
+        default=None,
+        help="""Only find the latest image that was configured with the cloud-init seed
+        with the digest.""",
+    )
+    catalog_group_.add_argument(
+        "--output",
+        "-o",
+        dest="{}_output".format(CATALOG_ARGUMENT),
+        choices=OUTPUT_FORMATS,
+        default=OUTPUT_FORMAT_JSON,
+        help="The format of the output.",
+    )
+    catalog_group_.add_argument(
+        "--verbose",
+        "-v",
+        dest="{}_verbose".format(CATALOG_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="Flag to enable verbose output.",
+    )
@@ -4,16 +4,34 @@ from configure_vm_image.cli.parsers.actions import (
     KeyValueAction,
     PositionalArgumentsAction,
 )
+from configure_vm_image.common.codes import (
+    CHECK_ERROR,
+    LOCK_ERROR,
+    RESIZE_ERROR,
+    SEED_VALIDATION_ERROR,
+)
 from configure_vm_image.common.defaults import (
+    CATALOG_PATH,
     CLOUD_INIT_DIR,
+    COMPLETION_MODE_CONSOLE,
+    COMPLETION_MODES,
     CONFIGURE_ARGUMENT,
-    CONFIGURE_VM_MACHINE,
+    CONFIGURE_IMAGE_TMP_DIR,
+    CONFIGURE_PHASE_TIMEOUTS,
     CONFIGURE_VM_MEMORY,
     CONFIGURE_VM_VCPUS,
-    CPU_ARCHITECTURE,
-    RES_DIR,
-    TMP_DIR,
+    EXPORT_FORMATS,
+    EXPORT_MAX_PARALLEL,
+    IMAGE_LOCK_TIMEOUT,
+    OUTPUT_FORMAT_JSON,
+    OUTPUT_FORMATS,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_LINK_AUTO,
+    RESULT_CACHE_LINK_MODES,
+    TEMPLATE_PROFILE_AUTO,
+    TEMPLATE_PROFILES,
     VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+    VM_ORCHESTRATOR_QEMU,
 )
 
 
@@ -62,32 +80,79 @@ def configure_group(parser):
         "--configure-vm-name",
         "-cv-name",
         dest="{}_configure_vm_name".format(CONFIGURE_ARGUMENT),
-        default="configure-vm-image",
-        help="The name of the VM that is used to configure the image.",
+        default=None,
+        help="""The name of the VM that is used to configure the image.
+        If not set, a unique name is generated for each configuration.
+        """,
     )
     configure_group_.add_argument(
         "--cloud-init-iso-output-path",
         "-ci-output",
         dest="{}_cloud_init_iso_output_path".format(CONFIGURE_ARGUMENT),
-        default=os.path.join(CLOUD_INIT_DIR, "cidata.iso"),
-        help="""The path to the cloud-init output iso image file that is generated
-        based on the data defined in the user-data, meta-data, vendor-data, and network-config files.
-        This seed iso file is then subsequently used to configure the defined input image.
+        default=None,
+        help="""The path to the cloud-init output iso image file that is generated based
+        on the data defined in the user-data, meta-data, vendor-data, and network-config
+        files. This seed iso file is then subsequently used to configure the defined
+        input image. If not set, the iso is generated in the scratch directory of the
+        configuration job.
+        """,
+    )
+    configure_group_.add_argument(
+        "--cloud-init-iso-cache-dir",
+        "-ci-cache",
+        dest="{}_cloud_init_iso_cache_dir".format(CONFIGURE_ARGUMENT),
+        default=None,
+        help="""The path to a directory where generated cloud-init iso images are
+        cached. When set, the iso is named after the digest of the rendered seed content
+        and is reused across runs, in which case the --cloud-init-iso-output-path is
+        ignored.
+        """,
+    )
+    configure_group_.add_argument(
+        "--config-template-values",
+        "-ci-tv",
+        dest="{}_seed_template_values".format(CONFIGURE_ARGUMENT),
+        metavar="KEY=VALUE",
+        action=KeyValueAction,
+        default=None,
+        help="""A comma seperated set of KEY=VALUE pairs, e.g.
+        hostname=node0,instance_id=node0. When set, the cloud-init configuration files
+        are rendered as Jinja2 templates with these values before the cloud-init iso is
+        generated.
         """,
     )
     configure_group_.add_argument(
         "--configure-vm-log-path",
         "-cv-log",
         dest="{}_configure_vm_log_path".format(CONFIGURE_ARGUMENT),
-        default=os.path.join(TMP_DIR, "configure-vm.log"),
-        help="""The path to the log file that is used to log the output of the configuring VM.""",
+        default=None,
+        help="""The path to the log file that is used to log the output of the
+        configuring VM. If not set, the log is written to the scratch directory of the
+        configuration job.""",
     )
     configure_group_.add_argument(
         "--configure-vm-template-path",
         "-cv-tp",
         dest="{}_configure_vm_template_path".format(CONFIGURE_ARGUMENT),
-        default=os.path.join(RES_DIR, "configure-vm-template.xml.j2"),
-        help="""The path to the template file that is used to configure the VM.""",
+        default=None,
+        help="""The path to the template file that is used to configure the VM.
+        If not set, the template is selected by the --configure-vm-template-profile.""",
+    )
+    configure_group_.add_argument(
+        "--configure-vm-template-profile",
+        "-cv-profile",
+        dest="{}_template_profile".format(CONFIGURE_ARGUMENT),
+        choices=TEMPLATE_PROFILES,
+        default=TEMPLATE_PROFILE_AUTO,
+        help="""The VM template profile that is used when no
+        --configure-vm-template-path is set. The 'default' profile emulates the VM with
+        IDE devices, whereas the 'performance' profile uses KVM when available, virtio
+        devices, and an unsafe disk cache since the configuring VM is discarded after
+        the configuration. The 'performance' profile can boot a kernel directly via the
+        kernel_path, initrd_path and kernel_cmdline template values. With 'auto', the
+        'performance' profile is selected when KVM can be used on the host, and the
+        'default' profile otherwise.
+        """,
     )
     configure_group_.add_argument(
         "--configure-vm-template-values",
@@ -95,23 +160,26 @@ def configure_group(parser):
         dest="{}_configure_vm_template_values".format(CONFIGURE_ARGUMENT),
         metavar="KEY=VALUE",
         action=KeyValueAction,
-        default="num_vcpus={},memory_size={},cpu_architecture={},machine={}".format(
-            CONFIGURE_VM_VCPUS,
-            CONFIGURE_VM_MEMORY,
-            CPU_ARCHITECTURE,
-            CONFIGURE_VM_MACHINE,
-        ),
-        help="""An additional set of comma seperated KEY=VALUE pair arguments that should be passed to the --configure-vm-template-path.
-        If a value contains spaces, you should define it with quotes.
-        If not included, the required 'cd_iso_path' and 'configure_vm_log_path' are automatically added.
-        """,
+        default=None,
+        help="""An additional set of comma seperated KEY=VALUE pair arguments that
+        should be passed to the --configure-vm-template-path. If a value contains
+        spaces, you should define it with quotes. If not included, the required
+        'cd_iso_path' and 'configure_vm_log_path' are automatically added. The
+        'num_vcpus' and 'memory_size' default to {} and {}, whereas the
+        'cpu_architecture' and 'machine' are probed from the image name or its contents
+        and from the machine types that QEMU supports on the host.
+        """.format(CONFIGURE_VM_VCPUS, CONFIGURE_VM_MEMORY),
     )
     configure_group_.add_argument(
         "--configure-vm-orchestrator",
         "-cv-orch",
         dest="{}_configure_vm_orchestrator".format(CONFIGURE_ARGUMENT),
         default=VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
-        help="The orchestrator to use when provisioning the virtual machine that is used to configure a particular virtual machine image",
+        help="""The orchestrator to use when provisioning the virtual machine that is
+        used to configure a particular virtual machine image. With '{}', the virtual
+        machine is run with qemu-system directly and controlled via QMP, which does not
+        require libvirt.
+        """.format(VM_ORCHESTRATOR_QEMU),
     )
     configure_group_.add_argument(
         "--configure-vm-remove-options",
@@ -127,6 +195,225 @@ def configure_group(parser):
         default="defaults,-ssh-userdir",
         help="""The operations to perform during the reset operation.""",
     )
+    configure_group_.add_argument(
+        "--timeout",
+        "-t",
+        dest="{}_timeout".format(CONFIGURE_ARGUMENT),
+        type=float,
+        default=None,
+        help="""The overall number of seconds that the configuration is allowed to take.
+        When exceeded, the configuring VM is removed and the configuration fails. If not
+        set, the configuration is only bounded by the --phase-timeouts.
+        """,
+    )
+    configure_group_.add_argument(
+        "--phase-timeouts",
+        "-pt",
+        dest="{}_phase_timeouts".format(CONFIGURE_ARGUMENT),
+        metavar="PHASE=SECONDS",
+        action=KeyValueAction,
+        default=None,
+        help="""A comma seperated set of PHASE=SECONDS pairs that overrides the default
+        timeout of the individual configuration phases, e.g. configure=7200,reset=600.
+        The phases are: {}.
+        """.format(", ".join(CONFIGURE_PHASE_TIMEOUTS.keys())),
+    )
+    configure_group_.add_argument(
+        "--completion-mode",
+        "-cm",
+        dest="{}_completion_mode".format(CONFIGURE_ARGUMENT),
+        choices=COMPLETION_MODES,
+        default=COMPLETION_MODE_CONSOLE,
+        help="""How the completion of the configuration inside the VM is detected. With
+        'console', the console log of the VM is monitored for the cloud-init finished
+        message. With 'channel', cloud-init reports its status over a virtio-serial
+        channel, which requires the --configure-vm-template-path to define the status
+        channel. With 'poweroff', cloud-init powers off the VM once it has finished,
+        where a VM that shut off cleanly is configured and a VM that crashed is not.
+        """,
+    )
+    configure_group_.add_argument(
+        "--scratch-dir",
+        "-sd",
+        dest="{}_scratch_dir".format(CONFIGURE_ARGUMENT),
+        default=CONFIGURE_IMAGE_TMP_DIR,
+        help="""The directory in which each configuration job creates its own private
+        scratch directory for the files it only requires while it runs, such as the
+        cloud-init iso, the VM log and the job journal. Placing it on a tmpfs, e.g.
+        /dev/shm, avoids any disk I/O for these files.
+        """,
+    )
+    configure_group_.add_argument(
+        "--keep-scratch-dir",
+        "-ksd",
+        dest="{}_keep_scratch_dir".format(CONFIGURE_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="""Flag to keep the scratch directory of a successful configuration job.
+        The scratch directory of a failed job is always kept such that its log can be
+        inspected.""",
+    )
+    configure_group_.add_argument(
+        "--lock-timeout",
+        "-lt",
+        dest="{}_lock_timeout".format(CONFIGURE_ARGUMENT),
+        type=float,
+        default=IMAGE_LOCK_TIMEOUT,
+        help="""The number of seconds to wait for the lock on the image when it is being
+        configured by another job. With 0, the configuration fails immediately with the
+        return code {} if the image is locked, such that a scheduler can skip the image
+        instead of waiting for it.
+        """.format(LOCK_ERROR),
+    )
+    configure_group_.add_argument(
+        "--no-image-lock",
+        dest="{}_image_lock".format(CONFIGURE_ARGUMENT),
+        action="store_false",
+        default=True,
+        help="""Flag to not lock the image while it is configured. By default, a lock
+        file and a lease file are created next to the image, which prevent concurrent
+        jobs, also on other hosts that share the image storage, from configuring the
+        same image at once.
+        """,
+    )
+    configure_group_.add_argument(
+        "--catalog-path",
+        "-cp",
+        dest="{}_catalog_path".format(CONFIGURE_ARGUMENT),
+        default=None,
+        help="""The path to the catalog that the configuration is recorded in as the
+        provenance of the image, which the latest configured image of a base image and
+        seed can be found by, e.g. {}.
+        """.format(CATALOG_PATH),
+    )
+    configure_group_.add_argument(
+        "--base-digest",
+        "-bd",
+        dest="{}_base_digest".format(CONFIGURE_ARGUMENT),
+        default=None,
+        help="""The digest of the image before it is configured, which is recorded in
+        the --catalog-path. By default, it is taken from the catalog, which only
+        calculates it if the image is new or has changed.
+        """,
+    )
+    configure_group_.add_argument(
+        "--result-cache-dir",
+        "-rcd",
+        dest="{}_result_cache_dir".format(CONFIGURE_ARGUMENT),
+        default=None,
+        help="""The directory of the result cache, e.g. {}, which the configured image
+        is stored in. When the image was configured before from the same base image with
+        the same seed, VM template, reset operations, completion mode and tool versions,
+        the configured image is restored from the cache instead of being configured
+        again.
+        """.format(RESULT_CACHE_DIR),
+    )
+    configure_group_.add_argument(
+        "--result-cache-link",
+        "-rcl",
+        dest="{}_result_cache_link".format(CONFIGURE_ARGUMENT),
+        choices=RESULT_CACHE_LINK_MODES,
+        default=RESULT_CACHE_LINK_AUTO,
+        help="""How a cached image is restored at the image path. With 'auto', the image
+        is cloned if the filesystem supports it, e.g. on btrfs and xfs, and copied
+        otherwise. A 'hardlink' shares the file with the cache, such that the restored
+        image must not be modified.
+        """,
+    )
+    configure_group_.add_argument(
+        "--rebuild",
+        dest="{}_rebuild".format(CONFIGURE_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="""Flag to configure the image even if its result is cached, which replaces
+        the cached result.""",
+    )
+    configure_group_.add_argument(
+        "--check-integrity",
+        dest="{}_integrity_check".format(CONFIGURE_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="""Flag to check the integrity of the image with qemu-img check before the
+        configuring VM is booted, which runs while the cloud-init seed is built. The
+        outcome is cached until the image changes, such that a shared base image is only
+        checked once. The return code is {} if the image is corrupt.
+        """.format(CHECK_ERROR),
+    )
+    configure_group_.add_argument(
+        "--no-seed-validation",
+        dest="{}_seed_validation".format(CONFIGURE_ARGUMENT),
+        action="store_false",
+        default=True,
+        help="""Flag to not validate the cloud-init seed before the cloud-init iso is
+        generated. By default, the YAML of each seed file, the #cloud-config header and
+        the known cloud-config keys of the user-data and vendor-data, and the version of
+        the network-config are validated offline, such that a broken seed fails before
+        the configuring VM is booted. The return code is {} if the seed is invalid.
+        """.format(SEED_VALIDATION_ERROR),
+    )
+    configure_group_.add_argument(
+        "--resize",
+        dest="{}_resize".format(CONFIGURE_ARGUMENT),
+        default=None,
+        help="""The size that the image is resized to before it is configured, e.g.
+        20GiB, or grown by if it starts with a +, e.g. +10G. The image is grown sparsely
+        with qemu-img resize, and the seed makes cloud-init grow the root partition and
+        filesystem in the boot that configures the image. The return code is {} if the
+        image can not be resized, which includes a size that would shrink it.
+        """.format(RESIZE_ERROR),
+    )
+    configure_group_.add_argument(
+        "--export-format",
+        "-ef",
+        dest="{}_export_formats".format(CONFIGURE_ARGUMENT),
+        action="append",
+        choices=EXPORT_FORMATS,
+        default=None,
+        help="""A format that the configured image is exported to with qemu-img convert,
+        which can be given multiple times. The formats are converted concurrently from
+        the configured image, and the size and digest of each exported image are
+        included in the result.
+        """,
+    )
+    configure_group_.add_argument(
+        "--export-dir",
+        "-ed",
+        dest="{}_export_dir".format(CONFIGURE_ARGUMENT),
+        default=None,
+        help="""The directory that the exported images are written to. By default, they
+        are written next to the configured image.""",
+    )
+    configure_group_.add_argument(
+        "--export-parallel",
+        "-ep",
+        dest="{}_export_parallel".format(CONFIGURE_ARGUMENT),
+        type=int,
+        default=EXPORT_MAX_PARALLEL,
+        help="The maximum number of formats that are converted at once.",
+    )
+    configure_group_.add_argument(
+        "--plan",
+        dest="{}_plan".format(CONFIGURE_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="""Flag to only plan the configuration without executing anything. The
+        output includes the resolved paths, template values and every command that the
+        configuration would run, together with an estimate of the vCPUs, memory, scratch
+        disk space and time that it requires.
+        """,
+    )
+    configure_group_.add_argument(
+        "--output",
+        "-o",
+        dest="{}_output".format(CONFIGURE_ARGUMENT),
+        choices=OUTPUT_FORMATS,
+        default=OUTPUT_FORMAT_JSON,
+        help="""The format of the output. With 'json', the result is printed as a single
+        JSON document once the configuration has finished. With 'ndjson', each phase
+        transition, console marker hit and command completion is printed as a compact
+        JSON line as it happens, followed by a final line with the result.
+        """,
+    )
     configure_group_.add_argument(
         "--verbose",
         "-v",
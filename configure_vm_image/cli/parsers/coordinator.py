@@ -0,0 +1,95 @@
+from configure_vm_image.cli.parsers.actions import PositionalArgumentsAction
+from configure_vm_image.common.defaults import (
+    CLUSTER_ADDRESS,
+    CLUSTER_HEARTBEAT_TIMEOUT,
+    CLUSTER_MAX_ATTEMPTS,
+    CLUSTER_WORKER_TIMEOUT,
+    COORDINATOR_ARGUMENT,
+    OUTPUT_FORMAT_JSON,
+    OUTPUT_FORMATS,
+)
+
+
+def coordinator_group(parser):
+    coordinator_group_ = parser.add_argument_group(
+        title="Coordinate the configuration of images across workers"
+    )
+    coordinator_group_.add_argument(
+        "jobs_path",
+        action=PositionalArgumentsAction,
+        help="""The path to the jobs file, which contains a JSON object per line with
+        the image_path and the configure_vm_image arguments of each image to configure,
+        e.g. {"image_path": "/images/a.qcow2", "user_data_path": "/seed/user-data"}. The
+        paths must be reachable at the same location on every worker.""",
+    )
+    coordinator_group_.add_argument(
+        "--listen",
+        "-l",
+        dest="{}_listen".format(COORDINATOR_ARGUMENT),
+        default=CLUSTER_ADDRESS,
+        help="""The address that the workers connect to, either as HOST:PORT or as the
+        path of a Unix socket.""",
+    )
+    coordinator_group_.add_argument(
+        "--max-attempts",
+        "-ma",
+        dest="{}_max_attempts".format(COORDINATOR_ARGUMENT),
+        type=int,
+        default=CLUSTER_MAX_ATTEMPTS,
+        help="""The number of workers that a job is handed to before it is failed, when
+        the workers that run it fail.""",
+    )
+    coordinator_group_.add_argument(
+        "--heartbeat-timeout",
+        "-ht",
+        dest="{}_heartbeat_timeout".format(COORDINATOR_ARGUMENT),
+        type=float,
+        default=CLUSTER_HEARTBEAT_TIMEOUT,
+        help="""The number of seconds after which a worker that has not sent anything is
+        treated as failed.""",
+    )
+    coordinator_group_.add_argument(
+        "--worker-timeout",
+        "-wt",
+        dest="{}_worker_timeout".format(COORDINATOR_ARGUMENT),
+        type=float,
+        default=CLUSTER_WORKER_TIMEOUT,
+        help="""The number of seconds after which the jobs fail when no worker is
+        connected, where 0 waits indefinitely.""",
+    )
+    coordinator_group_.add_argument(
+        "--allow-remote",
+        "-ar",
+        dest="{}_allow_remote".format(COORDINATOR_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="""Flag to allow listening on an address that is not a loopback address.
+        The protocol is not encrypted, such that it must only be exposed on a
+        trusted network, preferably together with --secret-path.""",
+    )
+    coordinator_group_.add_argument(
+        "--secret-path",
+        "-sp",
+        dest="{}_secret_path".format(COORDINATOR_ARGUMENT),
+        default=None,
+        help="""The path to a file with a shared secret, which a worker must be
+        given as well for it to be accepted.""",
+    )
+    coordinator_group_.add_argument(
+        "--output",
+        "-o",
+        dest="{}_output".format(COORDINATOR_ARGUMENT),
+        choices=OUTPUT_FORMATS,
+        default=OUTPUT_FORMAT_JSON,
+        help="""The format of the output. With 'ndjson', the events of every job are
+        printed as they happen, together with the job id and the worker that runs it.
+        """,
+    )
+    coordinator_group_.add_argument(
+        "--verbose",
+        "-v",
+        dest="{}_verbose".format(COORDINATOR_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="Flag to enable verbose output.",
+    )
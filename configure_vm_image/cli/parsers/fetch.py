@@ -0,0 +1,123 @@
+from configure_vm_image.cli.parsers.actions import PositionalArgumentsAction
+from configure_vm_image.common.defaults import (
+    CATALOG_PATH,
+    FETCH_ARGUMENT,
+    IMAGE_CHECKSUM_TYPE,
+    IMAGE_FETCH_CONNECTIONS,
+    IMAGE_FETCH_RETRIES,
+    IMAGE_STORE_DIR,
+    IMAGE_STORE_MAX_SIZE,
+    OUTPUT_FORMAT_JSON,
+    OUTPUT_FORMATS,
+)
+
+
+def fetch_group(parser):
+    fetch_group_ = parser.add_argument_group(
+        title="Fetch a base image into the image store"
+    )
+    fetch_group_.add_argument(
+        "url",
+        action=PositionalArgumentsAction,
+        help="The HTTP(S) or file URL, or the path, of the base image to fetch.",
+    )
+    fetch_group_.add_argument(
+        "--checksum",
+        "-c",
+        dest="{}_checksum".format(FETCH_ARGUMENT),
+        default=None,
+        help="The checksum that the base image is verified against.",
+    )
+    fetch_group_.add_argument(
+        "--checksum-url",
+        "-cu",
+        dest="{}_checksum_url".format(FETCH_ARGUMENT),
+        default=None,
+        help="""The URL of the checksum file that the base image is verified against,
+        which is used instead of --checksum. Its lines are either in the 'checksum (of
+        first N bytes) path', the 'checksum path' or the 'ALGORITHM (path) = checksum'
+        format.""",
+    )
+    fetch_group_.add_argument(
+        "--checksum-type",
+        "-ct",
+        dest="{}_checksum_type".format(FETCH_ARGUMENT),
+        default=IMAGE_CHECKSUM_TYPE,
+        help="The hash algorithm of the checksum.",
+    )
+    fetch_group_.add_argument(
+        "--checksum-read-bytes",
+        "-crb",
+        dest="{}_checksum_read_bytes".format(FETCH_ARGUMENT),
+        type=int,
+        default=None,
+        help="""The number of bytes at the start of the base image that the --checksum
+        covers, which defaults to the entire image.""",
+    )
+    fetch_group_.add_argument(
+        "--store-dir",
+        "-sd",
+        dest="{}_store_dir".format(FETCH_ARGUMENT),
+        default=IMAGE_STORE_DIR,
+        help="The directory of the image store.",
+    )
+    fetch_group_.add_argument(
+        "--max-size",
+        "-ms",
+        dest="{}_max_size".format(FETCH_ARGUMENT),
+        type=int,
+        default=IMAGE_STORE_MAX_SIZE,
+        help="""The size budget in bytes of the image store, which the least recently
+        used images are evicted to meet.""",
+    )
+    fetch_group_.add_argument(
+        "--connections",
+        "-cn",
+        dest="{}_connections".format(FETCH_ARGUMENT),
+        type=int,
+        default=IMAGE_FETCH_CONNECTIONS,
+        help="""The number of range requests that the base image is downloaded with
+        concurrently.""",
+    )
+    fetch_group_.add_argument(
+        "--retries",
+        "-r",
+        dest="{}_retries".format(FETCH_ARGUMENT),
+        type=int,
+        default=IMAGE_FETCH_RETRIES,
+        help="""The number of times that a failed range request is retried. An
+        interrupted download is resumed by fetching it again.""",
+    )
+    fetch_group_.add_argument(
+        "--output-path",
+        "-op",
+        dest="{}_output_path".format(FETCH_ARGUMENT),
+        default=None,
+        help="""The path that the base image is copied to, which can then be configured.
+        The images in the store are shared and must not be configured in place.""",
+    )
+    fetch_group_.add_argument(
+        "--catalog-path",
+        "-cp",
+        dest="{}_catalog_path".format(FETCH_ARGUMENT),
+        default=None,
+        help="""The path to the catalog that the copy at the --output-path is registered
+        in, e.g. {}. Its digest is taken from the image store, such that it is not
+        calculated when the copy is configured.""".format(CATALOG_PATH),
+    )
+    fetch_group_.add_argument(
+        "--output",
+        "-o",
+        dest="{}_output".format(FETCH_ARGUMENT),
+        choices=OUTPUT_FORMATS,
+        default=OUTPUT_FORMAT_JSON,
+        help="The format of the output.",
+    )
+    fetch_group_.add_argument(
+        "--verbose",
+        "-v",
+        dest="{}_verbose".format(FETCH_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="Flag to enable verbose output.",
+    )
@@ -0,0 +1,69 @@
+from configure_vm_image.common.defaults import (
+    CONFIGURE_IMAGE_TMP_DIR,
+    GC_ARGUMENT,
+    GC_MAX_CONCURRENT_REMOVES,
+    GC_MAX_SCRATCH_AGE,
+    VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+)
+
+
+def gc_group(parser):
+    gc_group_ = parser.add_argument_group(
+        title="Collect the garbage of earlier configurations"
+    )
+    gc_group_.add_argument(
+        "--scratch-dir",
+        "-sd",
+        dest="{}_scratch_dir".format(GC_ARGUMENT),
+        default=CONFIGURE_IMAGE_TMP_DIR,
+        help="The scratch directory that the configuration jobs were run with.",
+    )
+    gc_group_.add_argument(
+        "--configure-vm-orchestrator",
+        "-cv-orch",
+        dest="{}_vm_orchestrator".format(GC_ARGUMENT),
+        default=VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+        help="The orchestrator that the configuring VMs were created with.",
+    )
+    gc_group_.add_argument(
+        "--max-concurrent",
+        "-mc",
+        dest="{}_max_concurrent".format(GC_ARGUMENT),
+        type=int,
+        default=GC_MAX_CONCURRENT_REMOVES,
+        help="The maximum number of VMs that are removed concurrently.",
+    )
+    gc_group_.add_argument(
+        "--max-age",
+        "-ma",
+        dest="{}_max_age".format(GC_ARGUMENT),
+        type=float,
+        default=GC_MAX_SCRATCH_AGE,
+        help="""The age in seconds after which the scratch directories and files of
+        configuration jobs that are no longer running are purged.""",
+    )
+    gc_group_.add_argument(
+        "--max-size",
+        "-ms",
+        dest="{}_max_size".format(GC_ARGUMENT),
+        type=int,
+        default=None,
+        help="""The size budget in bytes of the scratch directory. When it is exceeded,
+        the oldest scratch directories and files of configuration jobs that are no
+        longer running are purged until it is met.""",
+    )
+    gc_group_.add_argument(
+        "--dry-run",
+        dest="{}_dry_run".format(GC_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="Flag to only report what would be removed.",
+    )
+    gc_group_.add_argument(
+        "--verbose",
+        "-v",
+        dest="{}_verbose".format(GC_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="Flag to enable verbose output.",
+    )
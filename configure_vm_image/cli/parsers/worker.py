@@ -0,0 +1,102 @@
+from configure_vm_image.common.defaults import (
+    CLUSTER_ADDRESS,
+    OUTPUT_FORMAT_JSON,
+    OUTPUT_FORMATS,
+    VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+    VM_ORCHESTRATOR_QEMU,
+    WORKER_ARGUMENT,
+)
+
+
+def worker_group(parser):
+    worker_group_ = parser.add_argument_group(
+        title="Configure the images that a coordinator assigns"
+    )
+    worker_group_.add_argument(
+        "--coordinator",
+        "-c",
+        dest="{}_coordinator".format(WORKER_ARGUMENT),
+        default=CLUSTER_ADDRESS,
+        help="""The address of the coordinator, either as HOST:PORT or as the path of a
+        Unix socket.""",
+    )
+    worker_group_.add_argument(
+        "--name",
+        "-n",
+        dest="{}_name".format(WORKER_ARGUMENT),
+        default=None,
+        help="""The name that the worker is reported as, which defaults to the hostname
+        and process id.""",
+    )
+    worker_group_.add_argument(
+        "--max-vcpus",
+        "-mv",
+        dest="{}_max_vcpus".format(WORKER_ARGUMENT),
+        type=int,
+        default=None,
+        help="""The number of vCPUs that the configuring VMs on this worker can use in
+        total, which defaults to the number of CPUs of the host.""",
+    )
+    worker_group_.add_argument(
+        "--max-memory",
+        "-mm",
+        dest="{}_max_memory".format(WORKER_ARGUMENT),
+        default=None,
+        help="""The memory that the configuring VMs on this worker can use in total,
+        e.g. 32GiB, which defaults to the available memory of the host.""",
+    )
+    worker_group_.add_argument(
+        "--max-jobs",
+        "-mj",
+        dest="{}_max_jobs".format(WORKER_ARGUMENT),
+        type=int,
+        default=None,
+        help="""The maximum number of images that are configured concurrently on this
+        worker.""",
+    )
+    worker_group_.add_argument(
+        "--configure-vm-orchestrator",
+        "-cv-orch",
+        dest="{}_configure_vm_orchestrator".format(WORKER_ARGUMENT),
+        default=None,
+        help="""The orchestrator that provisions the configuring VMs on this worker,
+        either '{}' or '{}', which defaults to '{}'.
+        The jobs can not choose it, since they are received over the network.""".format(
+            VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+            VM_ORCHESTRATOR_QEMU,
+            VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+        ),
+    )
+    worker_group_.add_argument(
+        "--allow-remote",
+        "-ar",
+        dest="{}_allow_remote".format(WORKER_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="""Flag to allow connecting to a coordinator that is not on a loopback
+        address. The protocol is not encrypted, such that it must only be used on a
+        trusted network, preferably together with --secret-path.""",
+    )
+    worker_group_.add_argument(
+        "--secret-path",
+        "-sp",
+        dest="{}_secret_path".format(WORKER_ARGUMENT),
+        default=None,
+        help="""The path to a file with the shared secret of the coordinator.""",
+    )
+    worker_group_.add_argument(
+        "--output",
+        "-o",
+        dest="{}_output".format(WORKER_ARGUMENT),
+        choices=OUTPUT_FORMATS,
+        default=OUTPUT_FORMAT_JSON,
+        help="The format of the output.",
+    )
+    worker_group_.add_argument(
+        "--verbose",
+        "-v",
+        dest="{}_verbose".format(WORKER_ARGUMENT),
+        action="store_true",
+        default=False,
+        help="Flag to enable verbose output.",
+    )
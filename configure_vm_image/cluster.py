@@ -0,0 +1,942 @@
+import asyncio
+import collections
+import hashlib
+import hmac
+import inspect
+import ipaddress
+import json
+import os
+import re
+import secrets
+import socket
+import uuid
+
+from configure_vm_image.common.codes import (
+    CANCELLED_ERROR,
+    CANCELLED_ERROR_MSG,
+    CLUSTER_ERROR,
+    CLUSTER_ERROR_MSG,
+    INVALID_ATTRIBUTE_TYPE_ERROR,
+    INVALID_ATTRIBUTE_TYPE_ERROR_MSG,
+    MISSING_ATTRIBUTE_ERROR,
+    MISSING_ATTRIBUTE_ERROR_MSG,
+    PATH_LOAD_ERROR,
+    PATH_LOAD_ERROR_MSG,
+    SUCCESS,
+    WORKER_ERROR,
+    WORKER_ERROR_MSG,
+)
+from configure_vm_image.common.defaults import (
+    CLUSTER_ADDRESS,
+    CLUSTER_HEARTBEAT_INTERVAL,
+    CLUSTER_HEARTBEAT_TIMEOUT,
+    CLUSTER_JOB_ARGUMENTS,
+    CLUSTER_JOB_TEMPLATE_VALUE_REGEX,
+    CLUSTER_JOB_TEMPLATE_VALUES,
+    CLUSTER_MAX_ATTEMPTS,
+    CLUSTER_MESSAGE_LIMIT,
+    CLUSTER_WORKER_TIMEOUT,
+    CONFIGURE_VM_MEMORY,
+    CONFIGURE_VM_VCPUS,
+)
+from configure_vm_image.common.utils import parse_size, to_str, transform_str_to_dict
+from configure_vm_image.result import Event, Result
+
+# The messages that the coordinator and the workers exchange,
+# which are JSON objects that are sent one per line
+MESSAGE_CHALLENGE = "challenge"
+MESSAGE_HELLO = "hello"
+MESSAGE_JOB = "job"
+MESSAGE_EVENT = "event"
+MESSAGE_RESULT = "result"
+MESSAGE_HEARTBEAT = "heartbeat"
+MESSAGE_SHUTDOWN = "shutdown"
+
+
+def parse_address(address):
+    """Parses the address into a (host, port) tuple when it is given as
+    host:port, and otherwise returns it as the path of a Unix socket"""
+    host, sep, port = address.rpartition(":")
+    if sep and host and port.isdigit() and os.sep not in address:
+        return host.strip("[]"), int(port)
+    return address
+
+
+def is_loopback(address):
+    """Whether the address can only be reached from the local host,
+    which a Unix socket path always is"""
+    parsed = parse_address(address)
+    if not isinstance(parsed, tuple):
+        return True
+    host = parsed[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def check_remote(address, allow_remote):
+    """Returns (SUCCESS, None), or (CLUSTER_ERROR, msg) if the address can be
+    reached from other hosts without remote access being allowed, since the
+    protocol is not encrypted"""
+    if allow_remote or is_loopback(address):
+        return SUCCESS, None
+    return CLUSTER_ERROR, CLUSTER_ERROR_MSG.format(
+        "the address: {} is not a loopback address, which requires remote access "
+        "to be explicitly allowed".format(address)
+    )
+
+
+def load_secret(secret_path):
+    """Returns (SUCCESS, secret) with the shared secret in the file,
+    or (PATH_LOAD_ERROR, msg) if it can not be read or is empty"""
+    try:
+        with open(secret_path, "rb") as fh:
+            secret = fh.read().strip()
+    except OSError as err:
+        return PATH_LOAD_ERROR, "{} - error: {}".format(
+            PATH_LOAD_ERROR_MSG.format(secret_path), err
+        )
+    if not secret:
+        return PATH_LOAD_ERROR, "{} - error: the shared secret is empty".format(
+            PATH_LOAD_ERROR_MSG.format(secret_path)
+        )
+    return SUCCESS, secret
+
+
+def authenticate(secret, nonce):
+    """The response of a worker to the challenge of the coordinator, which
+    proves that it has the shared secret without sending it"""
+    if not secret:
+        return None
+    return hmac.new(secret, nonce.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+async def open_connection(address):
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        reader, writer = await asyncio.open_connection(
+            *parsed, limit=CLUSTER_MESSAGE_LIMIT
+        )
+    else:
+        reader, writer = await asyncio.open_unix_connection(
+            parsed, limit=CLUSTER_MESSAGE_LIMIT
+        )
+    return Connection(reader, writer)
+
+
+async def start_server(handler, address):
+    """Starts the server that calls the handler with a Connection for each
+    peer that connects. Returns the server and the address it listens on,
+    which differs from the given address when it is bound to port 0."""
+
+    async def handle(reader, writer):
+        await handler(Connection(reader, writer))
+
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        server = await asyncio.start_server(
+            handle, *parsed, limit=CLUSTER_MESSAGE_LIMIT
+        )
+        host, port = server.sockets[0].getsockname()[:2]
+        if server.sockets[0].family == socket.AF_INET6:
+            host = "[{}]".format(host)
+        return server, "{}:{}".format(host, port)
+    server = await asyncio.start_unix_server(
+        handle, path=parsed, limit=CLUSTER_MESSAGE_LIMIT
+    )
+    return server, parsed
+
+
+class Connection:
+    """A connection between the coordinator and a worker, over which the
+    messages are sent as JSON lines. Both ends send heartbeats, such that
+    a peer that has not sent anything within the timeout is detected as failed,
+    also when the connection is not closed, e.g. because the host is down."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self._heartbeat = None
+
+    def write(self, message):
+        if self.writer.is_closing():
+            return
+        self.writer.write(
+            json.dumps(message, separators=(",", ":"), default=to_str).encode("utf-8")
+            + b"\n"
+        )
+
+    async def send(self, message):
+        self.write(message)
+        await self.writer.drain()
+
+    async def receive(self, timeout=CLUSTER_HEARTBEAT_TIMEOUT):
+        """Receives the next message that is not a heartbeat. Raises
+        ConnectionError if the connection is closed or the peer is silent
+        for longer than the timeout, and ValueError if the message is invalid."""
+        while True:
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), timeout)
+            except asyncio.TimeoutError as err:
+                raise ConnectionError(
+                    "No message was received within {} seconds".format(timeout)
+                ) from err
+            if not line:
+                raise ConnectionError("The connection was closed")
+            message = json.loads(line)
+            if not isinstance(message, dict) or "type" not in message:
+                raise ValueError("Invalid message: {}".format(line))
+            if message["type"] != MESSAGE_HEARTBEAT:
+                return message
+
+    def start_heartbeat(self, interval=CLUSTER_HEARTBEAT_INTERVAL):
+        async def heartbeat():
+            while not self.writer.is_closing():
+                await asyncio.sleep(interval)
+                self.write({"type": MESSAGE_HEARTBEAT})
+
+        self._heartbeat = asyncio.ensure_future(heartbeat())
+
+    async def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+def job_resources(kwargs):
+    """The vCPUs and bytes of memory that the configuring VM of the job
+    requires, which the job is only assigned to a worker that has free.
+    Values that are invalid are left for the worker to fail the job with."""
+    if kwargs.get("plan"):
+        # A plan does not run a VM
+        return {"num_vcpus": 0, "memory_bytes": 0}
+    template_values = kwargs.get("configure_vm_template_values") or {}
+    if isinstance(template_values, str):
+        template_values = transform_str_to_dict(template_values)
+    try:
+        num_vcpus = int(template_values.get("num_vcpus", CONFIGURE_VM_VCPUS))
+    except ValueError:
+        num_vcpus = int(CONFIGURE_VM_VCPUS)
+    try:
+        memory_bytes = parse_size(
+            template_values.get("memory_size", CONFIGURE_VM_MEMORY), unit="KiB"
+        )
+    except ValueError:
+        memory_bytes = parse_size(CONFIGURE_VM_MEMORY)
+    return {"num_vcpus": num_vcpus, "memory_bytes": memory_bytes}
+
+
+def check_job_arguments(kwargs):
+    """Returns (SUCCESS, None) if a worker accepts the configure_vm_image
+    arguments of the job, or (INVALID_ATTRIBUTE_TYPE_ERROR, msg) if the job
+    is given an argument or a template value that only the worker can set"""
+    rejected = sorted(set(kwargs) - set(CLUSTER_JOB_ARGUMENTS))
+    if rejected:
+        return INVALID_ATTRIBUTE_TYPE_ERROR, INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+            ", ".join(rejected),
+            kwargs,
+            "one of the arguments that a job accepts: {}".format(
+                ", ".join(CLUSTER_JOB_ARGUMENTS)
+            ),
+        )
+    template_values = kwargs.get("configure_vm_template_values") or {}
+    if isinstance(template_values, str):
+        template_values = transform_str_to_dict(template_values)
+    if not isinstance(template_values, dict):
+        return INVALID_ATTRIBUTE_TYPE_ERROR, INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+            "configure_vm_template_values", template_values, "a JSON object"
+        )
+    for key, value in template_values.items():
+        if key not in CLUSTER_JOB_TEMPLATE_VALUES:
+            return (
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+                    "configure_vm_template_values",
+                    key,
+                    "one of the template values that a job accepts: {}".format(
+                        ", ".join(CLUSTER_JOB_TEMPLATE_VALUES)
+                    ),
+                ),
+            )
+        if not re.match(CLUSTER_JOB_TEMPLATE_VALUE_REGEX, str(value)):
+            return (
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+                    key,
+                    value,
+                    "a value that matches: {}".format(CLUSTER_JOB_TEMPLATE_VALUE_REGEX),
+                ),
+            )
+    return SUCCESS, None
+
+
+def load_jobs(jobs_path, configure=None):
+    """Loads the jobs from the file, which contains a JSON object per line,
+    or a JSON list of objects, with the image_path and the keyword arguments
+    of configure_vm_image for each image. Returns (SUCCESS, jobs) or
+    (code, msg) if the file can not be loaded or a job is invalid."""
+    if configure is None:
+        from configure_vm_image.configure import configure_vm_image as configure
+
+    try:
+        with open(jobs_path, "r") as fh:
+            content = fh.read()
+    except OSError as err:
+        return PATH_LOAD_ERROR, "{} - error: {}".format(
+            PATH_LOAD_ERROR_MSG.format(jobs_path), err
+        )
+    try:
+        if content.lstrip().startswith("["):
+            jobs = json.loads(content)
+        else:
+            jobs = [json.loads(line) for line in content.splitlines() if line.strip()]
+    except ValueError as err:
+        return PATH_LOAD_ERROR, "{} - error: {}".format(
+            PATH_LOAD_ERROR_MSG.format(jobs_path), err
+        )
+
+    parameters = set(inspect.signature(configure).parameters) - {"event_handler"}
+    for job in jobs:
+        if not isinstance(job, dict):
+            return (
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format("job", job, "a JSON object"),
+            )
+        if not job.get("image_path"):
+            return MISSING_ATTRIBUTE_ERROR, MISSING_ATTRIBUTE_ERROR_MSG.format(
+                "image_path", job
+            )
+        unknown = sorted(set(job) - parameters)
+        if unknown:
+            return (
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+                    ", ".join(unknown), job, "an argument of configure_vm_image"
+                ),
+            )
+        kwargs = {key: value for key, value in job.items() if key != "image_path"}
+        checked, msg = check_job_arguments(kwargs)
+        if checked != SUCCESS:
+            return checked, msg
+    return SUCCESS, jobs
+
+
+class ClusterJob:
+    __slots__ = ("id", "image_path", "kwargs", "resources", "attempts", "future")
+
+    def __init__(self, image_path, kwargs, future):
+        self.id = uuid.uuid4().hex
+        self.image_path = image_path
+        self.kwargs = kwargs
+        self.resources = job_resources(kwargs)
+        self.attempts = 0
+        self.future = future
+
+    def finish(self, return_code, result):
+        if not self.future.done():
+            self.future.set_result((return_code, result))
+
+
+class WorkerState:
+    """The capacity that a connected worker advertised,
+    and the jobs that are assigned to it"""
+
+    def __init__(self, connection, name, capacity, max_jobs=None):
+        self.id = uuid.uuid4().hex
+        self.connection = connection
+        self.name = name
+        self.capacity = capacity
+        self.max_jobs = max_jobs
+        self.jobs = {}
+
+    def free(self):
+        free = dict(self.capacity)
+        for job in self.jobs.values():
+            for key, value in job.resources.items():
+                free[key] = free.get(key, 0) - value
+        return free
+
+    def fits(self, job):
+        if self.max_jobs is not None and len(self.jobs) >= self.max_jobs:
+            return False
+        free = self.free()
+        return all(free.get(key, 0) >= value for key, value in job.resources.items())
+
+
+class Coordinator:
+    """Hands the configure jobs to the workers that connect to it, where each
+    job is assigned to a worker that has the vCPUs and memory free that its
+    configuring VM requires. The progress of the jobs is streamed back as
+    events, and the jobs of a worker that fails are handed to another worker,
+    up to max_attempts workers in total. Only a worker that answers the
+    challenge with the shared secret is accepted when a secret is given."""
+
+    def __init__(
+        self,
+        address=CLUSTER_ADDRESS,
+        max_attempts=CLUSTER_MAX_ATTEMPTS,
+        heartbeat_interval=CLUSTER_HEARTBEAT_INTERVAL,
+        heartbeat_timeout=CLUSTER_HEARTBEAT_TIMEOUT,
+        worker_timeout=CLUSTER_WORKER_TIMEOUT,
+        allow_remote=False,
+        secret=None,
+        event_handler=None,
+        verbose=False,
+    ):
+        self.address = address
+        self.max_attempts = max_attempts
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.worker_timeout = worker_timeout
+        self.allow_remote = allow_remote
+        self.secret = secret
+        self.verbose = verbose
+        self.result = Result(event_handler=event_handler)
+        self._pending = collections.deque()
+        self._workers = {}
+        self._server = None
+        self._closed = False
+
+    async def start(self):
+        """Starts to listen for workers. Raises ValueError if the address is
+        not a loopback address and remote access is not allowed."""
+        checked, msg = check_remote(self.address, self.allow_remote)
+        if checked != SUCCESS:
+            raise ValueError(msg)
+        self._server, self.address = await start_server(
+            self._handle_worker, self.address
+        )
+        if self.verbose:
+            self.result.add_event("Listening for workers on: {}", self.address)
+
+    def submit(self, image_path, **kwargs):
+        """Submits the configuration of the image, where the kwargs are those
+        of configure_vm_image. Returns a future of its (return_code, result),
+        where the result is the dictionary of the Result on the worker."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(ClusterJob(image_path, kwargs, future))
+        self._schedule()
+        return future
+
+    async def run(self, jobs):
+        """Runs the jobs, which are the keyword arguments of configure_vm_image
+        for each image, and returns their (return_code, result) in order"""
+        futures = []
+        for job in jobs:
+            job = dict(job)
+            futures.append(self.submit(job.pop("image_path"), **job))
+        expire = None
+        if self.worker_timeout:
+            expire = asyncio.ensure_future(self._expire_without_workers())
+        try:
+            return await asyncio.gather(*futures)
+        finally:
+            if expire is not None:
+                expire.cancel()
+                await asyncio.gather(expire, return_exceptions=True)
+
+    async def _expire_without_workers(self):
+        """Fails the jobs that are waiting once no worker has been connected
+        for worker_timeout seconds, instead of waiting for one indefinitely"""
+        loop = asyncio.get_running_loop()
+        connected = loop.time()
+        while True:
+            await asyncio.sleep(min(self.heartbeat_interval, self.worker_timeout))
+            if self._workers:
+                connected = loop.time()
+                continue
+            if loop.time() - connected < self.worker_timeout:
+                continue
+            while self._pending:
+                job = self._pending.popleft()
+                job.finish(
+                    CLUSTER_ERROR,
+                    {
+                        "image_path": job.image_path,
+                        "msg": CLUSTER_ERROR_MSG.format(
+                            "no worker was connected within {} seconds".format(
+                                self.worker_timeout
+                            )
+                        ),
+                    },
+                )
+
+    def _schedule(self):
+        """Assigns the pending jobs in order to the worker that has the most
+        memory free among those that fit the job, where a job that does not fit
+        any worker waits without blocking the jobs that are queued after it"""
+        waiting = collections.deque()
+        while self._pending:
+            job = self._pending.popleft()
+            if job.future.done():
+                continue
+            workers = [worker for worker in self._workers.values() if worker.fits(job)]
+            if not workers:
+                # A job that requires more than the capacity of the workers
+                # is run on its own by an idle worker, instead of never running
+                workers = [
+                    worker
+                    for worker in self._workers.values()
+                    if not worker.jobs and worker.max_jobs != 0
+                ]
+            if not workers:
+                waiting.append(job)
+                continue
+            worker = max(
+                workers, key=lambda worker: worker.free().get("memory_bytes", 0)
+            )
+            job.attempts += 1
+            worker.jobs[job.id] = job
+            worker.connection.write(
+                {
+                    "type": MESSAGE_JOB,
+                    "job_id": job.id,
+                    "image_path": job.image_path,
+                    "kwargs": job.kwargs,
+                }
+            )
+            if self.verbose:
+                self.result.add_event(
+                    "Assigned the configuration of image: {} to worker: {}",
+                    job.image_path,
+                    worker.name,
+                )
+        self._pending = waiting
+
+    def _lose_worker(self, worker, reason):
+        """Hands the jobs of the failed worker to the other workers,
+        unless they have already been attempted max_attempts times"""
+        self._workers.pop(worker.id, None)
+        self.result.add_event("Lost worker: {} - {}", worker.name, reason)
+        requeued = []
+        for job in worker.jobs.values():
+            if job.attempts >= self.max_attempts:
+                job.finish(
+                    WORKER_ERROR,
+                    {
+                        "image_path": job.image_path,
+                        "msg": WORKER_ERROR_MSG.format(
+                            job.image_path,
+                            "the {} worker(s) that it was assigned to failed, "
+                            "the last with: {}".format(job.attempts, reason),
+                        ),
+                        "attempts": job.attempts,
+                    },
+                )
+            else:
+                requeued.append(job)
+        worker.jobs = {}
+        # The jobs that were already running are retried before the queued ones
+        self._pending.extendleft(reversed(requeued))
+        self._schedule()
+
+    def _handle_message(self, worker, message):
+        job = worker.jobs.get(message.get("job_id"))
+        if job is None:
+            return
+        if message["type"] == MESSAGE_EVENT:
+            if self.result.event_handler is None:
+                return
+            data = dict(message.get("event", {}))
+            kind = data.pop("event", None)
+            phase = data.pop("phase", None)
+            msg = data.pop("msg", "")
+            timestamp = data.pop("timestamp", None)
+            data.update({"job_id": job.id, "worker": worker.name})
+            self.result.event_handler(
+                Event(msg, kind=kind, phase=phase, data=data, timestamp=timestamp)
+            )
+        elif message["type"] == MESSAGE_RESULT:
+            del worker.jobs[job.id]
+            result = dict(message.get("result", {}))
+            result.update({"worker": worker.name, "attempts": job.attempts})
+            job.finish(message.get("return_code", WORKER_ERROR), result)
+            self._schedule()
+
+    async def _handle_worker(self, connection):
+        nonce = secrets.token_hex(16)
+        try:
+            await connection.send({"type": MESSAGE_CHALLENGE, "nonce": nonce})
+            hello = await connection.receive(timeout=self.heartbeat_timeout)
+            if hello["type"] != MESSAGE_HELLO or not isinstance(
+                hello.get("capacity"), dict
+            ):
+                raise ValueError("Expected a hello message, got: {}".format(hello))
+            if self.secret and not hmac.compare_digest(
+                str(hello.get("auth") or ""), authenticate(self.secret, nonce)
+            ):
+                raise ValueError(
+                    "The worker: {} did not answer with the shared secret".format(
+                        hello.get("worker")
+                    )
+                )
+        except (ConnectionError, ValueError) as err:
+            self.result.add_event("Rejected a worker connection - {}", err)
+            await connection.close()
+            return
+        if self._closed:
+            # The worker connected while the coordinator was stopping
+            try:
+                await connection.send({"type": MESSAGE_SHUTDOWN})
+            except ConnectionError:
+                pass
+            await connection.close()
+            return
+
+        worker = WorkerState(
+            connection,
+            hello.get("worker") or "unknown",
+            hello["capacity"],
+            max_jobs=hello.get("max_jobs"),
+        )
+        self._workers[worker.id] = worker
+        self.result.add_event(
+            "Worker: {} connected with the capacity: {}", worker.name, worker.capacity
+        )
+        connection.start_heartbeat(self.heartbeat_interval)
+        self._schedule()
+        reason = "the connection was closed"
+        try:
+            while True:
+                message = await connection.receive(timeout=self.heartbeat_timeout)
+                self._handle_message(worker, message)
+        except (ConnectionError, ValueError) as err:
+            reason = str(err)
+        finally:
+            if worker.id in self._workers:
+                self._lose_worker(worker, reason)
+            await connection.close()
+
+    async def close(self):
+        """Stops the workers and fails the jobs that have not finished"""
+        self._closed = True
+        if self._server is not None:
+            self._server.close()
+        for worker in list(self._workers.values()):
+            self._workers.pop(worker.id, None)
+            jobs = list(worker.jobs.values())
+            worker.jobs = {}
+            self._pending.extend(jobs)
+            try:
+                await worker.connection.send({"type": MESSAGE_SHUTDOWN})
+            except ConnectionError:
+                pass
+            await worker.connection.close()
+        while self._pending:
+            job = self._pending.popleft()
+            job.finish(
+                CANCELLED_ERROR,
+                {
+                    "image_path": job.image_path,
+                    "msg": CANCELLED_ERROR_MSG.format(
+                        "configure of image: {}".format(job.image_path)
+                    ),
+                },
+            )
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+        if not isinstance(parse_address(self.address), tuple):
+            try:
+                os.remove(self.address)
+            except FileNotFoundError:
+                pass
+
+
+class Worker:
+    """Connects to the coordinator, advertises the capacity that it has for
+    configuring VMs, and configures the images that it is assigned with
+    configure_vm_image, while the events and results are streamed back.
+    The jobs that are running when the connection to the coordinator is lost
+    are cancelled, since the coordinator hands them to another worker.
+    A job is only given the CLUSTER_JOB_ARGUMENTS by the coordinator,
+    whereas the configure_kwargs, e.g. the orchestrator, are set by the worker."""
+
+    def __init__(
+        self,
+        address=CLUSTER_ADDRESS,
+        name=None,
+        capacity=None,
+        max_jobs=None,
+        heartbeat_interval=CLUSTER_HEARTBEAT_INTERVAL,
+        heartbeat_timeout=CLUSTER_HEARTBEAT_TIMEOUT,
+        allow_remote=False,
+        secret=None,
+        configure=None,
+        configure_kwargs=None,
+        event_handler=None,
+        verbose=False,
+    ):
+        if capacity is None:
+            from configure_vm_image.host import host_capacity
+
+            capacity = host_capacity()
+        if configure is None:
+            from configure_vm_image.configure import configure_vm_image as configure
+
+        self.address = address
+        self.name = name or "{}-{}".format(os.uname().nodename, os.getpid())
+        self.capacity = capacity
+        self.max_jobs = max_jobs
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.allow_remote = allow_remote
+        self.secret = secret
+        self.configure = configure
+        self.configure_kwargs = configure_kwargs or {}
+        self.verbose = verbose
+        self.result = Result(event_handler=event_handler)
+        self._jobs = {}
+
+    async def _run_job(self, connection, message):
+        job_id, image_path = message["job_id"], message["image_path"]
+
+        def forward(event):
+            connection.write(
+                {"type": MESSAGE_EVENT, "job_id": job_id, "event": event.asdict()}
+            )
+
+        try:
+            kwargs = message.get("kwargs") or {}
+            return_code, result = check_job_arguments(kwargs)
+            if return_code == SUCCESS:
+                return_code, result = await self.configure(
+                    image_path,
+                    event_handler=forward,
+                    **dict(self.configure_kwargs, **kwargs)
+                )
+            else:
+                result = {"image_path": image_path, "msg": result}
+            if hasattr(result, "asdict"):
+                result = result.asdict(events=False)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            # A job that fails unexpectedly is reported instead of stopping
+            # the worker, e.g. when it is given invalid arguments
+            return_code = WORKER_ERROR
+            result = {
+                "image_path": image_path,
+                "msg": WORKER_ERROR_MSG.format(image_path, err),
+            }
+        finally:
+            self._jobs.pop(job_id, None)
+        if self.verbose:
+            self.result.add_event(
+                "Configured image: {} with the return code: {}",
+                image_path,
+                return_code,
+            )
+        try:
+            await connection.send(
+                {
+                    "type": MESSAGE_RESULT,
+                    "job_id": job_id,
+                    "return_code": return_code,
+                    "result": result,
+                }
+            )
+        except ConnectionError:
+            # The coordinator hands the job to another worker
+            pass
+
+    async def run(self):
+        checked, msg = check_remote(self.address, self.allow_remote)
+        if checked != SUCCESS:
+            return self.result.finish(checked, msg)
+        try:
+            connection = await open_connection(self.address)
+        except OSError as err:
+            return self.result.finish(
+                CLUSTER_ERROR,
+                CLUSTER_ERROR_MSG,
+                "failed to connect to the coordinator at: {} - {}".format(
+                    self.address, err
+                ),
+            )
+        try:
+            challenge = await connection.receive(timeout=self.heartbeat_timeout)
+            if challenge["type"] != MESSAGE_CHALLENGE:
+                raise ValueError(
+                    "Expected a challenge message, got: {}".format(challenge)
+                )
+            await connection.send(
+                {
+                    "type": MESSAGE_HELLO,
+                    "worker": self.name,
+                    "capacity": self.capacity,
+                    "max_jobs": self.max_jobs,
+                    "auth": authenticate(self.secret, str(challenge.get("nonce"))),
+                }
+            )
+        except (ConnectionError, ValueError) as err:
+            await connection.close()
+            return self.result.finish(CLUSTER_ERROR, CLUSTER_ERROR_MSG, err)
+        connection.start_heartbeat(self.heartbeat_interval)
+        self.result.add_event(
+            "Connected to the coordinator at: {} with the capacity: {}",
+            self.address,
+            self.capacity,
+        )
+
+        return_code, msg = SUCCESS, "Stopped the worker: {}".format(self.name)
+        try:
+            while True:
+                message = await connection.receive(timeout=self.heartbeat_timeout)
+                if message["type"] == MESSAGE_SHUTDOWN:
+                    break
+                if message["type"] == MESSAGE_JOB:
+                    if self.verbose:
+                        self.result.add_event(
+                            "Configuring image: {}", message["image_path"]
+                        )
+                    self._jobs[message["job_id"]] = asyncio.ensure_future(
+                        self._run_job(connection, message)
+                    )
+        except (ConnectionError, ValueError) as err:
+            return_code = CLUSTER_ERROR
+            msg = CLUSTER_ERROR_MSG.format(
+                "lost the connection to the coordinator - {}".format(err)
+            )
+        finally:
+            # The cancelled jobs remove the VMs that they started
+            jobs = list(self._jobs.values())
+            for job in jobs:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+            await connection.close()
+        return self.result.finish(return_code, msg)
+
+
+async def coordinate(
+    jobs_path,
+    listen=CLUSTER_ADDRESS,
+    max_attempts=CLUSTER_MAX_ATTEMPTS,
+    heartbeat_timeout=CLUSTER_HEARTBEAT_TIMEOUT,
+    worker_timeout=CLUSTER_WORKER_TIMEOUT,
+    allow_remote=False,
+    secret_path=None,
+    verbose=False,
+    event_handler=None,
+):
+    """Distributes the configurations in the jobs file to the workers that
+    connect to the coordinator at the listen address, and returns once every
+    job has finished, where the results of the jobs are included in order.
+    The jobs fail if no worker is connected within worker_timeout seconds."""
+    loaded, jobs = load_jobs(jobs_path)
+    if loaded != SUCCESS:
+        return Result(event_handler=event_handler).finish(loaded, jobs)
+    secret = None
+    if secret_path:
+        loaded, secret = load_secret(secret_path)
+        if loaded != SUCCESS:
+            return Result(event_handler=event_handler).finish(loaded, secret)
+
+    coordinator = Coordinator(
+        address=listen,
+        max_attempts=int(max_attempts),
+        heartbeat_timeout=float(heartbeat_timeout),
+        worker_timeout=float(worker_timeout or 0),
+        allow_remote=allow_remote,
+        secret=secret,
+        event_handler=event_handler,
+        verbose=verbose,
+    )
+    result = coordinator.result
+    try:
+        await coordinator.start()
+    except ValueError as err:
+        return result.finish(CLUSTER_ERROR, str(err))
+    except OSError as err:
+        return result.finish(
+            CLUSTER_ERROR,
+            CLUSTER_ERROR_MSG,
+            "failed to listen on: {} - {}".format(listen, err),
+        )
+    try:
+        job_results = await coordinator.run(jobs)
+    finally:
+        await coordinator.close()
+
+    result.set(
+        "jobs",
+        [
+            dict(job_result, return_code=return_code)
+            for return_code, job_result in job_results
+        ],
+    )
+    failed = [job for job in result["jobs"] if job["return_code"] != SUCCESS]
+    if failed:
+        return result.finish(
+            failed[0]["return_code"],
+            "Failed to configure {} of {} images, the first with: {}",
+            len(failed),
+            len(result["jobs"]),
+            failed[0].get("msg"),
+        )
+    return result.finish(SUCCESS, "Configured {} images", len(result["jobs"]))
+
+
+async def work(
+    coordinator=CLUSTER_ADDRESS,
+    name=None,
+    max_vcpus=None,
+    max_memory=None,
+    max_jobs=None,
+    allow_remote=False,
+    secret_path=None,
+    configure_vm_orchestrator=None,
+    verbose=False,
+    event_handler=None,
+):
+    """Configures the images that the coordinator assigns until it stops
+    the worker, with at most the vCPUs and memory that are available on
+    the host, or max_vcpus and max_memory if they are given"""
+    from configure_vm_image.host import host_capacity
+
+    capacity = host_capacity()
+    if max_vcpus is not None:
+        capacity["num_vcpus"] = int(max_vcpus)
+    if max_memory is not None:
+        try:
+            capacity["memory_bytes"] = parse_size(max_memory)
+        except ValueError:
+            return Result(event_handler=event_handler).finish(
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG,
+                "max_memory",
+                max_memory,
+                "a size such as {}".format(CONFIGURE_VM_MEMORY),
+            )
+    secret = None
+    if secret_path:
+        loaded, secret = load_secret(secret_path)
+        if loaded != SUCCESS:
+            return Result(event_handler=event_handler).finish(loaded, secret)
+    configure_kwargs = {}
+    if configure_vm_orchestrator is not None:
+        configure_kwargs["configure_vm_orchestrator"] = configure_vm_orchestrator
+    worker = Worker(
+        address=coordinator,
+        name=name,
+        capacity=capacity,
+        max_jobs=max_jobs,
+        allow_remote=allow_remote,
+        secret=secret,
+        configure_kwargs=configure_kwargs,
+        event_handler=event_handler,
+        verbose=verbose,
+    )
+    return await worker.run()
@@ -17,6 +17,7 @@ INVALID_ATTRIBUTE_TYPE_ERROR_MSG = (
     "Invalid attribute type: {} for value: {} - must be {}"
 )
 CHECKSUM_ERROR = 8
+CHECKSUM_ERROR_MSG = "Failed to verify the checksum of: {} - error: {}"
 RESIZE_ERROR = 9
 RESIZE_ERROR_MSG = "Failed to resize path: {}"
 CHECK_ERROR = 10
@@ -24,4 +25,27 @@ CHECK_ERROR_MSG = "Failed to check path: {}"
 JSON_DUMP_ERROR = 11
 JSON_DUMP_ERROR_MSG = "Failed to dump JSON: {}"
 DOWNLOAD_ERROR = 12
+DOWNLOAD_ERROR_MSG = "Failed to download: {} - error: {}"
 FUNCTION_NOT_FOUND_ERROR = 13
+SEED_RENDER_ERROR = 14
+SEED_RENDER_ERROR_MSG = "Failed to render the cloud-init seed: {} - error: {}"
+TIMEOUT_ERROR = 15
+TIMEOUT_ERROR_MSG = "Timed out during the {} phase of configuring image: {}"
+CANCELLED_ERROR = 16
+CANCELLED_ERROR_MSG = "Cancelled the operation: {}"
+GC_ERROR = 17
+GC_ERROR_MSG = "Failed to collect the garbage of earlier configurations - error: {}"
+LOCK_ERROR = 18
+LOCK_ERROR_MSG = "Failed to lock image: {} - error: {}"
+CLUSTER_ERROR = 19
+CLUSTER_ERROR_MSG = "Failed to coordinate the configurations - error: {}"
+WORKER_ERROR = 20
+WORKER_ERROR_MSG = "Failed to configure image: {} on a worker - error: {}"
+CATALOG_ERROR = 21
+CATALOG_ERROR_MSG = "Failed to use the catalog: {} - error: {}"
+EXPORT_ERROR = 22
+EXPORT_ERROR_MSG = "Failed to export image: {} - error: {}"
+SEED_VALIDATION_ERROR = 23
+SEED_VALIDATION_ERROR_MSG = "Invalid cloud-init seed: {} - error: {}"
+SEED_ISO_ERROR = 24
+SEED_ISO_ERROR_MSG = "Failed to generate the cloud-init iso: {} - error: {}"
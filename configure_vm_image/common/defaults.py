@@ -1,5 +1,4 @@
 import os
-import platform
 
 PACKAGE_NAME = "configure-vm-image"
 REPO_NAME = "configure-vm-image"
@@ -9,15 +8,287 @@ GOCD_FORMAT_VERSION = 10
 GO_REVISION_COMMIT_VAR = "GO_REVISION_SIF_VM_IMAGES"
 CLOUD_INIT_DIR = "cloud-init"
 CONFIGURE_IMAGE_TMP_DIR = os.path.join(os.sep, "tmp", "configure-vm-image")
+CONFIGURE_JOB_JOURNAL = "job.json"
+CONFIGURE_JOB_STATUS_RUNNING = "running"
+CONFIGURE_JOB_STATUS_FAILED = "failed"
+CONFIGURE_JOB_STATUS_SUCCEEDED = "succeeded"
 VM_DISK_DIR = "vmdisks"
 TMP_DIR = "tmp"
 RES_DIR = "res"
 CONFIGURE_ARGUMENT = "configure_argument"
+GC_ARGUMENT = "gc_argument"
+COORDINATOR_ARGUMENT = "coordinator_argument"
+WORKER_ARGUMENT = "worker_argument"
+FETCH_ARGUMENT = "fetch_argument"
+CATALOG_ARGUMENT = "catalog_argument"
+
+CONFIGURE_VM_TEMPLATE = "configure-vm-template.xml.j2"
+CONFIGURE_VM_PERFORMANCE_TEMPLATE = "configure-vm-template-performance.xml.j2"
+# The default profile emulates the VM with generic devices that work on any host,
+# whereas the performance profile uses KVM and virtio devices when available
+TEMPLATE_PROFILE_AUTO = "auto"
+TEMPLATE_PROFILE_DEFAULT = "default"
+TEMPLATE_PROFILE_PERFORMANCE = "performance"
+TEMPLATE_PROFILES = (
+    TEMPLATE_PROFILE_AUTO,
+    TEMPLATE_PROFILE_DEFAULT,
+    TEMPLATE_PROFILE_PERFORMANCE,
+)
+TEMPLATE_PROFILE_PATHS = {
+    TEMPLATE_PROFILE_DEFAULT: os.path.join(RES_DIR, CONFIGURE_VM_TEMPLATE),
+    TEMPLATE_PROFILE_PERFORMANCE: os.path.join(
+        RES_DIR, CONFIGURE_VM_PERFORMANCE_TEMPLATE
+    ),
+}
+KVM_DEVICE_PATH = os.path.join(os.sep, "dev", "kvm")
+HOST_PROBE_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", PACKAGE_NAME, "host-probes.json"
+)
+# The integrity checks of the images are cached by the version of each image,
+# such that a base image that is shared by many jobs is only checked once
+IMAGE_CHECK_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", PACKAGE_NAME, "image-checks.json"
+)
+# The digests of the base images that are looked up in the result cache
+# without a catalog, which are cached by the version of each image
+IMAGE_DIGEST_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", PACKAGE_NAME, "image-digests.json"
+)
 
 CONFIGURE_VM_VCPUS = "4"
 CONFIGURE_VM_MEMORY = "4096MiB"
 CONFIGURE_VM_MACHINE = "pc"
-CPU_ARCHITECTURE = platform.machine()
+# Equivalent to platform.machine() on POSIX, without importing platform
+CPU_ARCHITECTURE = os.uname().machine
+
+CONFIGURE_PHASE_SEED = "seed"
+CONFIGURE_PHASE_CHECK = "check"
+CONFIGURE_PHASE_RESIZE = "resize"
+CONFIGURE_PHASE_CREATE = "create"
+CONFIGURE_PHASE_CONFIGURE = "configure"
+CONFIGURE_PHASE_SHUTDOWN = "shutdown"
+CONFIGURE_PHASE_REMOVE = "remove"
+CONFIGURE_PHASE_RESET = "reset"
+CONFIGURE_PHASE_EXPORT = "export"
+CONFIGURE_PHASE_CLEANUP = "cleanup"
+# The default time budget in seconds for each phase of the configure pipeline,
+# where None means that the phase is only bounded by the overall timeout
+CONFIGURE_PHASE_TIMEOUTS = {
+    CONFIGURE_PHASE_SEED: 300,
+    CONFIGURE_PHASE_CHECK: 600,
+    CONFIGURE_PHASE_RESIZE: 300,
+    CONFIGURE_PHASE_CREATE: 300,
+    CONFIGURE_PHASE_CONFIGURE: 3600,
+    CONFIGURE_PHASE_SHUTDOWN: 120,
+    CONFIGURE_PHASE_REMOVE: 120,
+    CONFIGURE_PHASE_RESET: 3600,
+    CONFIGURE_PHASE_EXPORT: 3600,
+    CONFIGURE_PHASE_CLEANUP: 120,
+}
+
+# How the completion of the configuration inside the VM is detected,
+# either by the markers in the console log, by the status that
+# cloud-init reports over a virtio-serial channel, or by the guest
+# powering itself off once cloud-init has finished
+COMPLETION_MODE_CONSOLE = "console"
+COMPLETION_MODE_CHANNEL = "channel"
+COMPLETION_MODE_POWEROFF = "poweroff"
+COMPLETION_MODES = (
+    COMPLETION_MODE_CONSOLE,
+    COMPLETION_MODE_CHANNEL,
+    COMPLETION_MODE_POWEROFF,
+)
+CONFIGURE_VM_STATUS_CHANNEL = "org.ucphhpc.configure_vm_image.status.0"
+# The number of seconds that the cloud-init power_state module waits for
+# cloud-init to finish before the guest is powered off regardless
+CONFIGURE_VM_POWEROFF_TIMEOUT = 300
+# The number of seconds between the checks of whether the guest has powered off
+CONFIGURE_VM_POWEROFF_POLL_INTERVAL = 1
+# The libvirt reason of the shut off state of a guest that powered itself off,
+# as opposed to a VM that crashed or was destroyed by the host
+VM_SHUTDOWN_STATE_REASON = "shutdown"
+
+# Only the tail of the console log of the configuring VM is kept in memory,
+# which is included in the result when the configuration fails
+CONSOLE_TAIL_SIZE = 64 * 1024
+CONSOLE_READ_CHUNK_SIZE = 64 * 1024
+# The number of compressed rotations that are kept of a configure VM log
+CONFIGURE_VM_LOG_ROTATIONS = 5
 
+# An image is locked while it is configured via a lock file next to it,
+# together with a lease file that is renewed by a heartbeat, since file locks
+# are not reliable on every network filesystem. A lease that is not renewed
+# within its duration is expired, e.g. because the worker that held it crashed.
+IMAGE_LOCK_SUFFIX = ".lock"
+IMAGE_LEASE_SUFFIX = ".lease"
+IMAGE_LEASE_DURATION = 60
+IMAGE_LOCK_POLL_INTERVAL = 1
+# By default, a locked image fails immediately instead of waiting for the lock
+IMAGE_LOCK_TIMEOUT = 0
+
+# The kinds of events that are recorded while an image is configured
+EVENT_MESSAGE = "message"
+EVENT_WARNING = "warning"
+EVENT_PHASE = "phase"
+EVENT_MARKER = "marker"
+EVENT_COMMAND = "command"
+EVENT_RESULT = "result"
+
+# The formats that the CLI outputs the result in, where ndjson
+# streams each event as a compact JSON line as soon as it is recorded
+OUTPUT_FORMAT_JSON = "json"
+OUTPUT_FORMAT_NDJSON = "ndjson"
+OUTPUT_FORMATS = (OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_NDJSON)
 
 VM_ORCHESTRATOR_LIBVIRT_PROVIDER = "libvirt-provider"
+# The built-in orchestrator that runs the configuring VMs with
+# qemu-system directly and controls them via QMP, without libvirt
+VM_ORCHESTRATOR_QEMU = "qemu"
+QEMU_RUNTIME_DIR = os.path.join(os.sep, "tmp", "configure-vm-image-qemu")
+QEMU_QMP_TIMEOUT = 30
+# The time that QEMU is given to exit after it is told to quit, before it is killed
+QEMU_QUIT_TIMEOUT = 10
+# The EFI firmware that the architectures that boot via UEFI are started with,
+# in the locations that the distributions install them
+QEMU_EFI_FIRMWARE_PATHS = {
+    "aarch64": (
+        "/usr/share/qemu-efi-aarch64/QEMU_EFI.fd",
+        "/usr/share/AAVMF/AAVMF_CODE.fd",
+        "/usr/share/edk2/aarch64/QEMU_EFI.fd",
+        "/usr/share/qemu/edk2-aarch64-code.fd",
+    ),
+}
+
+# The values that are only known once a configuration runs,
+# which a plan reports in their place
+PLAN_GENERATED_VALUE = "<generated>"
+PLAN_INSTANCE_ID = "<instance-id>"
+PLAN_RENDERED_SEED = "<rendered>"
+# The size of an iso without any files, which the size of a cloud-init
+# iso is estimated from together with the size of its seed files
+ISO_BASE_SIZE = 384 * 1024
+ISO_SECTOR_SIZE = 2048
+
+# The configuring VMs are named with this prefix
+CONFIGURE_VM_NAME = "configure-vm-image"
+GC_MAX_CONCURRENT_REMOVES = 8
+# Scratch directories and files older than a week are purged
+GC_MAX_SCRATCH_AGE = 7 * 24 * 60 * 60
+
+# The coordinator hands the configure jobs to the workers that connect to it,
+# either over TCP as host:port or over a Unix socket path
+CLUSTER_ADDRESS = "127.0.0.1:8740"
+# Both ends send a heartbeat at the interval, and a peer that has not sent
+# anything within the timeout is treated as failed
+CLUSTER_HEARTBEAT_INTERVAL = 5
+CLUSTER_HEARTBEAT_TIMEOUT = 20
+# The number of workers that a job is handed to before it is failed,
+# when the workers that it was assigned to fail while configuring it
+CLUSTER_MAX_ATTEMPTS = 3
+# The messages include the tail of the console log and the plan of a job
+CLUSTER_MESSAGE_LIMIT = 16 * 1024**2
+# The coordinator fails the jobs that are waiting when no worker has been
+# connected to it for this many seconds, where 0 waits indefinitely
+CLUSTER_WORKER_TIMEOUT = 600
+# The arguments of configure_vm_image that a worker accepts for a job, since
+# the jobs are received over the network. The orchestrator, the VM template
+# and the paths that the configuration writes to are given to the worker itself.
+CLUSTER_JOB_ARGUMENTS = (
+    "image_format",
+    "user_data_path",
+    "meta_data_path",
+    "vendor_data_path",
+    "network_config_path",
+    "seed_template_values",
+    "configure_vm_name",
+    "configure_vm_template_values",
+    "template_profile",
+    "configure_vm_remove_options",
+    "reset_operations",
+    "timeout",
+    "phase_timeouts",
+    "completion_mode",
+    "lock_timeout",
+    "base_digest",
+    "rebuild",
+    "export_formats",
+    "resize",
+    "integrity_check",
+    "seed_validation",
+    "plan",
+    "verbose",
+)
+# The VM template values that a job can be given, which must match the regex,
+# such that a job can not add paths or options to the configuring VM
+CLUSTER_JOB_TEMPLATE_VALUES = (
+    "num_vcpus",
+    "memory_size",
+    "cpu_architecture",
+    "cpu_model",
+    "domain_type",
+    "firmware",
+    "machine",
+)
+CLUSTER_JOB_TEMPLATE_VALUE_REGEX = r"^[A-Za-z0-9_.:-]+$"
+
+# The base images are kept in the image store by their checksum, such that a
+# base image is only downloaded and verified once. The least recently used
+# images are evicted when the store exceeds its maximum size in bytes.
+IMAGE_STORE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", PACKAGE_NAME, "images"
+)
+IMAGE_STORE_MAX_SIZE = None
+IMAGE_CHECKSUM_TYPE = "sha256"
+# An image is downloaded as segments that are fetched concurrently with range
+# requests, where the completed segments are recorded such that an interrupted
+# download resumes with the segments that are missing
+IMAGE_FETCH_CONNECTIONS = 4
+IMAGE_FETCH_SEGMENT_SIZE = 16 * 1024**2
+IMAGE_FETCH_BUFFER_SIZE = 1024**2
+# The number of times that a segment is retried before the download fails
+IMAGE_FETCH_RETRIES = 3
+# The number of seconds that a request waits for the server to respond
+IMAGE_FETCH_TIMEOUT = 60
+
+# The catalog indexes the images below its roots in an SQLite database, together
+# with their probed formats, digests and the provenance of their configuration
+CATALOG_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", PACKAGE_NAME, "catalog.sqlite3"
+)
+CATALOG_IMAGE_REGEX = r".*\.(qcow2|raw|img|vmdk|vhdx|vdi|iso)$"
+# The number of seconds that an operation waits for another writer of the catalog
+CATALOG_TIMEOUT = 60
+
+# The configured images are cached by the digests of the base image, the seed,
+# the rendered VM template, the reset operations and the tool versions, such
+# that a configuration with the same inputs is restored instead of being run
+RESULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", PACKAGE_NAME, "results"
+)
+# The version of the result key, which is increased when the
+# configuration of an image changes in a way that the inputs do not show
+RESULT_CACHE_VERSION = 1
+# How a cached image is placed at the image path, where auto clones the image
+# if the filesystem supports it and copies it otherwise
+RESULT_CACHE_LINK_AUTO = "auto"
+RESULT_CACHE_LINK_REFLINK = "reflink"
+RESULT_CACHE_LINK_HARDLINK = "hardlink"
+RESULT_CACHE_LINK_COPY = "copy"
+RESULT_CACHE_LINK_MODES = (
+    RESULT_CACHE_LINK_AUTO,
+    RESULT_CACHE_LINK_REFLINK,
+    RESULT_CACHE_LINK_HARDLINK,
+    RESULT_CACHE_LINK_COPY,
+)
+
+# The formats that a configured image can be exported to with qemu-img convert
+EXPORT_FORMATS = ("qcow2", "raw", "vmdk", "vdi", "vhdx", "vpc")
+# The number of formats that are converted concurrently, where the conversions
+# that run together read the source image through the same page cache
+EXPORT_MAX_PARALLEL = 3
+# The number of parallel coroutines that each qemu-img convert uses
+EXPORT_COROUTINES = 8
+
+# The number of seed files whose validation outcome is kept in memory by their
+# digest, such that the jobs of a session that share a seed validate it once
+SEED_VALIDATION_CACHE_SIZE = 1024
@@ -1,5 +1,5 @@
-import datetime
 import os
+import re
 import sys
 
 
@@ -8,6 +8,8 @@ def error_print(*args, **kwargs):
 
 
 def to_str(o):
+    import datetime
+
     if hasattr(o, "asdict"):
         return o.asdict()
     if isinstance(o, datetime.datetime):
@@ -17,6 +19,64 @@ def to_str(o):
     return o
 
 
+# The size units that libvirt accepts, where the
+# single letter units are the binary multiples
+SIZE_UNITS = {
+    "b": 1,
+    "bytes": 1,
+    "kb": 1000,
+    "k": 1024,
+    "kib": 1024,
+    "mb": 1000**2,
+    "m": 1024**2,
+    "mib": 1024**2,
+    "gb": 1000**3,
+    "g": 1024**3,
+    "gib": 1024**3,
+    "tb": 1000**4,
+    "t": 1024**4,
+    "tib": 1024**4,
+}
+
+
+def parse_size(size, unit="b"):
+    """Parses a size such as 4096MiB or 4G into bytes,
+    where a size without a unit is in the given unit"""
+    match = re.fullmatch(r"\s*(\d+)\s*([a-zA-Z]*)\s*", str(size))
+    if not match:
+        raise ValueError("Invalid size: {}".format(size))
+    number, size_unit = match.groups()
+    size_unit = (size_unit or unit).lower()
+    if size_unit not in SIZE_UNITS:
+        raise ValueError("Invalid size unit: {}".format(size_unit))
+    return int(number) * SIZE_UNITS[size_unit]
+
+
+def parse_resize(size):
+    """Parses the size that an image is resized to, e.g. 20GiB, or grown by,
+    e.g. +10G, into whether it is relative and its number of bytes"""
+    size = str(size).strip()
+    relative = size.startswith("+")
+    num_bytes = parse_size(size[1:] if relative else size)
+    if num_bytes <= 0:
+        raise ValueError("Invalid size: {}".format(size))
+    return relative, num_bytes
+
+
+def parse_timeout(timeout):
+    """Parses a timeout in seconds, which can be given as a string
+    when passed from the CLI, where None means that there is no timeout"""
+    if timeout is None:
+        return None
+    try:
+        seconds = float(timeout)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid timeout: {}".format(timeout))
+    if not seconds >= 0:
+        raise ValueError("Invalid timeout: {}".format(timeout))
+    return seconds
+
+
 def expand_path(path):
     return os.path.realpath(os.path.expanduser(path))
 
@@ -24,9 +84,11 @@ def expand_path(path):
 def transform_str_to_dict(
     string, string_split_on_char=",", key_value_split_on_char="="
 ):
+    # Only split on the first occurrence such that values
+    # are allowed to contain the split character, e.g. base64 padding
     _dict = {
-        key_value.split(key_value_split_on_char)[0]: key_value.split(
-            key_value_split_on_char
+        key_value.split(key_value_split_on_char, 1)[0]: key_value.split(
+            key_value_split_on_char, 1
         )[1]
         for key_value in string.split(string_split_on_char)
     }
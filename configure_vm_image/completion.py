@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import json
+import os
+
+from configure_vm_image.common.defaults import (
+    CONFIGURE_VM_POWEROFF_TIMEOUT,
+    CONFIGURE_VM_STATUS_CHANNEL,
+)
+
+# The prefix of the status line that is written to the console
+# when the guest has no virtio-serial port to report the status over
+STATUS_CONSOLE_MARKER = "configure-vm-image-status: "
+
+# The script is run by cloud-init in the final stage, where it reports
+# the overall cloud-init status over the virtio-serial port once cloud-init
+# has finished. Without the port, e.g. when the VM template has no status
+# channel, the status is written to the console after the marker instead,
+# such that the host does not wait for the configure phase to time out.
+# It is detached, since cloud-init only finishes after the final stage,
+# including this script, has completed.
+STATUS_SCRIPT_TEMPLATE = """#!/bin/sh
+port=/dev/virtio-ports/{channel_name}
+prefix=
+if [ ! -e "$port" ]; then
+    port=/dev/console
+    prefix="{console_marker}"
+fi
+nohup sh -c '
+output=$(cloud-init status --wait 2>/dev/null)
+returncode=$?
+status=$(printf "%s\\n" "$output" | sed -n "s/^status: //p" | tail -n 1)
+printf "%s{{\\"status\\": \\"%s\\", \\"returncode\\": %d}}\\n" \\
+    "'"$prefix"'" "$status" "$returncode" > '"$port"'
+' >/dev/null 2>&1 &
+"""
+
+# The power_state module forks a process that waits for cloud-init to exit,
+# up to the timeout, before the guest is powered off. Its configuration
+# is the last part of the vendor-data, such that it takes precedence
+# over a power_state that is set by the given vendor-data.
+# The condition writes the cloud-init status to the console after the marker,
+# such that the host can tell whether cloud-init succeeded once the guest
+# has powered off, where a guest that could not report it is not powered off.
+POWEROFF_CONFIG_TEMPLATE = """#cloud-config
+power_state:
+  delay: now
+  mode: poweroff
+  message: Powering off after the configuration by configure-vm-image
+  timeout: {timeout}
+  condition:
+    - sh
+    - -c
+    - |
+      output=$(cloud-init status 2>/dev/null)
+      returncode=$?
+      status=$(printf "%s\\n" "$output" | sed -n "s/^status: //p" | tail -n 1)
+      printf "%s{{\\"status\\": \\"%s\\", \\"returncode\\": %d}}\\n" \\
+          "{console_marker}" "$status" "$returncode" > /dev/console
+"""
+
+# The growpart and resizefs modules run in the init stage of cloud-init,
+# before the configuration is applied, such that the partition and the
+# filesystem of a resized image are grown in the same boot that configures it.
+# A growpart or resize_rootfs in the given user-data takes precedence.
+GROWPART_CONFIG = """#cloud-config
+growpart:
+  mode: auto
+  devices: ["/"]
+resize_rootfs: true
+"""
+
+
+def status_script(channel_name=CONFIGURE_VM_STATUS_CHANNEL):
+    return STATUS_SCRIPT_TEMPLATE.format(
+        channel_name=channel_name, console_marker=STATUS_CONSOLE_MARKER
+    )
+
+
+def parse_console_status(line):
+    """Parses the status that the guest wrote to the console,
+    or returns None if the line does not contain it"""
+    if STATUS_CONSOLE_MARKER not in line:
+        return None
+    try:
+        status = json.loads(line.split(STATUS_CONSOLE_MARKER, 1)[1])
+    except ValueError:
+        return None
+    if not isinstance(status, dict):
+        return None
+    return status
+
+
+def poweroff_config(timeout=CONFIGURE_VM_POWEROFF_TIMEOUT):
+    return POWEROFF_CONFIG_TEMPLATE.format(
+        timeout=timeout, console_marker=STATUS_CONSOLE_MARKER
+    )
+
+
+def add_status_reporting(vendor_data=None, channel_name=CONFIGURE_VM_STATUS_CHANNEL):
+    """Returns the vendor-data content in bytes that, in addition to the
+    given vendor-data, makes cloud-init report its status over the channel."""
+    return add_vendor_data_part(
+        vendor_data, status_script(channel_name), "x-shellscript"
+    )
+
+
+def add_poweroff(vendor_data=None, timeout=CONFIGURE_VM_POWEROFF_TIMEOUT):
+    """Returns the vendor-data content in bytes that, in addition to the
+    given vendor-data, makes cloud-init power off the guest once it has finished"""
+    return add_vendor_data_part(vendor_data, poweroff_config(timeout), "cloud-config")
+
+
+def add_growpart(vendor_data=None):
+    """Returns the vendor-data content in bytes that, in addition to the
+    given vendor-data, makes cloud-init grow the root partition and filesystem"""
+    return add_vendor_data_part(vendor_data, GROWPART_CONFIG, "cloud-config")
+
+
+def add_vendor_data_part(vendor_data, content, subtype):
+    """Appends the content as a text/<subtype> part to the vendor-data.
+    The parts are combined into a multipart MIME message,
+    which cloud-init processes as if each part was given on its own."""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.parser import BytesParser
+
+    parts = []
+    if vendor_data:
+        message = BytesParser().parsebytes(vendor_data)
+        if message.is_multipart():
+            parts.extend(message.get_payload())
+        else:
+            # cloud-init infers the type of a text/plain part from its content,
+            # e.g. #cloud-config, such that any vendor-data can be included as is
+            parts.append(MIMEText(vendor_data.decode("utf-8"), "plain", "utf-8"))
+    parts.append(MIMEText(content, subtype, "utf-8"))
+
+    # The boundary is derived from the content, such that the same
+    # vendor-data results in the same seed that can be cached
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.as_bytes())
+    multipart = MIMEMultipart(
+        boundary="==configure-vm-image-{}==".format(digest.hexdigest()[:32])
+    )
+    for part in parts:
+        multipart.attach(part)
+    return multipart.as_bytes()
+
+
+class StatusListener:
+    """Listens on the unix socket that the configuring VM connects its
+    virtio-serial status channel to, and resolves once the guest
+    has reported its status, such that no polling is required"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._server = None
+        self._status = None
+        self._writers = set()
+
+    async def start(self):
+        self._status = asyncio.get_running_loop().create_future()
+        self._server = await asyncio.start_unix_server(
+            self._handle_connection, path=self.socket_path
+        )
+        # The hypervisor might run as another user that must be able to connect
+        os.chmod(self.socket_path, 0o666)
+
+    async def _handle_connection(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while not self._status.done():
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    status = json.loads(line)
+                except ValueError:
+                    # Discard partial lines that might be left
+                    # in the channel from before the guest rebooted
+                    continue
+                if isinstance(status, dict) and not self._status.done():
+                    self._status.set_result(status)
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def wait(self):
+        """Waits for the status that is reported by the guest"""
+        return await asyncio.shield(self._status)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # The hypervisor keeps its end of the channel connected,
+            # which has to be closed before the server is closed
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._status is not None and not self._status.done():
+            self._status.cancel()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def status_succeeded(status):
+    """cloud-init returns 0 when it finished successfully
+    and 2 when it finished with recoverable errors, where a cloud-init that
+    is still running, e.g. when the power off timed out, has not finished"""
+    return status.get("returncode") in (0, 2) and status.get("status") in (
+        "done",
+        "degraded done",
+    )
@@ -1,31 +1,145 @@
+import asyncio
+import errno
+import functools
 import os
+import re
+import sqlite3
+import tempfile
 import time
+import uuid
 from os.path import join, realpath
 
+from configure_vm_image.catalog import Catalog, digest_seed
+from configure_vm_image.check import (
+    check_image_command,
+    check_integrity,
+    check_succeeded,
+)
 from configure_vm_image.common.codes import (
+    CHECK_ERROR,
+    CHECK_ERROR_MSG,
     CONFIGURE_IMAGE_ERROR,
     CONFIGURE_IMAGE_ERROR_MSG,
+    EXPORT_ERROR,
+    EXPORT_ERROR_MSG,
+    INVALID_ATTRIBUTE_TYPE_ERROR,
+    INVALID_ATTRIBUTE_TYPE_ERROR_MSG,
+    LOCK_ERROR,
+    LOCK_ERROR_MSG,
     PATH_CREATE_ERROR,
     PATH_CREATE_ERROR_MSG,
     PATH_NOT_FOUND_ERROR,
     PATH_NOT_FOUND_ERROR_MSG,
     RESET_IMAGE_ERROR,
     RESET_IMAGE_ERROR_MSG,
+    RESIZE_ERROR,
+    RESIZE_ERROR_MSG,
+    SEED_ISO_ERROR,
+    SEED_ISO_ERROR_MSG,
+    SEED_RENDER_ERROR,
+    SEED_RENDER_ERROR_MSG,
     SUCCESS,
+    TIMEOUT_ERROR,
+    TIMEOUT_ERROR_MSG,
 )
 from configure_vm_image.common.defaults import (
     CLOUD_INIT_DIR,
-    CONFIGURE_VM_MACHINE,
+    COMPLETION_MODE_CHANNEL,
+    COMPLETION_MODE_CONSOLE,
+    COMPLETION_MODE_POWEROFF,
+    COMPLETION_MODES,
+    CONFIGURE_IMAGE_TMP_DIR,
+    CONFIGURE_JOB_STATUS_FAILED,
+    CONFIGURE_JOB_STATUS_RUNNING,
+    CONFIGURE_JOB_STATUS_SUCCEEDED,
+    CONFIGURE_PHASE_CHECK,
+    CONFIGURE_PHASE_CLEANUP,
+    CONFIGURE_PHASE_CONFIGURE,
+    CONFIGURE_PHASE_CREATE,
+    CONFIGURE_PHASE_EXPORT,
+    CONFIGURE_PHASE_REMOVE,
+    CONFIGURE_PHASE_RESET,
+    CONFIGURE_PHASE_RESIZE,
+    CONFIGURE_PHASE_SEED,
+    CONFIGURE_PHASE_SHUTDOWN,
+    CONFIGURE_PHASE_TIMEOUTS,
     CONFIGURE_VM_MEMORY,
+    CONFIGURE_VM_NAME,
+    CONFIGURE_VM_POWEROFF_POLL_INTERVAL,
+    CONFIGURE_VM_STATUS_CHANNEL,
     CONFIGURE_VM_VCPUS,
     CPU_ARCHITECTURE,
-    RES_DIR,
-    TMP_DIR,
+    EVENT_COMMAND,
+    EVENT_MARKER,
+    EXPORT_MAX_PARALLEL,
+    IMAGE_CHECK_CACHE_PATH,
+    IMAGE_LOCK_TIMEOUT,
+    ISO_BASE_SIZE,
+    ISO_SECTOR_SIZE,
+    PLAN_GENERATED_VALUE,
+    PLAN_INSTANCE_ID,
+    PLAN_RENDERED_SEED,
+    QEMU_RUNTIME_DIR,
+    RESULT_CACHE_LINK_AUTO,
+    TEMPLATE_PROFILE_AUTO,
+    TEMPLATE_PROFILE_PATHS,
+    TEMPLATE_PROFILE_PERFORMANCE,
+    TEMPLATE_PROFILES,
     VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+    VM_ORCHESTRATOR_QEMU,
+    VM_SHUTDOWN_STATE_REASON,
+)
+from configure_vm_image.common.utils import (
+    parse_resize,
+    parse_size,
+    parse_timeout,
+    transform_str_to_dict,
+)
+from configure_vm_image.completion import (
+    StatusListener,
+    add_growpart,
+    add_poweroff,
+    add_status_reporting,
+    parse_console_status,
+    status_succeeded,
+)
+from configure_vm_image.console import ConsoleCapture, rotate_log
+from configure_vm_image.export import convert_command, convert_formats, export_path
+from configure_vm_image.host import (
+    disk_io_mode,
+    domain_type,
+    emulated_cpu_model,
+    firmware_type,
+    probe_image_architecture,
+    probe_machine_types,
+    select_machine_type,
+    select_template_profile,
+)
+from configure_vm_image.lock import ImageLock
+from configure_vm_image.qemu import QemuOrchestrator, qemu_command
+from configure_vm_image.result import Result
+from configure_vm_image.result_cache import (
+    ResultCache,
+    image_digest,
+    result_key,
+    template_digest,
+    tool_versions,
+)
+from configure_vm_image.scratch import (
+    create_scratch_dir,
+    remove_scratch_dir,
+    reserve_path,
+    write_journal,
 )
-from configure_vm_image.common.utils import transform_str_to_dict
-from configure_vm_image.utils.io import exists, load, makedirs, which
-from configure_vm_image.utils.job import run
+from configure_vm_image.seed import (
+    SEED_PATH_FILES,
+    SEED_VENDOR_DATA,
+    render_seed,
+    seed_cache_path,
+)
+from configure_vm_image.utils.io import exists, makedirs, remove, which, write
+from configure_vm_image.utils.job import Deadline, run, run_async, run_stages
+from configure_vm_image.validate import validate_seed
 
 
 def discover_create_iso_command():
@@ -43,18 +157,14 @@ def discover_create_iso_command():
     return create_iso_command
 
 
-def create_cloud_init_disk(
-    output_path,
-    user_data_path=None,
-    meta_data_path=None,
-    vendor_data_path=None,
-    network_config_path=None,
+def cloud_init_iso_command(
+    create_iso_command, output_path, *sources, graft_points=False
 ):
-    # Generated the configuration iso image
+    """Prepares the command that generates the cloud-init iso from the sources,
+    which are either the seed file paths or graft points of the form name=path"""
     # Notice that we label the iso cidata to ensure that cloud-init
     # recognizes the disk as a configuration disk
-    create_iso_command = discover_create_iso_command()
-    cloud_init_command = [
+    command = [
         create_iso_command,
         "-output",
         output_path,
@@ -63,21 +173,96 @@ def create_cloud_init_disk(
         "--joliet",
         "--rock",
     ]
+    if graft_points:
+        command.extend(["-follow-links", "-graft-points"])
+    command.extend(sources)
+    return command
+
 
-    if user_data_path:
-        cloud_init_command.append(user_data_path)
-    if meta_data_path:
-        cloud_init_command.append(meta_data_path)
-    if vendor_data_path:
-        cloud_init_command.append(vendor_data_path)
-    if network_config_path:
-        cloud_init_command.append(network_config_path)
-    success, result = run(cloud_init_command)
+async def create_cloud_init_disk(
+    output_path,
+    user_data_path=None,
+    meta_data_path=None,
+    vendor_data_path=None,
+    network_config_path=None,
+    create_iso_command=None,
+):
+    # Generated the configuration iso image
+    if create_iso_command is None:
+        create_iso_command = discover_create_iso_command()
+    cloud_init_command = cloud_init_iso_command(
+        create_iso_command,
+        output_path,
+        *[
+            path
+            for path in (
+                user_data_path,
+                meta_data_path,
+                vendor_data_path,
+                network_config_path,
+            )
+            if path
+        ],
+    )
+    success, result = await run_async(cloud_init_command)
     if not success:
-        return PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG.format(
-            output_path, result["error"]
-        )
-    return True, result["output"]
+        return SEED_ISO_ERROR, SEED_ISO_ERROR_MSG.format(output_path, result["error"])
+    return SUCCESS, result["output"]
+
+
+async def create_cloud_init_disk_from_seed(output_path, seed, create_iso_command=None):
+    """Generates the cloud-init iso from the in-memory seed content,
+    where seed is a dictionary of the seed file name to its content.
+    The iso is first written to a temporary file next to the output path
+    and then moved into place, such that concurrent jobs that share the same
+    output path, e.g. a seed cache, never observe a partially written iso."""
+    if create_iso_command is None:
+        create_iso_command = discover_create_iso_command()
+    output_dir = os.path.dirname(output_path)
+    tmp_fd, tmp_output_path = tempfile.mkstemp(
+        dir=output_dir, prefix=".", suffix=".iso.tmp"
+    )
+    os.close(tmp_fd)
+
+    cloud_init_command = cloud_init_iso_command(
+        create_iso_command, tmp_output_path, graft_points=True
+    )
+
+    seed_fds, seed_dir, replaced = [], None, False
+    try:
+        if hasattr(os, "memfd_create"):
+            # Keep the seed content in anonymous memory backed files that
+            # are passed to the iso command, such that no intermediate
+            # files are written to the filesystem
+            for name, content in seed.items():
+                fd = os.memfd_create(name)
+                seed_fds.append(fd)
+                os.write(fd, content)
+                cloud_init_command.append("{}=/dev/fd/{}".format(name, fd))
+        else:
+            seed_dir = tempfile.mkdtemp(prefix="cloud-init-seed-")
+            for name, content in seed.items():
+                seed_path = join(seed_dir, name)
+                if not write(seed_path, content, mode="wb"):
+                    return PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG.format(seed_path)
+                cloud_init_command.append("{}={}".format(name, seed_path))
+        success, result = await run_async(cloud_init_command, pass_fds=seed_fds)
+        if not success:
+            return SEED_ISO_ERROR, SEED_ISO_ERROR_MSG.format(
+                output_path, result["error"]
+            )
+        os.replace(tmp_output_path, output_path)
+        replaced = True
+    finally:
+        for fd in seed_fds:
+            os.close(fd)
+        if seed_dir:
+            remove(seed_dir, recursive=True)
+        # The temporary iso is also removed when the seed phase
+        # is cancelled or times out while the iso is generated
+        if not replaced:
+            remove(tmp_output_path)
+    return SUCCESS, result["output"]
 
 
 def virt_customize(image_path, commands_from_file):
@@ -109,19 +294,40 @@ def virt_customize(image_path, commands_from_file):
     return result, None
 
 
-def generate_image_configuration(
+async def generate_image_configuration(
     output_path,
     user_data_path=None,
     meta_data_path=None,
     vendor_data_path=None,
     network_config_path=None,
+    seed=None,
+    create_iso_command=None,
+    validate=True,
 ):
-    return create_cloud_init_disk(
+    """Generates the cloud-init iso at the output path from the rendered seed,
+    or the seed files. The seed is validated first unless validate is disabled,
+    such that a broken seed fails before the iso is generated and a VM is booted."""
+    if validate:
+        validated, validated_msg = validate_seed(
+            seed,
+            user_data_path=user_data_path,
+            meta_data_path=meta_data_path,
+            vendor_data_path=vendor_data_path,
+            network_config_path=network_config_path,
+        )
+        if validated != SUCCESS:
+            return validated, validated_msg
+    if seed is not None:
+        return await create_cloud_init_disk_from_seed(
+            output_path, seed, create_iso_command=create_iso_command
+        )
+    return await create_cloud_init_disk(
         output_path,
         user_data_path=user_data_path,
         meta_data_path=meta_data_path,
         vendor_data_path=vendor_data_path,
         network_config_path=network_config_path,
+        create_iso_command=create_iso_command,
     )
 
 
@@ -129,6 +335,10 @@ def discover_vm_orchestrator(orchestrator=None):
     """Discovers the vm orchestrator command line tool on the system"""
     if orchestrator is None:
         orchestrator = VM_ORCHESTRATOR_LIBVIRT_PROVIDER
+    # The built-in orchestrator runs the qemu-system binary of the architecture
+    # of each VM, which is only discovered once the VM is created
+    if orchestrator == VM_ORCHESTRATOR_QEMU:
+        return orchestrator
 
     if not which(orchestrator):
         raise FileNotFoundError(
@@ -139,11 +349,22 @@ def discover_vm_orchestrator(orchestrator=None):
     return orchestrator
 
 
+async def run_vm_orchestrator(command, template_values=None):
+    """Runs the orchestrator command and returns its JSON output, where the
+    commands of the built-in qemu orchestrator are run within the process
+    with the template values as they are"""
+    if command[0] == VM_ORCHESTRATOR_QEMU:
+        return await QemuOrchestrator().run(
+            command[1:], template_values=template_values
+        )
+    return await run_async(command, output_format="json")
+
+
 def prepare_vm_orchestrator_args(
     orchestrator, orchestrator_args=None, vm_orchestrator_kwargs=None
 ):
     prepared_orchestrator_args = []
-    if orchestrator == VM_ORCHESTRATOR_LIBVIRT_PROVIDER:
+    if orchestrator in (VM_ORCHESTRATOR_LIBVIRT_PROVIDER, VM_ORCHESTRATOR_QEMU):
         prepared_orchestrator_args.extend(["instance", "create"])
         if orchestrator_args is not None and isinstance(orchestrator_args, list):
             prepared_orchestrator_args.extend(orchestrator_args)
@@ -163,10 +384,10 @@ def prepare_vm_orchestrator_args(
     return prepared_orchestrator_args
 
 
-async def configure_vm(
+def create_vm_command(
     vm_orchestrator, vm_orchestrator_args=None, template_path=None, template_kwargs=None
 ):
-    """This launches a subprocess that configures the VM image on boot."""
+    """Prepares the orchestrator command that creates the configuring VM"""
     create_command = [vm_orchestrator]
 
     if vm_orchestrator_args and isinstance(vm_orchestrator_args, list):
@@ -178,10 +399,35 @@ async def configure_vm(
     if template_kwargs is not None and isinstance(template_kwargs, dict):
         create_command.extend(["--extra-template-path-values"])
         create_command.append(
-            ",".join([f"{key}={value}" for key, value in template_kwargs.items()])
+            ",".join(
+                [
+                    f"{key}={value}"
+                    for key, value in template_kwargs.items()
+                    if value is not None
+                ]
+            )
         )
+    return create_command
+
 
-    create_success, create_result = run(create_command, output_format="json")
+async def configure_vm(
+    vm_orchestrator, vm_orchestrator_args=None, template_path=None, template_kwargs=None
+):
+    """This launches a subprocess that configures the VM image on boot."""
+    create_command = create_vm_command(
+        vm_orchestrator,
+        vm_orchestrator_args=vm_orchestrator_args,
+        template_path=template_path,
+        template_kwargs=template_kwargs,
+    )
+    template_values = None
+    if template_kwargs is not None and isinstance(template_kwargs, dict):
+        template_values = {
+            key: value for key, value in template_kwargs.items() if value is not None
+        }
+    create_success, create_result = await run_vm_orchestrator(
+        create_command, template_values=template_values
+    )
     if not create_success:
         return False, create_result["error"]
 
@@ -207,13 +453,10 @@ async def configure_vm(
         return False, create_result["output"]["instance"]
 
     instance_id = create_result["output"]["instance"]["id"]
-    start_command = [
-        vm_orchestrator,
-        "instance",
-        "start",
-        instance_id,
-    ]
-    start_success, start_result = run(start_command, output_format="json")
+    start_command = vm_action_command(
+        "start", instance_id, vm_orchestrator=vm_orchestrator
+    )
+    start_success, start_result = await run_vm_orchestrator(start_command)
     if not start_success:
         return False, start_result["error"]
     return instance_id, start_result["output"]
@@ -227,8 +470,18 @@ async def configure_image(vm_orchestrator, **kwargs):
     return configure_result, configure_msg
 
 
-def finished_configure(configure_vm_log_path, line_finished_markers=None):
-    """Waits for the configuration process to finish"""
+async def finished_configure(
+    configure_vm_log_path,
+    line_finished_markers=None,
+    poll_interval=1,
+    on_marker=None,
+    capture=None,
+):
+    """Waits for the configuration process to finish.
+    If on_marker is given, it is called with the log line
+    that contained the finished markers.
+    The log is followed by the capture, which only reads what was written
+    since its last pass and only keeps the tail of the log in memory."""
 
     # Wait for the configuration process to finish
     if not exists(configure_vm_log_path):
@@ -236,22 +489,74 @@ def finished_configure(configure_vm_log_path, line_finished_markers=None):
 
     if line_finished_markers is None:
         line_finished_markers = []
+    if capture is None:
+        capture = ConsoleCapture(configure_vm_log_path)
 
     finished = False
     while not finished:
-        content = load(configure_vm_log_path, readlines=True)
-        if content and isinstance(content, (list, set, tuple)):
-            for line in content:
-                found_markers = [
-                    marker for marker in line_finished_markers if marker in line
-                ]
-                if len(found_markers) == len(line_finished_markers):
-                    finished = True
+        for line in capture.read():
+            found_markers = [
+                marker for marker in line_finished_markers if marker in line
+            ]
+            if len(found_markers) == len(line_finished_markers):
+                finished = True
+                if on_marker is not None:
+                    on_marker(line.strip())
+                break
+        if not finished:
+            await asyncio.sleep(poll_interval)
     return finished
 
 
-def vm_action(action, name, *args, **kwargs):
-    vm_orchestrator = discover_vm_orchestrator()
+async def console_status(configure_vm_log_path, capture=None, poll_interval=1):
+    """Waits for the status that the guest writes to the console
+    when it has no virtio-serial port to report the status over"""
+    if capture is None:
+        capture = ConsoleCapture(configure_vm_log_path)
+    while True:
+        for line in capture.read():
+            status = parse_console_status(line)
+            if status is not None:
+                return status
+        await asyncio.sleep(poll_interval)
+
+
+def last_console_status(capture):
+    """Returns the last status that the guest wrote to the console
+    since the capture last read it, or None if it wrote none"""
+    status = None
+    for line in capture.read():
+        line_status = parse_console_status(line)
+        if line_status is not None:
+            status = line_status
+    return status
+
+
+async def wait_for_status(
+    status_listener, configure_vm_log_path, capture=None, poll_interval=1
+):
+    """Waits for the status that the guest reports over the status channel,
+    or over the console if the guest has no port for the channel.
+    Returns the status and whether it was reported over the console."""
+    channel = asyncio.ensure_future(status_listener.wait())
+    console = asyncio.ensure_future(
+        console_status(
+            configure_vm_log_path, capture=capture, poll_interval=poll_interval
+        )
+    )
+    try:
+        done, _ = await asyncio.wait(
+            (channel, console), return_when=asyncio.FIRST_COMPLETED
+        )
+    finally:
+        channel.cancel()
+        console.cancel()
+    if channel in done:
+        return channel.result(), False
+    return console.result(), True
+
+
+def vm_action_command(action, name, *args, vm_orchestrator, **kwargs):
     command = [vm_orchestrator, "instance", action, name, *args]
     for key, value in kwargs.items():
         if key and value:
@@ -260,47 +565,130 @@ def vm_action(action, name, *args, **kwargs):
             command.append(key)
         elif value and not key:
             command.append(value)
-    success, result = run(command, output_format="json")
+    return command
+
+
+async def vm_action(action, name, *args, vm_orchestrator=None, **kwargs):
+    if vm_orchestrator is None:
+        vm_orchestrator = discover_vm_orchestrator()
+    command = vm_action_command(
+        action, name, *args, vm_orchestrator=vm_orchestrator, **kwargs
+    )
+    success, result = await run_vm_orchestrator(command)
     if not success:
         return False, result["error"]
     return True, result["output"]
 
 
-def wait_for_vm_shutdown(name, attempts=30):
+async def find_vm_instances(regex=None, vm_orchestrator=None):
+    """Finds the VM instances whose name matches the regex"""
+    if vm_orchestrator is None:
+        vm_orchestrator = discover_vm_orchestrator()
+    command = [vm_orchestrator, "instance", "ls"]
+    if regex:
+        command.extend(["--regex", regex])
+    success, result = await run_vm_orchestrator(command)
+    if not success:
+        return False, result["error"]
+    if not isinstance(result["output"], dict):
+        return False, result["output"]
+    return True, result["output"].get("instances", [])
+
+
+async def remove_vm(name, *remove_args, vm_orchestrator=None):
+    """Stops and removes the VM, where a VM that
+    has already been removed is not treated as an error"""
+    found, result = await vm_action("show", name, vm_orchestrator=vm_orchestrator)
+    if not found:
+        return True, f"VM: {name} is already removed"
+
+    state = ""
+    if isinstance(result, dict):
+        state = result.get("instance", {}).get("state", "")
+    if state != "shut off":
+        shutdown, shutdown_msg = await vm_action(
+            "stop", name, vm_orchestrator=vm_orchestrator
+        )
+        if not shutdown:
+            return False, f"Failed to shutdown the VM: {name}: {shutdown_msg}"
+        shutdowned, shutdowned_msg = await wait_for_vm_shutdown(
+            name, vm_orchestrator=vm_orchestrator
+        )
+        if not shutdowned:
+            return False, shutdowned_msg
+
+    removed, removed_msg = await vm_action(
+        "remove", name, *remove_args, vm_orchestrator=vm_orchestrator
+    )
+    if not removed:
+        return False, f"Failed to remove the VM: {name}: {removed_msg}"
+    return await wait_for_vm_removed(name, vm_orchestrator=vm_orchestrator)
+
+
+async def wait_for_vm_shutdown(name, attempts=30, vm_orchestrator=None):
     """Waits for the VM to be shutdown"""
     attempt = 0
     while attempt < attempts:
-        found, result = vm_action("show", name)
+        found, result = await vm_action("show", name, vm_orchestrator=vm_orchestrator)
         if found:
             instance = result.get("instance", {})
             state = instance.get("state", "")
             if state == "shut off":
                 return True, f"VM: {name} was successfully shutdown"
         else:
-            return True, f"VM: {name} was is already removed"
-        time.sleep(1)
+            return True, f"VM: {name} is already removed"
+        await asyncio.sleep(1)
         attempt += 1
     return False, f"Failed to wait for the shutdown of VM: {name}"
 
 
-def wait_for_vm_removed(name, attempts=30):
+async def wait_for_vm_poweroff(
+    name, poll_interval=CONFIGURE_VM_POWEROFF_POLL_INTERVAL, vm_orchestrator=None
+):
+    """Waits for the guest to power itself off, where a VM that shut off
+    because of the guest has finished cleanly, whereas a VM that crashed,
+    was destroyed or disappeared has not. The reason of the shut off state
+    is the libvirt state reason, where an orchestrator that does not report
+    it leaves the caller to check how the guest finished.
+    Waits until the guest powers off, such that the caller bounds the wait."""
+    while True:
+        found, result = await vm_action("show", name, vm_orchestrator=vm_orchestrator)
+        if not found:
+            return False, f"VM: {name} disappeared before it powered off: {result}"
+        instance = {}
+        if isinstance(result, dict):
+            instance = result.get("instance", {})
+        state = instance.get("state", "")
+        state_reason = instance.get("state_reason", VM_SHUTDOWN_STATE_REASON)
+        if state == "shut off":
+            if state_reason != VM_SHUTDOWN_STATE_REASON:
+                return (
+                    False,
+                    f"VM: {name} shut off with the reason: {state_reason} "
+                    "before it powered off",
+                )
+            return True, f"VM: {name} powered off"
+        if state == "crashed":
+            return False, f"VM: {name} crashed before it powered off"
+        await asyncio.sleep(poll_interval)
+
+
+async def wait_for_vm_removed(name, attempts=30, vm_orchestrator=None):
     """Waits for the VM to be removed"""
     attempt = 0
     msg = ""
     while attempt < attempts:
-        found, msg = vm_action("show", name)
+        found, msg = await vm_action("show", name, vm_orchestrator=vm_orchestrator)
         if not found:
             return True, f"VM: {name} was sucessfully removed"
-        time.sleep(1)
+        await asyncio.sleep(1)
         attempt += 1
     if not msg:
         msg = f"Failed to wait for the removal of VM: {name}"
     return False, msg
 
 
-def reset_image(image, reset_operations=None, verbose=False):
-    """Resets the image such that it is ready to be started
-    in production"""
+def reset_image_command(image, reset_operations=None, verbose=False):
     # Ensure that the virt-sysprep doesn't try to use libvirt
     # but qemu instead
     # LIBGUESTFS_BACKEND=direct
@@ -309,313 +697,2040 @@ def reset_image(image, reset_operations=None, verbose=False):
         reset_command.extend(["--operations", reset_operations])
     if verbose:
         reset_command.append("--verbose")
-    success, result = run(reset_command)
+    return reset_command
+
+
+async def reset_image(image, reset_operations=None, verbose=False):
+    """Resets the image such that it is ready to be started
+    in production"""
+    reset_command = reset_image_command(
+        image, reset_operations=reset_operations, verbose=verbose
+    )
+    success, result = await run_async(reset_command)
     if not success:
         return False, result["error"]
     return True, result["output"]
 
 
-async def configure_vm_image(
-    image_path,
-    image_format=None,
-    user_data_path=join(CLOUD_INIT_DIR, "user-data"),
-    meta_data_path=join(CLOUD_INIT_DIR, "meta-data"),
-    vendor_data_path=join(CLOUD_INIT_DIR, "vendor-data"),
-    network_config_path=join(CLOUD_INIT_DIR, "network-config"),
-    cloud_init_iso_output_path=join(CLOUD_INIT_DIR, "cidata.iso"),
-    configure_vm_name="configure-vm-image",
-    configure_vm_log_path=join(TMP_DIR, "configure-vm.log"),
-    configure_vm_template_path=join(RES_DIR, "configure-vm-template.xml.j2"),
-    configure_vm_template_values=None,
-    configure_vm_orchestrator=VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
-    configure_vm_remove_options=None,
-    reset_operations="defaults,-ssh-userdir",
-    verbose=False,
+def resize_image_command(image, image_format, size):
+    """The command that resizes the image to the size, or grows it by the size
+    if it starts with a +. The image is grown sparsely, such that a large
+    image takes no more space or I/O than a small one until it is written to.
+    An image is never shrunk, which qemu-img refuses without --shrink."""
+    relative, num_bytes = parse_resize(size)
+    return [
+        "qemu-img",
+        "resize",
+        "-f",
+        image_format,
+        "--preallocation=off",
+        image,
+        "{}{}".format("+" if relative else "", num_bytes),
+    ]
+
+
+async def resize_image(image, image_format, size):
+    """Resizes the image before it is configured"""
+    success, result = await run_async(resize_image_command(image, image_format, size))
+    if not success:
+        return False, result["error"] or result["output"]
+    return True, result["output"]
+
+
+def estimate_iso_size(seed_sizes):
+    """Estimates the size of a cloud-init iso from the sizes of
+    its seed files, which each take up whole sectors"""
+    return ISO_BASE_SIZE + sum(
+        -(-size // ISO_SECTOR_SIZE) * ISO_SECTOR_SIZE for size in seed_sizes
+    )
+
+
+def resolve_seed_paths(
+    seed_dir=None,
+    user_data_path=None,
+    meta_data_path=None,
+    vendor_data_path=None,
+    network_config_path=None,
 ):
-    response = {}
-    verbose_outputs = []
-
-    # Expand the paths to their absolutes
-    user_data_path = realpath(user_data_path)
-    meta_data_path = realpath(meta_data_path)
-    vendor_data_path = realpath(vendor_data_path)
-    network_config_path = realpath(network_config_path)
-    cloud_init_iso_output_path = realpath(cloud_init_iso_output_path)
-    configure_vm_log_path = realpath(configure_vm_log_path)
-    configure_vm_template_path = realpath(configure_vm_template_path)
+    """Resolves the absolute paths of the seed files, where the files
+    that are not given are looked for in the seed_dir"""
+    seed_paths = {
+        "user_data_path": user_data_path,
+        "meta_data_path": meta_data_path,
+        "vendor_data_path": vendor_data_path,
+        "network_config_path": network_config_path,
+    }
+    for key, path in seed_paths.items():
+        if path is None and seed_dir:
+            path = join(seed_dir, SEED_PATH_FILES[key])
+        # Expand the paths to their absolutes
+        if path:
+            path = realpath(path)
+        seed_paths[key] = path
+    return seed_paths
+
+
+class ConfigureSession:
+    """A reusable configure session that resolves the tools, VM template
+    and default template values once, such that the configure method can be
+    awaited many times, and concurrently, without going through the CLI.
+    """
+
+    def __init__(
+        self,
+        configure_vm_template_path=None,
+        configure_vm_template_values=None,
+        template_profile=TEMPLATE_PROFILE_AUTO,
+        configure_vm_orchestrator=VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+        configure_vm_remove_options=None,
+        cloud_init_iso_cache_dir=None,
+        reset_operations="defaults,-ssh-userdir",
+        max_concurrent_configures=None,
+        timeout=None,
+        phase_timeouts=None,
+        scratch_dir=CONFIGURE_IMAGE_TMP_DIR,
+        keep_scratch_dir=False,
+        completion_mode=COMPLETION_MODE_CONSOLE,
+        image_lock=True,
+        lock_timeout=IMAGE_LOCK_TIMEOUT,
+        catalog_path=None,
+        result_cache_dir=None,
+        result_cache_link=RESULT_CACHE_LINK_AUTO,
+        rebuild=False,
+        export_formats=None,
+        export_dir=None,
+        export_parallel=EXPORT_MAX_PARALLEL,
+        resize=None,
+        integrity_check=False,
+        integrity_check_cache_path=IMAGE_CHECK_CACHE_PATH,
+        seed_validation=True,
+        verbose=False,
+    ):
+        self.configure_vm_template_path = configure_vm_template_path
+        self.configure_vm_template_values = configure_vm_template_values
+        self.template_profile = template_profile
+        self.configure_vm_orchestrator = configure_vm_orchestrator
+        self.configure_vm_remove_options = configure_vm_remove_options
+        self.cloud_init_iso_cache_dir = cloud_init_iso_cache_dir
+        self.reset_operations = reset_operations
+        self.max_concurrent_configures = max_concurrent_configures
+        self.timeout = timeout
+        self.phase_timeouts = dict(CONFIGURE_PHASE_TIMEOUTS)
+        if phase_timeouts:
+            self.phase_timeouts.update(phase_timeouts)
+        self.scratch_dir = scratch_dir
+        self.keep_scratch_dir = keep_scratch_dir
+        self.completion_mode = completion_mode
+        self.image_lock = image_lock
+        self.lock_timeout = lock_timeout
+        # The catalog that the provenance of the configured images is recorded in
+        self.catalog = None
+        if catalog_path:
+            self.catalog = Catalog(catalog_path)
+        # The cache of the configured images, which a rebuild bypasses
+        # while the image that it configures is still stored in it
+        self.result_cache = None
+        if result_cache_dir:
+            self.result_cache = ResultCache(
+                result_cache_dir, link_mode=result_cache_link
+            )
+        self.rebuild = rebuild
+        # The formats that the configured image is exported to
+        self.export_formats = export_formats or []
+        self.export_dir = export_dir
+        self.export_parallel = export_parallel
+        # The size that the image is resized to before it is configured,
+        # where the partition and filesystem are grown by cloud-init
+        self.resize = resize
+        # Whether the integrity of the image is checked before it is booted,
+        # where the outcome is cached until the image changes
+        self.integrity_check = integrity_check
+        self.integrity_check_cache_path = integrity_check_cache_path
+        # Whether the seed is validated offline before the iso is generated
+        self.seed_validation = seed_validation
+        self.verbose = verbose
+
+        self.vm_orchestrator = None
+        self._create_iso_command = None
+        self._resolved = False
+        self._semaphore = None
+
+    @property
+    def create_iso_command(self):
+        # Only required if a cloud-init iso has to be generated
+        if self._create_iso_command is None:
+            self._create_iso_command = discover_create_iso_command()
+        return self._create_iso_command
+
+    def resolve(self):
+        """Resolves the session paths, template values and orchestrator.
+        Is automatically called by configure, but can be called beforehand
+        to discover errors in the session setup before any image is configured.
+        """
+        if self._resolved:
+            return SUCCESS, None
+
+        template_values = self.configure_vm_template_values
+        if template_values is None:
+            template_values = {}
+        if isinstance(template_values, str):
+            template_values = transform_str_to_dict(template_values)
+        template_values = dict(template_values)
+
+        # TODO, these do not validate the template values correctly
+        if "num_vcpus" not in template_values:
+            template_values["num_vcpus"] = CONFIGURE_VM_VCPUS
+        if "memory_size" not in template_values:
+            template_values["memory_size"] = CONFIGURE_VM_MEMORY
+        # Used by the performance profile, where the host is only
+        # probed if the value is not already given
+        if "disk_io" not in template_values:
+            template_values["disk_io"] = disk_io_mode()
+        self.configure_vm_template_values = template_values
+
+        # An explicit template path takes precedence over the template profile,
+        # which is otherwise selected for each image based on its architecture
+        if self.configure_vm_template_path is not None:
+            self.configure_vm_template_path = realpath(self.configure_vm_template_path)
+            if not exists(self.configure_vm_template_path):
+                return PATH_NOT_FOUND_ERROR, PATH_NOT_FOUND_ERROR_MSG.format(
+                    self.configure_vm_template_path,
+                    "could not find the VM template configuration file",
+                )
+        elif self.template_profile not in TEMPLATE_PROFILES:
+            return (
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+                    "template_profile",
+                    self.template_profile,
+                    "one of: {}".format(", ".join(TEMPLATE_PROFILES)),
+                ),
+            )
 
-    if verbose:
-        verbose_outputs.extend(
-            [
-                "Using the following paths to configure the given image",
-                "Cloud-init data configuration path: {}".format(user_data_path),
-                "Cloud-init meta data configuration path: {}".format(meta_data_path),
-                "Cloud-init vendor data configuration path: {}".format(
-                    vendor_data_path
+        if self.cloud_init_iso_cache_dir:
+            self.cloud_init_iso_cache_dir = realpath(self.cloud_init_iso_cache_dir)
+        if self.scratch_dir:
+            self.scratch_dir = realpath(self.scratch_dir)
+        if self.completion_mode not in COMPLETION_MODES:
+            return (
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+                    "completion_mode",
+                    self.completion_mode,
+                    "one of: {}".format(", ".join(COMPLETION_MODES)),
                 ),
-                "Cloud-init network configuration path: {}".format(network_config_path),
-                "Cloud-init output iso path: {}".format(cloud_init_iso_output_path),
-                "Configure VM log path: {}".format(configure_vm_log_path),
-                "Configure VM template path: {}".format(configure_vm_template_path),
-            ]
+            )
+
+        # The timeouts can be given as strings when passed from the CLI
+        for phase in self.phase_timeouts:
+            if phase not in CONFIGURE_PHASE_TIMEOUTS:
+                return (
+                    INVALID_ATTRIBUTE_TYPE_ERROR,
+                    INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+                        "phase_timeouts",
+                        phase,
+                        "one of: {}".format(", ".join(CONFIGURE_PHASE_TIMEOUTS)),
+                    ),
+                )
+        timeouts = {"timeout": self.timeout, "lock_timeout": self.lock_timeout}
+        timeouts.update(
+            ("phase_timeouts[{}]".format(phase), phase_timeout)
+            for phase, phase_timeout in self.phase_timeouts.items()
         )
-        response["verbose_outputs"] = verbose_outputs
+        for name, timeout in timeouts.items():
+            try:
+                parse_timeout(timeout)
+            except ValueError:
+                return (
+                    INVALID_ATTRIBUTE_TYPE_ERROR,
+                    INVALID_ATTRIBUTE_TYPE_ERROR_MSG.format(
+                        name, timeout, "a non-negative number of seconds"
+                    ),
+                )
+        self.timeout = parse_timeout(self.timeout)
+        self.lock_timeout = parse_timeout(self.lock_timeout)
+        for phase, phase_timeout in self.phase_timeouts.items():
+            self.phase_timeouts[phase] = parse_timeout(phase_timeout)
+
+        self.vm_orchestrator = discover_vm_orchestrator(
+            orchestrator=self.configure_vm_orchestrator
+        )
+        self._resolved = True
+        return SUCCESS, None
 
-    if configure_vm_template_path is not None:
-        if not exists(configure_vm_template_path):
-            response["msg"] = PATH_NOT_FOUND_ERROR_MSG.format(
-                configure_vm_template_path,
-                "could not find the VM template configuration file",
+    async def configure(
+        self,
+        image_path,
+        image_format=None,
+        seed_dir=None,
+        user_data_path=None,
+        meta_data_path=None,
+        vendor_data_path=None,
+        network_config_path=None,
+        seed_template_values=None,
+        cloud_init_iso_output_path=None,
+        configure_vm_name=None,
+        configure_vm_log_path=None,
+        configure_vm_template_values=None,
+        base_digest=None,
+        verbose=None,
+        event_handler=None,
+    ):
+        """Configures the image at image_path with the cloud-init seed.
+        The seed is either given as a seed_dir that contains the cloud-init
+        configuration files, or by the path of each of the files.
+        With a catalog, the configuration is recorded as the provenance of the
+        image, where the base_digest identifies the image before it was
+        configured, which is otherwise taken from the catalog.
+        When no configure_vm_name is given, a unique name is generated,
+        such that concurrent configure calls do not conflict.
+        If an event_handler is given, it is called with each
+        result.Event as soon as it is recorded.
+        """
+        # Created lazily such that it is bound to the running event loop
+        if self.max_concurrent_configures and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_configures)
+
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        try:
+            return await self._configure(
+                image_path,
+                image_format=image_format,
+                seed_dir=seed_dir,
+                user_data_path=user_data_path,
+                meta_data_path=meta_data_path,
+                vendor_data_path=vendor_data_path,
+                network_config_path=network_config_path,
+                seed_template_values=seed_template_values,
+                cloud_init_iso_output_path=cloud_init_iso_output_path,
+                configure_vm_name=configure_vm_name,
+                configure_vm_log_path=configure_vm_log_path,
+                configure_vm_template_values=configure_vm_template_values,
+                base_digest=base_digest,
+                verbose=verbose,
+                event_handler=event_handler,
             )
-            response["verbose_outputs"] = verbose_outputs
-            return PATH_NOT_FOUND_ERROR, response
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
 
-    if configure_vm_template_values is None:
-        configure_vm_template_values = {}
+    async def plan(
+        self,
+        image_path,
+        image_format=None,
+        seed_dir=None,
+        user_data_path=None,
+        meta_data_path=None,
+        vendor_data_path=None,
+        network_config_path=None,
+        seed_template_values=None,
+        cloud_init_iso_output_path=None,
+        configure_vm_name=None,
+        configure_vm_log_path=None,
+        configure_vm_template_values=None,
+        base_digest=None,
+        verbose=None,
+        event_handler=None,
+    ):
+        """Plans the configuration of the image at image_path without executing
+        anything, by resolving the paths, template values and commands that
+        configure would use, and by estimating the resources that it requires.
+        The plan is set as the plan of the returned result.
+        As with configure, the image and the host are probed for the
+        template values that are not given, but no files or VMs are created.
+        """
+        result = Result(image_path, event_handler=event_handler)
+        if verbose is None:
+            verbose = self.verbose
+
+        resolved, resolved_msg = self.resolve()
+        if resolved != SUCCESS:
+            return result.finish(resolved, resolved_msg)
+
+        if not exists(image_path):
+            return result.finish(
+                PATH_NOT_FOUND_ERROR,
+                PATH_NOT_FOUND_ERROR_MSG,
+                image_path,
+                "could not find the image to configure",
+            )
+        if not image_format:
+            image_format = os.path.splitext(image_path)[1].replace(".", "")
+        checked_resize = self._check_resize(result, image_path)
+        if checked_resize is not None:
+            return checked_resize
+
+        if configure_vm_name is None:
+            configure_vm_name = "{}-{}".format(CONFIGURE_VM_NAME, PLAN_GENERATED_VALUE)
+        # The scratch directory gets a unique suffix when it is created
+        scratch_path = join(
+            self.scratch_dir, "{}-{}".format(configure_vm_name, PLAN_GENERATED_VALUE)
+        )
+        if cloud_init_iso_output_path is None:
+            cloud_init_iso_output_path = join(scratch_path, "cidata.iso")
+        if configure_vm_log_path is None:
+            configure_vm_log_path = join(scratch_path, "configure-vm.log")
+        cloud_init_iso_output_path = realpath(cloud_init_iso_output_path)
+        configure_vm_log_path = realpath(configure_vm_log_path)
+
+        seed_paths = self._existing_seed_paths(
+            result,
+            resolve_seed_paths(
+                seed_dir=seed_dir,
+                user_data_path=user_data_path,
+                meta_data_path=meta_data_path,
+                vendor_data_path=vendor_data_path,
+                network_config_path=network_config_path,
+            ),
+        )
+        has_seed = any(seed_paths.values())
+        completion_mode = self._completion_mode(result, has_seed)
+
+        # The seed is rendered as it would be, such that
+        # template errors are found before anything runs
+        if isinstance(seed_template_values, str):
+            seed_template_values = transform_str_to_dict(seed_template_values)
+        rendered, seed = self._render_seed(
+            image_path, seed_paths, seed_template_values, completion_mode
+        )
+        if rendered != SUCCESS:
+            return result.finish(rendered, seed)
+        if self.seed_validation and has_seed:
+            validated, validated_msg = validate_seed(seed, **seed_paths)
+            if validated != SUCCESS:
+                return result.finish(validated, validated_msg)
+        if self.cloud_init_iso_cache_dir and seed:
+            cloud_init_iso_output_path = seed_cache_path(
+                self.cloud_init_iso_cache_dir, seed
+            )
+        generate_iso = has_seed
+        if (
+            generate_iso
+            and self.cloud_init_iso_cache_dir
+            and exists(cloud_init_iso_output_path)
+        ):
+            generate_iso = False
+
+        commands = []
+        if generate_iso:
+            if seed is not None:
+                sources = ["{}={}".format(name, PLAN_RENDERED_SEED) for name in seed]
+            else:
+                sources = [path for path in seed_paths.values() if path]
+            commands.append(
+                {
+                    "phase": CONFIGURE_PHASE_SEED,
+                    "command": cloud_init_iso_command(
+                        self.create_iso_command,
+                        cloud_init_iso_output_path,
+                        *sources,
+                        graft_points=seed is not None,
+                    ),
+                }
+            )
 
-    if isinstance(configure_vm_template_values, str):
-        configure_vm_template_values = transform_str_to_dict(
-            configure_vm_template_values
+        template_values = self._template_values(configure_vm_template_values)
+        resolved, configure_vm_template_path = await self._resolve_vm_template(
+            image_path, template_values
         )
+        if resolved != SUCCESS:
+            return result.finish(resolved, configure_vm_template_path)
+        if has_seed or exists(cloud_init_iso_output_path):
+            if "cd_iso_path" not in template_values:
+                template_values["cd_iso_path"] = cloud_init_iso_output_path
+        if "disk_format" not in template_values:
+            template_values["disk_format"] = image_format
+        if "configure_vm_log_path" not in template_values:
+            template_values["configure_vm_log_path"] = configure_vm_log_path
+        if completion_mode == COMPLETION_MODE_CHANNEL:
+            template_values["status_socket_path"] = join(scratch_path, "status.sock")
+            template_values["status_channel_name"] = CONFIGURE_VM_STATUS_CHANNEL
+
+        try:
+            num_vcpus = int(template_values["num_vcpus"])
+        except ValueError:
+            return result.finish(
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG,
+                "num_vcpus",
+                template_values["num_vcpus"],
+                "an integer",
+            )
+        try:
+            # libvirt interprets a memory size without a unit in KiB
+            memory_bytes = parse_size(template_values["memory_size"], unit="KiB")
+        except ValueError:
+            return result.finish(
+                INVALID_ATTRIBUTE_TYPE_ERROR,
+                INVALID_ATTRIBUTE_TYPE_ERROR_MSG,
+                "memory_size",
+                template_values["memory_size"],
+                "a size such as {}".format(CONFIGURE_VM_MEMORY),
+            )
 
-    # Ensure that the image to configure exists
-    if not exists(image_path):
-        response["msg"] = PATH_NOT_FOUND_ERROR_MSG.format(
-            image_path, "could not find the image to configure"
+        if self.vm_orchestrator == VM_ORCHESTRATOR_QEMU:
+            # The VM is created by running QEMU directly,
+            # where the runtime directory is named after the instance id
+            instance_dir = join(QEMU_RUNTIME_DIR, PLAN_INSTANCE_ID)
+            try:
+                create_command = qemu_command(
+                    configure_vm_name,
+                    image_path,
+                    template_values,
+                    join(instance_dir, "qmp.sock"),
+                    join(instance_dir, "qemu.pid"),
+                )
+            except FileNotFoundError as err:
+                return result.finish(
+                    CONFIGURE_IMAGE_ERROR, CONFIGURE_IMAGE_ERROR_MSG, image_path, err
+                )
+        else:
+            create_command = create_vm_command(
+                self.vm_orchestrator,
+                vm_orchestrator_args=prepare_vm_orchestrator_args(
+                    self.vm_orchestrator,
+                    orchestrator_args=[configure_vm_name, image_path],
+                ),
+                template_path=configure_vm_template_path,
+                template_kwargs=template_values,
+            )
+        if self.integrity_check:
+            commands.append(
+                {
+                    "phase": CONFIGURE_PHASE_CHECK,
+                    "command": check_image_command(image_path, image_format),
+                }
+            )
+        if self.resize is not None:
+            commands.append(
+                {
+                    "phase": CONFIGURE_PHASE_RESIZE,
+                    "command": resize_image_command(
+                        image_path, image_format, self.resize
+                    ),
+                }
+            )
+        commands.extend(
+            [
+                {
+                    "phase": CONFIGURE_PHASE_CREATE,
+                    "command": create_command,
+                },
+                {
+                    "phase": CONFIGURE_PHASE_CREATE,
+                    "command": vm_action_command(
+                        "start", PLAN_INSTANCE_ID, vm_orchestrator=self.vm_orchestrator
+                    ),
+                },
+            ]
         )
-        response["verbose_outputs"] = verbose_outputs
-        return PATH_NOT_FOUND_ERROR, response
+        # A guest that powers itself off is not stopped
+        if completion_mode != COMPLETION_MODE_POWEROFF:
+            commands.append(
+                {
+                    "phase": CONFIGURE_PHASE_SHUTDOWN,
+                    "command": vm_action_command(
+                        "stop", PLAN_INSTANCE_ID, vm_orchestrator=self.vm_orchestrator
+                    ),
+                }
+            )
+        commands.extend(
+            [
+                {
+                    "phase": CONFIGURE_PHASE_REMOVE,
+                    "command": vm_action_command(
+                        "remove",
+                        PLAN_INSTANCE_ID,
+                        *self._remove_args(),
+                        vm_orchestrator=self.vm_orchestrator,
+                    ),
+                },
+                {
+                    "phase": CONFIGURE_PHASE_RESET,
+                    "command": reset_image_command(
+                        image_path,
+                        reset_operations=self.reset_operations,
+                        verbose=verbose,
+                    ),
+                },
+            ]
+        )
+        for export_format in self.export_formats:
+            commands.append(
+                {
+                    "phase": CONFIGURE_PHASE_EXPORT,
+                    "command": convert_command(
+                        image_path,
+                        image_format,
+                        export_path(
+                            image_path, export_format, export_dir=self.export_dir
+                        ),
+                        export_format,
+                    ),
+                }
+            )
 
-    if not image_format:
-        image_format = os.path.splitext(image_path)[1].replace(".", "")
+        iso_bytes = 0
+        if generate_iso:
+            if seed is not None:
+                seed_sizes = [len(content) for content in seed.values()]
+            else:
+                seed_sizes = [
+                    os.path.getsize(path) for path in seed_paths.values() if path
+                ]
+            iso_bytes = estimate_iso_size(seed_sizes)
+        scratch_bytes, cache_bytes = 0, 0
+        if cloud_init_iso_output_path.startswith(scratch_path + os.sep):
+            scratch_bytes = iso_bytes
+        elif self.cloud_init_iso_cache_dir:
+            cache_bytes = iso_bytes
+
+        phases = [
+            CONFIGURE_PHASE_CREATE,
+            CONFIGURE_PHASE_CONFIGURE,
+            CONFIGURE_PHASE_SHUTDOWN,
+            CONFIGURE_PHASE_REMOVE,
+            CONFIGURE_PHASE_RESET,
+        ]
+        if completion_mode == COMPLETION_MODE_POWEROFF:
+            phases.remove(CONFIGURE_PHASE_SHUTDOWN)
+        if self.resize is not None:
+            phases.insert(0, CONFIGURE_PHASE_RESIZE)
+        if self.integrity_check:
+            phases.insert(0, CONFIGURE_PHASE_CHECK)
+        if generate_iso:
+            phases.insert(0, CONFIGURE_PHASE_SEED)
+        if self.export_formats:
+            phases.append(CONFIGURE_PHASE_EXPORT)
+
+        plan = {
+            "image_path": image_path,
+            "image_format": image_format,
+            "configure_vm_name": configure_vm_name,
+            "configure_vm_template_path": configure_vm_template_path,
+            "configure_vm_log_path": configure_vm_log_path,
+            "cloud_init_iso_output_path": cloud_init_iso_output_path,
+            "cloud_init_iso_cached": has_seed and not generate_iso,
+            "scratch_path": scratch_path,
+            "lock_path": (ImageLock(image_path).lock_path if self.image_lock else None),
+            "seed_paths": seed_paths,
+            "completion_mode": completion_mode,
+            "catalog_path": self.catalog.path if self.catalog else None,
+            "base_digest": base_digest,
+            "result_cache_dir": (
+                self.result_cache.cache_dir if self.result_cache else None
+            ),
+            "template_values": template_values,
+            "commands": commands,
+            "resources": {
+                "num_vcpus": num_vcpus,
+                "memory_bytes": memory_bytes,
+                "scratch_bytes": scratch_bytes,
+                "cache_bytes": cache_bytes,
+                "image_bytes": os.path.getsize(image_path),
+                "max_duration": self._max_duration(phases),
+            },
+        }
+        result.set("plan", plan)
         if verbose:
-            verbose_outputs.append(
-                "Automatically discovered image format: {} to configure the disk image".format(
-                    image_format
+            for command in commands:
+                result.add_event(
+                    "Would run in the {} phase: {}",
+                    command["phase"],
+                    " ".join(command["command"]),
                 )
-            )
+        return result.finish(
+            SUCCESS, "Planned the configuration of image: {}", image_path
+        )
 
-    # Ensure that the required output directories exists
-    cidata_iso_dir = os.path.dirname(cloud_init_iso_output_path)
-    for d in [cidata_iso_dir]:
-        if not exists(d):
-            created = makedirs(d)
-            if not created:
-                response["msg"] = PATH_CREATE_ERROR_MSG.format(d)
-                response["verbose_outputs"] = verbose_outputs
-                return PATH_CREATE_ERROR, response
+    def _max_duration(self, phases):
+        """The number of seconds that the phases can take at most,
+        including the cleanup after a failure, or None if it is unbounded"""
+        max_duration = None
+        if all(self.phase_timeouts.get(phase) is not None for phase in phases):
+            max_duration = sum(self.phase_timeouts[phase] for phase in phases)
+        if self.timeout is not None:
+            if max_duration is None or self.timeout < max_duration:
+                max_duration = self.timeout
+        cleanup_timeout = self.phase_timeouts.get(CONFIGURE_PHASE_CLEANUP)
+        if max_duration is None or cleanup_timeout is None:
+            return max_duration
+        return max_duration + cleanup_timeout
+
+    async def _configure(self, image_path, event_handler=None, **kwargs):
+        """Runs the configure pipeline within the session timeouts.
+        If the pipeline fails, times out or is cancelled, the configuring VM
+        and the artefacts generated for it are removed, such that the
+        capacity it held is freed immediately."""
+        job = {
+            "phase": None,
+            "failed_phase": None,
+            # The phases of the stages that run concurrently before the VM
+            # is created, which are tracked apart from the sequential phase
+            "stages": [],
+            "status": CONFIGURE_JOB_STATUS_RUNNING,
+            "pid": os.getpid(),
+            "started_at": time.time(),
+            "image_path": realpath(image_path),
+            "vm_orchestrator": None,
+            "configure_vm_name": None,
+            "instance_id": None,
+            "scratch_path": None,
+            "status_listener": None,
+            "configure_vm_log_path": None,
+            "configure_vm_log_rotation_path": None,
+            "console": None,
+            "generated_paths": [],
+            "lock": None,
+            "result": Result(image_path, event_handler=event_handler),
+        }
+        deadline = Deadline(self.timeout)
+        try:
+            try:
+                return_code, result = await self._run_phases(
+                    job, deadline, image_path, **kwargs
+                )
+            except asyncio.TimeoutError:
+                await self._cleanup(job)
+                await self._finish_log(job, succeeded=False)
+                self._finish_job(job, CONFIGURE_JOB_STATUS_FAILED)
+                return job["result"].finish(
+                    TIMEOUT_ERROR, TIMEOUT_ERROR_MSG, job["failed_phase"], image_path
+                )
+            except asyncio.CancelledError:
+                await self._cleanup(job)
+                await self._finish_log(job, succeeded=False)
+                self._finish_job(job, CONFIGURE_JOB_STATUS_FAILED)
+                raise
+            if return_code != SUCCESS:
+                await self._cleanup(job)
+                await self._finish_log(job, succeeded=False)
+                self._finish_job(job, CONFIGURE_JOB_STATUS_FAILED)
+            else:
+                await self._finish_log(job, succeeded=True)
+                self._finish_job(job, CONFIGURE_JOB_STATUS_SUCCEEDED)
+            return return_code, result
+        finally:
+            # The image stays locked until the configuring VM has been removed
+            await self._release_lock(job)
+
+    def _template_values(self, configure_vm_template_values=None):
+        # Copy the session template values such that
+        # concurrent configure calls do not share the per run values
+        template_values = dict(self.configure_vm_template_values)
+        if configure_vm_template_values:
+            if isinstance(configure_vm_template_values, str):
+                configure_vm_template_values = transform_str_to_dict(
+                    configure_vm_template_values
+                )
+            template_values.update(configure_vm_template_values)
+        return template_values
+
+    def _existing_seed_paths(self, result, seed_paths):
+        """Leaves out the seed files that do not exist, which the configuration
+        continues without"""
+        existing_seed_paths = {}
+        for key, path in seed_paths.items():
+            if path and not exists(path):
+                result.add_event(
+                    PATH_NOT_FOUND_ERROR_MSG,
+                    path,
+                    "could not find the {} configuration file, "
+                    "continuing without it".format(SEED_PATH_FILES[key]),
+                )
+                path = None
+            existing_seed_paths[key] = path
+        return existing_seed_paths
+
+    def _completion_mode(self, result, has_seed):
+        # The status channel and the power off rely on cloud-init
+        if self.completion_mode == COMPLETION_MODE_CONSOLE:
+            return COMPLETION_MODE_CONSOLE
+        if not has_seed:
+            result.add_event(
+                "No cloud-init seed is provided, detecting the completion of the "
+                "configuration via the console log instead of the {} completion mode",
+                self.completion_mode,
+            )
+            return COMPLETION_MODE_CONSOLE
+        return self.completion_mode
+
+    def _check_resize(self, result, image_path):
+        """Returns the finished result if the resize is not a valid size,
+        or None otherwise"""
+        if self.resize is None:
+            return None
+        try:
+            parse_resize(self.resize)
+        except ValueError as err:
+            return result.finish(
+                RESIZE_ERROR,
+                RESIZE_ERROR_MSG,
+                "{} - error: {}".format(image_path, err),
+            )
+        return None
+
+    def _render_seed(
+        self, image_path, seed_paths, seed_template_values, completion_mode
+    ):
+        """Renders the seed in memory when it is templated, cached or extended
+        with the status reporting, power off or growpart, such that the iso is
+        generated directly from the rendered content. Returns None as the seed
+        otherwise, in which case the iso is generated from the seed files."""
+        if (
+            seed_template_values is None
+            and not self.cloud_init_iso_cache_dir
+            and completion_mode == COMPLETION_MODE_CONSOLE
+            and self.resize is None
+        ):
+            return SUCCESS, None
+        try:
+            seed = render_seed(template_values=seed_template_values, **seed_paths)
+        except (FileNotFoundError, ValueError) as err:
+            return SEED_RENDER_ERROR, SEED_RENDER_ERROR_MSG.format(image_path, err)
+        if completion_mode == COMPLETION_MODE_CHANNEL:
+            seed[SEED_VENDOR_DATA] = add_status_reporting(
+                seed.get(SEED_VENDOR_DATA),
+                channel_name=CONFIGURE_VM_STATUS_CHANNEL,
+            )
+        if completion_mode == COMPLETION_MODE_POWEROFF:
+            seed[SEED_VENDOR_DATA] = add_poweroff(seed.get(SEED_VENDOR_DATA))
+        if self.resize is not None:
+            seed[SEED_VENDOR_DATA] = add_growpart(seed.get(SEED_VENDOR_DATA))
+        return SUCCESS, seed
+
+    def _remove_args(self):
+        if self.configure_vm_remove_options is None:
+            return []
+        user_options = self.configure_vm_remove_options.split()
+        # https://github.com/rasmunk/libvirt_provider/blob/b90780f23aaa8f86ef1dc3142f996e7e6b30c0c3/libvirt_provider/cli/parsers/instance.py#L189
+        return ["--flags"] + user_options
+
+    async def _resolve_vm_template(self, image_path, template_values):
+        """Resolves the VM template and the template values that depend on
+        the architecture of the image, unless they are explicitly given.
+        Returns the path of the VM template to use."""
+        if "cpu_architecture" not in template_values:
+            cpu_architecture = await probe_image_architecture(image_path)
+            template_values["cpu_architecture"] = cpu_architecture or CPU_ARCHITECTURE
+        cpu_architecture = template_values["cpu_architecture"]
+
+        template_path = self.configure_vm_template_path
+        template_profile = None
+        if template_path is None:
+            template_profile = select_template_profile(
+                self.template_profile, cpu_architecture=cpu_architecture
+            )
+            template_path = realpath(TEMPLATE_PROFILE_PATHS[template_profile])
+            if not exists(template_path):
+                return PATH_NOT_FOUND_ERROR, PATH_NOT_FOUND_ERROR_MSG.format(
+                    template_path, "could not find the VM template configuration file"
+                )
 
-    if not exists(user_data_path):
-        verbose_outputs.append(
-            PATH_NOT_FOUND_ERROR_MSG.format(
-                user_data_path,
-                "could not find the user-data configuration file, continuing without it",
+        if "machine" not in template_values:
+            machine_types = await probe_machine_types(cpu_architecture)
+            # A custom template is expected to use the
+            # IDE devices of the default template
+            template_values["machine"] = select_machine_type(
+                cpu_architecture,
+                machine_types=machine_types,
+                ide=template_profile != TEMPLATE_PROFILE_PERFORMANCE,
             )
+        if "domain_type" not in template_values:
+            template_values["domain_type"] = domain_type(cpu_architecture)
+        if (
+            "cpu_model" not in template_values
+            and template_values["domain_type"] != "kvm"
+            and cpu_architecture != CPU_ARCHITECTURE
+        ):
+            cpu_model = emulated_cpu_model(cpu_architecture)
+            if cpu_model:
+                template_values["cpu_model"] = cpu_model
+        if "firmware" not in template_values:
+            firmware = firmware_type(cpu_architecture)
+            if firmware:
+                template_values["firmware"] = firmware
+        return SUCCESS, template_path
+
+    async def _run_phases(self, job, deadline, image_path, **kwargs):
+        try:
+            return await self._configure_phases(job, deadline, image_path, **kwargs)
+        finally:
+            if job["status_listener"] is not None:
+                await job["status_listener"].close()
+                job["status_listener"] = None
+
+    async def _export_image(self, job, deadline, image_path, image_format):
+        """Exports the configured image to the export formats concurrently.
+        Returns the finished result on failure, or None on success."""
+        result = job["result"]
+        phase_deadline = self._start_phase(job, deadline, CONFIGURE_PHASE_EXPORT)
+        return_code, exports = await asyncio.wait_for(
+            convert_formats(
+                result,
+                image_path,
+                image_format,
+                self.export_formats,
+                export_dir=self.export_dir,
+                max_parallel=self.export_parallel,
+                verbose=self.verbose,
+            ),
+            phase_deadline.remaining(),
         )
-        user_data_path = None
-
-    if not exists(meta_data_path):
-        verbose_outputs.append(
-            PATH_NOT_FOUND_ERROR_MSG.format(
-                meta_data_path,
-                "could not find the meta-data configuration file, continuing without it",
+        if return_code != SUCCESS:
+            return result.finish(return_code, exports)
+        result.set("exports", exports)
+        return None
+
+    async def _restore_result(self, job, cache_key):
+        """Materializes the cached result of the configuration at the image
+        path. Returns whether the result was cached and restored."""
+        loop = asyncio.get_running_loop()
+        metadata = await loop.run_in_executor(None, self.result_cache.lookup, cache_key)
+        if metadata is None:
+            return False
+        try:
+            link_mode = await loop.run_in_executor(
+                None, self.result_cache.restore, cache_key, job["image_path"]
             )
+        except OSError as err:
+            job["result"].add_event(
+                "Failed to restore the cached result: {} - error: {}", cache_key, err
+            )
+            return False
+        job["result"].record(
+            EVENT_MARKER,
+            "Restored the cached result: {} configured at: {} with: {}",
+            cache_key,
+            time.strftime(
+                "%Y-%m-%dT%H:%M:%S", time.localtime(metadata.get("stored_at", 0))
+            ),
+            link_mode,
+            result_cache_key=cache_key,
+            link_mode=link_mode,
         )
-        meta_data_path = None
+        return True
+
+    async def _store_result(self, job, cache_key, base_digest, seed_digest):
+        """Stores the configured image in the result cache, where a failure
+        to store it does not fail the configuration"""
+        try:
+            stored = await asyncio.get_running_loop().run_in_executor(
+                None,
+                self.result_cache.store,
+                cache_key,
+                job["image_path"],
+                {
+                    "image_path": job["image_path"],
+                    "base_digest": base_digest,
+                    "seed_digest": seed_digest,
+                    "reset_operations": self.reset_operations,
+                },
+                self.rebuild,
+            )
+        except OSError as err:
+            job["result"].add_event(
+                "Failed to store the configured image in the result cache: {} "
+                "- error: {}",
+                self.result_cache.cache_dir,
+                err,
+            )
+            return
+        if stored:
+            job["result"].add_event(
+                "Stored the configured image in the result cache as: {}", cache_key
+            )
 
-    if not exists(vendor_data_path):
-        verbose_outputs.append(
-            PATH_NOT_FOUND_ERROR_MSG.format(
-                vendor_data_path,
-                "could not find the vendor-data configuration file, continuing without it",
+    async def _record_provenance(
+        self, job, base_digest, seed_digest, completion_mode, result_cache_key=None
+    ):
+        """Records the configuration of the image in the catalog, where
+        a failure to record it does not fail the configuration"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(
+                    self.catalog.record_configuration,
+                    job["image_path"],
+                    base_digest=base_digest,
+                    seed_digest=seed_digest,
+                    details={
+                        "completion_mode": completion_mode,
+                        "vm_orchestrator": job["vm_orchestrator"],
+                        "configure_vm_name": job["configure_vm_name"],
+                        "result_cache_key": result_cache_key,
+                    },
+                ),
+            )
+        except (OSError, sqlite3.Error) as err:
+            job["result"].add_event(
+                "Failed to record the configuration of the image: {} "
+                "in the catalog: {} - error: {}",
+                job["image_path"],
+                self.catalog.path,
+                err,
             )
-        )
-        vendor_data_path = None
 
-    if not exists(network_config_path):
-        verbose_outputs.append(
-            PATH_NOT_FOUND_ERROR_MSG.format(
-                network_config_path,
-                "could not find the network-config configuration file, continuing without it",
+    def _write_journal(self, job):
+        """Records the progress of the job in its scratch directory,
+        such that a job that is left behind can be identified and cleaned up"""
+        if not job["scratch_path"]:
+            return
+        journal = {
+            key: value
+            for key, value in job.items()
+            if key not in ("result", "status_listener", "console", "lock")
+        }
+        try:
+            write_journal(job["scratch_path"], journal)
+        except OSError as err:
+            job["result"].add_event(
+                "Failed to write the job journal in: {} - error: {}",
+                job["scratch_path"],
+                err,
             )
+
+    async def _finish_log(self, job, succeeded=True):
+        """Captures the tail of the console log of a failed configuration
+        for the result, and compresses the log into its rotations,
+        such that the log path can be reused without the logs growing unbounded"""
+        log_path = job["configure_vm_log_path"]
+        if not log_path or not exists(log_path):
+            return
+        if not succeeded:
+            capture = job["console"]
+            if capture is None:
+                capture = ConsoleCapture(log_path)
+            capture.skip_to_tail()
+            for _ in capture.read():
+                pass
+            job["result"].set("console_tail", capture.tail)
+        job["console"] = None
+
+        # The log is removed together with the scratch directory
+        # of a succeeded job, such that it is not worth compressing
+        if (
+            succeeded
+            and not self.keep_scratch_dir
+            and job["scratch_path"]
+            and log_path.startswith(job["scratch_path"] + os.sep)
+        ):
+            return
+        try:
+            rotated_path = await asyncio.get_running_loop().run_in_executor(
+                None,
+                rotate_log,
+                log_path,
+                job["configure_vm_log_rotation_path"],
+            )
+        except OSError as err:
+            job["result"].add_event(
+                "Failed to rotate the configure VM log: {} - error: {}", log_path, err
+            )
+            return
+        job["configure_vm_log_path"] = rotated_path
+
+    async def _release_lock(self, job):
+        if job["lock"] is None:
+            return
+        await job["lock"].release()
+        job["lock"] = None
+
+    def _lock_lost(self, job):
+        """The lease on the image is lost if it was not renewed in time and was
+        taken over by another job, which might be configuring the image now"""
+        return job["lock"] is not None and job["lock"].lost
+
+    def _finish_job(self, job, status):
+        job["status"] = status
+        if not job["scratch_path"]:
+            return
+        # A failed job keeps its scratch directory such that
+        # the log of the configuring VM can be inspected
+        if status == CONFIGURE_JOB_STATUS_SUCCEEDED and not self.keep_scratch_dir:
+            remove_scratch_dir(job["scratch_path"])
+            job["scratch_path"] = None
+        else:
+            self._write_journal(job)
+
+    def _start_phase(self, job, deadline, phase):
+        """Marks the start of a phase and returns its deadline,
+        which is bounded by both the phase and the overall timeout"""
+        job["phase"] = phase
+        job["result"].enter_phase(phase)
+        self._write_journal(job)
+        return Deadline(deadline.budget(self.phase_timeouts.get(phase)))
+
+    def _start_stage(self, job, deadline, phase):
+        """Marks the start of a phase that runs concurrently with other phases
+        and returns its deadline. The phase is tracked in the running stages
+        of the job, since job["phase"] only follows the sequential phases,
+        and the events of the stage are given its phase explicitly"""
+        job["stages"].append(phase)
+        job["result"].start_stage(phase)
+        self._write_journal(job)
+        return Deadline(deadline.budget(self.phase_timeouts.get(phase)))
+
+    def _finish_stage(self, job, phase, failed=False):
+        """Marks the end of a concurrent phase, where the phase of the first
+        stage that fails is the phase that the job failed in"""
+        if phase in job["stages"]:
+            job["stages"].remove(phase)
+        if failed and job["failed_phase"] is None:
+            job["failed_phase"] = phase
+        self._write_journal(job)
+
+    def _record_command(self, job, command, succeeded, phase=None):
+        job["result"].record(
+            EVENT_COMMAND,
+            "The {} command {}",
+            command,
+            "succeeded" if succeeded else "failed",
+            phase=phase,
+            command=command,
+            succeeded=bool(succeeded),
         )
-        network_config_path = None
-    if verbose:
-        verbose_outputs.append(
-            "Generating the cloud-init iso image at: {}".format(
-                cloud_init_iso_output_path
+
+    async def _shutdown_vm(self, job, deadline, configured_id, vm_orchestrator):
+        """Stops the VM after the configuration, returns None when it is shut off"""
+        result = job["result"]
+        phase_deadline = self._start_phase(job, deadline, CONFIGURE_PHASE_SHUTDOWN)
+        shutdown, shutdown_msg = await asyncio.wait_for(
+            vm_action("stop", configured_id, vm_orchestrator=vm_orchestrator),
+            phase_deadline.remaining(),
+        )
+        self._record_command(job, "stop", shutdown)
+        if not shutdown:
+            return result.finish(
+                CONFIGURE_IMAGE_ERROR,
+                f"Failed to shutdown the VM: {configured_id} after configuration: {shutdown_msg}",
             )
+
+        shutdowned, shutdowned_msg = await asyncio.wait_for(
+            wait_for_vm_shutdown(configured_id, vm_orchestrator=vm_orchestrator),
+            phase_deadline.remaining(),
         )
+        if not shutdowned:
+            return result.finish(
+                CONFIGURE_IMAGE_ERROR,
+                f"Failed to wait for the shutdown of VM: {configured_id} after configuration: {shutdowned_msg}",
+            )
+        return None
+
+    async def _cleanup(self, job):
+        # A concurrent stage that failed has already set the failed phase
+        if job["failed_phase"] is None:
+            job["failed_phase"] = job["phase"]
+        job["phase"] = CONFIGURE_PHASE_CLEANUP
+        job["result"].enter_phase(CONFIGURE_PHASE_CLEANUP)
+        try:
+            await asyncio.wait_for(
+                self._cleanup_job(job), self.phase_timeouts.get(CONFIGURE_PHASE_CLEANUP)
+            )
+        except asyncio.TimeoutError:
+            job["result"].add_event(
+                "Timed out cleaning up after configuring with the VM: {}",
+                job["configure_vm_name"],
+            )
+        # The result reports the phase that the job failed in
+        job["result"].phase = job["failed_phase"]
+
+    async def _cleanup_job(self, job):
+        instance_ids = []
+        if job["instance_id"]:
+            instance_ids.append(job["instance_id"])
+        elif job["configure_vm_name"]:
+            # The VM might have been defined before the create phase
+            # was interrupted, in which case only its name is known
+            found, instances = await find_vm_instances(
+                regex="^{}$".format(re.escape(job["configure_vm_name"])),
+                vm_orchestrator=self.vm_orchestrator,
+            )
+            if found:
+                instance_ids.extend(
+                    [instance["id"] for instance in instances if "id" in instance]
+                )
+
+        for instance_id in instance_ids:
+            removed, removed_msg = await remove_vm(
+                instance_id, vm_orchestrator=self.vm_orchestrator
+            )
+            self._record_command(job, "remove", removed)
+            job["result"].add_event(removed_msg)
+            if removed:
+                job["instance_id"] = None
+
+        for path in job["generated_paths"]:
+            if exists(path):
+                remove(path)
+
+    async def _configure_phases(
+        self,
+        job,
+        deadline,
+        image_path,
+        image_format=None,
+        seed_dir=None,
+        user_data_path=None,
+        meta_data_path=None,
+        vendor_data_path=None,
+        network_config_path=None,
+        seed_template_values=None,
+        cloud_init_iso_output_path=None,
+        configure_vm_name=None,
+        configure_vm_log_path=None,
+        configure_vm_template_values=None,
+        base_digest=None,
+        verbose=None,
+    ):
+        result = job["result"]
+
+        if verbose is None:
+            verbose = self.verbose
+
+        resolved, resolved_msg = self.resolve()
+        if resolved != SUCCESS:
+            return result.finish(resolved, resolved_msg)
+
+        # An export that would overwrite the image is refused before the
+        # image is configured, rather than after
+        for export_format in self.export_formats:
+            if export_path(
+                image_path, export_format, export_dir=self.export_dir
+            ) == os.path.abspath(image_path):
+                return result.finish(
+                    EXPORT_ERROR,
+                    EXPORT_ERROR_MSG,
+                    image_path,
+                    "the image would be exported to itself in the format: {}".format(
+                        export_format
+                    ),
+                )
+        checked_resize = self._check_resize(result, image_path)
+        if checked_resize is not None:
+            return checked_resize
+
+        if configure_vm_name is None:
+            configure_vm_name = "{}-{}".format(CONFIGURE_VM_NAME, uuid.uuid4().hex[:8])
+        job["configure_vm_name"] = configure_vm_name
+        job["vm_orchestrator"] = self.vm_orchestrator
+
+        # Each job gets its own scratch directory for the files that are only
+        # required while it runs, such that concurrent jobs never contend on paths
+        try:
+            job["scratch_path"] = create_scratch_dir(
+                configure_vm_name, scratch_dir=self.scratch_dir
+            )
+        except OSError as err:
+            return result.finish(
+                PATH_CREATE_ERROR,
+                PATH_CREATE_ERROR_MSG,
+                "{} - error: {}".format(self.scratch_dir, err),
+            )
+        self._write_journal(job)
+
+        if cloud_init_iso_output_path is None:
+            cloud_init_iso_output_path = join(job["scratch_path"], "cidata.iso")
+        if configure_vm_log_path is None:
+            configure_vm_log_path = join(job["scratch_path"], "configure-vm.log")
 
-    if user_data_path or meta_data_path or vendor_data_path or network_config_path:
-        generated_result, generated_msg = generate_image_configuration(
-            cloud_init_iso_output_path,
+        seed_paths = resolve_seed_paths(
+            seed_dir=seed_dir,
             user_data_path=user_data_path,
             meta_data_path=meta_data_path,
             vendor_data_path=vendor_data_path,
             network_config_path=network_config_path,
         )
-        if verbose and generated_msg:
-            verbose_outputs.append(generated_msg)
-        if not generated_result:
-            response["msg"] = generated_msg
-            response["verbose_outputs"] = verbose_outputs
-            return generated_result, response
-
-    if not exists(os.path.dirname(configure_vm_log_path)):
-        created = makedirs(os.path.dirname(configure_vm_log_path))
-        if not created:
-            response["msg"] = PATH_CREATE_ERROR_MSG.format(
-                os.path.dirname(configure_vm_log_path)
-            )
-            response["verbose_outputs"] = verbose_outputs
-            return PATH_CREATE_ERROR, response
-
-    incrementer = 0
-    while exists(configure_vm_log_path):
-        if incrementer == 0:
+        cloud_init_iso_output_path = realpath(cloud_init_iso_output_path)
+        cloud_init_iso_cache_dir = self.cloud_init_iso_cache_dir
+        configure_vm_log_path = realpath(configure_vm_log_path)
+
+        if verbose:
+            result.add_event("Using the following paths to configure the given image")
+            result.add_event(
+                "Cloud-init data configuration path: {}", seed_paths["user_data_path"]
+            )
+            result.add_event(
+                "Cloud-init meta data configuration path: {}",
+                seed_paths["meta_data_path"],
+            )
+            result.add_event(
+                "Cloud-init vendor data configuration path: {}",
+                seed_paths["vendor_data_path"],
+            )
+            result.add_event(
+                "Cloud-init network configuration path: {}",
+                seed_paths["network_config_path"],
+            )
+            result.add_event(
+                "Cloud-init output iso path: {}", cloud_init_iso_output_path
+            )
+            result.add_event(
+                "Cloud-init iso cache directory: {}", cloud_init_iso_cache_dir
+            )
+            result.add_event("Configure VM log path: {}", configure_vm_log_path)
+            result.add_event("Job scratch directory: {}", job["scratch_path"])
+
+        if isinstance(seed_template_values, str):
+            seed_template_values = transform_str_to_dict(seed_template_values)
+        template_values = self._template_values(configure_vm_template_values)
+
+        seed_paths = self._existing_seed_paths(result, seed_paths)
+        has_seed = any(seed_paths.values())
+        completion_mode = self._completion_mode(result, has_seed)
+
+        async def check_image():
+            # Ensure that the image to configure exists
+            if not exists(image_path):
+                return PATH_NOT_FOUND_ERROR, PATH_NOT_FOUND_ERROR_MSG.format(
+                    image_path, "could not find the image to configure"
+                )
+            if image_format:
+                return SUCCESS, image_format
+            discovered_format = os.path.splitext(image_path)[1].replace(".", "")
             if verbose:
-                verbose_outputs.append(
-                    f"The configuring log file: {configure_vm_log_path} already exists, increasing the designated file name"
+                result.add_event(
+                    "Automatically discovered image format: {} to configure the disk image",
+                    discovered_format,
                 )
-            configure_vm_log_path = f"{configure_vm_log_path}.%s" % incrementer
-        else:
-            file_increment = os.path.splitext(configure_vm_log_path)[1]
-            configure_vm_log_path = configure_vm_log_path.replace(
-                file_increment, f".{incrementer + 1}"
+            return SUCCESS, discovered_format
+
+        async def resolve_template():
+            resolved, resolved_template = await self._resolve_vm_template(
+                image_path, template_values
             )
-        incrementer += 1
-    if verbose:
-        verbose_outputs.append(f"Generated new log file path: {configure_vm_log_path}")
-        verbose_outputs.append(
-            f"Using the VM template description: {configure_vm_template_path}"
-        )
-
-    # TODO, these do not validate the template values correctly
-    # Ensure that the required template values are set for the cloud-init iso image
-    # and for the VM log file that is monitored to tell when the configuration process is finished
-    if "num_vcpus" not in configure_vm_template_values:
-        configure_vm_template_values["num_vcpus"] = CONFIGURE_VM_VCPUS
-    if "memory_size" not in configure_vm_template_values:
-        configure_vm_template_values["memory_size"] = CONFIGURE_VM_MEMORY
-    if "cpu_architecture" not in configure_vm_template_values:
-        configure_vm_template_values["cpu_architecture"] = CPU_ARCHITECTURE
-    if "machine" not in configure_vm_template_values:
-        configure_vm_template_values["machine"] = CONFIGURE_VM_MACHINE
-
-    # Only add the cd_iso_path to the template values if the cloud-init iso image has been generated
-    if exists(cloud_init_iso_output_path):
-        if "cd_iso_path" not in configure_vm_template_values:
-            configure_vm_template_values["cd_iso_path"] = cloud_init_iso_output_path
-    if "configure_vm_log_path" not in configure_vm_template_values:
-        configure_vm_template_values["configure_vm_log_path"] = configure_vm_log_path
-
-    # Prepare the orchestrator
-    vm_orchestrator = discover_vm_orchestrator(orchestrator=configure_vm_orchestrator)
-
-    vm_orchestrator_args = prepare_vm_orchestrator_args(
-        vm_orchestrator, orchestrator_args=[configure_vm_name, image_path]
-    )
+            if resolved != SUCCESS:
+                return resolved, resolved_template
+            if verbose:
+                result.add_event("Configure VM template path: {}", resolved_template)
+                result.add_event(
+                    "Configure VM architecture: {}, machine type: {}, domain type: {}",
+                    template_values["cpu_architecture"],
+                    template_values["machine"],
+                    template_values["domain_type"],
+                )
+            return SUCCESS, resolved_template
+
+        async def build_seed():
+            iso_output_path = cloud_init_iso_output_path
+            # When the seed is templated, cached or extended with the status
+            # reporting, it is rendered in memory and the iso is generated
+            # directly from the rendered content
+            rendered, seed = self._render_seed(
+                image_path, seed_paths, seed_template_values, completion_mode
+            )
+            if rendered != SUCCESS:
+                return rendered, seed
+            if cloud_init_iso_cache_dir and seed:
+                iso_output_path = seed_cache_path(cloud_init_iso_cache_dir, seed)
+
+            # Ensure that the required output directories exists
+            cidata_iso_dir = os.path.dirname(iso_output_path)
+            if not exists(cidata_iso_dir):
+                created = makedirs(cidata_iso_dir)
+                if not created:
+                    return PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG.format(
+                        cidata_iso_dir
+                    )
+
+            generate_iso = has_seed
+            if generate_iso and cloud_init_iso_cache_dir and exists(iso_output_path):
+                generate_iso = False
+                if verbose:
+                    result.add_event(
+                        "Reusing the cached cloud-init iso image at: {}",
+                        iso_output_path,
+                    )
+
+            if generate_iso:
+                phase_deadline = self._start_stage(job, deadline, CONFIGURE_PHASE_SEED)
+                # A cached iso is kept for later runs, whereas an iso that is
+                # only generated for this run is removed if it fails
+                if not cloud_init_iso_cache_dir:
+                    job["generated_paths"].append(iso_output_path)
+                if verbose:
+                    result.add_event(
+                        "Generating the cloud-init iso image at: {}",
+                        iso_output_path,
+                        phase=CONFIGURE_PHASE_SEED,
+                    )
+                generated_result, generated_msg = await asyncio.wait_for(
+                    generate_image_configuration(
+                        iso_output_path,
+                        seed=seed,
+                        create_iso_command=self.create_iso_command,
+                        validate=self.seed_validation,
+                        **seed_paths,
+                    ),
+                    phase_deadline.remaining(),
+                )
+                self._record_command(
+                    job,
+                    self.create_iso_command,
+                    generated_result == SUCCESS,
+                    phase=CONFIGURE_PHASE_SEED,
+                )
+                if verbose and generated_msg:
+                    result.add_event(generated_msg, phase=CONFIGURE_PHASE_SEED)
+                if generated_result != SUCCESS:
+                    return generated_result, generated_msg
+            return SUCCESS, iso_output_path
+
+        async def reserve_log():
+            log_dir = os.path.dirname(configure_vm_log_path)
+            if not exists(log_dir):
+                created = makedirs(log_dir)
+                if not created:
+                    return PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG.format(log_dir)
+
+            # A log path that is shared with other jobs gets a numeric suffix
+            # if it is already in use, which the reservation ensures is unique
+            try:
+                reserved_log_path = reserve_path(configure_vm_log_path)
+            except OSError as err:
+                return PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG.format(
+                    "{} - error: {}".format(configure_vm_log_path, err)
+                )
+            if verbose and reserved_log_path != configure_vm_log_path:
+                result.add_event(
+                    f"The configuring log file: {configure_vm_log_path} already exists, using: {reserved_log_path}"
+                )
+            job["configure_vm_log_rotation_path"] = configure_vm_log_path
+            job["configure_vm_log_path"] = reserved_log_path
+            if verbose:
+                result.add_event(f"Generated new log file path: {reserved_log_path}")
+            return SUCCESS, reserved_log_path
+
+        async def lock_image():
+            image_lock = ImageLock(image_path)
+            try:
+                locked, locked_msg = await image_lock.acquire(timeout=self.lock_timeout)
+            except OSError as err:
+                if err.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+                    return LOCK_ERROR, LOCK_ERROR_MSG.format(image_path, err)
+                # An image in a directory that is not writable, e.g. on a
+                # read-only share, is configured without the lock instead
+                result.add_warning(
+                    "Configuring the image: {} without a lock, since the lock file "
+                    "can not be created - error: {}",
+                    image_path,
+                    err,
+                )
+                return SUCCESS, None
+            if not locked:
+                return LOCK_ERROR, LOCK_ERROR_MSG.format(image_path, locked_msg)
+            job["lock"] = image_lock
+            if verbose:
+                result.add_event("Locked the image with: {}", image_lock.lock_path)
+            return SUCCESS, image_lock
+
+        async def resolve_base_digest():
+            # The digest of the image before it is configured, which the
+            # catalog, or otherwise the digest cache, only calculates once
+            # for each version of the image
+            if base_digest:
+                return SUCCESS, base_digest
+            if self.catalog is not None:
+                digest_func = self.catalog.digest
+            else:
+                digest_func = image_digest
+            try:
+                digest = await asyncio.get_running_loop().run_in_executor(
+                    None, digest_func, image_path
+                )
+            except (OSError, sqlite3.Error) as err:
+                result.add_event(
+                    "Failed to calculate the digest of the image: {} - error: {}",
+                    image_path,
+                    err,
+                )
+                return SUCCESS, None
+            if verbose:
+                result.add_event("The digest of the image to configure: {}", digest)
+            return SUCCESS, digest
 
-    configured_id, configured_msg = await configure_image(
-        vm_orchestrator,
-        vm_orchestrator_args=vm_orchestrator_args,
-        template_path=configure_vm_template_path,
-        template_kwargs=configure_vm_template_values,
-    )
-    if verbose:
-        verbose_outputs.append(configured_msg)
-    if not configured_id:
-        response["msg"] = CONFIGURE_IMAGE_ERROR_MSG.format(
-            image_path, "failed to configure image"
-        )
-        response["verbose_outputs"] = verbose_outputs
-        return CONFIGURE_IMAGE_ERROR, response
+        async def check_image_integrity():
+            phase_deadline = self._start_stage(job, deadline, CONFIGURE_PHASE_CHECK)
+            check_format = image_format or os.path.splitext(image_path)[1].replace(
+                ".", ""
+            )
+            checked, check = await asyncio.wait_for(
+                check_integrity(
+                    image_path,
+                    check_format,
+                    cache_path=self.integrity_check_cache_path,
+                ),
+                phase_deadline.remaining(),
+            )
+            if not checked:
+                return CHECK_ERROR, CHECK_ERROR_MSG.format(
+                    "{} - error: {}".format(image_path, check)
+                )
+            if check is None:
+                result.add_event(
+                    "Skipping the integrity check of the image: {}, "
+                    "qemu-img was not found",
+                    image_path,
+                    phase=CONFIGURE_PHASE_CHECK,
+                )
+                return SUCCESS, None
+            if not check["cached"]:
+                self._record_command(
+                    job,
+                    "qemu-img check",
+                    check_succeeded(check),
+                    phase=CONFIGURE_PHASE_CHECK,
+                )
+            result.record(
+                EVENT_MARKER,
+                "The integrity check of the image: {} is: {}",
+                image_path,
+                check["status"],
+                phase=CONFIGURE_PHASE_CHECK,
+                check=check,
+            )
+            if not check_succeeded(check):
+                return CHECK_ERROR, CHECK_ERROR_MSG.format(
+                    "{} - error: the image is corrupt with {} corruptions "
+                    "and {} check errors".format(
+                        image_path, check["corruptions"], check["check_errors"]
+                    )
+                )
+            return SUCCESS, check
 
-    if verbose:
-        verbose_outputs.append("Waiting for the configuration process to finish")
+        async def resize():
+            if self._lock_lost(job):
+                return LOCK_ERROR, LOCK_ERROR_MSG.format(
+                    image_path, "the lease on the image was lost before it was resized"
+                )
+            phase_deadline = self._start_stage(job, deadline, CONFIGURE_PHASE_RESIZE)
+            resize_format = image_format or os.path.splitext(image_path)[1].replace(
+                ".", ""
+            )
+            resized, resized_msg = await asyncio.wait_for(
+                resize_image(image_path, resize_format, self.resize),
+                phase_deadline.remaining(),
+            )
+            self._record_command(
+                job, "qemu-img resize", resized, phase=CONFIGURE_PHASE_RESIZE
+            )
+            if not resized:
+                return RESIZE_ERROR, RESIZE_ERROR_MSG.format(
+                    "{} - error: {}".format(image_path, resized_msg)
+                )
+            if verbose:
+                result.add_event(
+                    "Resized the image: {} with: {}",
+                    image_path,
+                    self.resize,
+                    phase=CONFIGURE_PHASE_RESIZE,
+                )
+            return SUCCESS, self.resize
+
+        seed_digest = digest_seed(seed_paths, seed_template_values)
+        # The values of the stages that the result cache lookup depends on,
+        # and whether the configured image was restored from the cache
+        stage_values = {}
+        cached = {"key": None, "restored": False}
+
+        def record_value(name, stage):
+            async def run_stage():
+                return_code, value = await stage()
+                stage_values[name] = value
+                return return_code, value
+
+            return run_stage
+
+        def in_stage(phase, stage):
+            # The concurrent stages do not enter their phases, such that
+            # the phase of a stage that fails is recorded once it has ended
+            async def run_stage():
+                failed = True
+                try:
+                    return_code, value = await stage()
+                    failed = return_code != SUCCESS
+                    return return_code, value
+                finally:
+                    self._finish_stage(job, phase, failed=failed)
+
+            return run_stage
+
+        def on_cache_miss(stage):
+            async def run_stage():
+                if cached["restored"]:
+                    return SUCCESS, None
+                return await stage()
+
+            return run_stage
+
+        async def restore_cached_result():
+            if not stage_values["base"]:
+                return SUCCESS, False
+            # The tool versions are probed by running the tools
+            cached["key"] = await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: result_key(
+                    stage_values["base"],
+                    seed_digest,
+                    template_digest(stage_values["template"], template_values),
+                    reset_operations=self.reset_operations,
+                    image_format=stage_values["image"],
+                    resize=self.resize,
+                    completion_mode=completion_mode,
+                    tools=tool_versions(self.vm_orchestrator),
+                ),
+            )
+            if self.rebuild:
+                result.add_event(
+                    "Bypassing the result cache to rebuild the image: {}", image_path
+                )
+                return SUCCESS, False
+            cached["restored"] = await self._restore_result(job, cached["key"])
+            return SUCCESS, cached["restored"]
+
+        async def start_status_listener():
+            # The listener is started before the VM is created,
+            # since the VM connects to it when it is started
+            status_listener = StatusListener(join(job["scratch_path"], "status.sock"))
+            try:
+                await status_listener.start()
+            except OSError as err:
+                return PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG.format(
+                    "{} - error: {}".format(status_listener.socket_path, err)
+                )
+            job["status_listener"] = status_listener
+            if verbose:
+                result.add_event(
+                    "Listening for the configuration status on: {}",
+                    status_listener.socket_path,
+                )
+            return SUCCESS, status_listener
+
+        # The stages before the VM is created are run concurrently where they
+        # do not depend on each other, e.g. the seed iso is generated while
+        # the architecture of the image is probed, to shorten the time until
+        # the configuring VM boots
+        stages = {
+            "image": (record_value("image", check_image), ()),
+            "template": (record_value("template", resolve_template), ("image",)),
+            "seed": (in_stage(CONFIGURE_PHASE_SEED, build_seed), ()),
+            "log": (reserve_log, ()),
+        }
+        # The image is locked before the VM that configures it is created,
+        # such that concurrent jobs never boot or reset the same image
+        if self.image_lock:
+            stages["lock"] = (lock_image, ("image",))
+        # The digest is taken once the image is locked,
+        # such that no other job modifies it in the meantime
+        if self.catalog is not None or self.result_cache is not None:
+            stages["base"] = (
+                record_value("base", resolve_base_digest),
+                ("lock",) if self.image_lock else ("image",),
+            )
+        image_stage = "lock" if self.image_lock else "image"
+        # The result cache is looked up as soon as the digest is taken, where
+        # the image is neither checked, resized nor given a seed when the
+        # configured image is restored from the cache instead
+        if self.result_cache is not None:
+            stages["cache"] = (restore_cached_result, ("base", "template"))
+            for name in ("seed", "log"):
+                stage, dependencies = stages[name]
+                stages[name] = (on_cache_miss(stage), dependencies + ("cache",))
+        # The integrity of the image is checked while the seed is built,
+        # and before it is resized, such that a corrupt image is never booted
+        if self.integrity_check:
+            stages["check"] = (
+                in_stage(CONFIGURE_PHASE_CHECK, check_image_integrity),
+                (image_stage,),
+            )
+        # The image is resized once its digest is taken, and after its
+        # architecture is probed, such that nothing reads it while it changes
+        if self.resize is not None:
+            resize_dependencies = [
+                "base" if "base" in stages else image_stage,
+                "template",
+            ]
+            if self.integrity_check:
+                resize_dependencies.append("check")
+            stages["resize"] = (
+                in_stage(CONFIGURE_PHASE_RESIZE, resize),
+                tuple(resize_dependencies),
+            )
+        if completion_mode == COMPLETION_MODE_CHANNEL:
+            stages["status"] = (start_status_listener, ())
+        if "cache" in stages:
+            for name in ("check", "resize", "status"):
+                if name in stages:
+                    stage, dependencies = stages[name]
+                    stages[name] = (on_cache_miss(stage), dependencies + ("cache",))
+        staged, staged_values = await run_stages(stages)
+        if staged != SUCCESS:
+            return result.finish(staged, staged_values)
+        image_format = staged_values["image"]
+        configure_vm_template_path = staged_values["template"]
+        cache_key = cached["key"]
+        if cached["restored"]:
+            if self.export_formats:
+                export_result = await self._export_image(
+                    job, deadline, image_path, image_format
+                )
+                if export_result is not None:
+                    return export_result
+            if self.catalog is not None:
+                await self._record_provenance(
+                    job,
+                    staged_values["base"],
+                    seed_digest,
+                    completion_mode,
+                    result_cache_key=cache_key,
+                )
+            return result.finish(
+                SUCCESS,
+                "Restored the configured image: {} from the result cache: {}",
+                image_path,
+                self.result_cache.cache_dir,
+            )
+        cloud_init_iso_output_path = staged_values["seed"]
+        configure_vm_log_path = staged_values["log"]
+        if verbose:
+            result.add_event(
+                f"Using the VM template description: {configure_vm_template_path}"
+            )
 
-    if not exists(configure_vm_log_path):
-        response["msg"] = PATH_NOT_FOUND_ERROR_MSG.format(
-            configure_vm_log_path,
-            "Failed to find the log file that is used for monitored the configuration process",
+        # Ensure that the required template values are set for the cloud-init iso image
+        # and for the VM log file that is monitored to tell when the configuration process is finished
+        # Only add the cd_iso_path to the template values if the cloud-init iso image has been generated
+        if exists(cloud_init_iso_output_path):
+            if "cd_iso_path" not in template_values:
+                template_values["cd_iso_path"] = cloud_init_iso_output_path
+        if "disk_format" not in template_values:
+            template_values["disk_format"] = image_format
+        if "configure_vm_log_path" not in template_values:
+            template_values["configure_vm_log_path"] = configure_vm_log_path
+        if job["status_listener"] is not None:
+            template_values["status_socket_path"] = job["status_listener"].socket_path
+            template_values["status_channel_name"] = CONFIGURE_VM_STATUS_CHANNEL
+
+        # Prepare the orchestrator
+        vm_orchestrator = self.vm_orchestrator
+        vm_orchestrator_args = prepare_vm_orchestrator_args(
+            vm_orchestrator, orchestrator_args=[configure_vm_name, image_path]
         )
-        return PATH_NOT_FOUND_ERROR, response
 
-    if exists(cloud_init_iso_output_path):
-        # Expect cloud-init to run
-        finished = finished_configure(
-            configure_vm_log_path, line_finished_markers=["Cloud-init v", "finished at"]
-        )
-    else:
-        # Just expect a normal boot
-        finished = finished_configure(
-            configure_vm_log_path,
-            line_finished_markers=["Activate the web console with:"],
-        )
-    if not finished:
-        response["msg"] = "Failed to finish configuring the image"
-        response["verbose_outputs"] = verbose_outputs
-        return CONFIGURE_IMAGE_ERROR, response
-    if verbose:
-        verbose_outputs.append(
-            f"Finished configuring the image in the instance: {configured_id}"
+        if self._lock_lost(job):
+            return result.finish(
+                LOCK_ERROR,
+                LOCK_ERROR_MSG,
+                image_path,
+                "the lease on the image was lost before the VM was created",
+            )
+        phase_deadline = self._start_phase(job, deadline, CONFIGURE_PHASE_CREATE)
+        configured_id, configured_msg = await asyncio.wait_for(
+            configure_image(
+                vm_orchestrator,
+                vm_orchestrator_args=vm_orchestrator_args,
+                template_path=configure_vm_template_path,
+                template_kwargs=template_values,
+            ),
+            phase_deadline.remaining(),
         )
+        self._record_command(job, "create", configured_id)
+        if verbose:
+            result.add_event(configured_msg)
+        if not configured_id:
+            return result.finish(
+                CONFIGURE_IMAGE_ERROR,
+                CONFIGURE_IMAGE_ERROR_MSG,
+                image_path,
+                "failed to configure image",
+            )
+        job["instance_id"] = configured_id
 
-    shutdown, shutdown_msg = vm_action("stop", configured_id)
-    if not shutdown:
-        response["msg"] = (
-            f"Failed to shutdown the VM: {configured_id} after configuration: {shutdown_msg}"
-        )
-        response["verbose_outputs"] = verbose_outputs
-        return CONFIGURE_IMAGE_ERROR, response
+        if verbose:
+            result.add_event("Waiting for the configuration process to finish")
+
+        if not exists(configure_vm_log_path):
+            return result.finish(
+                PATH_NOT_FOUND_ERROR,
+                PATH_NOT_FOUND_ERROR_MSG,
+                configure_vm_log_path,
+                "Failed to find the log file that is used for monitored the configuration process",
+            )
 
-    shutdowned, shutdowned_msg = wait_for_vm_shutdown(configured_id)
-    if not shutdowned:
-        response["msg"] = (
-            f"Failed to wait for the shutdown of VM: {configured_id} after configuration: {shutdowned_msg}"
-        )
-        response["verbose_outputs"] = verbose_outputs
-        return CONFIGURE_IMAGE_ERROR, response
+        phase_deadline = self._start_phase(job, deadline, CONFIGURE_PHASE_CONFIGURE)
+        if job["status_listener"] is not None:
+            job["console"] = ConsoleCapture(configure_vm_log_path)
+            status, over_console = await asyncio.wait_for(
+                wait_for_status(
+                    job["status_listener"],
+                    configure_vm_log_path,
+                    capture=job["console"],
+                ),
+                phase_deadline.remaining(),
+            )
+            result.record(
+                EVENT_MARKER,
+                "The configuring VM reported the status: {}{}",
+                status.get("status"),
+                " over the console" if over_console else "",
+                status=status,
+            )
+            if verbose:
+                result.add_event("The configuring VM reported the status: {}", status)
+            if not status_succeeded(status):
+                return result.finish(
+                    CONFIGURE_IMAGE_ERROR,
+                    CONFIGURE_IMAGE_ERROR_MSG,
+                    image_path,
+                    "cloud-init finished with the status: {}".format(
+                        status.get("status")
+                    ),
+                )
+            finished = True
+        elif completion_mode == COMPLETION_MODE_POWEROFF:
+            # The guest powers itself off once cloud-init has finished,
+            # such that a VM that shut off cleanly has been configured
+            poweroff, poweroff_msg = await asyncio.wait_for(
+                wait_for_vm_poweroff(configured_id, vm_orchestrator=vm_orchestrator),
+                phase_deadline.remaining(),
+            )
+            if not poweroff:
+                return result.finish(
+                    CONFIGURE_IMAGE_ERROR,
+                    CONFIGURE_IMAGE_ERROR_MSG,
+                    image_path,
+                    poweroff_msg,
+                )
+            result.record(EVENT_MARKER, poweroff_msg)
+            # The guest reports the cloud-init status to the console before
+            # it powers off, which tells whether cloud-init succeeded
+            job["console"] = ConsoleCapture(configure_vm_log_path)
+            status = last_console_status(job["console"])
+            if status is None:
+                return result.finish(
+                    CONFIGURE_IMAGE_ERROR,
+                    CONFIGURE_IMAGE_ERROR_MSG,
+                    image_path,
+                    "The configuring VM powered off without reporting "
+                    "the cloud-init status",
+                )
+            result.record(
+                EVENT_MARKER,
+                "The configuring VM reported the status: {} over the console",
+                status.get("status"),
+                status=status,
+            )
+            if verbose:
+                result.add_event("The configuring VM reported the status: {}", status)
+            if not status_succeeded(status):
+                return result.finish(
+                    CONFIGURE_IMAGE_ERROR,
+                    CONFIGURE_IMAGE_ERROR_MSG,
+                    image_path,
+                    "cloud-init finished with the status: {}".format(
+                        status.get("status")
+                    ),
+                )
+            finished = True
+        else:
+            if exists(cloud_init_iso_output_path):
+                # Expect cloud-init to run
+                line_finished_markers = ["Cloud-init v", "finished at"]
+            else:
+                # Just expect a normal boot
+                line_finished_markers = ["Activate the web console with:"]
+            job["console"] = ConsoleCapture(configure_vm_log_path)
+            finished = await asyncio.wait_for(
+                finished_configure(
+                    configure_vm_log_path,
+                    line_finished_markers=line_finished_markers,
+                    capture=job["console"],
+                    on_marker=functools.partial(
+                        result.record,
+                        EVENT_MARKER,
+                        "Found the finished markers in the console log line: {}",
+                        markers=line_finished_markers,
+                    ),
+                ),
+                phase_deadline.remaining(),
+            )
+        if not finished:
+            return result.finish(
+                CONFIGURE_IMAGE_ERROR, "Failed to finish configuring the image"
+            )
+        if verbose:
+            result.add_event(
+                f"Finished configuring the image in the instance: {configured_id}"
+            )
 
-    remove_args = []
-    if configure_vm_remove_options is not None:
-        user_options = configure_vm_remove_options.split()
-        # https://github.com/rasmunk/libvirt_provider/blob/b90780f23aaa8f86ef1dc3142f996e7e6b30c0c3/libvirt_provider/cli/parsers/instance.py#L189
-        remove_args = ["--flags"] + user_options
-    if verbose:
-        verbose_outputs.append(f"Using the configure vm removal options: {remove_args}")
+        if completion_mode != COMPLETION_MODE_POWEROFF:
+            shutdown_result = await self._shutdown_vm(
+                job, deadline, configured_id, vm_orchestrator
+            )
+            if shutdown_result is not None:
+                return shutdown_result
 
-    remove, remove_msg = vm_action("remove", configured_id, *remove_args)
-    if not remove:
-        response["msg"] = (
-            f"Failed to remove the VM: {configured_id} after configuration: {remove_msg} with options: {remove_args}"
+        remove_args = self._remove_args()
+        if verbose:
+            result.add_event(f"Using the configure vm removal options: {remove_args}")
+
+        phase_deadline = self._start_phase(job, deadline, CONFIGURE_PHASE_REMOVE)
+        remove, remove_msg = await asyncio.wait_for(
+            vm_action(
+                "remove", configured_id, *remove_args, vm_orchestrator=vm_orchestrator
+            ),
+            phase_deadline.remaining(),
         )
-        response["verbose_outputs"] = verbose_outputs
-        return CONFIGURE_IMAGE_ERROR, response
+        self._record_command(job, "remove", remove)
+        if not remove:
+            return result.finish(
+                CONFIGURE_IMAGE_ERROR,
+                f"Failed to remove the VM: {configured_id} after configuration: {remove_msg} with options: {remove_args}",
+            )
 
-    removed, removed_msg = wait_for_vm_removed(configured_id)
-    if not removed:
-        response["msg"] = (
-            f"Failed to wait for the removal of VM: {configured_id} after the configuration was applied: {removed_msg}"
+        removed, removed_msg = await asyncio.wait_for(
+            wait_for_vm_removed(configured_id, vm_orchestrator=vm_orchestrator),
+            phase_deadline.remaining(),
         )
-        response["verbose_outputs"] = verbose_outputs
-        return CONFIGURE_IMAGE_ERROR, response
-    if verbose:
-        verbose_outputs.append(
-            f"Removed the VM: {configured_id} after configuration: {removed_msg}"
+        if not removed:
+            return result.finish(
+                CONFIGURE_IMAGE_ERROR,
+                f"Failed to wait for the removal of VM: {configured_id} after the configuration was applied: {removed_msg}",
+            )
+        job["instance_id"] = None
+        if verbose:
+            result.add_event(
+                f"Removed the VM: {configured_id} after configuration: {removed_msg}"
+            )
+
+        if self._lock_lost(job):
+            return result.finish(
+                LOCK_ERROR,
+                LOCK_ERROR_MSG,
+                image_path,
+                "the lease on the image was lost before it was reset",
+            )
+        phase_deadline = self._start_phase(job, deadline, CONFIGURE_PHASE_RESET)
+        reset_success, reset_results = await asyncio.wait_for(
+            reset_image(
+                image_path, reset_operations=self.reset_operations, verbose=verbose
+            ),
+            phase_deadline.remaining(),
         )
+        self._record_command(job, "virt-sysprep", reset_success)
+        if verbose:
+            result.add_event(reset_results)
+        if not reset_success:
+            return result.finish(
+                RESET_IMAGE_ERROR,
+                RESET_IMAGE_ERROR_MSG,
+                reset_results,
+                "failed to reset image",
+            )
+        if cache_key is not None:
+            await self._store_result(job, cache_key, staged_values["base"], seed_digest)
+        if self.catalog is not None:
+            await self._record_provenance(
+                job,
+                staged_values["base"],
+                seed_digest,
+                completion_mode,
+                result_cache_key=cache_key,
+            )
+        if self.export_formats:
+            export_result = await self._export_image(
+                job, deadline, image_path, image_format
+            )
+            if export_result is not None:
+                return export_result
+        return result.finish(SUCCESS, "Succesfully configured image: {}", image_path)
+
 
-    reset_success, reset_results = reset_image(
-        image_path, reset_operations=reset_operations, verbose=verbose
+async def configure_vm_image(
+    image_path,
+    image_format=None,
+    user_data_path=join(CLOUD_INIT_DIR, "user-data"),
+    meta_data_path=join(CLOUD_INIT_DIR, "meta-data"),
+    vendor_data_path=join(CLOUD_INIT_DIR, "vendor-data"),
+    network_config_path=join(CLOUD_INIT_DIR, "network-config"),
+    cloud_init_iso_output_path=None,
+    cloud_init_iso_cache_dir=None,
+    seed_template_values=None,
+    configure_vm_name=None,
+    configure_vm_log_path=None,
+    configure_vm_template_path=None,
+    configure_vm_template_values=None,
+    template_profile=TEMPLATE_PROFILE_AUTO,
+    configure_vm_orchestrator=VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+    configure_vm_remove_options=None,
+    reset_operations="defaults,-ssh-userdir",
+    timeout=None,
+    phase_timeouts=None,
+    scratch_dir=CONFIGURE_IMAGE_TMP_DIR,
+    keep_scratch_dir=False,
+    completion_mode=COMPLETION_MODE_CONSOLE,
+    image_lock=True,
+    lock_timeout=IMAGE_LOCK_TIMEOUT,
+    catalog_path=None,
+    base_digest=None,
+    result_cache_dir=None,
+    result_cache_link=RESULT_CACHE_LINK_AUTO,
+    rebuild=False,
+    export_formats=None,
+    export_dir=None,
+    export_parallel=EXPORT_MAX_PARALLEL,
+    resize=None,
+    integrity_check=False,
+    integrity_check_cache_path=IMAGE_CHECK_CACHE_PATH,
+    seed_validation=True,
+    plan=False,
+    verbose=False,
+    event_handler=None,
+):
+    session = ConfigureSession(
+        configure_vm_template_path=configure_vm_template_path,
+        configure_vm_template_values=configure_vm_template_values,
+        template_profile=template_profile,
+        configure_vm_orchestrator=configure_vm_orchestrator,
+        configure_vm_remove_options=configure_vm_remove_options,
+        cloud_init_iso_cache_dir=cloud_init_iso_cache_dir,
+        reset_operations=reset_operations,
+        timeout=timeout,
+        phase_timeouts=phase_timeouts,
+        scratch_dir=scratch_dir,
+        keep_scratch_dir=keep_scratch_dir,
+        completion_mode=completion_mode,
+        image_lock=image_lock,
+        lock_timeout=lock_timeout,
+        catalog_path=catalog_path,
+        result_cache_dir=result_cache_dir,
+        result_cache_link=result_cache_link,
+        rebuild=rebuild,
+        export_formats=export_formats,
+        export_dir=export_dir,
+        export_parallel=export_parallel,
+        resize=resize,
+        integrity_check=integrity_check,
+        integrity_check_cache_path=integrity_check_cache_path,
+        seed_validation=seed_validation,
+        verbose=verbose,
+    )
+    if plan:
+        configure = session.plan
+    else:
+        configure = session.configure
+    return await configure(
+        image_path,
+        image_format=image_format,
+        user_data_path=user_data_path,
+        meta_data_path=meta_data_path,
+        vendor_data_path=vendor_data_path,
+        network_config_path=network_config_path,
+        seed_template_values=seed_template_values,
+        cloud_init_iso_output_path=cloud_init_iso_output_path,
+        configure_vm_name=configure_vm_name,
+        configure_vm_log_path=configure_vm_log_path,
+        base_digest=base_digest,
+        event_handler=event_handler,
     )
-    if verbose:
-        verbose_outputs.append(reset_results)
-    if not reset_success:
-        response["msg"] = RESET_IMAGE_ERROR_MSG.format(
-            reset_results, "failed to reset image"
-        )
-        response["verbose_outputs"] = verbose_outputs
-        return RESET_IMAGE_ERROR, response
-    response["msg"] = "Succesfully configured image: {}".format(image_path)
-    return SUCCESS, response
@@ -0,0 +1,113 @@
+import collections
+import gzip
+import os
+import shutil
+
+from configure_vm_image.common.defaults import (
+    CONFIGURE_VM_LOG_ROTATIONS,
+    CONSOLE_READ_CHUNK_SIZE,
+    CONSOLE_TAIL_SIZE,
+)
+
+
+class ConsoleCapture:
+    """Follows the console log of the configuring VM from the offset it has
+    read up to, such that each pass only reads what the guest has written since.
+    Only the last tail_size bytes of the console are kept in memory, which are
+    used for error reports, such that the memory use is bounded regardless of
+    how much the guest writes to its console."""
+
+    def __init__(
+        self,
+        path,
+        tail_size=CONSOLE_TAIL_SIZE,
+        chunk_size=CONSOLE_READ_CHUNK_SIZE,
+    ):
+        self.path = path
+        self.tail_size = tail_size
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self._tail = collections.deque()
+        self._tail_bytes = 0
+        self._partial = b""
+
+    def _add_to_tail(self, line):
+        self._tail.append(line)
+        self._tail_bytes += len(line)
+        while self._tail_bytes > self.tail_size and len(self._tail) > 1:
+            self._tail_bytes -= len(self._tail.popleft())
+
+    def skip_to_tail(self):
+        """Skips to the last tail_size bytes of the log,
+        for when only its tail is of interest"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size - self.tail_size > self.offset:
+            # The tail that was kept is no longer followed by what is read next
+            self.offset = size - self.tail_size
+            self._tail.clear()
+            self._tail_bytes, self._partial = 0, b""
+
+    def read(self):
+        """Reads the lines that were written since the last read.
+        A line that is still being written is returned once it is complete,
+        unless it exceeds the tail size, in which case it is returned in parts."""
+        try:
+            fh = open(self.path, "rb")
+        except OSError:
+            return
+        with fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < self.offset:
+                # The log was truncated, e.g. because it was rotated
+                self.offset, self._partial = 0, b""
+            fh.seek(self.offset)
+            while True:
+                chunk = fh.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+                lines = (self._partial + chunk).split(b"\n")
+                self._partial = lines.pop()
+                if len(self._partial) > self.tail_size:
+                    lines.append(self._partial)
+                    self._partial = b""
+                for line in lines:
+                    self._add_to_tail(line + b"\n")
+                    yield line.decode("utf-8", errors="replace")
+
+    @property
+    def tail(self):
+        tail = b"".join(self._tail) + self._partial
+        start = max(0, len(tail) - self.tail_size)
+        return tail[start:].decode("utf-8", errors="replace")
+
+
+def rotate_log(path, rotated_path=None, rotations=CONFIGURE_VM_LOG_ROTATIONS):
+    """Compresses the log at path into rotated_path.1.gz, after the earlier
+    rotations of rotated_path have been shifted by one, where only the
+    latest number of rotations are kept. The log at path is removed afterwards,
+    such that the same log path can be reused by the next configuration.
+    The log is compressed in chunks, such that the memory use is bounded."""
+    if rotated_path is None:
+        rotated_path = path
+    if not os.path.exists(path):
+        return None
+
+    def rotation(index):
+        return "{}.{}.gz".format(rotated_path, index)
+
+    if os.path.exists(rotation(rotations)):
+        os.remove(rotation(rotations))
+    for index in range(rotations - 1, 0, -1):
+        if os.path.exists(rotation(index)):
+            os.replace(rotation(index), rotation(index + 1))
+
+    tmp_path = "{}.tmp".format(rotation(1))
+    with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, CONSOLE_READ_CHUNK_SIZE)
+    os.replace(tmp_path, rotation(1))
+    os.remove(path)
+    return rotation(1)
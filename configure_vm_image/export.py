@@ -0,0 +1,203 @@
+import asyncio
+import os
+import time
+
+from configure_vm_image.common.codes import (
+    EXPORT_ERROR,
+    EXPORT_ERROR_MSG,
+    PATH_CREATE_ERROR,
+    PATH_CREATE_ERROR_MSG,
+    SUCCESS,
+)
+from configure_vm_image.common.defaults import (
+    EVENT_COMMAND,
+    EXPORT_COROUTINES,
+    EXPORT_MAX_PARALLEL,
+    IMAGE_CHECKSUM_TYPE,
+)
+from configure_vm_image.result import Result
+from configure_vm_image.store import file_checksum
+from configure_vm_image.utils.io import exists, join, makedirs, remove
+from configure_vm_image.utils.job import run_async
+
+
+def export_path(image_path, export_format, export_dir=None):
+    """The path that the image is exported to in the format, which is next
+    to the image with the extension of the format, unless an export_dir is given"""
+    name = "{}.{}".format(
+        os.path.splitext(os.path.basename(image_path))[0], export_format
+    )
+    return join(export_dir or os.path.dirname(os.path.abspath(image_path)), name)
+
+
+def convert_command(
+    image_path, image_format, output_path, output_format, coroutines=EXPORT_COROUTINES
+):
+    """The qemu-img convert command that exports the image to the output format.
+    The source is read through the page cache, such that the conversions of
+    the same image that run together only read it from the disk once."""
+    return [
+        "qemu-img",
+        "convert",
+        "-f",
+        image_format,
+        "-O",
+        output_format,
+        "-T",
+        "writeback",
+        "-m",
+        str(coroutines),
+        image_path,
+        output_path,
+    ]
+
+
+async def _convert(
+    image_path,
+    image_format,
+    output_path,
+    output_format,
+    coroutines=EXPORT_COROUTINES,
+    checksum_type=IMAGE_CHECKSUM_TYPE,
+):
+    """Converts the image into a temporary file next to the output path,
+    which replaces the output path once its digest is calculated.
+    Returns (success, export) where export is an error message on failure."""
+    started_at = time.time()
+    tmp_path = join(
+        os.path.dirname(output_path), ".{}.export".format(os.path.basename(output_path))
+    )
+    command = convert_command(
+        image_path, image_format, tmp_path, output_format, coroutines=coroutines
+    )
+    try:
+        success, results = await run_async(command)
+    except asyncio.CancelledError:
+        remove(tmp_path)
+        raise
+    if not success:
+        remove(tmp_path)
+        return False, results.get("error") or results.get("output")
+    try:
+        digest = await asyncio.get_running_loop().run_in_executor(
+            None, file_checksum, tmp_path, checksum_type
+        )
+        stat = os.stat(tmp_path)
+        os.replace(tmp_path, output_path)
+    except OSError as err:
+        remove(tmp_path)
+        return False, str(err)
+    return True, {
+        "format": output_format,
+        "path": output_path,
+        "size": stat.st_size,
+        "allocated_size": stat.st_blocks * 512,
+        "digest": digest,
+        "digest_type": checksum_type,
+        "duration": time.time() - started_at,
+    }
+
+
+async def convert_formats(
+    result,
+    image_path,
+    image_format,
+    export_formats,
+    export_dir=None,
+    max_parallel=EXPORT_MAX_PARALLEL,
+    coroutines=EXPORT_COROUTINES,
+    verbose=False,
+):
+    """Exports the image to each of the formats concurrently, where at most
+    max_parallel conversions run at once. The events of the conversions are
+    recorded in the result. Returns (return_code, exports), where exports
+    is the list of the exported images, or the error message on failure."""
+    if export_dir and not exists(export_dir) and not makedirs(export_dir):
+        return PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG.format(export_dir)
+    image_path = os.path.abspath(image_path)
+    output_paths = {
+        export_format: export_path(image_path, export_format, export_dir=export_dir)
+        for export_format in export_formats
+    }
+    if image_path in output_paths.values():
+        return EXPORT_ERROR, EXPORT_ERROR_MSG.format(
+            image_path, "the image would be exported to itself"
+        )
+
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+
+    async def export(export_format):
+        async with semaphore:
+            if verbose:
+                result.add_event(
+                    "Exporting the image: {} to: {}",
+                    image_path,
+                    output_paths[export_format],
+                )
+            success, export = await _convert(
+                image_path,
+                image_format,
+                output_paths[export_format],
+                export_format,
+                coroutines=coroutines,
+            )
+        result.record(
+            EVENT_COMMAND,
+            "The qemu-img convert command to {} {}",
+            export_format,
+            "succeeded" if success else "failed",
+            command="qemu-img",
+            succeeded=success,
+            format=export_format,
+        )
+        return success, export
+
+    # A failing conversion does not cancel the others,
+    # such that the formats that succeeded are still exported
+    exported = await asyncio.gather(
+        *(export(export_format) for export_format in output_paths)
+    )
+    errors = [
+        "{}: {}".format(export_format, export)
+        for export_format, (success, export) in zip(output_paths, exported)
+        if not success
+    ]
+    if errors:
+        return EXPORT_ERROR, EXPORT_ERROR_MSG.format(image_path, "; ".join(errors))
+    return SUCCESS, [export for _, export in exported]
+
+
+async def export_image(
+    image_path,
+    export_formats,
+    image_format=None,
+    export_dir=None,
+    max_parallel=EXPORT_MAX_PARALLEL,
+    coroutines=EXPORT_COROUTINES,
+    verbose=False,
+    event_handler=None,
+):
+    """Exports the image to each of the formats with qemu-img convert,
+    where the size and digest of every exported image is in the exports of the result"""
+    result = Result(image_path=image_path, event_handler=event_handler)
+    if not image_format:
+        image_format = os.path.splitext(image_path)[1].replace(".", "")
+    return_code, exports = await convert_formats(
+        result,
+        image_path,
+        image_format,
+        export_formats,
+        export_dir=export_dir,
+        max_parallel=max_parallel,
+        coroutines=coroutines,
+        verbose=verbose,
+    )
+    if return_code != SUCCESS:
+        return result.finish(return_code, exports)
+    result.set("exports", exports)
+    return result.finish(
+        SUCCESS,
+        "Exported the image: {} to: {}",
+        image_path,
+        ", ".join(export["path"] for export in exports),
+    )
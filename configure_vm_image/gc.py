@@ -0,0 +1,276 @@
+import asyncio
+import os
+import time
+
+from configure_vm_image.common.codes import GC_ERROR, GC_ERROR_MSG, SUCCESS
+from configure_vm_image.common.defaults import (
+    CONFIGURE_IMAGE_TMP_DIR,
+    CONFIGURE_JOB_STATUS_RUNNING,
+    EVENT_COMMAND,
+    GC_MAX_CONCURRENT_REMOVES,
+    GC_MAX_SCRATCH_AGE,
+    VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+)
+from configure_vm_image.configure import (
+    discover_vm_orchestrator,
+    find_vm_instances,
+    remove_vm,
+)
+from configure_vm_image.result import Result
+from configure_vm_image.scratch import load_journal, remove_scratch_dir
+from configure_vm_image.utils.io import remove
+from configure_vm_image.utils.job import process_alive
+
+
+def job_active(journal):
+    """A job is active while its journal says it is running
+    and the process that runs it is still alive"""
+    return journal.get("status") == CONFIGURE_JOB_STATUS_RUNNING and process_alive(
+        journal.get("pid")
+    )
+
+
+def path_size(path):
+    """Returns the size of the file, or of all the files in the directory"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        try:
+            return os.lstat(path).st_size
+        except OSError:
+            return 0
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def scratch_entries(scratch_dir=CONFIGURE_IMAGE_TMP_DIR):
+    """Lists the entries in the scratch directory, which are either the scratch
+    directories of configure jobs or files that were left in it directly,
+    such as isos and logs that were placed there by earlier versions"""
+    entries = []
+    try:
+        names = os.listdir(scratch_dir)
+    except FileNotFoundError:
+        return entries
+    for name in names:
+        path = os.path.join(scratch_dir, name)
+        try:
+            mtime = os.lstat(path).st_mtime
+        except OSError:
+            continue
+        journal = None
+        if os.path.isdir(path) and not os.path.islink(path):
+            journal = load_journal(path)
+        entries.append(
+            {
+                "path": path,
+                "journal": journal,
+                "mtime": mtime,
+                "size": path_size(path),
+            }
+        )
+    return entries
+
+
+def select_purgeable(entries, max_age=None, max_size=None, now=None):
+    """Selects the scratch entries to purge, which are those older than max_age
+    seconds, followed by the oldest of the remaining entries until their
+    total size is within max_size bytes. Entries of active jobs are never selected."""
+    if now is None:
+        now = time.time()
+    candidates = [
+        entry
+        for entry in entries
+        if not (entry["journal"] and job_active(entry["journal"]))
+    ]
+    candidates.sort(key=lambda entry: entry["mtime"])
+
+    purge, keep = [], []
+    for entry in candidates:
+        if max_age is not None and now - entry["mtime"] > max_age:
+            purge.append(entry)
+        else:
+            keep.append(entry)
+
+    if max_size is not None:
+        # The size of the active jobs also counts towards the budget
+        total_size = sum(entry["size"] for entry in entries) - sum(
+            entry["size"] for entry in purge
+        )
+        while keep and total_size > max_size:
+            entry = keep.pop(0)
+            purge.append(entry)
+            total_size -= entry["size"]
+    return purge
+
+
+def orphaned_vms(instances, entries):
+    """Selects the VM instances that are left behind by configure jobs,
+    which are those that are recorded in the journal of a job that is
+    no longer running. A VM that only matches the naming scheme of the
+    configuring VMs might belong to a job in another scratch directory
+    or of another user, such that it is never selected, and neither are
+    the VMs of active jobs."""
+    active_names, active_ids = set(), set()
+    journal_names, journal_ids = set(), set()
+    for entry in entries:
+        journal = entry["journal"]
+        if not journal:
+            continue
+        if job_active(journal):
+            names, ids = active_names, active_ids
+        else:
+            names, ids = journal_names, journal_ids
+        if journal.get("configure_vm_name"):
+            names.add(journal["configure_vm_name"])
+        if journal.get("instance_id"):
+            ids.add(journal["instance_id"])
+
+    orphans = []
+    for instance in instances:
+        instance_id, name = instance.get("id"), instance.get("name", "")
+        if instance_id in active_ids or name in active_names:
+            continue
+        if instance_id in journal_ids or name in journal_names:
+            orphans.append(instance)
+    return orphans
+
+
+async def remove_vms(
+    instances,
+    max_concurrent=GC_MAX_CONCURRENT_REMOVES,
+    vm_orchestrator=None,
+    on_removed=None,
+):
+    """Stops and removes the VM instances concurrently, where at most
+    max_concurrent instances are removed at the same time.
+    Returns the list of (instance, removed, msg) tuples."""
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def _remove(instance):
+        async with semaphore:
+            removed, msg = await remove_vm(
+                instance.get("id") or instance.get("name"),
+                vm_orchestrator=vm_orchestrator,
+            )
+        if on_removed is not None:
+            on_removed(instance, removed, msg)
+        return instance, removed, msg
+
+    return await asyncio.gather(*[_remove(instance) for instance in instances])
+
+
+async def collect_garbage(
+    scratch_dir=CONFIGURE_IMAGE_TMP_DIR,
+    vm_orchestrator=VM_ORCHESTRATOR_LIBVIRT_PROVIDER,
+    max_concurrent=GC_MAX_CONCURRENT_REMOVES,
+    max_age=GC_MAX_SCRATCH_AGE,
+    max_size=None,
+    dry_run=False,
+    verbose=False,
+    event_handler=None,
+):
+    """Removes the configuring VMs that were left behind by configure jobs
+    that crashed, and purges the scratch directories and files that are older
+    than max_age seconds or exceed the max_size budget in bytes.
+    Nothing is removed that belongs to a configure job that is still running."""
+    result = Result(event_handler=event_handler)
+    if max_age is not None:
+        max_age = float(max_age)
+    if max_size is not None:
+        max_size = int(max_size)
+    max_concurrent = int(max_concurrent)
+
+    vm_orchestrator = discover_vm_orchestrator(orchestrator=vm_orchestrator)
+    found, instances = await find_vm_instances(vm_orchestrator=vm_orchestrator)
+    if not found:
+        return result.finish(
+            GC_ERROR,
+            GC_ERROR_MSG,
+            "failed to list the VM instances: {}".format(instances),
+        )
+    # The journals are read after the instances are listed, since a job writes
+    # its journal before it creates its VM, such that a job that starts
+    # in the meantime is never mistaken for one that was left behind
+    entries = scratch_entries(scratch_dir)
+
+    orphans = orphaned_vms(instances, entries)
+    if verbose:
+        result.add_event("Found {} orphaned VM(s)", len(orphans))
+
+    failed_vms = []
+    if dry_run:
+        for instance in orphans:
+            result.add_event("Would remove the VM: {}", instance.get("name"))
+    else:
+
+        def on_removed(instance, removed, msg):
+            result.record(
+                EVENT_COMMAND,
+                "The remove command {} for the VM: {}",
+                "succeeded" if removed else "failed",
+                instance.get("name"),
+                command="remove",
+                succeeded=bool(removed),
+            )
+            if verbose or not removed:
+                result.add_event(msg)
+
+        removals = await remove_vms(
+            orphans,
+            max_concurrent=max_concurrent,
+            vm_orchestrator=vm_orchestrator,
+            on_removed=on_removed,
+        )
+        failed_vms = [instance for instance, removed, _ in removals if not removed]
+
+    # The scratch entries of jobs whose VM could not be removed are kept,
+    # such that the VM can still be identified by a later collection
+    failed_names = {instance.get("name") for instance in failed_vms}
+    failed_ids = {instance.get("id") for instance in failed_vms}
+    purged_size = 0
+    for entry in select_purgeable(entries, max_age=max_age, max_size=max_size):
+        journal = entry["journal"] or {}
+        if (
+            journal.get("configure_vm_name") in failed_names
+            or journal.get("instance_id") in failed_ids
+        ):
+            continue
+        purged_size += entry["size"]
+        if dry_run:
+            result.add_event("Would purge: {} ({} bytes)", entry["path"], entry["size"])
+            continue
+        if os.path.isdir(entry["path"]) and not os.path.islink(entry["path"]):
+            remove_scratch_dir(entry["path"])
+        else:
+            remove(entry["path"])
+        if verbose:
+            result.add_event("Purged: {} ({} bytes)", entry["path"], entry["size"])
+
+    if failed_vms:
+        return result.finish(
+            GC_ERROR,
+            GC_ERROR_MSG,
+            "failed to remove the VM(s): {}".format(
+                ", ".join(instance.get("name", "") for instance in failed_vms)
+            ),
+        )
+    if dry_run:
+        return result.finish(
+            SUCCESS,
+            "Would remove {} orphaned VM(s) and purge {} bytes from: {}",
+            len(orphans),
+            purged_size,
+            scratch_dir,
+        )
+    return result.finish(
+        SUCCESS,
+        "Removed {} orphaned VM(s) and purged {} bytes from: {}",
+        len(orphans),
+        purged_size,
+        scratch_dir,
+    )
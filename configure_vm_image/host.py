@@ -0,0 +1,295 @@
+import functools
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from configure_vm_image.common.defaults import (
+    CONFIGURE_VM_MACHINE,
+    CPU_ARCHITECTURE,
+    HOST_PROBE_CACHE_PATH,
+    KVM_DEVICE_PATH,
+    TEMPLATE_PROFILE_AUTO,
+    TEMPLATE_PROFILE_DEFAULT,
+    TEMPLATE_PROFILE_PERFORMANCE,
+)
+from configure_vm_image.utils.job import run_async
+
+# The architecture names that distributions use in their image names
+ARCHITECTURE_ALIASES = {
+    "amd64": "x86_64",
+    "x86-64": "x86_64",
+    "x64": "x86_64",
+    "arm64": "aarch64",
+    "ppc64el": "ppc64le",
+    "i386": "i686",
+}
+ARCHITECTURE_NAME_REGEX = re.compile(
+    r"(?<![a-z0-9])"
+    r"(x86_64|x86-64|amd64|x64|aarch64|arm64|ppc64le|ppc64el|s390x|riscv64|i386|i686)"
+    r"(?![a-z0-9])"
+)
+# The QEMU system emulator that runs each architecture
+QEMU_SYSTEM_ARCHITECTURES = {"i686": "i386", "ppc64le": "ppc64"}
+# The architectures whose machine types can provide IDE devices
+IDE_ARCHITECTURES = ("x86_64", "i686")
+MACHINE_TYPE_PREFERENCES = {
+    "x86_64": ("q35", "pc"),
+    "i686": ("q35", "pc"),
+    "aarch64": ("virt",),
+    "ppc64le": ("pseries",),
+    "s390x": ("s390-ccw-virtio",),
+    "riscv64": ("virt",),
+}
+# The CPU models that are emulated when the VM can not be accelerated,
+# since the host CPU model can not be used for another architecture
+EMULATED_CPU_MODELS = {
+    "x86_64": "qemu64",
+    "i686": "qemu32",
+    "aarch64": "cortex-a57",
+    "riscv64": "rv64",
+}
+# The architectures that boot via UEFI, which libvirt selects the firmware for
+EFI_ARCHITECTURES = ("aarch64",)
+
+
+def host_capacity():
+    """The number of vCPUs and the bytes of memory that are available
+    on the host for running configuring VMs"""
+    memory_bytes = None
+    try:
+        with open("/proc/meminfo", "r") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    memory_bytes = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError, IndexError):
+        pass
+    if memory_bytes is None:
+        memory_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    return {"num_vcpus": os.cpu_count() or 1, "memory_bytes": memory_bytes}
+
+
+# The host capabilities do not change while the process is running,
+# such that each probe is only performed once per process
+@functools.lru_cache(maxsize=None)
+def kvm_available(cpu_architecture=CPU_ARCHITECTURE):
+    """Checks whether KVM can be used to accelerate a VM of the given architecture,
+    which requires that it matches the host architecture"""
+    if cpu_architecture != CPU_ARCHITECTURE:
+        return False
+    return os.access(KVM_DEVICE_PATH, os.R_OK | os.W_OK)
+
+
+def kernel_version(release=None):
+    """Returns the (major, minor) version of the host kernel"""
+    if release is None:
+        release = os.uname().release
+    match = re.match(r"(\d+)\.(\d+)", release)
+    if not match:
+        return 0, 0
+    return int(match.group(1)), int(match.group(2))
+
+
+@functools.lru_cache(maxsize=None)
+def io_uring_available():
+    """Checks whether the host kernel supports io_uring for disk I/O"""
+    # QEMU requires the io_uring features that were added in Linux 5.6
+    if kernel_version() < (5, 6):
+        return False
+    # Since Linux 6.6, io_uring can be disabled for all processes via sysctl
+    try:
+        with open("/proc/sys/kernel/io_uring_disabled", "r") as fh:
+            if fh.read().strip() == "2":
+                return False
+    except OSError:
+        pass
+    return True
+
+
+def disk_io_mode():
+    if io_uring_available():
+        return "io_uring"
+    return "threads"
+
+
+def domain_type(cpu_architecture=CPU_ARCHITECTURE):
+    if kvm_available(cpu_architecture):
+        return "kvm"
+    return "qemu"
+
+
+def select_template_profile(
+    template_profile=TEMPLATE_PROFILE_AUTO, cpu_architecture=CPU_ARCHITECTURE
+):
+    """Selects the VM template profile, where the auto profile selects the
+    performance profile when the VM can be accelerated with KVM or requires
+    virtio devices, and falls back to the default profile otherwise"""
+    if template_profile != TEMPLATE_PROFILE_AUTO:
+        return template_profile
+    # The default profile relies on IDE devices, which
+    # only the machine types of x86 architectures provide
+    if kvm_available(cpu_architecture) or cpu_architecture not in IDE_ARCHITECTURES:
+        return TEMPLATE_PROFILE_PERFORMANCE
+    return TEMPLATE_PROFILE_DEFAULT
+
+
+def architecture_from_name(image_path):
+    """Infers the architecture of an image from the tokens in its file name,
+    e.g. debian-12-genericcloud-arm64.qcow2, which most distributions include"""
+    match = ARCHITECTURE_NAME_REGEX.search(os.path.basename(image_path).lower())
+    if not match:
+        return None
+    architecture = match.group(1)
+    return ARCHITECTURE_ALIASES.get(architecture, architecture)
+
+
+async def architecture_from_inspection(image_path, timeout=300):
+    """Inspects the operating system in the image for its architecture,
+    which requires virt-inspector from libguestfs"""
+    virt_inspector = shutil.which("virt-inspector")
+    if not virt_inspector:
+        return None
+    success, result = await run_async(
+        [virt_inspector, "-a", image_path, "--no-applications", "--no-icon"],
+        timeout=timeout,
+    )
+    if not success:
+        return None
+    match = re.search(r"<arch>([^<]+)</arch>", result["output"])
+    if not match:
+        return None
+    architecture = match.group(1).strip()
+    return ARCHITECTURE_ALIASES.get(architecture, architecture)
+
+
+# The key of the inspected image architectures in the probe cache
+IMAGE_ARCHITECTURES_CACHE_KEY = "image_architectures"
+
+
+async def probe_image_architecture(image_path, cache_path=HOST_PROBE_CACHE_PATH):
+    """Probes the architecture of the image by inspecting its operating system,
+    where the name of the image is only used when it can not be inspected,
+    since the name can be misleading. The inspected architecture is cached
+    in the probe cache for as long as the image is not replaced or modified."""
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return architecture_from_name(image_path)
+    image_realpath = os.path.realpath(image_path)
+    version = [stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns]
+    architectures = load_probe_cache(cache_path).get(IMAGE_ARCHITECTURES_CACHE_KEY)
+    if isinstance(architectures, dict):
+        cached = architectures.get(image_realpath)
+        if isinstance(cached, dict) and cached.get("version") == version:
+            return cached.get("architecture")
+
+    architecture = await architecture_from_inspection(image_path)
+    if not architecture:
+        return architecture_from_name(image_path)
+    # The cache is reloaded, since it might have changed during the inspection,
+    # and only keeps the architecture of the current version of each image
+    cache = load_probe_cache(cache_path)
+    architectures = cache.get(IMAGE_ARCHITECTURES_CACHE_KEY)
+    if not isinstance(architectures, dict):
+        architectures = cache[IMAGE_ARCHITECTURES_CACHE_KEY] = {}
+    architectures[image_realpath] = {"version": version, "architecture": architecture}
+    save_probe_cache(cache_path, cache)
+    return architecture
+
+
+def qemu_system_binary(cpu_architecture):
+    return shutil.which(
+        "qemu-system-{}".format(
+            QEMU_SYSTEM_ARCHITECTURES.get(cpu_architecture, cpu_architecture)
+        )
+    )
+
+
+def parse_machine_types(output):
+    """Parses the output of `qemu-system-<arch> -machine help` into the
+    list of supported machine types, including their aliases"""
+    machine_types = []
+    for line in output.splitlines():
+        if not line or line.startswith("Supported machines"):
+            continue
+        machine_types.append(line.split()[0])
+    return machine_types
+
+
+def load_probe_cache(cache_path):
+    """Loads the cache of the probe results at cache_path,
+    which is empty if it does not exist or can not be read"""
+    try:
+        with open(cache_path, "r") as fh:
+            cache = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return cache
+
+
+def save_probe_cache(cache_path, cache):
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".json.tmp")
+        with os.fdopen(fd, "w") as fh:
+            json.dump(cache, fh, indent=4, sort_keys=True)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # The cache is only an optimization
+        pass
+
+
+async def probe_machine_types(cpu_architecture, cache_path=HOST_PROBE_CACHE_PATH):
+    """Probes the machine types that QEMU supports for the architecture.
+    The result is cached per host and QEMU binary, such that the cache
+    can be shared between hosts and is invalidated when QEMU is upgraded"""
+    binary = qemu_system_binary(cpu_architecture)
+    if not binary:
+        return []
+    try:
+        binary_mtime = os.stat(binary).st_mtime_ns
+    except OSError:
+        return []
+
+    key = "{}:{}:{}".format(os.uname().nodename, binary, binary_mtime)
+    cache = load_probe_cache(cache_path)
+    if key in cache:
+        return cache[key]
+
+    success, result = await run_async([binary, "-machine", "help"], timeout=30)
+    if not success:
+        return []
+    machine_types = parse_machine_types(result["output"])
+    cache[key] = machine_types
+    save_probe_cache(cache_path, cache)
+    return machine_types
+
+
+def select_machine_type(cpu_architecture, machine_types=None, ide=False):
+    """Selects the preferred machine type of the architecture that is supported,
+    where the IDE devices of the default template require the i440FX machine"""
+    if ide and cpu_architecture in IDE_ARCHITECTURES:
+        preferences = ("pc",)
+    else:
+        preferences = MACHINE_TYPE_PREFERENCES.get(cpu_architecture, ())
+    for machine_type in preferences:
+        if not machine_types or machine_type in machine_types:
+            return machine_type
+    if machine_types:
+        return machine_types[0]
+    return CONFIGURE_VM_MACHINE
+
+
+def emulated_cpu_model(cpu_architecture):
+    return EMULATED_CPU_MODELS.get(cpu_architecture)
+
+
+def firmware_type(cpu_architecture):
+    if cpu_architecture in EFI_ARCHITECTURES:
+        return "efi"
+    return None
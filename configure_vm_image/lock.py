@@ -0,0 +1,264 @@
+import asyncio
+import fcntl
+import json
+import os
+import struct
+import tempfile
+import time
+import uuid
+
+from configure_vm_image.common.defaults import (
+    IMAGE_LEASE_DURATION,
+    IMAGE_LEASE_SUFFIX,
+    IMAGE_LOCK_POLL_INTERVAL,
+    IMAGE_LOCK_SUFFIX,
+)
+from configure_vm_image.utils.io import remove
+from configure_vm_image.utils.job import Deadline, process_alive
+
+# The images that are locked by this process, since the fallback to
+# process associated locks would otherwise let two jobs in the
+# same process lock the same image
+_locked_images = set()
+
+
+def _set_lock(fd, lock_type):
+    """Sets an open file description lock on the whole file, which is owned by
+    the open file rather than the process, such that concurrent jobs in the
+    same process exclude each other. Falls back to a process associated lock
+    on systems without open file description locks."""
+    if hasattr(fcntl, "F_OFD_SETLK"):
+        # struct flock, where the pid must be 0 for open file description locks
+        flock = struct.pack("hhqqi", lock_type, os.SEEK_SET, 0, 0, 0)
+        fcntl.fcntl(fd, fcntl.F_OFD_SETLK, flock)
+    elif lock_type == fcntl.F_UNLCK:
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+    else:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def load_lease(lease_path):
+    try:
+        with open(lease_path, "r") as fh:
+            lease = json.load(fh)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        # A lease that can not be read is treated as held
+        # until it is older than the lease duration
+        return {}
+    if not isinstance(lease, dict):
+        return {}
+    return lease
+
+
+def write_lease(lease_path, lease, exclusive=False):
+    """Writes the lease to a temporary file that is moved into place,
+    such that the lease is never observed partially written.
+    When exclusive, the lease is linked into place, which fails with
+    FileExistsError if a lease already exists, also on NFS."""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(lease_path), prefix=".", suffix=".lease.tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as fh:
+            json.dump(lease, fh)
+        if exclusive:
+            os.link(tmp_path, lease_path)
+        else:
+            os.replace(tmp_path, lease_path)
+    finally:
+        remove(tmp_path)
+
+
+def lease_expired(lease, lease_path, lease_duration=IMAGE_LEASE_DURATION, now=None):
+    """A lease expires when it is not renewed within its duration, or
+    immediately when the process that held it on this host has exited"""
+    if now is None:
+        now = time.time()
+    if not lease:
+        try:
+            return now - os.stat(lease_path).st_mtime > lease_duration
+        except OSError:
+            return True
+    if lease.get("host") == os.uname().nodename and not process_alive(lease.get("pid")):
+        return True
+    return lease.get("expires_at", 0) < now
+
+
+class ImageLock:
+    """An advisory lock on an image, which ensures that only a single job
+    configures the image at a time, e.g. when workers share the image storage.
+    The lock is held as a file lock on the lock file next to the image, which
+    is accompanied by a lease file that is renewed by a heartbeat, since file
+    locks are not reliable on every network filesystem. A lease that is not
+    renewed within its duration is taken over, such that the image
+    is not locked forever by a worker that crashed on another host.
+    Since the lease expiry is compared across hosts,
+    their clocks are expected to be synchronized."""
+
+    def __init__(
+        self,
+        image_path,
+        lease_duration=IMAGE_LEASE_DURATION,
+        poll_interval=IMAGE_LOCK_POLL_INTERVAL,
+    ):
+        self.image_path = os.path.realpath(image_path)
+        self.lock_path = self.image_path + IMAGE_LOCK_SUFFIX
+        self.lease_path = self.image_path + IMAGE_LEASE_SUFFIX
+        self.lease_duration = lease_duration
+        self.poll_interval = poll_interval
+        self.token = uuid.uuid4().hex
+        # Set when the lease was taken over by another job while held
+        self.lost = False
+        self._fd = None
+        self._heartbeat = None
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def _lease(self):
+        now = time.time()
+        return {
+            "token": self.token,
+            "host": os.uname().nodename,
+            "pid": os.getpid(),
+            "image_path": self.image_path,
+            "renewed_at": now,
+            "expires_at": now + self.lease_duration,
+        }
+
+    def _take_over_lease(self, lease):
+        """Removes the expired lease, unless it was replaced in the meantime"""
+        stale_path = "{}.{}.stale".format(self.lease_path, self.token)
+        try:
+            os.rename(self.lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+        taken = load_lease(stale_path)
+        if taken and lease and taken.get("token") != lease.get("token"):
+            # Another job took over the lease first, which is put back
+            try:
+                os.link(stale_path, self.lease_path)
+            except FileExistsError:
+                pass
+            remove(stale_path)
+            return False
+        remove(stale_path)
+        return True
+
+    def holder(self):
+        """Describes the job that holds the lease on the image"""
+        lease = load_lease(self.lease_path)
+        if lease is None:
+            return "unknown"
+        if not lease:
+            return "unreadable lease: {}".format(self.lease_path)
+        return "pid {} on {} until {}".format(
+            lease.get("pid"),
+            lease.get("host"),
+            time.strftime(
+                "%Y-%m-%dT%H:%M:%S", time.localtime(lease.get("expires_at", 0))
+            ),
+        )
+
+    def _lock(self, fd):
+        try:
+            _set_lock(fd, fcntl.F_WRLCK)
+        except (BlockingIOError, PermissionError):
+            return False, "the image is locked by: {}".format(self.holder())
+
+        lease = load_lease(self.lease_path)
+        if lease is not None:
+            if not lease_expired(
+                lease, self.lease_path, lease_duration=self.lease_duration
+            ):
+                return False, "the image is leased by: {}".format(self.holder())
+            if not self._take_over_lease(lease):
+                return False, "the expired lease was taken over by another job"
+        try:
+            write_lease(self.lease_path, self._lease(), exclusive=True)
+        except FileExistsError:
+            return False, "the image was leased by: {}".format(self.holder())
+        return True, None
+
+    def try_acquire(self):
+        """Tries to acquire the lock without waiting.
+        Returns (True, None) when acquired and (False, msg) otherwise,
+        whereas an OSError is raised if the lock can not be taken at all,
+        e.g. because the directory of the image is not writable."""
+        if self.locked:
+            return True, None
+        if self.image_path in _locked_images:
+            return False, "the image is locked by another job in this process"
+
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            locked, msg = self._lock(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+        if not locked:
+            # Closing the lock file releases the file lock
+            os.close(fd)
+            return False, msg
+        self._fd = fd
+        _locked_images.add(self.image_path)
+        return True, None
+
+    async def acquire(self, timeout=0):
+        """Acquires the lock, where a timeout of 0 does not wait if the image
+        is locked, and a timeout of None waits until the lock is acquired.
+        The lease is renewed in the background until the lock is released."""
+        deadline = Deadline(timeout)
+        while True:
+            locked, msg = self.try_acquire()
+            if locked:
+                break
+            remaining = deadline.remaining()
+            if remaining is not None and remaining <= 0:
+                return False, msg
+            if remaining is None:
+                remaining = self.poll_interval
+            await asyncio.sleep(min(self.poll_interval, remaining))
+        self._heartbeat = asyncio.ensure_future(self._renew())
+        return True, None
+
+    def _renew_lease(self):
+        lease = load_lease(self.lease_path)
+        if not lease or lease.get("token") != self.token:
+            return False
+        write_lease(self.lease_path, self._lease())
+        return True
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.lease_duration / 3)
+            try:
+                renewed = self._renew_lease()
+            except OSError:
+                # Retried at the next heartbeat, before the lease expires
+                continue
+            if not renewed:
+                self.lost = True
+                return
+
+    async def release(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        if not self.locked:
+            return
+        lease = load_lease(self.lease_path)
+        if lease and lease.get("token") == self.token:
+            remove(self.lease_path)
+        # The lock file is kept, since removing it would let another job
+        # lock a new file while a third still waits on the removed one
+        os.close(self._fd)
+        self._fd = None
+        _locked_images.discard(self.image_path)
@@ -0,0 +1,552 @@
+import asyncio
+import json
+import os
+import re
+import shutil
+import signal
+import time
+import uuid
+
+from configure_vm_image.common.defaults import (
+    CONFIGURE_VM_MACHINE,
+    CONFIGURE_VM_MEMORY,
+    CONFIGURE_VM_VCPUS,
+    CPU_ARCHITECTURE,
+    QEMU_EFI_FIRMWARE_PATHS,
+    QEMU_QMP_TIMEOUT,
+    QEMU_QUIT_TIMEOUT,
+    QEMU_RUNTIME_DIR,
+)
+from configure_vm_image.common.utils import parse_size
+from configure_vm_image.host import QEMU_SYSTEM_ARCHITECTURES, qemu_system_binary
+from configure_vm_image.utils.job import process_alive, run_async
+
+# The instance states that the QEMU run states correspond to, which follow
+# the states that libvirt-provider reports, such that both orchestrators
+# can be driven by the same configure flow
+QEMU_INSTANCE_STATES = {
+    "prelaunch": "paused",
+    "paused": "paused",
+    "suspended": "paused",
+    "running": "running",
+    "shutdown": "shut off",
+    "guest-panicked": "crashed",
+    "internal-error": "crashed",
+}
+# The devices that report a kernel panic of the guest to QEMU, where the ISA
+# device is only available on x86 and the ppc64le and s390x guests report
+# their panics without a device
+QEMU_PANIC_DEVICES = {
+    "x86_64": "pvpanic",
+    "i686": "pvpanic",
+    "ppc64le": None,
+    "s390x": None,
+}
+QEMU_DEFAULT_PANIC_DEVICE = "pvpanic-pci"
+# The QMP events that are recorded when the VM shuts off or the guest panics
+QEMU_RECORDED_EVENTS = ("SHUTDOWN", "GUEST_PANICKED")
+# The references to the tasks that record the events of the started VMs
+_event_recorders = set()
+
+
+class QMPError(Exception):
+    pass
+
+
+class QMPClient:
+    """A minimal client of the QEMU Machine Protocol over a Unix socket.
+    The events that QEMU emits while a command is executed,
+    e.g. SHUTDOWN, are collected in the events list."""
+
+    def __init__(self, socket_path, timeout=QEMU_QMP_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.events = []
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(self.socket_path), self.timeout
+        )
+        greeting = await self._receive(self.timeout)
+        if "QMP" not in greeting:
+            raise QMPError("Unexpected QMP greeting: {}".format(greeting))
+        # Leave the capabilities negotiation mode to enable the commands
+        await self.execute("qmp_capabilities")
+
+    async def _receive(self, timeout=QEMU_QMP_TIMEOUT):
+        line = await asyncio.wait_for(self._reader.readline(), timeout)
+        if not line:
+            raise QMPError("The QMP connection was closed by QEMU")
+        try:
+            message = json.loads(line)
+        except ValueError as err:
+            raise QMPError("Invalid QMP message: {}".format(line)) from err
+        if not isinstance(message, dict):
+            raise QMPError("Invalid QMP message: {}".format(line))
+        return message
+
+    async def execute(self, command, arguments=None):
+        message = {"execute": command}
+        if arguments:
+            message["arguments"] = arguments
+        self._writer.write(json.dumps(message).encode("utf-8") + b"\n")
+        await self._writer.drain()
+        while True:
+            response = await self._receive(self.timeout)
+            if "event" in response:
+                self.events.append(response)
+                continue
+            if "error" in response:
+                raise QMPError(
+                    "The QMP command: {} failed: {}".format(
+                        command, response["error"].get("desc")
+                    )
+                )
+            return response.get("return")
+
+    async def receive_event(self):
+        """Waits for the next event that QEMU emits,
+        until QEMU closes the connection when it exits"""
+        while True:
+            message = await self._receive(None)
+            if "event" in message:
+                return message
+
+    async def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+        self._reader, self._writer = None, None
+
+    async def __aenter__(self):
+        try:
+            await self.connect()
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def _escape(value):
+    # A comma in a QEMU option value is escaped by doubling it
+    return str(value).replace(",", ",,")
+
+
+def efi_firmware_path(cpu_architecture):
+    for path in QEMU_EFI_FIRMWARE_PATHS.get(cpu_architecture, ()):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def qemu_command(
+    name,
+    image_path,
+    template_values,
+    qmp_socket_path,
+    pid_path,
+    events_socket_path=None,
+):
+    """Prepares the qemu-system command that runs the configuring VM with the
+    same template values that the libvirt templates are rendered with.
+    The VM is started paused as a daemon that is controlled via QMP,
+    and is kept when the guest shuts down, such that its state can be
+    queried until it is removed. The events of the VM are emitted on the
+    separate events socket, since QEMU serves a single QMP client per socket."""
+    cpu_architecture = template_values.get("cpu_architecture") or CPU_ARCHITECTURE
+    binary = qemu_system_binary(cpu_architecture) or "qemu-system-{}".format(
+        QEMU_SYSTEM_ARCHITECTURES.get(cpu_architecture, cpu_architecture)
+    )
+    # The virtio devices are attached via the channel subsystem on s390x
+    virtio_bus = "ccw" if cpu_architecture == "s390x" else "pci"
+    memory_size = parse_size(
+        template_values.get("memory_size") or CONFIGURE_VM_MEMORY, unit="KiB"
+    )
+
+    command = [
+        binary,
+        "-name",
+        _escape(name),
+        "-machine",
+        template_values.get("machine") or CONFIGURE_VM_MACHINE,
+        "-m",
+        "{}M".format(max(memory_size // 1024**2, 1)),
+        "-smp",
+        str(template_values.get("num_vcpus") or CONFIGURE_VM_VCPUS),
+        "-nodefaults",
+        "-no-user-config",
+        "-display",
+        "none",
+        "-S",
+        "-no-shutdown",
+        "-daemonize",
+        "-pidfile",
+        pid_path,
+        "-qmp",
+        "unix:{},server=on,wait=off".format(_escape(qmp_socket_path)),
+    ]
+    if events_socket_path:
+        command.extend(
+            [
+                "-qmp",
+                "unix:{},server=on,wait=off".format(_escape(events_socket_path)),
+            ]
+        )
+    if template_values.get("domain_type") == "kvm":
+        command.extend(["-accel", "kvm", "-cpu", "host"])
+    else:
+        command.extend(
+            ["-accel", "tcg", "-cpu", template_values.get("cpu_model") or "max"]
+        )
+    if template_values.get("firmware") == "efi":
+        firmware_path = efi_firmware_path(cpu_architecture)
+        if not firmware_path:
+            raise FileNotFoundError(
+                "Failed to find the EFI firmware for the {} architecture. "
+                "Please ensure that it is installed".format(cpu_architecture)
+            )
+        command.extend(["-bios", firmware_path])
+    if template_values.get("kernel_path"):
+        command.extend(["-kernel", template_values["kernel_path"]])
+        if template_values.get("initrd_path"):
+            command.extend(["-initrd", template_values["initrd_path"]])
+        if template_values.get("kernel_cmdline"):
+            command.extend(["-append", template_values["kernel_cmdline"]])
+
+    disk = "file={},format={},if=virtio,cache=unsafe,discard=unmap".format(
+        _escape(image_path), template_values.get("disk_format") or "qcow2"
+    )
+    if template_values.get("disk_io"):
+        disk += ",aio={}".format(template_values["disk_io"])
+    command.extend(["-drive", disk])
+    if template_values.get("cd_iso_path"):
+        # cloud-init finds the seed by its cidata label on any block device
+        command.extend(
+            [
+                "-drive",
+                "file={},format=raw,if=virtio,readonly=on".format(
+                    _escape(template_values["cd_iso_path"])
+                ),
+            ]
+        )
+
+    if template_values.get("configure_vm_log_path"):
+        command.extend(
+            [
+                "-chardev",
+                "file,id=console,path={},append=on".format(
+                    _escape(template_values["configure_vm_log_path"])
+                ),
+                "-serial",
+                "chardev:console",
+            ]
+        )
+    if template_values.get("status_socket_path"):
+        command.extend(
+            [
+                "-chardev",
+                "socket,id=status,path={},reconnect=1".format(
+                    _escape(template_values["status_socket_path"])
+                ),
+                "-device",
+                "virtio-serial-{}".format(virtio_bus),
+                "-device",
+                "virtserialport,chardev=status,name={}".format(
+                    _escape(template_values["status_channel_name"])
+                ),
+            ]
+        )
+    command.extend(
+        [
+            "-object",
+            "rng-random,id=rng,filename=/dev/urandom",
+            "-device",
+            "virtio-rng-{},rng=rng".format(virtio_bus),
+        ]
+    )
+    # A guest that panics is reported as crashed instead of hanging until
+    # the configuration times out
+    panic_device = QEMU_PANIC_DEVICES.get(cpu_architecture, QEMU_DEFAULT_PANIC_DEVICE)
+    if panic_device:
+        command.extend(["-device", panic_device])
+    return command
+
+
+class QemuOrchestrator:
+    """Runs the configuring VMs as qemu-system daemons without libvirt,
+    where each VM is controlled via the QMP socket in its runtime directory.
+    The runtime directory records the VM, such that the VMs can be found
+    and removed by another process, e.g. the garbage collector."""
+
+    def __init__(self, runtime_dir=QEMU_RUNTIME_DIR):
+        self.runtime_dir = runtime_dir
+
+    def _instance_dir(self, instance_id):
+        return os.path.join(self.runtime_dir, instance_id)
+
+    def _load_instance(self, instance_id):
+        try:
+            with open(
+                os.path.join(self._instance_dir(instance_id), "instance.json"), "r"
+            ) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _instances(self):
+        try:
+            instance_ids = os.listdir(self.runtime_dir)
+        except FileNotFoundError:
+            return []
+        instances = []
+        for instance_id in instance_ids:
+            instance = self._load_instance(instance_id)
+            if instance:
+                instances.append(instance)
+        return instances
+
+    def _find_instance(self, name):
+        """Finds the instance by its id or otherwise by its name"""
+        instance = None
+        if os.sep not in name:
+            instance = self._load_instance(name)
+        if instance is None:
+            for candidate in self._instances():
+                if candidate.get("name") == name:
+                    return candidate
+        return instance
+
+    def _pid(self, instance):
+        try:
+            with open(instance["pid_path"], "r") as fh:
+                return int(fh.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _shutdown_reason(self, instance):
+        """Returns the reason of the shutdown as the libvirt reason of a
+        shut off domain, where only a guest that powered itself off has shut
+        down, whereas a shutdown that the host requested has destroyed it"""
+        try:
+            with open(instance["events_path"], "r") as fh:
+                events = [json.loads(line) for line in fh if line.strip()]
+        except (KeyError, OSError, ValueError):
+            return "unknown"
+        reasons = [
+            event.get("data", {}).get("reason")
+            for event in events
+            if isinstance(event, dict) and event.get("event") == "SHUTDOWN"
+        ]
+        if not reasons:
+            return "unknown"
+        if reasons[-1] == "guest-shutdown":
+            return "shutdown"
+        return "destroyed"
+
+    async def _state(self, instance):
+        """Returns the state of the VM and the reason of the state,
+        which follow the libvirt domain states and their reasons"""
+        pid = self._pid(instance)
+        if not process_alive(pid):
+            # QEMU is kept when the guest shuts down,
+            # such that it has exited without being removed
+            return "shut off", "crashed"
+        try:
+            async with QMPClient(instance["qmp_socket_path"]) as qmp:
+                status = await qmp.execute("query-status")
+        except (OSError, QMPError, asyncio.TimeoutError):
+            return "unknown", "unknown"
+        run_state = status.get("status")
+        state = QEMU_INSTANCE_STATES.get(run_state, run_state)
+        if run_state == "shutdown":
+            return state, self._shutdown_reason(instance)
+        if run_state == "guest-panicked":
+            return state, "panicked"
+        return state, "unknown"
+
+    async def _record_events(self, instance, qmp):
+        """Records the shutdown and panic events of the VM,
+        until QEMU exits or the VM is removed"""
+        try:
+            while True:
+                event = await qmp.receive_event()
+                if event.get("event") in QEMU_RECORDED_EVENTS:
+                    with open(instance["events_path"], "a") as fh:
+                        fh.write(json.dumps(event) + "\n")
+        except (OSError, QMPError):
+            pass
+        finally:
+            await qmp.close()
+
+    async def _execute(self, instance, command):
+        try:
+            async with QMPClient(instance["qmp_socket_path"]) as qmp:
+                await qmp.execute(command)
+        except (OSError, QMPError, asyncio.TimeoutError) as err:
+            return False, "Failed to {} the VM: {} - error: {}".format(
+                command, instance["name"], err
+            )
+        return True, {}
+
+    async def create(self, name, image_path, template_values):
+        # QEMU changes its working directory once it is daemonized
+        image_path = os.path.realpath(image_path)
+        instance_id = uuid.uuid4().hex
+        instance_dir = self._instance_dir(instance_id)
+        os.makedirs(instance_dir, mode=0o700)
+        instance = {
+            "id": instance_id,
+            "name": name,
+            "image_path": image_path,
+            "qmp_socket_path": os.path.join(instance_dir, "qmp.sock"),
+            "pid_path": os.path.join(instance_dir, "qemu.pid"),
+            "events_socket_path": os.path.join(instance_dir, "events.sock"),
+            "events_path": os.path.join(instance_dir, "events.json"),
+            "created_at": time.time(),
+        }
+        try:
+            instance["command"] = qemu_command(
+                name,
+                image_path,
+                template_values,
+                instance["qmp_socket_path"],
+                instance["pid_path"],
+                events_socket_path=instance["events_socket_path"],
+            )
+            with open(os.path.join(instance_dir, "instance.json"), "w") as fh:
+                json.dump(instance, fh)
+        except (OSError, ValueError) as err:
+            shutil.rmtree(instance_dir, ignore_errors=True)
+            return False, "Failed to create the VM: {} - error: {}".format(name, err)
+
+        # QEMU only returns once the daemon is initialized,
+        # at which point the QMP socket accepts connections
+        success, result = await run_async(instance["command"])
+        if not success:
+            shutil.rmtree(instance_dir, ignore_errors=True)
+            return False, "Failed to create the VM: {} - error: {}".format(
+                name, result["error"]
+            )
+        return True, {"instance": {"id": instance_id, "name": name}}
+
+    async def start(self, instance):
+        if instance.get("events_socket_path"):
+            # The events are watched before the guest runs,
+            # such that the reason of its shutdown is recorded
+            qmp = QMPClient(instance["events_socket_path"])
+            try:
+                await qmp.connect()
+            except (OSError, QMPError, asyncio.TimeoutError) as err:
+                await qmp.close()
+                return (
+                    False,
+                    "Failed to watch the events of the VM: {} - error: {}".format(
+                        instance["name"], err
+                    ),
+                )
+            recorder = asyncio.create_task(self._record_events(instance, qmp))
+            _event_recorders.add(recorder)
+            recorder.add_done_callback(_event_recorders.discard)
+        return await self._execute(instance, "cont")
+
+    async def stop(self, instance):
+        # Requests the guest to power off via ACPI, such that it shuts down cleanly
+        return await self._execute(instance, "system_powerdown")
+
+    async def show(self, instance):
+        state, state_reason = await self._state(instance)
+        return True, {
+            "instance": {
+                "id": instance["id"],
+                "name": instance["name"],
+                "state": state,
+                "state_reason": state_reason,
+            }
+        }
+
+    async def remove(self, instance):
+        pid = self._pid(instance)
+        if process_alive(pid):
+            try:
+                async with QMPClient(instance["qmp_socket_path"]) as qmp:
+                    await qmp.execute("quit")
+            except (OSError, QMPError, asyncio.TimeoutError):
+                # QEMU might close the connection before it responds to quit
+                pass
+            # The exit of the QEMU process signals that the VM is removed
+            deadline = time.monotonic() + QEMU_QUIT_TIMEOUT
+            while process_alive(pid) and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            if process_alive(pid):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        shutil.rmtree(self._instance_dir(instance["id"]), ignore_errors=True)
+        return True, {}
+
+    async def ls(self, regex=None):
+        instances = []
+        for instance in self._instances():
+            if regex and not re.search(regex, instance.get("name", "")):
+                continue
+            state, state_reason = await self._state(instance)
+            instances.append(
+                {
+                    "id": instance["id"],
+                    "name": instance["name"],
+                    "state": state,
+                    "state_reason": state_reason,
+                }
+            )
+        return True, {"instances": instances}
+
+    async def run(self, args, template_values=None):
+        """Runs the libvirt-provider style instance command args, e.g.
+        ["instance", "show", <id>], and returns the (success, result) in the
+        same form as run_async, such that the configure flow can drive
+        both orchestrators with the same commands. The template values of
+        a create are given as a dictionary instead of the comma separated
+        --extra-template-path-values, such that they can contain commas."""
+        if len(args) < 2 or args[0] != "instance":
+            return False, {"output": "", "error": "Unknown command: {}".format(args)}
+        action, args = args[1], args[2:]
+        options = {}
+        positional = []
+        while args:
+            if args[0].startswith("--") and len(args) > 1:
+                options[args[0]] = args[1]
+                args = args[2:]
+            else:
+                positional.append(args[0])
+                args = args[1:]
+
+        if action == "ls":
+            success, output = await self.ls(regex=options.get("--regex"))
+        elif action == "create" and len(positional) >= 2:
+            success, output = await self.create(
+                positional[0], positional[1], template_values or {}
+            )
+        elif action in ("start", "stop", "show", "remove") and positional:
+            instance = self._find_instance(positional[0])
+            if instance is None:
+                success, output = False, "Failed to find the VM: {}".format(
+                    positional[0]
+                )
+            else:
+                success, output = await getattr(self, action)(instance)
+        else:
+            success, output = False, "Unknown command: instance {}".format(action)
+
+        if not success:
+            return False, {"output": "", "error": output}
+        return True, {"output": output, "error": ""}
@@ -0,0 +1,217 @@
+import time
+
+from configure_vm_image.common.codes import SUCCESS
+from configure_vm_image.common.defaults import (
+    EVENT_MESSAGE,
+    EVENT_PHASE,
+    EVENT_WARNING,
+)
+
+# The keys of a serialized event and result, which their data can not use,
+# such that the data never hides the outcome that it belongs to
+EVENT_KEYS = ("event", "phase", "msg", "timestamp")
+RESULT_KEYS = (
+    "return_code",
+    "image_path",
+    "phase",
+    "msg",
+    "started_at",
+    "finished_at",
+    "duration",
+    "events",
+    "verbose_outputs",
+)
+
+
+def _check_data(data, reserved_keys):
+    reserved = sorted(set(data).intersection(reserved_keys))
+    if reserved:
+        raise ValueError("The data uses the reserved keys: {}".format(reserved))
+
+
+def _format(template, args):
+    if not args:
+        return template
+    return template.format(*args)
+
+
+class Event:
+    """An outcome within a phase of the configure pipeline.
+    The message is only formatted when it is read, such that events can be
+    recorded cheaply regardless of whether anyone reads them."""
+
+    __slots__ = ("kind", "phase", "template", "args", "data", "timestamp")
+
+    def __init__(
+        self,
+        template,
+        *args,
+        kind=EVENT_MESSAGE,
+        phase=None,
+        data=None,
+        timestamp=None,
+    ):
+        self.kind = kind
+        self.phase = phase
+        self.template = template
+        self.args = args
+        if data:
+            _check_data(data, EVENT_KEYS)
+        self.data = data
+        if timestamp is None:
+            timestamp = time.time()
+        self.timestamp = timestamp
+
+    @property
+    def msg(self):
+        return _format(self.template, self.args)
+
+    def __str__(self):
+        return self.msg
+
+    def __repr__(self):
+        return "Event(kind={!r}, phase={!r}, msg={!r})".format(
+            self.kind, self.phase, self.msg
+        )
+
+    def asdict(self):
+        event = {
+            "event": self.kind,
+            "phase": self.phase,
+            "msg": self.msg,
+            "timestamp": self.timestamp,
+        }
+        if self.data:
+            event.update(self.data)
+        return event
+
+
+class Result:
+    """The outcome of configuring an image, which consists of the return code,
+    the phase that the configuration ended in, and the events that were
+    recorded along the way. The message is only formatted when it is read.
+    If an event handler is given, it is called with each event as soon as
+    it is recorded, such that the progress can be followed while it runs."""
+
+    __slots__ = (
+        "return_code",
+        "image_path",
+        "phase",
+        "events",
+        "template",
+        "args",
+        "started_at",
+        "finished_at",
+        "event_handler",
+        "data",
+    )
+
+    def __init__(
+        self, image_path=None, return_code=SUCCESS, phase=None, event_handler=None
+    ):
+        self.return_code = return_code
+        self.image_path = image_path
+        self.phase = phase
+        self.events = []
+        self.template = ""
+        self.args = ()
+        self.started_at = time.time()
+        self.finished_at = None
+        self.event_handler = event_handler
+        # The payloads that are specific to the operation, e.g. the plan of
+        # a configuration or the images that it was exported to
+        self.data = {}
+
+    @property
+    def succeeded(self):
+        return self.return_code == SUCCESS
+
+    @property
+    def msg(self):
+        return _format(self.template, self.args)
+
+    @property
+    def duration(self):
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    @property
+    def verbose_outputs(self):
+        return [
+            event.msg
+            for event in self.events
+            if event.kind in (EVENT_MESSAGE, EVENT_WARNING)
+        ]
+
+    def record(self, kind, template, *args, phase=None, **data):
+        """Records an event within the phase of the result,
+        unless the phase is given, e.g. by a concurrent stage"""
+        if phase is None:
+            phase = self.phase
+        event = Event(template, *args, kind=kind, phase=phase, data=data)
+        self.events.append(event)
+        if self.event_handler is not None:
+            self.event_handler(event)
+        return event
+
+    def add_event(self, template, *args, phase=None):
+        return self.record(EVENT_MESSAGE, template, *args, phase=phase)
+
+    def add_warning(self, template, *args, phase=None):
+        return self.record(EVENT_WARNING, template, *args, phase=phase)
+
+    def enter_phase(self, phase):
+        self.phase = phase
+        return self.record(EVENT_PHASE, "Started the {} phase", phase)
+
+    def start_stage(self, phase):
+        """Records the start of a phase that runs concurrently with others,
+        which unlike enter_phase leaves the phase of the result as it is"""
+        return self.record(EVENT_PHASE, "Started the {} phase", phase, phase=phase)
+
+    def set(self, key, value):
+        """Sets a payload of the operation, which is included in the response"""
+        _check_data((key,), RESULT_KEYS)
+        self.data[key] = value
+
+    def finish(self, return_code, template="", *args):
+        """Sets the outcome of the result and returns the (return_code, result)
+        tuple that the configure operations return"""
+        self.return_code = return_code
+        self.template = template
+        self.args = args
+        self.finished_at = time.time()
+        return return_code, self
+
+    def get(self, key, default=None):
+        """Provides the same access as the response dictionaries that
+        the configure operations previously returned, e.g. result.get("msg")"""
+        if key in ("msg", "verbose_outputs"):
+            return getattr(self, key)
+        return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        if key in ("msg", "verbose_outputs"):
+            return getattr(self, key)
+        return self.data[key]
+
+    def __repr__(self):
+        return "Result(return_code={!r}, phase={!r}, msg={!r})".format(
+            self.return_code, self.phase, self.msg
+        )
+
+    def asdict(self, events=True):
+        result = {
+            "return_code": self.return_code,
+            "image_path": self.image_path,
+            "phase": self.phase,
+            "msg": self.msg,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": self.duration,
+        }
+        result.update(self.data)
+        if events:
+            result["events"] = [event.asdict() for event in self.events]
+        return result
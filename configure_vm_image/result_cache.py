@@ -0,0 +1,238 @@
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from configure_vm_image._version import __version__
+from configure_vm_image.check import image_version
+from configure_vm_image.common.defaults import (
+    IMAGE_CHECKSUM_TYPE,
+    IMAGE_DIGEST_CACHE_PATH,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_LINK_AUTO,
+    RESULT_CACHE_LINK_COPY,
+    RESULT_CACHE_LINK_HARDLINK,
+    RESULT_CACHE_LINK_REFLINK,
+    RESULT_CACHE_VERSION,
+)
+from configure_vm_image.host import load_probe_cache, save_probe_cache
+from configure_vm_image.store import file_checksum
+from configure_vm_image.utils.io import remove
+
+RESULT_CACHE_IMAGE = "image"
+RESULT_CACHE_METADATA = "metadata.json"
+# The ioctl that clones the extents of a file on the filesystems
+# that support it, e.g. btrfs and xfs, without copying the data
+FICLONE = 0x40049409
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(command):
+    """Returns the first line that the command prints with --version,
+    or None if it can not be run"""
+    try:
+        completed = subprocess.run(
+            [command, "--version"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    lines = completed.stdout.decode("utf-8", errors="replace").strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        return None
+    return lines[0]
+
+
+def tool_versions(vm_orchestrator):
+    """The versions of the tools that take part in producing a configured
+    image, which are part of the result key such that an upgrade of
+    any of them configures the image again"""
+    return {
+        "configure-vm-image": __version__,
+        "virt-sysprep": tool_version("virt-sysprep"),
+        "vm_orchestrator": vm_orchestrator,
+    }
+
+
+def image_digest(
+    image_path, cache_path=IMAGE_DIGEST_CACHE_PATH, digest_type=IMAGE_CHECKSUM_TYPE
+):
+    """Returns the digest of the image without a catalog, which is cached by
+    the device, inode, size and modification time of the image, such that
+    an image is only hashed again once it has changed"""
+    image_path = os.path.realpath(image_path)
+    version = image_version(image_path)
+    cached = load_probe_cache(cache_path).get(image_path)
+    if (
+        isinstance(cached, dict)
+        and cached.get("version") == version
+        and cached.get("digest_type") == digest_type
+    ):
+        return cached["digest"]
+
+    digest = file_checksum(image_path, digest_type)
+    # The image might have been modified while it was hashed
+    if image_version(image_path) == version:
+        cache = load_probe_cache(cache_path)
+        cache[image_path] = {
+            "version": version,
+            "digest_type": digest_type,
+            "digest": digest,
+        }
+        save_probe_cache(cache_path, cache)
+    return digest
+
+
+def template_digest(template_path, template_values):
+    """Calculates the digest of the VM template together with the values
+    that it is rendered with, which excludes the values that are unique to
+    each run, such as the paths of the seed iso and the console log"""
+    digest = hashlib.sha256()
+    with open(template_path, "rb") as fh:
+        digest.update(hashlib.sha256(fh.read()).digest())
+    digest.update(json.dumps(template_values, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def result_key(
+    base_digest,
+    seed_digest,
+    template_digest,
+    reset_operations=None,
+    image_format=None,
+    resize=None,
+    completion_mode=None,
+    tools=None,
+):
+    """The key of a configured image, which is the digest of every input that
+    determines its content, such that the same inputs produce the same image"""
+    inputs = {
+        "version": RESULT_CACHE_VERSION,
+        "base_digest": base_digest,
+        "seed_digest": seed_digest,
+        "template_digest": template_digest,
+        "reset_operations": reset_operations,
+        "image_format": image_format,
+        "resize": resize,
+        "completion_mode": completion_mode,
+        "tools": tools or {},
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def reflink(source, target):
+    """Clones the source to the target, which raises an OSError
+    if the filesystem does not support it"""
+    with open(source, "rb") as source_fh, open(target, "wb") as target_fh:
+        fcntl.ioctl(target_fh.fileno(), FICLONE, source_fh.fileno())
+
+
+def materialize(source, target, link_mode=RESULT_CACHE_LINK_AUTO):
+    """Places a copy of the source at the target, which replaces the target
+    atomically. With auto, the source is cloned if the filesystem supports it
+    and copied otherwise. A hard link shares the file with the source, such
+    that it must not be modified afterwards, e.g. by configuring it again.
+    Returns the link mode that was used."""
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".{}.".format(os.path.basename(target)), dir=os.path.dirname(target)
+    )
+    os.close(fd)
+    try:
+        if link_mode == RESULT_CACHE_LINK_HARDLINK:
+            remove(tmp_path)
+            os.link(source, tmp_path)
+        elif link_mode in (RESULT_CACHE_LINK_AUTO, RESULT_CACHE_LINK_REFLINK):
+            try:
+                reflink(source, tmp_path)
+                link_mode = RESULT_CACHE_LINK_REFLINK
+            except OSError:
+                if link_mode == RESULT_CACHE_LINK_REFLINK:
+                    raise
+                link_mode = RESULT_CACHE_LINK_COPY
+        if link_mode == RESULT_CACHE_LINK_COPY:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        remove(tmp_path)
+        raise
+    return link_mode
+
+
+class ResultCache:
+    """A cache of configured images, which are kept by the key of the inputs
+    that they were configured from, such that a configuration with the same
+    base image, seed, template, reset operations and tools is materialized
+    from the cache instead of being run again. An entry is a directory with
+    the configured image and the metadata of its inputs, which is moved into
+    place once it is complete, such that it is never observed partially written."""
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, link_mode=RESULT_CACHE_LINK_AUTO):
+        self.cache_dir = os.path.realpath(os.path.expanduser(cache_dir))
+        self.link_mode = link_mode
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """Returns the metadata of the cached image, or None if it is not cached"""
+        try:
+            with open(os.path.join(self.entry_path(key), RESULT_CACHE_METADATA)) as fh:
+                metadata = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(os.path.join(self.entry_path(key), RESULT_CACHE_IMAGE)):
+            return None
+        return metadata
+
+    def restore(self, key, image_path):
+        """Materializes the cached image at the image path.
+        Returns the link mode that was used."""
+        return materialize(
+            os.path.join(self.entry_path(key), RESULT_CACHE_IMAGE),
+            image_path,
+            link_mode=self.link_mode,
+        )
+
+    def store(self, key, image_path, metadata, replace=False):
+        """Stores the configured image at image_path as the result of the key,
+        which is cloned if the filesystem supports it and copied otherwise.
+        A result that is already cached is kept, unless replace is set."""
+        if self.lookup(key) is not None and not replace:
+            return False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".{}.".format(key), dir=self.cache_dir)
+        try:
+            # The cached image is never hard linked to the image that was
+            # configured, since the image might be modified afterwards
+            materialize(
+                image_path,
+                os.path.join(tmp_dir, RESULT_CACHE_IMAGE),
+                link_mode=RESULT_CACHE_LINK_AUTO,
+            )
+            metadata = dict(metadata, key=key, stored_at=time.time())
+            with open(os.path.join(tmp_dir, RESULT_CACHE_METADATA), "w") as fh:
+                json.dump(metadata, fh, sort_keys=True)
+            os.chmod(tmp_dir, 0o755)
+            if replace and os.path.isdir(self.entry_path(key)):
+                replaced_dir = tempfile.mkdtemp(
+                    prefix=".{}.".format(key), dir=self.cache_dir
+                )
+                os.rename(self.entry_path(key), os.path.join(replaced_dir, key))
+                shutil.rmtree(replaced_dir, ignore_errors=True)
+            os.rename(tmp_dir, self.entry_path(key))
+        except OSError as err:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            # Another job stored the same result in the meantime
+            if os.path.isdir(self.entry_path(key)):
+                return False
+            raise err
+        return True
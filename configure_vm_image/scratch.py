@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import tempfile
+
+from configure_vm_image.common.defaults import (
+    CONFIGURE_IMAGE_TMP_DIR,
+    CONFIGURE_JOB_JOURNAL,
+)
+
+
+def create_scratch_dir(prefix, scratch_dir=CONFIGURE_IMAGE_TMP_DIR):
+    """Atomically creates a private scratch directory for a single configure job
+    inside the shared scratch directory, which is created if it does not exist"""
+    os.makedirs(scratch_dir, exist_ok=True)
+    path = tempfile.mkdtemp(prefix="{}-".format(prefix), dir=scratch_dir)
+    # mkdtemp creates the directory with the 0700 mode, whereas the hypervisor
+    # might run as another user that must be able to read the seed iso
+    os.chmod(path, 0o755)
+    return path
+
+
+def remove_scratch_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def reserve_path(path, max_attempts=1000):
+    """Reserves a unique file path by exclusively creating it.
+    If the path is already taken, a numeric suffix is appended to it,
+    where the creation ensures that concurrent jobs never reserve the same path."""
+    candidate = path
+    for attempt in range(max_attempts):
+        try:
+            fd = os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            candidate = "{}.{}".format(path, attempt)
+            continue
+        os.close(fd)
+        return candidate
+    raise FileExistsError("Failed to reserve a unique path for: {}".format(path))
+
+
+def journal_path(scratch_path):
+    return os.path.join(scratch_path, CONFIGURE_JOB_JOURNAL)
+
+
+def write_journal(scratch_path, journal):
+    """Writes the job journal to the scratch directory, where the journal is
+    replaced atomically such that a reader never sees a partial journal"""
+    fd, tmp_path = tempfile.mkstemp(dir=scratch_path, suffix=".json.tmp")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            json.dump(journal, fh, indent=4, sort_keys=True)
+        os.replace(tmp_path, journal_path(scratch_path))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_journal(scratch_path):
+    """Loads the job journal from the scratch directory.
+    Returns None if the journal does not exist or can not be read."""
+    try:
+        with open(journal_path(scratch_path), "r") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+from configure_vm_image.utils.io import load
+
+# The cloud-init NoCloud datasource expects the seed files
+# to be present with these exact names on the cidata disk
+SEED_USER_DATA = "user-data"
+SEED_META_DATA = "meta-data"
+SEED_VENDOR_DATA = "vendor-data"
+SEED_NETWORK_CONFIG = "network-config"
+SEED_FILES = (SEED_USER_DATA, SEED_META_DATA, SEED_VENDOR_DATA, SEED_NETWORK_CONFIG)
+# The seed file that each of the seed path arguments refers to
+SEED_PATH_FILES = {
+    "user_data_path": SEED_USER_DATA,
+    "meta_data_path": SEED_META_DATA,
+    "vendor_data_path": SEED_VENDOR_DATA,
+    "network_config_path": SEED_NETWORK_CONFIG,
+}
+
+
+def render_seed_template(content, template_values=None):
+    """Renders a single seed file content as a Jinja2 template"""
+    import jinja2
+
+    if template_values is None:
+        template_values = {}
+    try:
+        # Undefined variables are errors, such that a missing per-image
+        # value fails before a VM is booted with a half rendered seed
+        template = jinja2.Template(
+            content, undefined=jinja2.StrictUndefined, keep_trailing_newline=True
+        )
+        return template.render(**template_values)
+    except jinja2.TemplateError as err:
+        raise ValueError("Failed to render the seed template: {}".format(err)) from err
+
+
+def render_seed(
+    user_data_path=None,
+    meta_data_path=None,
+    vendor_data_path=None,
+    network_config_path=None,
+    template_values=None,
+):
+    """Renders the seed files in memory.
+    Returns a dictionary of the seed file name to its rendered content in bytes,
+    where files that are not provided are left out."""
+    seed_paths = {
+        SEED_USER_DATA: user_data_path,
+        SEED_META_DATA: meta_data_path,
+        SEED_VENDOR_DATA: vendor_data_path,
+        SEED_NETWORK_CONFIG: network_config_path,
+    }
+
+    seed = {}
+    for name, path in seed_paths.items():
+        if not path:
+            continue
+        content = load(path)
+        if content is False:
+            raise FileNotFoundError(
+                "Failed to load the cloud-init {} file: {}".format(name, path)
+            )
+        if template_values is not None:
+            content = render_seed_template(content, template_values)
+        seed[name] = content.encode("utf-8")
+    return seed
+
+
+def seed_digest(seed, algorithm="sha256"):
+    """Calculates a digest that uniquely identifies the rendered seed content"""
+    hash_algorithm = hashlib.new(algorithm)
+    for name in sorted(seed):
+        content = seed[name]
+        hash_algorithm.update(name.encode("utf-8"))
+        hash_algorithm.update(len(content).to_bytes(8, "big"))
+        hash_algorithm.update(content)
+    return hash_algorithm.hexdigest()
+
+
+def seed_cache_path(cache_dir, seed):
+    """Returns the path of the cached seed iso for the rendered seed content"""
+    return os.path.join(cache_dir, "{}.iso".format(seed_digest(seed)))
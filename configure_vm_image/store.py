@@ -0,0 +1,679 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from configure_vm_image.common.codes import (
+    CHECKSUM_ERROR,
+    CHECKSUM_ERROR_MSG,
+    DOWNLOAD_ERROR,
+    DOWNLOAD_ERROR_MSG,
+    PATH_CREATE_ERROR,
+    PATH_CREATE_ERROR_MSG,
+    SUCCESS,
+)
+from configure_vm_image.common.defaults import (
+    IMAGE_CHECKSUM_TYPE,
+    IMAGE_FETCH_BUFFER_SIZE,
+    IMAGE_FETCH_CONNECTIONS,
+    IMAGE_FETCH_RETRIES,
+    IMAGE_FETCH_SEGMENT_SIZE,
+    IMAGE_FETCH_TIMEOUT,
+    IMAGE_STORE_DIR,
+    IMAGE_STORE_MAX_SIZE,
+)
+from configure_vm_image.lock import ImageLock
+from configure_vm_image.result import Result
+from configure_vm_image.utils.io import copy, remove
+
+STORE_IMAGES_DIR = "images"
+# The downloads that are in progress, or were interrupted
+STORE_PARTIAL_DIR = "partial"
+STORE_METADATA_SUFFIX = ".json"
+
+# The formats of the lines in a checksum file, which are either
+# 'checksum (of first xxxxx bytes) relative_serverside_path',
+# 'ALGORITHM (relative_serverside_path) = checksum' or
+# 'checksum relative_serverside_path', where the path is optional
+CHECKSUM_LINE_REGEXES = (
+    re.compile(
+        r"^(?P<checksum>[0-9a-fA-F]+) \(of first (?P<read_bytes>\d+) bytes\)"
+        r"(\s+\*?(?P<name>.+))?$"
+    ),
+    re.compile(r"^\w+ \((?P<name>.+)\) = (?P<checksum>[0-9a-fA-F]+)$"),
+    re.compile(r"^(?P<checksum>[0-9a-fA-F]+)(\s+\*?(?P<name>.+))?$"),
+)
+
+
+def parse_checksum(content, name=None):
+    """Parses a checksum file, which returns the (checksum, read_bytes) tuple
+    of the line for the file with the given name, or of the first line if none
+    of the lines name it. The read_bytes are None when the checksum is
+    calculated over the entire file. Returns None if no checksum is found."""
+    checksums = []
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        for regex in CHECKSUM_LINE_REGEXES:
+            match = regex.match(line)
+            if match:
+                checksums.append(match.groupdict())
+                break
+    if not checksums:
+        return None
+    selected = checksums[0]
+    if name:
+        for checksum in checksums:
+            if checksum.get("name") and os.path.basename(checksum["name"]) == name:
+                selected = checksum
+                break
+    read_bytes = selected.get("read_bytes")
+    if read_bytes is not None:
+        read_bytes = int(read_bytes)
+    return selected["checksum"].lower(), read_bytes
+
+
+def store_key(checksum, checksum_type=IMAGE_CHECKSUM_TYPE, read_bytes=None):
+    """The key that an image is stored by, which includes the number of
+    bytes that the checksum covers when it is not the entire file"""
+    if read_bytes is None:
+        return "{}-{}".format(checksum_type, checksum.lower())
+    return "{}-{}-{}".format(checksum_type, checksum.lower(), read_bytes)
+
+
+def file_checksum(
+    path,
+    checksum_type=IMAGE_CHECKSUM_TYPE,
+    read_bytes=None,
+    buffer_size=IMAGE_FETCH_BUFFER_SIZE,
+):
+    """Calculates the checksum of the file, or of its first read_bytes bytes"""
+    checksum = hashlib.new(checksum_type)
+    remaining = read_bytes
+    with open(path, "rb") as fh:
+        while remaining is None or remaining > 0:
+            if remaining is None:
+                chunk = fh.read(buffer_size)
+            else:
+                chunk = fh.read(min(buffer_size, remaining))
+                remaining -= len(chunk)
+            if not chunk:
+                break
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def url_path(url):
+    """Returns the local path of a file URL or a plain path,
+    and None for the URLs that are downloaded"""
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == "file":
+        return urllib.request.url2pathname(parsed.path)
+    if not parsed.scheme:
+        return os.path.expanduser(url)
+    return None
+
+
+def _write_json(path, content):
+    """Writes the content to a temporary file that is moved into place,
+    such that it is never observed partially written"""
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".{}.".format(os.path.basename(path)), dir=os.path.dirname(path)
+    )
+    try:
+        with os.fdopen(fd, "w") as fh:
+            json.dump(content, fh)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove(tmp_path)
+        raise
+
+
+def _load_json(path):
+    try:
+        with open(path, "r") as fh:
+            content = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(content, dict):
+        return None
+    return content
+
+
+def read_url(url, timeout=IMAGE_FETCH_TIMEOUT):
+    """Reads the entire content of a small file, such as a checksum file"""
+    path = url_path(url)
+    if path is not None:
+        with open(path, "rb") as fh:
+            return fh.read()
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+def probe_url(url, timeout=IMAGE_FETCH_TIMEOUT):
+    """Returns the size of the file at the URL, whether it can be fetched
+    in ranges, and the validator that identifies its current version.
+    A single byte range is requested, since not every server supports HEAD."""
+    path = url_path(url)
+    if path is not None:
+        stat = os.stat(path)
+        return stat.st_size, True, "{}-{}".format(stat.st_size, stat.st_mtime_ns)
+
+    request = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        validator = response.headers.get("ETag") or response.headers.get(
+            "Last-Modified"
+        )
+        content_range = response.headers.get("Content-Range", "")
+        if response.status == 206 and "/" in content_range:
+            size = content_range.rsplit("/", 1)[1]
+            if size.isdigit():
+                return int(size), True, validator
+        size = response.headers.get("Content-Length")
+        if size is not None and size.isdigit():
+            size = int(size)
+        else:
+            size = None
+        return size, False, validator
+
+
+def fetch_range(
+    url,
+    path,
+    start,
+    end,
+    timeout=IMAGE_FETCH_TIMEOUT,
+    buffer_size=IMAGE_FETCH_BUFFER_SIZE,
+):
+    """Fetches the inclusive byte range of the URL into the same range of the
+    file at path, which is expected to be allocated to the size of the URL"""
+    length = end - start + 1
+    written = 0
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        source_path = url_path(url)
+        if source_path is not None:
+            with open(source_path, "rb") as fh:
+                fh.seek(start)
+                while written < length:
+                    chunk = fh.read(min(buffer_size, length - written))
+                    if not chunk:
+                        break
+                    os.pwrite(fd, chunk, start + written)
+                    written += len(chunk)
+        else:
+            request = urllib.request.Request(
+                url, headers={"Range": "bytes={}-{}".format(start, end)}
+            )
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                content_range = response.headers.get("Content-Range", "")
+                if response.status != 206 or not content_range.startswith(
+                    "bytes {}-".format(start)
+                ):
+                    raise IOError(
+                        "the server did not respond with the range: {}-{}".format(
+                            start, end
+                        )
+                    )
+                while written < length:
+                    chunk = response.read(min(buffer_size, length - written))
+                    if not chunk:
+                        break
+                    os.pwrite(fd, chunk, start + written)
+                    written += len(chunk)
+    finally:
+        os.close(fd)
+    if written != length:
+        raise IOError(
+            "received {} of the {} bytes in the range: {}-{}".format(
+                written, length, start, end
+            )
+        )
+    return written
+
+
+def fetch_stream(
+    url, path, timeout=IMAGE_FETCH_TIMEOUT, buffer_size=IMAGE_FETCH_BUFFER_SIZE
+):
+    """Fetches the entire URL into the file at path with a single request,
+    for the servers that do not support range requests"""
+    written = 0
+    with urllib.request.urlopen(url, timeout=timeout) as response, open(
+        path, "wb"
+    ) as fh:
+        for chunk in iter(lambda: response.read(buffer_size), b""):
+            fh.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def segments(size, segment_size=IMAGE_FETCH_SEGMENT_SIZE):
+    """Splits the size into the inclusive (start, end) byte ranges of its segments"""
+    return [
+        (start, min(start + segment_size, size) - 1)
+        for start in range(0, size, segment_size)
+    ]
+
+
+class ImageStore:
+    """A local store of base images, where each image is kept by the key of its
+    checksum together with a metadata file that records where it was fetched
+    from and when it was last used. A stored image was verified when it was
+    added, such that it is neither downloaded nor hashed again when it is used.
+    The stored images are shared and must not be modified, e.g. configured,
+    in place, which is why fetch_image copies them to an output path."""
+
+    def __init__(self, store_dir=IMAGE_STORE_DIR, max_size=IMAGE_STORE_MAX_SIZE):
+        self.store_dir = os.path.realpath(os.path.expanduser(store_dir))
+        self.images_dir = os.path.join(self.store_dir, STORE_IMAGES_DIR)
+        self.partial_dir = os.path.join(self.store_dir, STORE_PARTIAL_DIR)
+        self.max_size = max_size
+
+    def create(self):
+        os.makedirs(self.images_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    def image_path(self, key):
+        return os.path.join(self.images_dir, key)
+
+    def metadata_path(self, key):
+        return self.image_path(key) + STORE_METADATA_SUFFIX
+
+    def partial_path(self, url):
+        """The path that the URL is downloaded to before it is verified"""
+        return os.path.join(
+            self.partial_dir, hashlib.sha256(url.encode("utf-8")).hexdigest()
+        )
+
+    def entries(self):
+        """Lists the metadata of the stored images"""
+        entries = []
+        try:
+            names = os.listdir(self.images_dir)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(STORE_METADATA_SUFFIX):
+                continue
+            key = name[: -len(STORE_METADATA_SUFFIX)]
+            metadata = _load_json(self.metadata_path(key))
+            if metadata is None or not os.path.exists(self.image_path(key)):
+                continue
+            metadata["key"] = key
+            metadata["path"] = self.image_path(key)
+            entries.append(metadata)
+        return entries
+
+    def lookup(self, key):
+        """Returns the path of the stored image and records that it was used,
+        or None if the image is not in the store"""
+        metadata = _load_json(self.metadata_path(key))
+        if metadata is None or not os.path.exists(self.image_path(key)):
+            return None
+        metadata["last_used"] = time.time()
+        try:
+            _write_json(self.metadata_path(key), metadata)
+        except OSError:
+            # The image can still be used from a read-only store
+            pass
+        return self.image_path(key)
+
+    def lookup_url(self, url):
+        """Returns the key of the image that was fetched from the URL
+        without a checksum, or None if it has not been fetched"""
+        for entry in self.entries():
+            if url in entry.get("urls", []):
+                return entry["key"]
+        return None
+
+    def add(self, key, path, url, checksum, checksum_type, read_bytes=None):
+        """Moves the verified image at path into the store"""
+        now = time.time()
+        metadata = _load_json(self.metadata_path(key)) or {
+            "checksum": checksum,
+            "checksum_type": checksum_type,
+            "read_bytes": read_bytes,
+            "urls": [],
+            "added": now,
+        }
+        if url not in metadata["urls"]:
+            metadata["urls"].append(url)
+        metadata["size"] = os.path.getsize(path)
+        metadata["last_used"] = now
+        os.replace(path, self.image_path(key))
+        _write_json(self.metadata_path(key), metadata)
+        return self.image_path(key)
+
+    def digest(self, key):
+        """Returns the checksum of the entire stored image,
+        or None if its checksum only covers its first bytes"""
+        metadata = _load_json(self.metadata_path(key))
+        if not metadata or metadata.get("read_bytes") is not None:
+            return None
+        return metadata.get("checksum")
+
+    def evict(self, keep=()):
+        """Removes the least recently used images until the store is within its
+        maximum size, where the images with a key in keep are never removed.
+        Returns the metadata of the images that were removed."""
+        if self.max_size is None:
+            return []
+        entries = self.entries()
+        total_size = sum(entry.get("size", 0) for entry in entries)
+        evicted = []
+        for entry in sorted(entries, key=lambda entry: entry.get("last_used", 0)):
+            if total_size <= self.max_size:
+                break
+            if entry["key"] in keep:
+                continue
+            remove(self.metadata_path(entry["key"]))
+            remove(entry["path"])
+            total_size -= entry.get("size", 0)
+            evicted.append(entry)
+        return evicted
+
+    async def download(
+        self,
+        url,
+        connections=IMAGE_FETCH_CONNECTIONS,
+        segment_size=IMAGE_FETCH_SEGMENT_SIZE,
+        retries=IMAGE_FETCH_RETRIES,
+        timeout=IMAGE_FETCH_TIMEOUT,
+        result=None,
+    ):
+        """Downloads the URL to its partial path with concurrent range requests,
+        where the completed segments are recorded in a state file next to it,
+        such that an interrupted download only fetches the missing segments,
+        unless the file at the URL has changed in the meantime.
+        Returns the partial path, whereas an OSError is raised if it fails."""
+        loop = asyncio.get_running_loop()
+        path = self.partial_path(url)
+        state_path = path + STORE_METADATA_SUFFIX
+
+        size, ranges, validator = await loop.run_in_executor(
+            None, probe_url, url, timeout
+        )
+        if not ranges or size is None:
+            if result is not None:
+                result.add_event(
+                    "The server does not support range requests, "
+                    "downloading: {} at once",
+                    url,
+                )
+            await loop.run_in_executor(None, fetch_stream, url, path, timeout)
+            remove(state_path)
+            return path
+
+        state = _load_json(state_path)
+        if (
+            not state
+            or state.get("url") != url
+            or state.get("size") != size
+            or state.get("segment_size") != segment_size
+            or state.get("validator") != validator
+            or not os.path.exists(path)
+        ):
+            state = {
+                "url": url,
+                "size": size,
+                "segment_size": segment_size,
+                "validator": validator,
+                "completed": [],
+            }
+            with open(path, "wb") as fh:
+                fh.truncate(size)
+            _write_json(state_path, state)
+
+        completed = set(state["completed"])
+        pending = [
+            segment
+            for index, segment in enumerate(segments(size, segment_size))
+            if index not in completed
+        ]
+        if result is not None and completed:
+            result.add_event(
+                "Resuming the download of: {} with {} of {} segments remaining",
+                url,
+                len(pending),
+                len(pending) + len(completed),
+            )
+        queue = asyncio.Queue()
+        for segment in pending:
+            queue.put_nowait(segment)
+        # A segment that fails does not stop the others, such that
+        # as much as possible of the download is kept for its resumption
+        errors = []
+
+        async def fetch_segments():
+            while not queue.empty():
+                start, end = queue.get_nowait()
+                for attempt in range(retries + 1):
+                    try:
+                        await loop.run_in_executor(
+                            None, fetch_range, url, path, start, end, timeout
+                        )
+                        break
+                    except (OSError, urllib.error.URLError) as err:
+                        if attempt == retries:
+                            errors.append(err)
+                else:
+                    continue
+                # Only the event loop updates the state,
+                # such that the segments are never recorded concurrently
+                completed.add(start // segment_size)
+                state["completed"] = sorted(completed)
+                _write_json(state_path, state)
+
+        workers = [
+            asyncio.ensure_future(fetch_segments())
+            for _ in range(max(min(connections, len(pending)), 1))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        if errors:
+            raise errors[0]
+        remove(state_path)
+        return path
+
+    def discard(self, url):
+        """Removes the partial download of the URL"""
+        path = self.partial_path(url)
+        remove(path)
+        remove(path + STORE_METADATA_SUFFIX)
+
+
+async def fetch_image(
+    url,
+    checksum=None,
+    checksum_url=None,
+    checksum_type=IMAGE_CHECKSUM_TYPE,
+    checksum_read_bytes=None,
+    store_dir=IMAGE_STORE_DIR,
+    max_size=IMAGE_STORE_MAX_SIZE,
+    connections=IMAGE_FETCH_CONNECTIONS,
+    segment_size=IMAGE_FETCH_SEGMENT_SIZE,
+    retries=IMAGE_FETCH_RETRIES,
+    timeout=IMAGE_FETCH_TIMEOUT,
+    output_path=None,
+    catalog_path=None,
+    verbose=False,
+    event_handler=None,
+):
+    """Fetches the base image at the URL into the image store, unless the store
+    already has it, and copies it to the output path if one is given.
+    The image is verified against the checksum, or the checksum in the file at
+    checksum_url, which may only cover the first checksum_read_bytes bytes.
+    An image without a checksum is stored by the checksum of its content,
+    which is found by its URL when it is fetched again. The copy at the output
+    path is registered in the catalog at catalog_path with the checksum of the
+    stored image, such that its digest is known without calculating it."""
+    result = Result(event_handler=event_handler)
+    store = ImageStore(store_dir=store_dir, max_size=max_size)
+    try:
+        store.create()
+    except OSError:
+        return result.finish(PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG, store_dir)
+
+    if checksum_url:
+        try:
+            content = await asyncio.get_running_loop().run_in_executor(
+                None, read_url, checksum_url, timeout
+            )
+        except (OSError, urllib.error.URLError) as err:
+            return result.finish(DOWNLOAD_ERROR, DOWNLOAD_ERROR_MSG, checksum_url, err)
+        parsed = parse_checksum(
+            content.decode("utf-8", errors="replace"),
+            name=os.path.basename(urllib.parse.urlparse(url).path),
+        )
+        if parsed is None:
+            return result.finish(
+                CHECKSUM_ERROR,
+                CHECKSUM_ERROR_MSG,
+                url,
+                "no checksum was found in: {}".format(checksum_url),
+            )
+        checksum, checksum_read_bytes = parsed
+    if checksum_read_bytes is not None:
+        checksum_read_bytes = int(checksum_read_bytes)
+
+    if checksum:
+        key = store_key(checksum, checksum_type, checksum_read_bytes)
+    else:
+        key = store.lookup_url(url)
+    image_path = store.lookup(key) if key else None
+    if image_path:
+        if verbose:
+            result.add_event("Found the image: {} in the store: {}", url, image_path)
+    else:
+        # Concurrent fetches of the same URL wait for each other,
+        # after which the image is taken from the store
+        download_lock = ImageLock(store.partial_path(url))
+        await download_lock.acquire(timeout=None)
+        try:
+            if not checksum:
+                key = store.lookup_url(url)
+            image_path = store.lookup(key) if key else None
+            if not image_path:
+                return_code, key = await _fetch_into_store(
+                    store,
+                    url,
+                    result,
+                    checksum=checksum,
+                    checksum_type=checksum_type,
+                    checksum_read_bytes=checksum_read_bytes,
+                    connections=connections,
+                    segment_size=segment_size,
+                    retries=retries,
+                    timeout=timeout,
+                    verbose=verbose,
+                )
+                if return_code != SUCCESS:
+                    return return_code, result
+                image_path = store.image_path(key)
+        finally:
+            await download_lock.release()
+
+    if output_path:
+        if not await asyncio.get_running_loop().run_in_executor(
+            None, copy, image_path, output_path
+        ):
+            return result.finish(PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG, output_path)
+        if catalog_path:
+            from configure_vm_image.catalog import Catalog
+
+            try:
+                Catalog(catalog_path).register(
+                    output_path, digest=store.digest(key), digest_type=checksum_type
+                )
+            except (OSError, sqlite3.Error) as err:
+                result.add_event(
+                    "Failed to register the image: {} in the catalog: {} - error: {}",
+                    output_path,
+                    catalog_path,
+                    err,
+                )
+        image_path = output_path
+    result.image_path = image_path
+    return result.finish(SUCCESS, "Fetched the image: {} to: {}", url, image_path)
+
+
+async def _fetch_into_store(
+    store,
+    url,
+    result,
+    checksum=None,
+    checksum_type=IMAGE_CHECKSUM_TYPE,
+    checksum_read_bytes=None,
+    connections=IMAGE_FETCH_CONNECTIONS,
+    segment_size=IMAGE_FETCH_SEGMENT_SIZE,
+    retries=IMAGE_FETCH_RETRIES,
+    timeout=IMAGE_FETCH_TIMEOUT,
+    verbose=False,
+):
+    """Downloads and verifies the image, and adds it to the store.
+    Returns the (return_code, key) tuple of the stored image, where the result
+    is finished with the error if the image could not be fetched."""
+    started = time.monotonic()
+    try:
+        path = await store.download(
+            url,
+            connections=connections,
+            segment_size=segment_size,
+            retries=retries,
+            timeout=timeout,
+            result=result if verbose else None,
+        )
+    except (OSError, urllib.error.URLError) as err:
+        # The partial download is kept, such that it can be resumed
+        result.finish(DOWNLOAD_ERROR, DOWNLOAD_ERROR_MSG, url, err)
+        return DOWNLOAD_ERROR, None
+    if verbose:
+        result.add_event(
+            "Downloaded: {} in {:.1f} seconds", url, time.monotonic() - started
+        )
+
+    loop = asyncio.get_running_loop()
+    try:
+        calculated = await loop.run_in_executor(
+            None, file_checksum, path, checksum_type, checksum_read_bytes
+        )
+    except (OSError, ValueError) as err:
+        result.finish(CHECKSUM_ERROR, CHECKSUM_ERROR_MSG, url, err)
+        return CHECKSUM_ERROR, None
+    if checksum and calculated != checksum.lower():
+        # A corrupt download can not be resumed
+        store.discard(url)
+        result.finish(
+            CHECKSUM_ERROR,
+            CHECKSUM_ERROR_MSG,
+            url,
+            "expected the {} checksum: {} but calculated: {}".format(
+                checksum_type, checksum.lower(), calculated
+            ),
+        )
+        return CHECKSUM_ERROR, None
+
+    key = store_key(calculated, checksum_type, checksum_read_bytes)
+    try:
+        store.add(
+            key, path, url, calculated, checksum_type, read_bytes=checksum_read_bytes
+        )
+    except OSError:
+        result.finish(PATH_CREATE_ERROR, PATH_CREATE_ERROR_MSG, store.image_path(key))
+        return PATH_CREATE_ERROR, None
+    for entry in store.evict(keep=(key,)):
+        result.add_event("Evicted the image: {} from the store", entry["path"])
+    return SUCCESS, key
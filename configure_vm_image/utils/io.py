@@ -121,10 +121,11 @@ def hashsum(path, algorithm="sha1", buffer_size=65536):
 
 
 def find(directory_path, regex_name):
+    pattern = re.compile(regex_name)
     found = []
     for root, dirs, files in os.walk(directory_path):
         for f in files:
-            if re.match(regex_name, f):
+            if pattern.match(f):
                 found.append(f)
     return found
 
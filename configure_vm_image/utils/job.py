@@ -1,6 +1,11 @@
+import asyncio
 import datetime
 import json
+import os
 import subprocess
+import time
+
+from configure_vm_image.common.codes import SUCCESS
 
 
 def __to_str__(o):
@@ -75,16 +80,8 @@ def check_call(cmd, output_format="str", **run_kwargs):
     return __format_output__(result, to_format=output_format)
 
 
-def run(cmd, output_format="str", **run_kwargs):
-    if not output_format:
-        output_format = "str"
+def __format_results__(raw_results, output_format="str"):
     return_values = {"output": "", "error": ""}
-    try:
-        raw_results = subprocess.run(cmd, **run_kwargs, capture_output=True)
-    except Exception as e:
-        return_values["error"] = f"Failed to run command: {cmd}, error: {e}"
-        return False, return_values
-
     result = __extract_results__(raw_results)
     if result["error"]:
         formatted_error = __format_output__(result["error"], to_format=output_format)
@@ -99,3 +96,222 @@ def run(cmd, output_format="str", **run_kwargs):
     if result["returncode"] != 0:
         return False, return_values
     return True, return_values
+
+
+def run(cmd, output_format="str", **run_kwargs):
+    if not output_format:
+        output_format = "str"
+    return_values = {"output": "", "error": ""}
+    try:
+        raw_results = subprocess.run(cmd, **run_kwargs, capture_output=True)
+    except Exception as e:
+        return_values["error"] = f"Failed to run command: {cmd}, error: {e}"
+        return False, return_values
+    return __format_results__(raw_results, output_format=output_format)
+
+
+async def run_async(cmd, output_format="str", timeout=None, **run_kwargs):
+    """Asynchronous version of run that does not block the event loop
+    while the command is executing, such that multiple commands can be
+    awaited concurrently.
+    If the command does not finish within the timeout, or the awaiting task
+    is cancelled, the command is killed before returning or re-raising."""
+    if not output_format:
+        output_format = "str"
+    return_values = {"output": "", "error": ""}
+    spawn = asyncio.ensure_future(
+        asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **run_kwargs,
+        )
+    )
+    try:
+        # The spawn is shielded, since asyncio reaps a process whose spawn is
+        # cancelled behind the back of its child watcher. Instead, the spawned
+        # process is killed and reaped like any other cancelled command.
+        process = await asyncio.shield(spawn)
+    except asyncio.CancelledError:
+        try:
+            process = await spawn
+        except Exception:
+            raise asyncio.CancelledError()
+        await __kill_process__(process)
+        raise
+    except Exception as e:
+        return_values["error"] = f"Failed to run command: {cmd}, error: {e}"
+        return False, return_values
+
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        await __kill_process__(process)
+        return_values["error"] = (
+            f"Failed to run command: {cmd}, error: timed out after {timeout} seconds"
+        )
+        return False, return_values
+    except asyncio.CancelledError:
+        await __kill_process__(process)
+        raise
+    raw_results = subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+    return __format_results__(raw_results, output_format=output_format)
+
+
+def __process_exited__(pid):
+    """Checks whether the process has exited without reaping it,
+    such that it is left for the child watcher of the event loop to reap"""
+    if not hasattr(os, "waitid"):
+        return False
+    try:
+        return (
+            os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+        )
+    except ChildProcessError:
+        return True
+
+
+async def __kill_process__(process):
+    if process.returncode is not None:
+        return
+    # Killing a process that has already exited reaps it
+    # behind the back of the child watcher of the event loop
+    if not __process_exited__(process.pid):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            return
+    # Reap the killed process such that it does not linger as a zombie
+    await process.wait()
+
+
+def process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but is owned by another user
+        return True
+    return True
+
+
+class Deadline:
+    """An overall deadline from which the time budget of each
+    individual phase is derived. A timeout of None is unbounded."""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        if timeout is None:
+            self.expires_at = None
+        else:
+            self.expires_at = time.monotonic() + timeout
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0)
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def budget(self, phase_timeout=None):
+        """Returns the time that a phase is allowed to take, which is the
+        phase timeout bounded by the remaining time of the deadline"""
+        remaining = self.remaining()
+        if remaining is None:
+            return phase_timeout
+        if phase_timeout is None:
+            return remaining
+        return min(remaining, phase_timeout)
+
+
+async def cancel_on_signals(coroutine, signals=None):
+    """Awaits the coroutine as a task that is cancelled when one of the signals
+    is received, such that the coroutine gets the chance to clean up
+    the resources it holds before the process exits."""
+    import signal
+
+    if signals is None:
+        signals = (signal.SIGINT, signal.SIGTERM)
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(coroutine)
+    for sig in signals:
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        return await task
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+
+
+def _check_stages(stages):
+    """Ensures that the stages form a dependency graph without cycles,
+    since a stage in a cycle would wait forever for its dependencies"""
+    visited, visiting = set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError("The stage: {} depends on itself".format(name))
+        if name not in stages:
+            raise ValueError("Unknown stage dependency: {}".format(name))
+        visiting.add(name)
+        for dependency in stages[name][1]:
+            visit(dependency)
+        visiting.remove(name)
+        visited.add(name)
+
+    for name in stages:
+        visit(name)
+
+
+async def run_stages(stages):
+    """Runs the stages of a dependency graph concurrently, where stages maps
+    the name of each stage to a (coroutine_function, dependencies) tuple.
+    A stage is started as soon as all of the stages it depends on have succeeded,
+    and returns a (return_code, value) tuple. When a stage fails or raises,
+    the stages that are still running are cancelled.
+    Returns (SUCCESS, values) with the value of each stage by its name,
+    or the (return_code, value) of the first stage that failed."""
+    _check_stages(stages)
+    tasks = {}
+
+    async def run_stage(name):
+        func, dependencies = stages[name]
+        for dependency in dependencies:
+            return_code, value = await tasks[dependency]
+            if return_code != SUCCESS:
+                return return_code, value
+        return await func()
+
+    # The tasks only start running once this coroutine yields,
+    # such that every stage has a task before any stage awaits its dependencies
+    for name in stages:
+        tasks[name] = asyncio.ensure_future(run_stage(name))
+
+    pending = set(tasks.values())
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                return_code, value = task.result()
+                if return_code != SUCCESS:
+                    return return_code, value
+        return SUCCESS, {name: task.result()[1] for name, task in tasks.items()}
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        # A stage that raised is reported once, whereas the exception is
+        # also raised by the stages that depend on it, which finish with it
+        for task in tasks.values():
+            if task.done() and not task.cancelled():
+                task.exception()
@@ -0,0 +1,420 @@
+import difflib
+import hashlib
+
+from configure_vm_image.common.codes import (
+    SEED_VALIDATION_ERROR,
+    SEED_VALIDATION_ERROR_MSG,
+    SUCCESS,
+)
+from configure_vm_image.common.defaults import SEED_VALIDATION_CACHE_SIZE
+from configure_vm_image.seed import (
+    SEED_META_DATA,
+    SEED_NETWORK_CONFIG,
+    SEED_PATH_FILES,
+    SEED_USER_DATA,
+    SEED_VENDOR_DATA,
+)
+
+# The type of each top-level key of the cloud-config modules that cloud-init
+# provides, which is a compiled subset of the cloud-init JSON schema,
+# where None is allowed for every key, since cloud-init skips empty keys
+CLOUD_CONFIG_TYPES = {
+    "allow_public_ssh_keys": (bool,),
+    "ansible": (dict,),
+    "apk_repos": (dict,),
+    "apt": (dict,),
+    "apt_pipelining": (bool, str, int),
+    "apt_reboot_if_required": (bool,),
+    "apt_update": (bool,),
+    "apt_upgrade": (bool,),
+    "autoinstall": (dict,),
+    "bootcmd": (list,),
+    "byobu_by_default": (str,),
+    "ca-certs": (dict,),
+    "ca_certs": (dict,),
+    "chef": (dict,),
+    "chpasswd": (dict,),
+    "cloud_config_modules": (list,),
+    "cloud_final_modules": (list,),
+    "cloud_init_modules": (list,),
+    "create_hostname_file": (bool,),
+    "datasource": (dict,),
+    "debug": (dict,),
+    "device_aliases": (dict,),
+    "disable_ec2_metadata": (bool,),
+    "disable_root": (bool,),
+    "disable_root_opts": (str,),
+    "disk_setup": (dict,),
+    "drivers": (dict,),
+    "fan": (dict,),
+    "final_message": (str,),
+    "fqdn": (str,),
+    "fs_setup": (list,),
+    "groups": (list, dict, str),
+    "growpart": (dict,),
+    "grub-dpkg": (dict,),
+    "grub_dpkg": (dict,),
+    "hostname": (str,),
+    "keyboard": (dict,),
+    "landscape": (dict,),
+    "locale": (str, bool),
+    "locale_configfile": (str,),
+    "lxd": (dict,),
+    "manage_etc_hosts": (bool, str),
+    "manage_resolv_conf": (bool,),
+    "manual_cache_clean": (bool,),
+    "mcollective": (dict,),
+    "merge_how": (list, str),
+    "merge_type": (list, str),
+    "mount_default_fields": (list,),
+    "mounts": (list,),
+    "no_ssh_fingerprints": (bool,),
+    "ntp": (dict,),
+    "output": (dict,),
+    "package_reboot_if_required": (bool,),
+    "package_update": (bool,),
+    "package_upgrade": (bool,),
+    "packages": (list,),
+    "password": (str,),
+    "phone_home": (dict,),
+    "power_state": (dict,),
+    "prefer_fqdn_over_hostname": (bool,),
+    "preserve_hostname": (bool,),
+    "puppet": (dict,),
+    "random_seed": (dict,),
+    "reporting": (dict,),
+    "resize_rootfs": (bool, str),
+    "resolv_conf": (dict,),
+    "rh_subscription": (dict,),
+    "rsyslog": (dict, list),
+    "runcmd": (list,),
+    "salt_minion": (dict,),
+    "snap": (dict,),
+    "spacewalk": (dict,),
+    "ssh": (dict,),
+    "ssh_authorized_keys": (list,),
+    "ssh_deletekeys": (bool,),
+    "ssh_fp_console_blacklist": (list,),
+    "ssh_genkeytypes": (list,),
+    "ssh_import_id": (list,),
+    "ssh_key_console_blacklist": (list,),
+    "ssh_keys": (dict,),
+    "ssh_publish_hostkeys": (dict,),
+    "ssh_pwauth": (bool, str),
+    "ssh_quiet_keygen": (bool,),
+    "swap": (dict,),
+    "system_info": (dict,),
+    "timezone": (str,),
+    "ubuntu_advantage": (dict,),
+    "ubuntu_pro": (dict,),
+    "updates": (dict,),
+    "user": (dict, str),
+    "users": (list, dict, str),
+    "vendor_data": (dict,),
+    "wireguard": (dict,),
+    "write_files": (list,),
+    "yum_repo_dir": (str,),
+    "yum_repos": (dict,),
+    "zypper": (dict,),
+}
+# The type of the items of the cloud-config keys that are lists
+CLOUD_CONFIG_ITEM_TYPES = {
+    "bootcmd": (str, list),
+    "packages": (str, list),
+    "runcmd": (str, list),
+    "ssh_authorized_keys": (str,),
+    "users": (str, dict),
+    "write_files": (dict,),
+}
+# The headers of the user-data formats that are not validated further
+USER_DATA_HEADERS = (
+    "#!",
+    "#include",
+    "#cloud-boothook",
+    "#part-handler",
+    "#upstart-job",
+    "## template: jinja",
+)
+NETWORK_CONFIG_V1_TYPES = ("physical", "bond", "bridge", "vlan", "nameserver", "route")
+NETWORK_CONFIG_V2_KEYS = (
+    "version",
+    "renderer",
+    "ethernets",
+    "bonds",
+    "bridges",
+    "vlans",
+    "wifis",
+    "tunnels",
+    "vrfs",
+    "modems",
+)
+TYPE_NAMES = {
+    bool: "a boolean",
+    int: "an integer",
+    str: "a string",
+    list: "a list",
+    dict: "a mapping",
+}
+
+# The outcome of the validation of each distinct seed file by its digest,
+# such that a batch of jobs that share a seed only validates it once
+_validations = {}
+
+
+def _type_names(types):
+    return " or ".join(TYPE_NAMES[_type] for _type in types)
+
+
+def _is_type(value, types):
+    # A boolean is an int in Python, but not in YAML
+    if isinstance(value, bool):
+        return bool in types
+    return isinstance(value, types)
+
+
+def _load_yaml(content):
+    """Parses the YAML content, where an error includes the line it is on"""
+    import yaml
+
+    try:
+        return yaml.safe_load(content), None
+    except yaml.YAMLError as err:
+        mark = getattr(err, "problem_mark", None)
+        problem = getattr(err, "problem", None) or str(err)
+        if mark is not None:
+            return None, "line {}: {}".format(mark.line + 1, problem)
+        return None, problem
+
+
+def validate_cloud_config(content):
+    """Validates the #cloud-config content against the types of the
+    cloud-config keys. An unknown key is only an error if it is close to
+    a known key, since it is likely misspelled, whereas other unknown keys
+    might belong to modules of a newer cloud-init."""
+    config, error = _load_yaml(content)
+    if error:
+        return [error]
+    if config is None:
+        return []
+    if not isinstance(config, dict):
+        return [
+            "the cloud-config must be a mapping, not {}".format(type(config).__name__)
+        ]
+
+    errors = []
+    for key, value in config.items():
+        if key not in CLOUD_CONFIG_TYPES:
+            matches = difflib.get_close_matches(
+                str(key), CLOUD_CONFIG_TYPES, n=1, cutoff=0.8
+            )
+            if matches:
+                errors.append(
+                    "unknown key: '{}', did you mean: '{}'".format(key, matches[0])
+                )
+            continue
+        if value is None:
+            continue
+        if not _is_type(value, CLOUD_CONFIG_TYPES[key]):
+            errors.append(
+                "the key: '{}' must be {}, not {}".format(
+                    key, _type_names(CLOUD_CONFIG_TYPES[key]), type(value).__name__
+                )
+            )
+            continue
+        if key in CLOUD_CONFIG_ITEM_TYPES and isinstance(value, list):
+            for index, item in enumerate(value):
+                if not _is_type(item, CLOUD_CONFIG_ITEM_TYPES[key]):
+                    errors.append(
+                        "the item: {} of '{}' must be {}, not {}".format(
+                            index,
+                            key,
+                            _type_names(CLOUD_CONFIG_ITEM_TYPES[key]),
+                            type(item).__name__,
+                        )
+                    )
+                elif key == "write_files" and "path" not in item:
+                    errors.append(
+                        "the item: {} of 'write_files' has no 'path'".format(index)
+                    )
+    return errors
+
+
+def validate_user_data(content):
+    """Validates the user-data or vendor-data by the format that its header
+    declares, where the parts of a multipart MIME message are validated
+    one by one. Content that cloud-init would ignore is an error."""
+    if not content.strip() or content.startswith(b"\x1f\x8b"):
+        return []
+    text = content.decode("utf-8", errors="replace")
+    first_line = text.lstrip().split("\n", 1)[0].strip()
+    if first_line.startswith("#cloud-config-archive"):
+        archive, error = _load_yaml(text)
+        if error:
+            return [error]
+        if not isinstance(archive, list):
+            return ["the #cloud-config-archive must be a list"]
+        return []
+    if first_line.startswith("#cloud-config"):
+        return validate_cloud_config(text)
+    if first_line.startswith(USER_DATA_HEADERS):
+        return []
+    if first_line.lower().startswith(("content-type:", "mime-version:")):
+        return _validate_multipart(content)
+
+    config, error = _load_yaml(text)
+    if error is None and isinstance(config, dict):
+        return ["the #cloud-config header is missing on the first line"]
+    return [
+        "the format is not recognized by its first line: '{}', "
+        "which cloud-init ignores".format(first_line)
+    ]
+
+
+def _validate_multipart(content):
+    from email.parser import BytesParser
+
+    message = BytesParser().parsebytes(content)
+    if not message.is_multipart():
+        return _validate_part(message)
+    errors = []
+    for index, part in enumerate(message.walk()):
+        if part.is_multipart():
+            continue
+        errors.extend(
+            "part {}: {}".format(index, error) for error in _validate_part(part)
+        )
+    return errors
+
+
+def _validate_part(part):
+    payload = part.get_payload(decode=True) or b""
+    content_type = part.get_content_type()
+    if content_type == "text/cloud-config":
+        return validate_cloud_config(payload.decode("utf-8", errors="replace"))
+    if content_type in ("text/plain", "text/x-not-multipart"):
+        return validate_user_data(payload)
+    return []
+
+
+def validate_meta_data(content):
+    meta_data, error = _load_yaml(content)
+    if error:
+        return [error]
+    if meta_data is None:
+        return []
+    if not isinstance(meta_data, dict):
+        return ["the meta-data must be a mapping"]
+    instance_id = meta_data.get("instance-id")
+    if instance_id is not None and not isinstance(instance_id, (str, int)):
+        return ["the key: 'instance-id' must be a string"]
+    return []
+
+
+def validate_network_config(content):
+    """Validates the network-config as either version 1 or version 2,
+    which may be nested within a top-level network key"""
+    network_config, error = _load_yaml(content)
+    if error:
+        return [error]
+    if network_config is None:
+        return []
+    if not isinstance(network_config, dict):
+        return ["the network-config must be a mapping"]
+    if isinstance(network_config.get("network"), dict):
+        network_config = network_config["network"]
+
+    version = network_config.get("version")
+    if version == 1:
+        config = network_config.get("config")
+        if config == "disabled":
+            return []
+        if not isinstance(config, list):
+            return ["the 'config' of a version 1 network-config must be a list"]
+        errors = []
+        for index, item in enumerate(config):
+            if not isinstance(item, dict):
+                errors.append("the config item: {} must be a mapping".format(index))
+            elif item.get("type") not in NETWORK_CONFIG_V1_TYPES:
+                errors.append(
+                    "the config item: {} has the unknown type: '{}', "
+                    "must be one of: {}".format(
+                        index, item.get("type"), ", ".join(NETWORK_CONFIG_V1_TYPES)
+                    )
+                )
+            elif item["type"] in (
+                "physical",
+                "bond",
+                "bridge",
+                "vlan",
+            ) and not item.get("name"):
+                errors.append("the config item: {} has no 'name'".format(index))
+        return errors
+    if version == 2:
+        errors = []
+        for key, value in network_config.items():
+            if key not in NETWORK_CONFIG_V2_KEYS:
+                errors.append(
+                    "unknown key: '{}' in a version 2 network-config".format(key)
+                )
+            elif key not in ("version", "renderer"):
+                if not isinstance(value, dict) or not all(
+                    isinstance(device, dict) or device is None
+                    for device in value.values()
+                ):
+                    errors.append(
+                        "the key: '{}' must be a mapping of device names "
+                        "to their configuration".format(key)
+                    )
+        return errors
+    return ["the network-config version must be 1 or 2, not: {}".format(version)]
+
+
+SEED_VALIDATORS = {
+    SEED_USER_DATA: validate_user_data,
+    SEED_VENDOR_DATA: validate_user_data,
+    SEED_META_DATA: validate_meta_data,
+    SEED_NETWORK_CONFIG: validate_network_config,
+}
+
+
+def validate_seed_file(name, content):
+    """Validates the content in bytes of the seed file with the name,
+    where the outcome is cached by the digest of the content.
+    Returns the list of errors, which is empty if the file is valid."""
+    key = (name, hashlib.sha256(content).hexdigest())
+    if key not in _validations:
+        if len(_validations) >= SEED_VALIDATION_CACHE_SIZE:
+            _validations.clear()
+        if name in (SEED_USER_DATA, SEED_VENDOR_DATA):
+            _validations[key] = SEED_VALIDATORS[name](content)
+        else:
+            _validations[key] = SEED_VALIDATORS[name](
+                content.decode("utf-8", errors="replace")
+            )
+    return list(_validations[key])
+
+
+def validate_seed(seed=None, **seed_paths):
+    """Validates the seed, which is either given as a dictionary of the seed
+    file name to its content, or by the path of each of the seed files,
+    such that a broken seed is found without booting a VM.
+    Returns (SUCCESS, None) or (SEED_VALIDATION_ERROR, msg)."""
+    if seed is None:
+        seed = {}
+        for key, path in seed_paths.items():
+            if not path:
+                continue
+            try:
+                with open(path, "rb") as fh:
+                    seed[SEED_PATH_FILES[key]] = fh.read()
+            except OSError as err:
+                return SEED_VALIDATION_ERROR, SEED_VALIDATION_ERROR_MSG.format(
+                    SEED_PATH_FILES[key], err
+                )
+    for name in sorted(seed):
+        errors = validate_seed_file(name, seed[name])
+        if errors:
+            return SEED_VALIDATION_ERROR, SEED_VALIDATION_ERROR_MSG.format(
+                name, "; ".join(errors)
+            )
+    return SUCCESS, None
@@ -34,7 +34,13 @@ setup(
     author_email="code@munk0.dk",
     packages=find_packages(),
     data_files=[
-        ("etc/configure-vm-image/res", ["res/configure-vm-template.xml.j2"]),
+        (
+            "etc/configure-vm-image/res",
+            [
+                "res/configure-vm-template.xml.j2",
+                "res/configure-vm-template-performance.xml.j2",
+            ],
+        ),
     ],
     url="https://github.com/ucphhpc/configure-vm-image",
     license="MIT",
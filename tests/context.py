@@ -3,10 +3,10 @@ import os
 import psutil
 from gen_vm_image.common.codes import SUCCESS
 from gen_vm_image.image import generate_image
-from gen_vm_image.utils.net import download_file
 
 from configure_vm_image.common.defaults import CPU_ARCHITECTURE
-from configure_vm_image.utils.io import exists, join, load, makedirs, remove
+from configure_vm_image.store import fetch_image
+from configure_vm_image.utils.io import exists, join, makedirs, remove
 
 TEST_IMAGE_NAME = "test_image"
 TEST_IMAGE_FORMAT = "qcow2"
@@ -48,30 +48,6 @@ def get_cpus_slice(core_count_divisor=2):
     return cpus_slice
 
 
-def extract_checksum_from_image_file(path):
-    """Extract checksum, expects the format:
-        'checksum (of first xxxxx bytes) relative_serverside_path'
-
-    which will return the checksum and the byte size.
-
-    Otherwise the function will expect that the entire file is used
-    to calculate the checksum with the following format:
-        'checksum relative_serverside_path'
-
-    Which will return the checksum and None.
-    """
-    content = load(path)
-    if not content:
-        return False
-    split_content = content.split(" ")
-    checksum = split_content[0]
-    if len(split_content) < 4:
-        checksum_byte_size = None
-    else:
-        checksum_byte_size = split_content[3]
-    return checksum, checksum_byte_size
-
-
 class AsyncConfigureTestContext:
     def __init__(self):
         self.init_done = False
@@ -104,28 +80,18 @@ class AsyncConfigureTestContext:
             self.test_tmp_directory, "{}.{}".format(TEST_IMAGE_NAME, TEST_IMAGE_FORMAT)
         )
         if not exists(self.image):
-            checksum_file_path = join(
-                self.test_tmp_directory, f"{TEST_IMAGE_NAME}.checksum"
-            )
-            downloaded, response = await download_file(
-                INPUT_IMAGE_CHECKSUM_URL, checksum_file_path
-            )
-            assert downloaded
-            assert exists(checksum_file_path)
-            checksum, checksum_byte_size = extract_checksum_from_image_file(
-                checksum_file_path
+            # The base image is kept in the image store across test runs,
+            # such that it is only downloaded and verified once
+            fetched, result = await fetch_image(
+                INPUT_IMAGE_URL, checksum_url=INPUT_IMAGE_CHECKSUM_URL
             )
-            if checksum_byte_size is not None:
-                checksum_byte_size = int(checksum_byte_size)
+            assert fetched == SUCCESS, result.msg
 
             # Test that the image can be configured
             success, msg = await generate_image(
                 self.image_config["name"],
                 self.image_config["size"],
-                input=self.image_config["input"],
-                input_checksum=checksum,
-                input_checksum_type="sha256",
-                input_checksum_read_bytes=checksum_byte_size,
+                input=result.image_path,
                 output_directory=self.image_config["output_directory"],
                 output_format=self.image_config["output_format"],
             )
@@ -0,0 +1,162 @@
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+from configure_vm_image.catalog import Catalog, catalog_images, digest_seed, probe_image
+from configure_vm_image.common.codes import CATALOG_ERROR, SUCCESS
+from configure_vm_image.store import file_checksum
+from configure_vm_image.utils.io import join, makedirs
+
+
+def qcow2_header(virtual_size, backing_file=None):
+    """The start of a qcow2 header with the fields that are probed"""
+    backing_file_offset, backing_file_size = 0, 0
+    if backing_file:
+        backing_file_offset, backing_file_size = 72, len(backing_file)
+    header = struct.pack(
+        ">4sIQIIQ",
+        b"QFI\xfb",
+        3,
+        backing_file_offset,
+        backing_file_size,
+        16,
+        virtual_size,
+    )
+    header += b"\0" * (72 - len(header))
+    if backing_file:
+        header += backing_file.encode()
+    return header
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = join(self.tmp_dir, "images")
+        self.assertTrue(makedirs(join(self.root, "nested")))
+        self.catalog = Catalog(join(self.tmp_dir, "catalog.sqlite3"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, path, content):
+        with open(path, "wb") as fh:
+            fh.write(content)
+        return os.path.realpath(path)
+
+    def touch(self, path):
+        # Ensures that the modification time changes on coarse filesystems
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+    def test_probe_image(self):
+        qcow2_path = self.write(
+            join(self.tmp_dir, "a.qcow2"), qcow2_header(10 * 1024**3, "base.qcow2")
+        )
+        self.assertEqual(
+            probe_image(qcow2_path),
+            {
+                "format": "qcow2",
+                "virtual_size": 10 * 1024**3,
+                "backing_file": "base.qcow2",
+            },
+        )
+        raw_path = self.write(join(self.tmp_dir, "a.img"), b"\0" * 512)
+        self.assertEqual(
+            probe_image(raw_path),
+            {"format": "raw", "virtual_size": 512, "backing_file": None},
+        )
+
+    def test_incremental_scan(self):
+        first = self.write(join(self.root, "first.qcow2"), qcow2_header(1024))
+        second = self.write(join(self.root, "nested", "second.img"), b"raw")
+        self.write(join(self.root, "notes.txt"), b"not an image")
+
+        self.assertEqual(
+            self.catalog.scan([self.root]),
+            {"added": 2, "updated": 0, "unchanged": 0, "removed": 0},
+        )
+        self.assertEqual(
+            [(entry["path"], entry["format"]) for entry in self.catalog.images()],
+            [(first, "qcow2"), (second, "raw")],
+        )
+        digest = self.catalog.digest(first)
+        self.assertEqual(digest, file_checksum(first))
+
+        # An unchanged image keeps its digest, whereas a changed one drops it
+        self.touch(second)
+        self.assertEqual(
+            self.catalog.scan([self.root]),
+            {"added": 0, "updated": 1, "unchanged": 1, "removed": 0},
+        )
+        self.assertEqual(self.catalog.get(first)["digest"], digest)
+        os.remove(second)
+        self.assertEqual(self.catalog.scan([self.root])["removed"], 1)
+        self.assertIsNone(self.catalog.get(second))
+
+        self.touch(first)
+        self.assertIsNone(self.catalog.lookup(first))
+        self.assertEqual(self.catalog.digest(first), digest)
+
+    def test_registered_digest_is_not_calculated(self):
+        image_path = self.write(join(self.root, "image.qcow2"), qcow2_header(1024))
+        self.catalog.register(image_path, digest="known")
+        self.assertEqual(self.catalog.digest(image_path), "known")
+
+    def test_scan_keeps_registered_digest(self):
+        image_path = self.write(join(self.root, "image.qcow2"), qcow2_header(1024))
+        self.catalog.register(image_path, digest="known")
+        self.assertEqual(
+            self.catalog.scan([self.root]),
+            {"added": 0, "updated": 0, "unchanged": 1, "removed": 0},
+        )
+        entry = self.catalog.get(image_path)
+        self.assertEqual(entry["digest"], "known")
+        self.assertEqual(entry["root"], os.path.realpath(self.root))
+
+        self.touch(image_path)
+        self.assertEqual(self.catalog.scan([self.root])["updated"], 1)
+        self.assertIsNone(self.catalog.get(image_path)["digest"])
+
+    def test_latest_configured(self):
+        seed_path = self.write(join(self.tmp_dir, "user-data"), b"#cloud-config\n")
+        seed = digest_seed({"user_data_path": seed_path, "meta_data_path": None})
+        self.assertNotEqual(seed, digest_seed({"user_data_path": seed_path}, {"a": 1}))
+
+        first = self.write(join(self.root, "first.qcow2"), qcow2_header(1024))
+        second = self.write(join(self.root, "second.qcow2"), qcow2_header(1024))
+        self.catalog.record_configuration(first, base_digest="base", seed_digest=seed)
+        time.sleep(0.01)
+        self.catalog.record_configuration(
+            second, base_digest="base", seed_digest=seed, details={"a": 1}
+        )
+        self.catalog.record_configuration(first, base_digest="other", seed_digest=seed)
+
+        latest = self.catalog.latest_configured("base", seed_digest=seed)
+        self.assertEqual(latest["image_path"], second)
+        self.assertEqual(latest["details"], {"a": 1})
+        # An image that changed since it was configured is skipped
+        self.touch(second)
+        self.assertEqual(self.catalog.latest_configured("base")["image_path"], first)
+        self.assertIsNone(self.catalog.latest_configured("base", seed_digest="x"))
+
+    def test_catalog_images(self):
+        self.write(join(self.root, "image.qcow2"), qcow2_header(1024))
+        return_code, result = catalog_images(
+            roots=[self.root], catalog_path=self.catalog.path, digests=True
+        )
+        self.assertEqual(return_code, SUCCESS, result.msg)
+        self.assertEqual(len(result["images"]), 1)
+        self.assertIsNotNone(result["images"][0]["digest"])
+
+        return_code, result = catalog_images(
+            catalog_path=self.catalog.path, base_digest="base"
+        )
+        self.assertEqual(return_code, CATALOG_ERROR)
+
+
+if __name__ == "__main__":
+    unittest.main()
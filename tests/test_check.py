@@ -0,0 +1,72 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.check import (
+    CHECK_STATUS_CORRUPT,
+    CHECK_STATUS_LEAKED,
+    CHECK_STATUS_OK,
+    CHECK_STATUS_UNSUPPORTED,
+    check_integrity,
+    check_succeeded,
+    image_version,
+    parse_check,
+)
+from configure_vm_image.utils.io import join
+
+
+class TestCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.image_path = join(self.tmp_dir, "image.qcow2")
+        with open(self.image_path, "wb") as fh:
+            fh.write(b"QFI\xfb")
+        self.cache_path = join(self.tmp_dir, "image-checks.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_parse_check(self):
+        report = {"check-errors": 0, "filename": "image.qcow2", "format": "qcow2"}
+        self.assertEqual(parse_check(json.dumps(report))["status"], CHECK_STATUS_OK)
+        self.assertEqual(
+            parse_check(json.dumps(dict(report, leaks=3)))["status"],
+            CHECK_STATUS_LEAKED,
+        )
+        corrupt = parse_check(json.dumps(dict(report, corruptions=1)))
+        self.assertEqual(corrupt["status"], CHECK_STATUS_CORRUPT)
+        self.assertFalse(check_succeeded(corrupt))
+        self.assertEqual(
+            parse_check("", "qemu-img: This image format does not support checks"),
+            {"status": CHECK_STATUS_UNSUPPORTED},
+        )
+        self.assertIsNone(parse_check("", "qemu-img: Could not open 'image.qcow2'"))
+
+    def test_cached_check(self):
+        check = {"status": CHECK_STATUS_CORRUPT, "corruptions": 2, "leaks": 0}
+        with open(self.cache_path, "w") as fh:
+            json.dump(
+                {self.image_path: dict(check, version=image_version(self.image_path))},
+                fh,
+            )
+        checked, cached = asyncio.run(
+            check_integrity(self.image_path, "qcow2", cache_path=self.cache_path)
+        )
+        self.assertTrue(checked)
+        self.assertTrue(cached["cached"])
+        self.assertEqual(cached["corruptions"], 2)
+
+        # The cached check no longer applies once the image has changed
+        with open(self.image_path, "ab") as fh:
+            fh.write(b"\0" * 512)
+        checked, check = asyncio.run(
+            check_integrity(self.image_path, "qcow2", cache_path=self.cache_path)
+        )
+        self.assertFalse(checked and check is not None and check["cached"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,13 @@
+import contextlib
+import io
+import json
+import subprocess
+import sys
 import unittest
 
 from configure_vm_image.cli.configure_image import main
-from configure_vm_image.common.codes import SUCCESS
+from configure_vm_image.common.codes import PATH_NOT_FOUND_ERROR, SUCCESS
+from configure_vm_image.common.defaults import VM_ORCHESTRATOR_QEMU
 
 
 class TestCLIBase(unittest.TestCase):
@@ -21,3 +27,50 @@ class TestCLIBase(unittest.TestCase):
         except SystemExit as e:
             return_code = e.code
         self.assertEqual(return_code, SUCCESS)
+
+    def test_cli_version_lazy_imports(self):
+        # The version, help and argument validation paths should not import
+        # the configure pipeline or asyncio, since they dominate the startup time
+        script = "\n".join(
+            [
+                "import sys",
+                "from configure_vm_image.cli.configure_image import main",
+                "try:",
+                "    main(['--version'])",
+                "except SystemExit:",
+                "    pass",
+                "print(','.join(sorted(sys.modules)))",
+            ]
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, check=True
+        )
+        imported_modules = result.stdout.decode("utf-8").strip().split("\n")[-1]
+        imported_modules = imported_modules.split(",")
+        self.assertNotIn("asyncio", imported_modules)
+        self.assertNotIn("json", imported_modules)
+        self.assertNotIn("configure_vm_image.configure", imported_modules)
+
+    def test_cli_gc_help(self):
+        return_code = None
+        try:
+            return_code = main(["gc", "--help"])
+        except SystemExit as e:
+            return_code = e.code
+        self.assertEqual(return_code, SUCCESS)
+
+    def test_cli_explicit_configure(self):
+        # An image whose path is the name of an operation
+        # is configured when the configure operation is given
+        with contextlib.redirect_stderr(io.StringIO()) as output:
+            return_code = main(
+                [
+                    "configure",
+                    "gc",
+                    "--plan",
+                    "--configure-vm-orchestrator",
+                    VM_ORCHESTRATOR_QEMU,
+                ]
+            )
+        self.assertEqual(return_code, PATH_NOT_FOUND_ERROR)
+        self.assertIn("gc", json.loads(output.getvalue())["msg"])
@@ -0,0 +1,325 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.cluster import (
+    Coordinator,
+    Worker,
+    check_job_arguments,
+    is_loopback,
+    job_resources,
+    load_jobs,
+    parse_address,
+)
+from configure_vm_image.common.codes import (
+    CLUSTER_ERROR,
+    INVALID_ATTRIBUTE_TYPE_ERROR,
+    MISSING_ATTRIBUTE_ERROR,
+    SUCCESS,
+    WORKER_ERROR,
+)
+from configure_vm_image.common.defaults import EVENT_PHASE
+from configure_vm_image.result import Result
+from configure_vm_image.utils.io import join
+
+GiB = 1024**3
+
+
+class TestCluster(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.address = join(self.tmp_dir, "coordinator.sock")
+        # The images that are being configured on each worker
+        self.running = {}
+        self.max_running = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def configure(self, worker_name, block=False):
+        async def configure(image_path, event_handler=None, **kwargs):
+            result = Result(image_path=image_path, event_handler=event_handler)
+            result.enter_phase("configure")
+            running = self.running.setdefault(worker_name, set())
+            running.add(image_path)
+            self.max_running[worker_name] = max(
+                self.max_running.get(worker_name, 0), len(running)
+            )
+            try:
+                await asyncio.sleep(3600 if block else 0.05)
+            finally:
+                running.discard(image_path)
+            return result.finish(SUCCESS, "Configured image: {}", image_path)
+
+        return configure
+
+    def worker(self, name, num_vcpus=4, block=False, **kwargs):
+        return Worker(
+            address=self.address,
+            name=name,
+            capacity={"num_vcpus": num_vcpus, "memory_bytes": 16 * GiB},
+            configure=self.configure(name, block=block),
+            heartbeat_interval=0.1,
+            heartbeat_timeout=1,
+            **kwargs
+        )
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("127.0.0.1:8740"), ("127.0.0.1", 8740))
+        self.assertEqual(parse_address("[::1]:8740"), ("::1", 8740))
+        self.assertEqual(
+            parse_address("/run/coordinator.sock"), "/run/coordinator.sock"
+        )
+        self.assertEqual(parse_address("coordinator.sock"), "coordinator.sock")
+
+    def test_is_loopback(self):
+        self.assertTrue(is_loopback("127.0.0.1:8740"))
+        self.assertTrue(is_loopback("[::1]:8740"))
+        self.assertTrue(is_loopback("localhost:8740"))
+        self.assertTrue(is_loopback("/run/coordinator.sock"))
+        self.assertFalse(is_loopback("0.0.0.0:8740"))
+        self.assertFalse(is_loopback("build-1:8740"))
+
+    def test_job_resources(self):
+        self.assertEqual(job_resources({}), {"num_vcpus": 4, "memory_bytes": 4 * GiB})
+        self.assertEqual(
+            job_resources(
+                {"configure_vm_template_values": "num_vcpus=2,memory_size=1GiB"}
+            ),
+            {"num_vcpus": 2, "memory_bytes": GiB},
+        )
+        self.assertEqual(
+            job_resources({"plan": True}), {"num_vcpus": 0, "memory_bytes": 0}
+        )
+
+    def test_load_jobs(self):
+        jobs_path = join(self.tmp_dir, "jobs.jsonl")
+        with open(jobs_path, "w") as fh:
+            fh.write(json.dumps({"image_path": "/a.qcow2", "timeout": 60}) + "\n\n")
+            fh.write(json.dumps({"image_path": "/b.qcow2"}) + "\n")
+        self.assertEqual(
+            load_jobs(jobs_path),
+            (
+                SUCCESS,
+                [{"image_path": "/a.qcow2", "timeout": 60}, {"image_path": "/b.qcow2"}],
+            ),
+        )
+
+        with open(jobs_path, "w") as fh:
+            json.dump([{"timeout": 60}], fh)
+        self.assertEqual(load_jobs(jobs_path)[0], MISSING_ATTRIBUTE_ERROR)
+
+        with open(jobs_path, "w") as fh:
+            json.dump([{"image_path": "/a.qcow2", "unknown": 1}], fh)
+        self.assertEqual(load_jobs(jobs_path)[0], INVALID_ATTRIBUTE_TYPE_ERROR)
+
+        # The orchestrator is set by each worker instead
+        with open(jobs_path, "w") as fh:
+            json.dump(
+                [{"image_path": "/a.qcow2", "configure_vm_orchestrator": "qemu"}], fh
+            )
+        self.assertEqual(load_jobs(jobs_path)[0], INVALID_ATTRIBUTE_TYPE_ERROR)
+
+    def test_check_job_arguments(self):
+        self.assertEqual(
+            check_job_arguments(
+                {
+                    "user_data_path": "/seed/user-data",
+                    "configure_vm_template_values": {"num_vcpus": 2},
+                }
+            ),
+            (SUCCESS, None),
+        )
+        self.assertEqual(
+            check_job_arguments(
+                {"configure_vm_template_values": "num_vcpus=2,memory_size=1GiB"}
+            ),
+            (SUCCESS, None),
+        )
+        for kwargs in (
+            {"configure_vm_orchestrator": "/bin/sh"},
+            {"configure_vm_template_path": "/tmp/template.xml.j2"},
+            {"scratch_dir": "/etc"},
+            {"configure_vm_template_values": {"kernel_path": "/boot/vmlinuz"}},
+            {"configure_vm_template_values": {"cpu_model": "max</model>"}},
+            {"configure_vm_template_values": ["num_vcpus"]},
+        ):
+            return_code, msg = check_job_arguments(kwargs)
+            self.assertEqual(return_code, INVALID_ATTRIBUTE_TYPE_ERROR, kwargs)
+
+    def test_jobs_are_distributed_by_capacity(self):
+        events = []
+
+        async def run():
+            coordinator = Coordinator(
+                address=self.address,
+                heartbeat_interval=0.1,
+                event_handler=events.append,
+            )
+            await coordinator.start()
+            workers = [
+                asyncio.ensure_future(self.worker(name).run())
+                for name in ("worker-1", "worker-2")
+            ]
+            try:
+                results = await asyncio.wait_for(
+                    coordinator.run(
+                        [{"image_path": "image-{}.qcow2".format(i)} for i in range(6)]
+                    ),
+                    10,
+                )
+            finally:
+                await coordinator.close()
+            worker_results = await asyncio.wait_for(asyncio.gather(*workers), 5)
+            return results, worker_results
+
+        results, worker_results = asyncio.run(run())
+        self.assertEqual(
+            [return_code for return_code, _ in results], [SUCCESS] * len(results)
+        )
+        self.assertEqual(results[2][1]["image_path"], "image-2.qcow2")
+        self.assertEqual(
+            {result["worker"] for _, result in results}, {"worker-1", "worker-2"}
+        )
+        # Each worker only has the capacity for a single VM with the default vCPUs
+        self.assertEqual(self.max_running, {"worker-1": 1, "worker-2": 1})
+        self.assertEqual([return_code for return_code, _ in worker_results], [0, 0])
+
+        phase_events = [event for event in events if event.kind == EVENT_PHASE]
+        self.assertEqual(len(phase_events), 6)
+        self.assertIn(phase_events[0].data["worker"], ("worker-1", "worker-2"))
+        self.assertIn("job_id", phase_events[0].data)
+
+    def test_jobs_of_failed_worker_are_reassigned(self):
+        async def run(max_attempts):
+            coordinator = Coordinator(
+                address=self.address, max_attempts=max_attempts, heartbeat_interval=0.1
+            )
+            await coordinator.start()
+            failing = asyncio.ensure_future(self.worker("failing", block=True).run())
+            try:
+                future = coordinator.submit("image.qcow2")
+                while "image.qcow2" not in self.running.get("failing", ()):
+                    await asyncio.sleep(0.01)
+                # The worker fails while it configures the image,
+                # which cancels the configuration on it
+                failing.cancel()
+                await asyncio.gather(failing, return_exceptions=True)
+                self.assertFalse(self.running["failing"])
+
+                healthy = asyncio.ensure_future(self.worker("healthy").run())
+                result = await asyncio.wait_for(future, 10)
+            finally:
+                await coordinator.close()
+            await asyncio.wait_for(healthy, 5)
+            return result
+
+        return_code, result = asyncio.run(run(max_attempts=2))
+        self.assertEqual(return_code, SUCCESS)
+        self.assertEqual(result["worker"], "healthy")
+        self.assertEqual(result["attempts"], 2)
+
+        self.running.clear()
+        return_code, result = asyncio.run(run(max_attempts=1))
+        self.assertEqual(return_code, WORKER_ERROR)
+        self.assertIn("image.qcow2", result["msg"])
+
+    def test_worker_rejects_arguments(self):
+        async def run():
+            coordinator = Coordinator(address=self.address, heartbeat_interval=0.1)
+            await coordinator.start()
+            worker = asyncio.ensure_future(self.worker("worker").run())
+            try:
+                result = await asyncio.wait_for(
+                    coordinator.submit(
+                        "image.qcow2", configure_vm_orchestrator="/tmp/orchestrator"
+                    ),
+                    10,
+                )
+            finally:
+                await coordinator.close()
+            await asyncio.wait_for(worker, 5)
+            return result
+
+        return_code, result = asyncio.run(run())
+        self.assertEqual(return_code, INVALID_ATTRIBUTE_TYPE_ERROR)
+        self.assertIn("configure_vm_orchestrator", result["msg"])
+        self.assertNotIn("worker", self.max_running)
+
+    def test_shared_secret(self):
+        async def run(secret):
+            coordinator = Coordinator(
+                address=self.address,
+                heartbeat_interval=0.1,
+                worker_timeout=1,
+                secret=b"secret",
+            )
+            await coordinator.start()
+            worker = asyncio.ensure_future(self.worker("worker", secret=secret).run())
+            try:
+                result = await asyncio.wait_for(
+                    coordinator.run([{"image_path": "image.qcow2"}]), 10
+                )
+            finally:
+                await coordinator.close()
+            worker_result = await asyncio.wait_for(worker, 5)
+            return result[0], worker_result
+
+        (return_code, result), (worker_code, _) = asyncio.run(run(b"secret"))
+        self.assertEqual(return_code, SUCCESS)
+        self.assertEqual(worker_code, SUCCESS)
+
+        self.max_running.clear()
+        (return_code, result), (worker_code, _) = asyncio.run(run(b"wrong"))
+        self.assertEqual(return_code, CLUSTER_ERROR)
+        self.assertEqual(worker_code, CLUSTER_ERROR)
+        self.assertFalse(self.max_running)
+
+    def test_remote_address_requires_allow_remote(self):
+        async def start(allow_remote):
+            coordinator = Coordinator(address="0.0.0.0:0", allow_remote=allow_remote)
+            try:
+                await coordinator.start()
+            finally:
+                await coordinator.close()
+            return coordinator.address
+
+        with self.assertRaises(ValueError):
+            asyncio.run(start(False))
+        self.assertNotEqual(asyncio.run(start(True)), "0.0.0.0:0")
+
+        worker = Worker(address="192.0.2.1:8740", capacity={}, configure=object())
+        return_code, result = asyncio.run(worker.run())
+        self.assertEqual(return_code, CLUSTER_ERROR)
+        self.assertIn("loopback", result.msg)
+
+    def test_jobs_fail_without_workers(self):
+        async def run():
+            coordinator = Coordinator(
+                address=self.address, heartbeat_interval=0.05, worker_timeout=0.2
+            )
+            await coordinator.start()
+            try:
+                return await asyncio.wait_for(
+                    coordinator.run([{"image_path": "image.qcow2"}]), 10
+                )
+            finally:
+                await coordinator.close()
+
+        [(return_code, result)] = asyncio.run(run())
+        self.assertEqual(return_code, CLUSTER_ERROR)
+        self.assertIn("no worker", result["msg"])
+
+    def test_worker_without_coordinator(self):
+        return_code, result = asyncio.run(self.worker("lonely").run())
+        self.assertNotEqual(return_code, SUCCESS)
+        self.assertIn("failed to connect", result.msg)
+        self.assertFalse(os.path.exists(self.address))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,234 @@
+import asyncio
+import email
+import os
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.common.codes import SUCCESS
+from configure_vm_image.common.defaults import (
+    COMPLETION_MODE_CONSOLE,
+    COMPLETION_MODE_POWEROFF,
+)
+from configure_vm_image.completion import (
+    GROWPART_CONFIG,
+    STATUS_CONSOLE_MARKER,
+    StatusListener,
+    add_poweroff,
+    add_status_reporting,
+    parse_console_status,
+    poweroff_config,
+    status_script,
+    status_succeeded,
+)
+from configure_vm_image.configure import (
+    ConfigureSession,
+    last_console_status,
+    wait_for_status,
+)
+from configure_vm_image.console import ConsoleCapture
+from configure_vm_image.result import Result
+from configure_vm_image.seed import SEED_VENDOR_DATA
+
+
+class TestStatusReporting(unittest.TestCase):
+
+    def test_add_status_reporting(self):
+        vendor_data = b"#cloud-config\npackages:\n  - git\n"
+        content = add_status_reporting(vendor_data, channel_name="test.0")
+        message = email.message_from_bytes(content)
+        self.assertTrue(message.is_multipart())
+
+        parts = message.get_payload()
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[0].get_payload(decode=True), vendor_data)
+        self.assertEqual(parts[1].get_content_type(), "text/x-shellscript")
+        self.assertEqual(
+            parts[1].get_payload(decode=True).decode("utf-8"),
+            status_script(channel_name="test.0"),
+        )
+        self.assertIn("/dev/virtio-ports/test.0", status_script("test.0"))
+
+        # The same vendor-data must result in the same content to be cacheable
+        self.assertEqual(
+            content, add_status_reporting(vendor_data, channel_name="test.0")
+        )
+
+    def test_add_status_reporting_to_multipart(self):
+        content = add_status_reporting(add_status_reporting(b"#cloud-config\n"))
+        message = email.message_from_bytes(content)
+        self.assertEqual(len(message.get_payload()), 3)
+
+    def test_add_status_reporting_without_vendor_data(self):
+        message = email.message_from_bytes(add_status_reporting())
+        self.assertEqual(len(message.get_payload()), 1)
+
+    def test_add_poweroff(self):
+        vendor_data = b"#cloud-config\npower_state:\n  mode: reboot\n"
+        message = email.message_from_bytes(add_poweroff(vendor_data, timeout=60))
+        parts = message.get_payload()
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[0].get_payload(decode=True), vendor_data)
+        # The power off is the last part, such that it overrides the vendor-data
+        self.assertEqual(parts[1].get_content_type(), "text/cloud-config")
+        config = parts[1].get_payload(decode=True).decode("utf-8")
+        self.assertEqual(config, poweroff_config(timeout=60))
+        self.assertIn("mode: poweroff", config)
+        self.assertIn("timeout: 60", config)
+        # The status is reported to the console before the guest is powered off
+        self.assertIn(STATUS_CONSOLE_MARKER, config)
+        self.assertNotIn("condition: true", config)
+
+    def test_render_seed_with_poweroff(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        user_data_path = os.path.join(directory, "user-data")
+        with open(user_data_path, "w") as fh:
+            fh.write("#cloud-config\n")
+
+        session = ConfigureSession(completion_mode=COMPLETION_MODE_POWEROFF)
+        result = Result()
+        completion_mode = session._completion_mode(result, has_seed=True)
+        self.assertEqual(completion_mode, COMPLETION_MODE_POWEROFF)
+        rendered, seed = session._render_seed(
+            "image.qcow2", {"user_data_path": user_data_path}, None, completion_mode
+        )
+        self.assertEqual(rendered, SUCCESS)
+        parts = email.message_from_bytes(seed[SEED_VENDOR_DATA]).get_payload()
+        self.assertEqual(
+            parts[-1].get_payload(decode=True).decode("utf-8"), poweroff_config()
+        )
+
+        # Without a seed, cloud-init can not power off the guest
+        self.assertEqual(
+            session._completion_mode(result, has_seed=False), COMPLETION_MODE_CONSOLE
+        )
+
+    def test_render_seed_with_growpart(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        user_data_path = os.path.join(directory, "user-data")
+        with open(user_data_path, "w") as fh:
+            fh.write("#cloud-config\n")
+
+        # A resized image gets its partition and filesystem grown by cloud-init
+        session = ConfigureSession(resize="+10G")
+        rendered, seed = session._render_seed(
+            "image.qcow2",
+            {"user_data_path": user_data_path},
+            None,
+            COMPLETION_MODE_CONSOLE,
+        )
+        self.assertEqual(rendered, SUCCESS)
+        parts = email.message_from_bytes(seed[SEED_VENDOR_DATA]).get_payload()
+        self.assertEqual(
+            parts[-1].get_payload(decode=True).decode("utf-8"), GROWPART_CONFIG
+        )
+
+        rendered, seed = ConfigureSession()._render_seed(
+            "image.qcow2",
+            {"user_data_path": user_data_path},
+            None,
+            COMPLETION_MODE_CONSOLE,
+        )
+        self.assertIsNone(seed)
+
+    def test_status_succeeded(self):
+        self.assertTrue(status_succeeded({"status": "done", "returncode": 0}))
+        self.assertTrue(status_succeeded({"status": "degraded done", "returncode": 2}))
+        self.assertFalse(status_succeeded({"status": "error", "returncode": 1}))
+        self.assertFalse(status_succeeded({}))
+        # cloud-init is still running when the power off timed out
+        self.assertFalse(status_succeeded({"status": "running", "returncode": 0}))
+
+
+class TestStatusListener(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, "status.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_wait_for_status(self):
+        async def report_and_wait():
+            listener = StatusListener(self.socket_path)
+            await listener.start()
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_path)
+                # Partial lines that are not a status are discarded
+                writer.write(b'garbage\n{"status": "done", "returncode": 0}\n')
+                await writer.drain()
+                status = await asyncio.wait_for(listener.wait(), 5)
+                writer.close()
+                return status
+            finally:
+                await listener.close()
+
+        status = asyncio.run(report_and_wait())
+        self.assertEqual(status, {"status": "done", "returncode": 0})
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_wait_for_status_over_console(self):
+        log_path = os.path.join(self.directory, "console.log")
+        with open(log_path, "w") as fh:
+            fh.write("[  OK  ] Started cloud-final.service\n")
+
+        async def report_and_wait():
+            listener = StatusListener(self.socket_path)
+            await listener.start()
+            try:
+                waiting = asyncio.ensure_future(
+                    wait_for_status(listener, log_path, poll_interval=0.05)
+                )
+                await asyncio.sleep(0.1)
+                # The guest has no port for the status channel
+                with open(log_path, "a") as fh:
+                    fh.write(
+                        '{}{{"status": "error", "returncode": 1}}\n'.format(
+                            STATUS_CONSOLE_MARKER
+                        )
+                    )
+                return await asyncio.wait_for(waiting, 5)
+            finally:
+                await listener.close()
+
+        status, over_console = asyncio.run(report_and_wait())
+        self.assertEqual(status, {"status": "error", "returncode": 1})
+        self.assertTrue(over_console)
+
+    def test_last_console_status(self):
+        log_path = os.path.join(self.directory, "console.log")
+        with open(log_path, "w") as fh:
+            fh.write("Cloud-init v. 23.1 finished at\n")
+        capture = ConsoleCapture(log_path)
+        self.assertIsNone(last_console_status(capture))
+
+        # The status of the power off follows the one of the status script
+        with open(log_path, "a") as fh:
+            for status in ("running", "error"):
+                fh.write(
+                    '{}{{"status": "{}", "returncode": 0}}\n'.format(
+                        STATUS_CONSOLE_MARKER, status
+                    )
+                )
+            fh.write("reboot: Power down\n")
+        self.assertEqual(
+            last_console_status(capture), {"status": "error", "returncode": 0}
+        )
+
+    def test_parse_console_status(self):
+        line = '[   42.1] {}{{"status": "done", "returncode": 0}}\r\n'.format(
+            STATUS_CONSOLE_MARKER
+        )
+        self.assertEqual(
+            parse_console_status(line), {"status": "done", "returncode": 0}
+        )
+        self.assertIsNone(parse_console_status("Cloud-init v. 23.1 finished at"))
+        self.assertIsNone(parse_console_status(STATUS_CONSOLE_MARKER + "{partial"))
+        self.assertIn(STATUS_CONSOLE_MARKER, status_script())
+
+
+if __name__ == "__main__":
+    unittest.main()
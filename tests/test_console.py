@@ -0,0 +1,94 @@
+import asyncio
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.configure import finished_configure
+from configure_vm_image.console import ConsoleCapture, rotate_log
+from configure_vm_image.utils.io import join
+
+
+class TestConsole(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_path = join(self.log_dir, "configure-vm.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def append(self, content):
+        with open(self.log_path, "a") as fh:
+            fh.write(content)
+
+    def test_read_follows_the_log(self):
+        capture = ConsoleCapture(self.log_path)
+        self.assertEqual(list(capture.read()), [])
+        self.append("first\nsec")
+        self.assertEqual(list(capture.read()), ["first"])
+        self.append("ond\nthird\n")
+        self.assertEqual(list(capture.read()), ["second", "third"])
+        self.assertEqual(list(capture.read()), [])
+
+    def test_tail_is_bounded(self):
+        capture = ConsoleCapture(self.log_path, tail_size=64, chunk_size=16)
+        self.append("".join("line {}\n".format(i) for i in range(1000)))
+        self.assertEqual(len(list(capture.read())), 1000)
+        self.assertLessEqual(len(capture.tail), 64)
+        self.assertTrue(capture.tail.endswith("line 999\n"))
+
+    def test_long_line_is_split(self):
+        capture = ConsoleCapture(self.log_path, tail_size=64, chunk_size=16)
+        self.append("x" * 1000)
+        lines = list(capture.read())
+        # The line is returned in parts that are bounded by the tail size
+        self.assertGreater(len(lines), 1)
+        self.assertTrue(all(len(line) <= 64 + 16 for line in lines))
+
+    def test_truncated_log_is_reread(self):
+        capture = ConsoleCapture(self.log_path)
+        self.append("a much longer first line\n")
+        list(capture.read())
+        os.truncate(self.log_path, 0)
+        self.append("new\n")
+        self.assertEqual(list(capture.read()), ["new"])
+
+    def test_skip_to_tail(self):
+        capture = ConsoleCapture(self.log_path, tail_size=16)
+        self.append("skipped\n" * 100 + "end\n")
+        capture.skip_to_tail()
+        list(capture.read())
+        self.assertTrue(capture.tail.endswith("end\n"))
+        self.assertLessEqual(len(capture.tail), 16)
+
+    def test_finished_configure(self):
+        self.append("booting\nCloud-init v. 24.1 finished at Thu\n")
+        markers = []
+        finished = asyncio.run(
+            finished_configure(
+                self.log_path,
+                line_finished_markers=["Cloud-init v", "finished at"],
+                on_marker=markers.append,
+            )
+        )
+        self.assertTrue(finished)
+        self.assertEqual(markers, ["Cloud-init v. 24.1 finished at Thu"])
+
+    def test_rotate_log(self):
+        for index in range(4):
+            self.append("run {}\n".format(index))
+            rotated = rotate_log(self.log_path, rotations=3)
+            self.assertEqual(rotated, "{}.1.gz".format(self.log_path))
+            self.assertFalse(os.path.exists(self.log_path))
+
+        self.assertEqual(
+            sorted(os.listdir(self.log_dir)),
+            ["configure-vm.log.{}.gz".format(index) for index in (1, 2, 3)],
+        )
+        with gzip.open("{}.1.gz".format(self.log_path), "rt") as fh:
+            self.assertEqual(fh.read(), "run 3\n")
+        with gzip.open("{}.3.gz".format(self.log_path), "rt") as fh:
+            self.assertEqual(fh.read(), "run 1\n")
+        self.assertIsNone(rotate_log(self.log_path))
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.common.codes import EXPORT_ERROR, SUCCESS
+from configure_vm_image.export import convert_command, export_image, export_path
+from configure_vm_image.utils.io import join, which
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.image_path = join(self.tmp_dir, "image.raw")
+        self.content = os.urandom(1024 * 1024)
+        with open(self.image_path, "wb") as fh:
+            fh.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_export_path(self):
+        self.assertEqual(export_path("/images/a.qcow2", "raw"), "/images/a.raw")
+        self.assertEqual(
+            export_path("/images/a.qcow2", "vmdk", export_dir="/exports"),
+            "/exports/a.vmdk",
+        )
+
+    def test_convert_command(self):
+        self.assertEqual(
+            convert_command("/a.qcow2", "qcow2", "/a.raw", "raw", coroutines=4),
+            [
+                "qemu-img",
+                "convert",
+                "-f",
+                "qcow2",
+                "-O",
+                "raw",
+                "-T",
+                "writeback",
+                "-m",
+                "4",
+                "/a.qcow2",
+                "/a.raw",
+            ],
+        )
+
+    def test_export_to_itself(self):
+        return_code, result = asyncio.run(export_image(self.image_path, ["raw"]))
+        self.assertEqual(return_code, EXPORT_ERROR)
+        self.assertIn("itself", result.msg)
+
+    @unittest.skipUnless(which("qemu-img"), "requires qemu-img")
+    def test_export_formats(self):
+        export_dir = join(self.tmp_dir, "exports")
+        return_code, result = asyncio.run(
+            export_image(
+                self.image_path,
+                ["qcow2", "vmdk", "raw"],
+                export_dir=export_dir,
+                max_parallel=2,
+            )
+        )
+        self.assertEqual(return_code, SUCCESS, result.msg)
+        self.assertEqual(
+            [export["format"] for export in result["exports"]], ["qcow2", "vmdk", "raw"]
+        )
+        for export in result["exports"]:
+            self.assertEqual(os.path.getsize(export["path"]), export["size"])
+        raw_export = result["exports"][2]
+        self.assertEqual(raw_export["digest"], hashlib.sha256(self.content).hexdigest())
+        # No temporary files are left behind
+        self.assertEqual(
+            sorted(os.listdir(export_dir)), ["image.qcow2", "image.raw", "image.vmdk"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
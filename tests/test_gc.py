@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.common.defaults import (
+    CONFIGURE_JOB_STATUS_FAILED,
+    CONFIGURE_JOB_STATUS_RUNNING,
+)
+from configure_vm_image.gc import (
+    job_active,
+    orphaned_vms,
+    scratch_entries,
+    select_purgeable,
+)
+from configure_vm_image.scratch import write_journal
+from configure_vm_image.utils.io import join
+
+
+def entry(path, mtime, size, journal=None):
+    return {"path": path, "journal": journal, "mtime": mtime, "size": size}
+
+
+class TestGC(unittest.TestCase):
+
+    def setUp(self):
+        self.live = {
+            "status": CONFIGURE_JOB_STATUS_RUNNING,
+            "pid": os.getpid(),
+            "configure_vm_name": "live-vm",
+        }
+        # A job that was running when its process crashed
+        self.crashed = {
+            "status": CONFIGURE_JOB_STATUS_RUNNING,
+            "pid": 0,
+            "configure_vm_name": "custom-vm",
+            "instance_id": "custom-id",
+        }
+
+    def test_job_active(self):
+        self.assertTrue(job_active(self.live))
+        self.assertFalse(job_active(self.crashed))
+        self.assertFalse(
+            job_active({"status": CONFIGURE_JOB_STATUS_FAILED, "pid": os.getpid()})
+        )
+
+    def test_orphaned_vms(self):
+        instances = [
+            {"id": "1", "name": "configure-vm-image-aaaa1111"},
+            {"id": "2", "name": "configure-vm-image"},
+            {"id": "3", "name": "live-vm"},
+            {"id": "custom-id", "name": "renamed-vm"},
+            {"id": "5", "name": "unrelated-vm"},
+            {"id": "6", "name": "configure-vm-imaged"},
+        ]
+        entries = [
+            entry("live", 0, 0, journal=self.live),
+            entry("crashed", 0, 0, journal=self.crashed),
+        ]
+        orphans = orphaned_vms(instances, entries)
+        self.assertEqual([orphan["id"] for orphan in orphans], ["custom-id"])
+
+    def test_orphaned_vms_requires_journal(self):
+        # A VM that matches the naming scheme, but is not recorded in a journal,
+        # might belong to a job that runs with another scratch directory
+        instances = [{"id": "1", "name": "configure-vm-image-aaaa1111"}]
+        self.assertEqual(orphaned_vms(instances, []), [])
+        crashed = dict(self.crashed, configure_vm_name="configure-vm-image-aaaa1111")
+        self.assertEqual(
+            orphaned_vms(instances, [entry("crashed", 0, 0, crashed)]), instances
+        )
+
+    def test_orphaned_vms_skips_active_jobs(self):
+        instances = [{"id": "1", "name": "configure-vm-image-aaaa1111"}]
+        live = dict(self.live, configure_vm_name="configure-vm-image-aaaa1111")
+        self.assertEqual(orphaned_vms(instances, [entry("live", 0, 0, live)]), [])
+
+    def test_select_purgeable_by_age(self):
+        entries = [
+            entry("old", 0, 10),
+            entry("new", 95, 10),
+            entry("live", 0, 10, journal=self.live),
+        ]
+        purge = select_purgeable(entries, max_age=50, now=100)
+        self.assertEqual([e["path"] for e in purge], ["old"])
+
+    def test_select_purgeable_by_size(self):
+        entries = [
+            entry("newest", 90, 10),
+            entry("oldest", 10, 10),
+            entry("middle", 50, 10),
+            entry("live", 0, 10, journal=self.live),
+        ]
+        # The active job counts towards the budget, but is never purged
+        purge = select_purgeable(entries, max_size=20, now=100)
+        self.assertEqual([e["path"] for e in purge], ["oldest", "middle"])
+        self.assertEqual(select_purgeable(entries, now=100), [])
+
+    def test_scratch_entries(self):
+        scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch_dir)
+        job_dir = join(scratch_dir, "job")
+        os.mkdir(job_dir)
+        write_journal(job_dir, self.crashed)
+        with open(join(scratch_dir, "configure-vm.log"), "w") as fh:
+            fh.write("log")
+
+        entries = {e["path"]: e for e in scratch_entries(scratch_dir)}
+        self.assertEqual(entries[job_dir]["journal"], self.crashed)
+        self.assertGreater(entries[job_dir]["size"], 0)
+        log_path = join(scratch_dir, "configure-vm.log")
+        self.assertIsNone(entries[log_path]["journal"])
+        self.assertEqual(entries[log_path]["size"], 3)
+        self.assertEqual(scratch_entries(join(scratch_dir, "missing")), [])
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from configure_vm_image.common.defaults import (
+    CPU_ARCHITECTURE,
+    TEMPLATE_PROFILE_AUTO,
+    TEMPLATE_PROFILE_DEFAULT,
+    TEMPLATE_PROFILE_PERFORMANCE,
+)
+from configure_vm_image.host import (
+    architecture_from_name,
+    disk_io_mode,
+    domain_type,
+    kernel_version,
+    kvm_available,
+    load_probe_cache,
+    parse_machine_types,
+    probe_image_architecture,
+    select_machine_type,
+    select_template_profile,
+)
+
+
+class TestHostProbing(unittest.TestCase):
+
+    def test_kernel_version(self):
+        self.assertEqual(kernel_version("6.8.0-45-generic"), (6, 8))
+        self.assertEqual(kernel_version("5.14.0-427.el9.x86_64"), (5, 14))
+        self.assertEqual(kernel_version("unknown"), (0, 0))
+
+    def test_foreign_architecture(self):
+        foreign_architecture = "s390x" if CPU_ARCHITECTURE != "s390x" else "x86_64"
+        self.assertFalse(kvm_available(foreign_architecture))
+        self.assertEqual(domain_type(foreign_architecture), "qemu")
+
+    def test_auto_template_profile(self):
+        # Only x86 machine types provide the IDE devices of the default profile
+        for cpu_architecture in ["aarch64", "s390x"]:
+            if cpu_architecture == CPU_ARCHITECTURE:
+                continue
+            self.assertEqual(
+                select_template_profile(
+                    TEMPLATE_PROFILE_AUTO, cpu_architecture=cpu_architecture
+                ),
+                TEMPLATE_PROFILE_PERFORMANCE,
+            )
+
+    def test_probe_image_architecture(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache_path = os.path.join(directory, "host-probes.json")
+        image_path = os.path.join(directory, "debian-12-genericcloud-amd64.qcow2")
+        with open(image_path, "wb") as fh:
+            fh.write(b"image")
+        inspections = []
+
+        async def inspect(path):
+            inspections.append(path)
+            return "aarch64"
+
+        def probe():
+            return asyncio.run(probe_image_architecture(image_path, cache_path))
+
+        with mock.patch(
+            "configure_vm_image.host.architecture_from_inspection", inspect
+        ):
+            # The contents of the image take precedence over its name
+            self.assertEqual(probe(), "aarch64")
+            # The inspection is cached across processes in the probe cache
+            self.assertEqual(probe(), "aarch64")
+            self.assertEqual(len(inspections), 1)
+            self.assertEqual(len(load_probe_cache(cache_path)), 1)
+
+            # A modified image is inspected again
+            with open(image_path, "ab") as fh:
+                fh.write(b"configured")
+            self.assertEqual(probe(), "aarch64")
+            self.assertEqual(len(inspections), 2)
+
+        async def unavailable(path):
+            return None
+
+        # The name is only used when the image can not be inspected
+        with open(image_path, "ab") as fh:
+            fh.write(b"again")
+        with mock.patch(
+            "configure_vm_image.host.architecture_from_inspection", unavailable
+        ):
+            self.assertEqual(probe(), "x86_64")
+
+    def test_architecture_from_name(self):
+        self.assertEqual(
+            architecture_from_name("debian-12-genericcloud-arm64.qcow2"), "aarch64"
+        )
+        self.assertEqual(
+            architecture_from_name("/images/Rocky-9-GenericCloud.x86_64.qcow2"),
+            "x86_64",
+        )
+        self.assertEqual(
+            architecture_from_name("jammy-server-cloudimg-amd64.img"), "x86_64"
+        )
+        self.assertIsNone(architecture_from_name("image.qcow2"))
+
+    def test_select_machine_type(self):
+        output = """Supported machines are:
+pc                   Standard PC (i440FX + PIIX, 1996) (alias of pc-i440fx-8.2)
+pc-i440fx-8.2        Standard PC (i440FX + PIIX, 1996) (default)
+q35                  Standard PC (Q35 + ICH9, 2009) (alias of pc-q35-8.2)
+pc-q35-8.2           Standard PC (Q35 + ICH9, 2009)
+none                 empty machine
+"""
+        machine_types = parse_machine_types(output)
+        self.assertEqual(
+            machine_types, ["pc", "pc-i440fx-8.2", "q35", "pc-q35-8.2", "none"]
+        )
+        self.assertEqual(select_machine_type("x86_64", machine_types), "q35")
+        self.assertEqual(select_machine_type("x86_64", machine_types, ide=True), "pc")
+        self.assertEqual(select_machine_type("x86_64", ["pc"]), "pc")
+        # Without the probed machine types, the preferred machine type is used
+        self.assertEqual(select_machine_type("aarch64"), "virt")
+
+    def test_explicit_template_profile(self):
+        for profile in [TEMPLATE_PROFILE_DEFAULT, TEMPLATE_PROFILE_PERFORMANCE]:
+            self.assertEqual(select_template_profile(profile), profile)
+
+    def test_disk_io_mode(self):
+        self.assertIn(disk_io_mode(), ("io_uring", "threads"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,11 @@
+import asyncio
 import os
 import random
 import unittest
 
 from configure_vm_image.common.codes import SUCCESS
 from configure_vm_image.common.defaults import CONFIGURE_VM_MACHINE, CPU_ARCHITECTURE
-from configure_vm_image.configure import configure_vm_image
+from configure_vm_image.configure import ConfigureSession, configure_vm_image
 from configure_vm_image.utils.io import chown, copy, exists, join, remove
 from tests.context import AsyncConfigureTestContext
 from tests.utils import get_current_user_gid, get_current_user_uid
@@ -111,3 +112,35 @@ class AsyncTestImageConfiguration(unittest.IsolatedAsyncioTestCase):
         )
         self.assertEqual(return_code, SUCCESS)
         self.assertIsNotNone(msg)
+
+    async def test_session_configure_concurrently(self):
+        session = ConfigureSession(
+            configure_vm_template_path=self.context.image_template_config,
+            cloud_init_iso_cache_dir=self.cloud_init_output_directory,
+            verbose=True,
+        )
+        resolved, msg = session.resolve()
+        self.assertEqual(resolved, SUCCESS)
+
+        second_image_to_configure = self.image_to_configure.replace(
+            self.seed, f"{self.seed}-2"
+        )
+        self.assertTrue(copy(self.context.image, second_image_to_configure))
+
+        results = await asyncio.gather(
+            *[
+                session.configure(
+                    image,
+                    seed_dir=self.cloud_init_directory,
+                    configure_vm_log_path=join(
+                        self.context.test_tmp_directory,
+                        f"{os.path.basename(image)}.log",
+                    ),
+                )
+                for image in [self.image_to_configure, second_image_to_configure]
+            ]
+        )
+        self.assertTrue(remove(second_image_to_configure))
+        for return_code, msg in results:
+            self.assertEqual(return_code, SUCCESS)
+            self.assertIsNotNone(msg)
@@ -0,0 +1,106 @@
+import asyncio
+import gc
+import sys
+import time
+import unittest
+
+from configure_vm_image.common.codes import PATH_NOT_FOUND_ERROR, SUCCESS
+from configure_vm_image.utils.job import run_async, run_stages
+
+
+class TestJob(unittest.TestCase):
+
+    def test_run_stages(self):
+        started = {}
+
+        def stage(name, value, delay=0):
+            async def run():
+                started[name] = time.monotonic()
+                await asyncio.sleep(delay)
+                return SUCCESS, value
+
+            return run
+
+        stages = {
+            "image": (stage("image", "qcow2", delay=0.1), ()),
+            "template": (stage("template", "template.xml.j2"), ("image",)),
+            "seed": (stage("seed", "cidata.iso", delay=0.1), ()),
+        }
+        return_code, values = asyncio.run(run_stages(stages))
+        self.assertEqual(return_code, SUCCESS)
+        self.assertEqual(
+            values,
+            {"image": "qcow2", "template": "template.xml.j2", "seed": "cidata.iso"},
+        )
+        # The independent stages run concurrently,
+        # whereas a dependent stage waits for its dependencies
+        self.assertLess(abs(started["image"] - started["seed"]), 0.05)
+        self.assertGreaterEqual(started["template"] - started["image"], 0.1)
+
+    def test_run_stages_failure_cancels(self):
+        cancelled = []
+
+        async def fail():
+            return PATH_NOT_FOUND_ERROR, "missing"
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append("slow")
+                raise
+            return SUCCESS, None
+
+        async def dependent():
+            return SUCCESS, None
+
+        stages = {
+            "fail": (fail, ()),
+            "slow": (slow, ()),
+            "dependent": (dependent, ("fail",)),
+        }
+        self.assertEqual(
+            asyncio.run(run_stages(stages)), (PATH_NOT_FOUND_ERROR, "missing")
+        )
+        self.assertEqual(cancelled, ["slow"])
+
+    def test_run_stages_raises(self):
+        errors = []
+
+        async def timeout():
+            raise asyncio.TimeoutError()
+
+        async def dependent():
+            return SUCCESS, None
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            loop.set_exception_handler(lambda _, context: errors.append(context))
+            with self.assertRaises(asyncio.TimeoutError):
+                await run_stages(
+                    {"timeout": (timeout, ()), "dependent": (dependent, ("timeout",))}
+                )
+
+        asyncio.run(run())
+        gc.collect()
+        # The exception is raised once instead of being left in the stages
+        # that depend on the stage that raised it
+        self.assertEqual(errors, [])
+
+    def test_run_stages_cycle(self):
+        async def stage():
+            return SUCCESS, None
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run_stages({"a": (stage, ("b",)), "b": (stage, ("a",))}))
+        with self.assertRaises(ValueError):
+            asyncio.run(run_stages({"a": (stage, ("missing",))}))
+
+    def test_run_async_timeout(self):
+        success, result = asyncio.run(
+            run_async(
+                [sys.executable, "-c", "import time; time.sleep(10)"], timeout=0.5
+            )
+        )
+        self.assertFalse(success)
+        self.assertIn("timed out", result["error"])
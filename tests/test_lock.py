@@ -0,0 +1,96 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from configure_vm_image.lock import ImageLock, lease_expired, load_lease, write_lease
+from configure_vm_image.utils.io import join
+
+
+class TestLock(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.image_path = join(self.tmp_dir, "image.qcow2")
+        with open(self.image_path, "w") as fh:
+            fh.write("image")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def other_lease(self, expires_at, host="other-host"):
+        return {"token": "other", "host": host, "pid": 1, "expires_at": expires_at}
+
+    def test_lock_excludes_other_jobs(self):
+        async def run():
+            first, second = ImageLock(self.image_path), ImageLock(self.image_path)
+            self.assertEqual(await first.acquire(), (True, None))
+            self.assertEqual(load_lease(first.lease_path)["token"], first.token)
+            locked, msg = await second.acquire()
+            self.assertFalse(locked)
+            self.assertIn("locked", msg)
+
+            await first.release()
+            self.assertFalse(os.path.exists(first.lease_path))
+            # The lock file is kept for the next job
+            self.assertTrue(os.path.exists(first.lock_path))
+            self.assertEqual(await second.acquire(), (True, None))
+            await second.release()
+
+        asyncio.run(run())
+
+    def test_acquire_waits_for_release(self):
+        async def run():
+            first = ImageLock(self.image_path)
+            second = ImageLock(self.image_path, poll_interval=0.05)
+            await first.acquire()
+
+            started = time.monotonic()
+            locked, _ = await second.acquire(timeout=0.2)
+            self.assertFalse(locked)
+            self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+            asyncio.get_running_loop().call_later(
+                0.1, lambda: asyncio.ensure_future(first.release())
+            )
+            self.assertEqual(await second.acquire(timeout=5), (True, None))
+            await second.release()
+
+        asyncio.run(run())
+
+    def test_expired_lease_is_taken_over(self):
+        image_lock = ImageLock(self.image_path)
+        write_lease(image_lock.lease_path, self.other_lease(time.time() + 60))
+        locked, msg = image_lock.try_acquire()
+        self.assertFalse(locked)
+        self.assertIn("leased", msg)
+
+        write_lease(image_lock.lease_path, self.other_lease(time.time() - 1))
+        self.assertEqual(image_lock.try_acquire(), (True, None))
+        self.assertEqual(load_lease(image_lock.lease_path)["token"], image_lock.token)
+        asyncio.run(image_lock.release())
+
+    def test_lease_expired(self):
+        now = time.time()
+        lease_path = join(self.tmp_dir, "image.qcow2.lease")
+        self.assertFalse(lease_expired(self.other_lease(now + 10), lease_path, now=now))
+        self.assertTrue(lease_expired(self.other_lease(now - 10), lease_path, now=now))
+        # The lease of a process on this host that has exited expires immediately
+        dead_lease = self.other_lease(now + 10, host=os.uname().nodename)
+        dead_lease["pid"] = 0
+        self.assertTrue(lease_expired(dead_lease, lease_path, now=now))
+
+    def test_lost_lease(self):
+        async def run():
+            image_lock = ImageLock(self.image_path, lease_duration=0.15)
+            await image_lock.acquire()
+            write_lease(image_lock.lease_path, self.other_lease(time.time() + 60))
+            await asyncio.sleep(0.2)
+            self.assertTrue(image_lock.lost)
+            await image_lock.release()
+            # The lease of the other job is left in place
+            self.assertEqual(load_lease(image_lock.lease_path)["token"], "other")
+
+        asyncio.run(run())
@@ -0,0 +1,195 @@
+import unittest
+
+from configure_vm_image.common.codes import INVALID_ATTRIBUTE_TYPE_ERROR, SUCCESS
+from configure_vm_image.common.defaults import (
+    CONFIGURE_PHASE_CHECK,
+    CONFIGURE_PHASE_CLEANUP,
+    CONFIGURE_PHASE_CONFIGURE,
+    CONFIGURE_PHASE_CREATE,
+    CONFIGURE_PHASE_SEED,
+    ISO_BASE_SIZE,
+    ISO_SECTOR_SIZE,
+    VM_ORCHESTRATOR_QEMU,
+)
+from configure_vm_image.common.utils import parse_resize, parse_size
+from configure_vm_image.configure import (
+    ConfigureSession,
+    cloud_init_iso_command,
+    create_vm_command,
+    estimate_iso_size,
+    reset_image_command,
+    resize_image_command,
+    resolve_seed_paths,
+    vm_action_command,
+)
+from configure_vm_image.result import Result
+from configure_vm_image.utils.job import Deadline
+
+
+class TestPlan(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("4096MiB"), 4096 * 1024**2)
+        self.assertEqual(parse_size("2G"), 2 * 1024**3)
+        self.assertEqual(parse_size("2GB"), 2 * 1000**3)
+        self.assertEqual(parse_size(512), 512)
+        self.assertEqual(parse_size("4194304", unit="KiB"), 4 * 1024**3)
+        for size in ("lots", "4.5GiB", "4XB", ""):
+            with self.assertRaises(ValueError):
+                parse_size(size)
+
+    def test_resize_image_command(self):
+        self.assertEqual(parse_resize("+10G"), (True, 10 * 1024**3))
+        self.assertEqual(parse_resize("20GiB"), (False, 20 * 1024**3))
+        for size in ("-10G", "+0", "large"):
+            with self.assertRaises(ValueError):
+                parse_resize(size)
+        self.assertEqual(
+            resize_image_command("/image.qcow2", "qcow2", "+1G"),
+            [
+                "qemu-img",
+                "resize",
+                "-f",
+                "qcow2",
+                "--preallocation=off",
+                "/image.qcow2",
+                "+1073741824",
+            ],
+        )
+
+    def test_estimate_iso_size(self):
+        self.assertEqual(estimate_iso_size([]), ISO_BASE_SIZE)
+        self.assertEqual(
+            estimate_iso_size([1, ISO_SECTOR_SIZE, ISO_SECTOR_SIZE + 1]),
+            ISO_BASE_SIZE + 4 * ISO_SECTOR_SIZE,
+        )
+
+    def test_resolve_seed_paths(self):
+        seed_paths = resolve_seed_paths(
+            seed_dir="/seed", meta_data_path="/other/meta-data"
+        )
+        self.assertEqual(seed_paths["user_data_path"], "/seed/user-data")
+        self.assertEqual(seed_paths["meta_data_path"], "/other/meta-data")
+        self.assertEqual(seed_paths["network_config_path"], "/seed/network-config")
+        self.assertEqual(resolve_seed_paths()["user_data_path"], None)
+
+    def test_cloud_init_iso_command(self):
+        self.assertEqual(
+            cloud_init_iso_command("genisoimage", "/out.iso", "/seed/user-data"),
+            [
+                "genisoimage",
+                "-output",
+                "/out.iso",
+                "-V",
+                "cidata",
+                "--joliet",
+                "--rock",
+                "/seed/user-data",
+            ],
+        )
+        command = cloud_init_iso_command(
+            "genisoimage", "/out.iso", "user-data=/dev/fd/3", graft_points=True
+        )
+        self.assertEqual(
+            command[-3:], ["-follow-links", "-graft-points", "user-data=/dev/fd/3"]
+        )
+
+    def test_vm_commands(self):
+        self.assertEqual(
+            create_vm_command(
+                "libvirt-provider",
+                vm_orchestrator_args=["instance", "create", "vm", "image.qcow2"],
+                template_path="/template.xml.j2",
+                template_kwargs={"num_vcpus": "4", "cd_iso_path": None},
+            ),
+            [
+                "libvirt-provider",
+                "instance",
+                "create",
+                "vm",
+                "image.qcow2",
+                "--template-path",
+                "/template.xml.j2",
+                "--extra-template-path-values",
+                "num_vcpus=4",
+            ],
+        )
+        self.assertEqual(
+            vm_action_command(
+                "remove", "id", "--flags", "1", vm_orchestrator="libvirt-provider"
+            ),
+            ["libvirt-provider", "instance", "remove", "id", "--flags", "1"],
+        )
+        self.assertEqual(
+            reset_image_command("image.qcow2", reset_operations="defaults"),
+            ["virt-sysprep", "-a", "image.qcow2", "--operations", "defaults"],
+        )
+
+    def test_max_duration(self):
+        phases = [CONFIGURE_PHASE_CREATE, CONFIGURE_PHASE_CONFIGURE]
+        session = ConfigureSession(
+            phase_timeouts={
+                CONFIGURE_PHASE_CREATE: 10,
+                CONFIGURE_PHASE_CONFIGURE: 100,
+                CONFIGURE_PHASE_CLEANUP: 5,
+            }
+        )
+        self.assertEqual(session._max_duration(phases), 115)
+        session.timeout = 50
+        self.assertEqual(session._max_duration(phases), 55)
+
+        session = ConfigureSession(phase_timeouts={CONFIGURE_PHASE_CONFIGURE: None})
+        self.assertIsNone(session._max_duration(phases))
+
+    def test_resolve_invalid_timeouts(self):
+        for kwargs in (
+            {"phase_timeouts": {"reset": "abc"}},
+            {"phase_timeouts": {"unknown": 10}},
+            {"timeout": "-1"},
+            {"lock_timeout": "soon"},
+        ):
+            session = ConfigureSession(
+                configure_vm_orchestrator=VM_ORCHESTRATOR_QEMU, **kwargs
+            )
+            return_code, _ = session.resolve()
+            self.assertEqual(return_code, INVALID_ATTRIBUTE_TYPE_ERROR)
+
+        session = ConfigureSession(
+            configure_vm_orchestrator=VM_ORCHESTRATOR_QEMU,
+            phase_timeouts={"reset": "600", CONFIGURE_PHASE_CONFIGURE: None},
+            lock_timeout="0",
+        )
+        self.assertEqual(session.resolve(), (SUCCESS, None))
+        self.assertEqual(session.phase_timeouts["reset"], 600.0)
+        self.assertIsNone(session.phase_timeouts[CONFIGURE_PHASE_CONFIGURE])
+        self.assertEqual(session.lock_timeout, 0.0)
+
+    def test_concurrent_stage_phases(self):
+        session = ConfigureSession(phase_timeouts={CONFIGURE_PHASE_CHECK: 10})
+        result = Result("image.qcow2")
+        job = {
+            "phase": None,
+            "failed_phase": None,
+            "stages": [],
+            "scratch_path": None,
+            "result": result,
+        }
+        deadline = Deadline(None)
+        session._start_stage(job, deadline, CONFIGURE_PHASE_SEED)
+        check_deadline = session._start_stage(job, deadline, CONFIGURE_PHASE_CHECK)
+        self.assertLessEqual(check_deadline.remaining(), 10)
+
+        # The stages neither enter their phases nor overwrite each other's phase
+        self.assertEqual(job["stages"], [CONFIGURE_PHASE_SEED, CONFIGURE_PHASE_CHECK])
+        self.assertIsNone(job["phase"])
+        self.assertIsNone(result.phase)
+        self.assertEqual(
+            [event.phase for event in result.events],
+            [CONFIGURE_PHASE_SEED, CONFIGURE_PHASE_CHECK],
+        )
+
+        # The first stage that fails is the phase that the job failed in
+        session._finish_stage(job, CONFIGURE_PHASE_CHECK, failed=True)
+        session._finish_stage(job, CONFIGURE_PHASE_SEED, failed=True)
+        self.assertEqual(job["stages"], [])
+        self.assertEqual(job["failed_phase"], CONFIGURE_PHASE_CHECK)
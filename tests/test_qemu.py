@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.qemu import QemuOrchestrator, QMPClient, QMPError, qemu_command
+from configure_vm_image.utils.io import join
+
+
+class TestQemu(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orchestrator = QemuOrchestrator(runtime_dir=join(self.tmp_dir, "qemu"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def command(self, **template_values):
+        values = {"cpu_architecture": "x86_64", "memory_size": "2GiB"}
+        values.update(template_values)
+        return qemu_command("vm", "/images/a,b.qcow2", values, "/qmp.sock", "/qemu.pid")
+
+    def option(self, command, name):
+        return [command[i + 1] for i, arg in enumerate(command) if arg == name]
+
+    def test_qemu_command(self):
+        command = self.command(num_vcpus="4")
+        self.assertEqual(self.option(command, "-m"), ["2048M"])
+        self.assertEqual(self.option(command, "-smp"), ["4"])
+        self.assertIn("-S", command)
+        self.assertIn("-daemonize", command)
+        self.assertEqual(self.option(command, "-accel"), ["tcg"])
+        self.assertEqual(self.option(command, "-cpu"), ["max"])
+        # Commas in paths are escaped by doubling them
+        self.assertTrue(
+            self.option(command, "-drive")[0].startswith("file=/images/a,,b.qcow2,")
+        )
+        self.assertEqual(
+            self.option(command, "-qmp"), ["unix:/qmp.sock,server=on,wait=off"]
+        )
+        self.assertIn("-no-shutdown", command)
+        self.assertIn("pvpanic", self.option(command, "-device"))
+
+        command = self.command(domain_type="kvm", cd_iso_path="/seed.iso")
+        self.assertEqual(self.option(command, "-accel"), ["kvm"])
+        self.assertEqual(self.option(command, "-cpu"), ["host"])
+        self.assertEqual(
+            self.option(command, "-drive")[1],
+            "file=/seed.iso,format=raw,if=virtio,readonly=on",
+        )
+
+    def test_qemu_command_status_channel(self):
+        command = self.command(
+            configure_vm_log_path="/console.log",
+            status_socket_path="/status.sock",
+            status_channel_name="org.configure.status",
+        )
+        self.assertEqual(
+            self.option(command, "-chardev"),
+            [
+                "file,id=console,path=/console.log,append=on",
+                "socket,id=status,path=/status.sock,reconnect=1",
+            ],
+        )
+        self.assertIn(
+            "virtserialport,chardev=status,name=org.configure.status",
+            self.option(command, "-device"),
+        )
+
+    def test_qemu_command_panic_device(self):
+        command = self.command(cpu_architecture="aarch64")
+        self.assertIn("pvpanic-pci", self.option(command, "-device"))
+        # The s390x guests report their panics without a device
+        command = self.command(cpu_architecture="s390x")
+        self.assertFalse(
+            [
+                device
+                for device in self.option(command, "-device")
+                if "pvpanic" in device
+            ]
+        )
+
+        command = qemu_command(
+            "vm",
+            "/image.qcow2",
+            {"cpu_architecture": "x86_64"},
+            "/qmp.sock",
+            "/qemu.pid",
+            events_socket_path="/events.sock",
+        )
+        self.assertEqual(
+            self.option(command, "-qmp"),
+            [
+                "unix:/qmp.sock,server=on,wait=off",
+                "unix:/events.sock,server=on,wait=off",
+            ],
+        )
+
+    def test_qemu_command_efi_firmware(self):
+        # No EFI firmware is known for the architecture
+        with self.assertRaises(FileNotFoundError):
+            self.command(cpu_architecture="riscv64", firmware="efi")
+        self.assertNotIn("-bios", self.command(firmware="bios"))
+
+    def test_run(self):
+        async def run():
+            self.assertEqual(
+                await self.orchestrator.run(["instance", "ls"]),
+                (True, {"output": {"instances": []}, "error": ""}),
+            )
+            success, result = await self.orchestrator.run(["instance", "show", "vm"])
+            self.assertFalse(success)
+            self.assertIn("Failed to find the VM", result["error"])
+            success, result = await self.orchestrator.run(["instance", "migrate", "vm"])
+            self.assertFalse(success)
+            self.assertIn("Unknown command", result["error"])
+            success, _ = await self.orchestrator.run(["network", "ls"])
+            self.assertFalse(success)
+
+        asyncio.run(run())
+
+    def test_run_create_template_values(self):
+        created = []
+
+        class Orchestrator(QemuOrchestrator):
+            async def create(self, name, image_path, template_values):
+                created.append(template_values)
+                return True, {"instance": {"id": "id", "name": name}}
+
+        # The template values are passed as they are, since a value
+        # can contain commas, e.g. the console of the kernel command line
+        template_values = {
+            "kernel_path": "/boot/vmlinuz",
+            "kernel_cmdline": "console=ttyS0,115200 quiet",
+        }
+        success, result = asyncio.run(
+            Orchestrator(runtime_dir=self.orchestrator.runtime_dir).run(
+                [
+                    "instance",
+                    "create",
+                    "vm",
+                    "image.qcow2",
+                    "--extra-template-path-values",
+                    "kernel_path=/boot/vmlinuz,"
+                    "kernel_cmdline=console=ttyS0,115200 quiet",
+                ],
+                template_values=template_values,
+            )
+        )
+        self.assertTrue(success)
+        self.assertEqual(created, [template_values])
+        self.assertIn(
+            "console=ttyS0,115200 quiet",
+            self.option(self.command(**template_values), "-append"),
+        )
+
+    def add_instance(self, pid=None):
+        instance_dir = join(self.orchestrator.runtime_dir, "id")
+        os.makedirs(instance_dir)
+        instance = {
+            "id": "id",
+            "name": "vm",
+            "qmp_socket_path": join(instance_dir, "qmp.sock"),
+            "pid_path": join(instance_dir, "qemu.pid"),
+            "events_socket_path": join(instance_dir, "events.sock"),
+            "events_path": join(instance_dir, "events.json"),
+        }
+        with open(join(instance_dir, "instance.json"), "w") as fh:
+            json.dump(instance, fh)
+        if pid is not None:
+            with open(instance["pid_path"], "w") as fh:
+                fh.write(str(pid))
+        return instance
+
+    async def serve_qmp(self, socket_path, status="running", events=()):
+        """Serves the QMP socket of a fake VM that emits the events
+        once the capabilities are negotiated"""
+        commands = []
+
+        async def serve(reader, writer):
+            writer.write(b'{"QMP": {"version": {}, "capabilities": []}}\n')
+            while line := await reader.readline():
+                command = json.loads(line)["execute"]
+                commands.append(command)
+                writer.write(
+                    json.dumps({"return": {"status": status}}).encode() + b"\n"
+                )
+                if command == "qmp_capabilities":
+                    for event in events:
+                        writer.write(json.dumps(event).encode() + b"\n")
+                await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_unix_server(serve, path=socket_path)
+        return server, commands
+
+    def test_shutdown_reason(self):
+        # The VM is kept by the running test process
+        instance = self.add_instance(pid=os.getpid())
+
+        async def state():
+            server, _ = await self.serve_qmp(
+                instance["qmp_socket_path"], status="shutdown"
+            )
+            async with server:
+                _, result = await self.orchestrator.run(["instance", "show", "vm"])
+            instance_state = result["output"]["instance"]
+            return instance_state["state"], instance_state["state_reason"]
+
+        # The reason is unknown without the recorded shutdown event
+        self.assertEqual(asyncio.run(state()), ("shut off", "unknown"))
+        for reason, state_reason in (
+            ("guest-shutdown", "shutdown"),
+            ("host-qmp-system-reset", "destroyed"),
+        ):
+            with open(instance["events_path"], "w") as fh:
+                fh.write(
+                    json.dumps({"event": "SHUTDOWN", "data": {"reason": reason}}) + "\n"
+                )
+            self.assertEqual(asyncio.run(state()), ("shut off", state_reason))
+
+    def test_start_records_events(self):
+        instance = self.add_instance(pid=os.getpid())
+        shutdown = {
+            "event": "SHUTDOWN",
+            "data": {"guest": True, "reason": "guest-shutdown"},
+        }
+
+        async def run():
+            qmp_server, commands = await self.serve_qmp(instance["qmp_socket_path"])
+            events_server, _ = await self.serve_qmp(
+                instance["events_socket_path"],
+                events=[{"event": "RESUME"}, shutdown],
+            )
+            async with qmp_server, events_server:
+                success, _ = await self.orchestrator.run(["instance", "start", "vm"])
+                self.assertTrue(success)
+                for _ in range(50):
+                    if os.path.exists(instance["events_path"]):
+                        break
+                    await asyncio.sleep(0.1)
+            return commands
+
+        self.assertEqual(asyncio.run(run()), ["qmp_capabilities", "cont"])
+        # Only the shutdown and panic events are recorded
+        with open(instance["events_path"], "r") as fh:
+            self.assertEqual([json.loads(line) for line in fh], [shutdown])
+
+    def test_removed_instance_is_shut_off(self):
+        instance_dir = join(self.orchestrator.runtime_dir, "id")
+        os.makedirs(instance_dir)
+        instance = {
+            "id": "id",
+            "name": "vm",
+            "qmp_socket_path": join(instance_dir, "qmp.sock"),
+            "pid_path": join(instance_dir, "qemu.pid"),
+        }
+        with open(join(instance_dir, "instance.json"), "w") as fh:
+            json.dump(instance, fh)
+
+        async def run():
+            success, result = await self.orchestrator.run(["instance", "show", "vm"])
+            self.assertTrue(success)
+            self.assertEqual(result["output"]["instance"]["state"], "shut off")
+            # The QEMU process is kept until the VM is removed,
+            # such that a VM without its process has crashed
+            self.assertEqual(result["output"]["instance"]["state_reason"], "crashed")
+            success, _ = await self.orchestrator.run(["instance", "remove", "id"])
+            self.assertTrue(success)
+            self.assertFalse(os.path.exists(instance_dir))
+
+        asyncio.run(run())
+
+    def test_qmp_client(self):
+        socket_path = join(self.tmp_dir, "qmp.sock")
+        commands = []
+
+        async def serve(reader, writer):
+            writer.write(b'{"QMP": {"version": {}, "capabilities": []}}\n')
+            while line := await reader.readline():
+                command = json.loads(line)["execute"]
+                commands.append(command)
+                if command == "system_powerdown":
+                    writer.write(b'{"event": "POWERDOWN"}\n')
+                if command == "migrate":
+                    writer.write(b'{"error": {"desc": "not supported"}}\n')
+                else:
+                    writer.write(b'{"return": {"status": "running"}}\n')
+                await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_unix_server(serve, path=socket_path)
+            async with server:
+                async with QMPClient(socket_path, timeout=5) as qmp:
+                    status = await qmp.execute("query-status")
+                    self.assertEqual(status, {"status": "running"})
+                    await qmp.execute("system_powerdown")
+                    self.assertEqual(qmp.events, [{"event": "POWERDOWN"}])
+                    with self.assertRaises(QMPError):
+                        await qmp.execute("migrate")
+
+        asyncio.run(run())
+        self.assertEqual(
+            commands,
+            ["qmp_capabilities", "query-status", "system_powerdown", "migrate"],
+        )
@@ -0,0 +1,139 @@
+import unittest
+
+from configure_vm_image.common.codes import (
+    PATH_NOT_FOUND_ERROR,
+    PATH_NOT_FOUND_ERROR_MSG,
+    SUCCESS,
+)
+from configure_vm_image.common.defaults import (
+    EVENT_COMMAND,
+    EVENT_MESSAGE,
+    EVENT_PHASE,
+    EVENT_WARNING,
+)
+from configure_vm_image.result import Event, Result
+
+
+class TestResult(unittest.TestCase):
+
+    def test_event_is_formatted_lazily(self):
+        class Counter:
+            formatted = 0
+
+            def __format__(self, spec):
+                Counter.formatted += 1
+                return "counted"
+
+        event = Event("Value: {}", Counter(), phase="seed")
+        self.assertEqual(Counter.formatted, 0)
+        self.assertEqual(event.msg, "Value: counted")
+        self.assertEqual(Counter.formatted, 1)
+        self.assertEqual(event.phase, "seed")
+
+    def test_event_without_args(self):
+        # A message without args is kept as is, even if it contains braces
+        event = Event("status: {'status': 'done'}")
+        self.assertEqual(str(event), "status: {'status': 'done'}")
+
+    def test_add_event_records_phase(self):
+        result = Result("image.qcow2")
+        result.add_event("first")
+        result.phase = "create"
+        result.add_event("second: {}", 2)
+        self.assertEqual([event.phase for event in result.events], [None, "create"])
+        self.assertEqual(result.verbose_outputs, ["first", "second: 2"])
+
+    def test_start_stage(self):
+        result = Result("image.qcow2", phase="create")
+        result.start_stage("check")
+        result.add_event("checked", phase="check")
+        result.add_event("created")
+        # A concurrent stage leaves the phase of the result as it is
+        self.assertEqual(result.phase, "create")
+        self.assertEqual(
+            [(event.kind, event.phase) for event in result.events],
+            [
+                (EVENT_PHASE, "check"),
+                (EVENT_MESSAGE, "check"),
+                (EVENT_MESSAGE, "create"),
+            ],
+        )
+
+    def test_add_warning(self):
+        result = Result("image.qcow2")
+        result.add_warning("unlocked: {}", "image.qcow2")
+        self.assertEqual(result.events[0].kind, EVENT_WARNING)
+        self.assertEqual(result.verbose_outputs, ["unlocked: image.qcow2"])
+
+    def test_finish(self):
+        result = Result("image.qcow2")
+        self.assertIsNone(result.duration)
+        return_code, finished = result.finish(
+            PATH_NOT_FOUND_ERROR, PATH_NOT_FOUND_ERROR_MSG, "image.qcow2", "missing"
+        )
+        self.assertEqual(return_code, PATH_NOT_FOUND_ERROR)
+        self.assertIs(finished, result)
+        self.assertFalse(result.succeeded)
+        self.assertEqual(
+            result.msg, PATH_NOT_FOUND_ERROR_MSG.format("image.qcow2", "missing")
+        )
+        self.assertGreaterEqual(result.duration, 0)
+
+    def test_response_compatibility(self):
+        result = Result("image.qcow2")
+        result.add_event("event")
+        result.finish(SUCCESS, "Succesfully configured image: {}", "image.qcow2")
+        self.assertTrue(result.succeeded)
+        self.assertEqual(result["msg"], "Succesfully configured image: image.qcow2")
+        self.assertEqual(result.get("verbose_outputs"), ["event"])
+        self.assertIsNone(result.get("unknown"))
+        with self.assertRaises(KeyError):
+            result["unknown"]
+
+    def test_data(self):
+        result = Result("image.qcow2")
+        self.assertIsNone(result.get("plan"))
+        with self.assertRaises(KeyError):
+            result["plan"]
+        result.set("plan", {"commands": []})
+        result.finish(SUCCESS, "planned")
+        self.assertEqual(result["plan"], {"commands": []})
+        self.assertEqual(result.asdict(events=False)["plan"], {"commands": []})
+        # The data can not hide the outcome of the result
+        with self.assertRaises(ValueError):
+            result.set("msg", "hidden")
+        self.assertEqual(result.asdict()["msg"], "planned")
+
+    def test_event_data_reserved_keys(self):
+        event = Event("done", kind=EVENT_COMMAND, data={"command": "qemu-img"})
+        self.assertEqual(event.asdict()["command"], "qemu-img")
+        with self.assertRaises(ValueError):
+            Event("done", kind=EVENT_COMMAND, data={"msg": "hidden"})
+        result = Result("image.qcow2")
+        with self.assertRaises(ValueError):
+            result.record(EVENT_COMMAND, "done", event="hidden")
+
+    def test_asdict(self):
+        result = Result("image.qcow2", phase="reset")
+        result.add_event("event")
+        result.finish(SUCCESS, "done")
+        as_dict = result.asdict()
+        self.assertEqual(as_dict["return_code"], SUCCESS)
+        self.assertEqual(as_dict["phase"], "reset")
+        self.assertEqual(as_dict["msg"], "done")
+        self.assertEqual(as_dict["events"][0]["msg"], "event")
+        self.assertEqual(as_dict["events"][0]["phase"], "reset")
+
+    def test_event_handler(self):
+        events = []
+        result = Result("image.qcow2", event_handler=events.append)
+        result.enter_phase("seed")
+        result.record(EVENT_COMMAND, "The {} command", "genisoimage", succeeded=True)
+        self.assertEqual([event.kind for event in events], [EVENT_PHASE, EVENT_COMMAND])
+        self.assertEqual(result.phase, "seed")
+        # Only the messages are part of the verbose outputs
+        self.assertEqual(result.verbose_outputs, [])
+        as_dict = events[1].asdict()
+        self.assertEqual(as_dict["event"], EVENT_COMMAND)
+        self.assertEqual(as_dict["phase"], "seed")
+        self.assertTrue(as_dict["succeeded"])
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.common.defaults import (
+    RESULT_CACHE_LINK_AUTO,
+    RESULT_CACHE_LINK_COPY,
+    RESULT_CACHE_LINK_HARDLINK,
+    RESULT_CACHE_LINK_REFLINK,
+)
+from configure_vm_image.host import load_probe_cache, save_probe_cache
+from configure_vm_image.result_cache import (
+    ResultCache,
+    image_digest,
+    materialize,
+    result_key,
+    template_digest,
+)
+from configure_vm_image.store import file_checksum
+from configure_vm_image.utils.io import join
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.image_path = join(self.tmp_dir, "image.qcow2")
+        self.write(self.image_path, b"configured")
+        self.cache = ResultCache(join(self.tmp_dir, "results"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, path, content):
+        with open(path, "wb") as fh:
+            fh.write(content)
+
+    def read(self, path):
+        with open(path, "rb") as fh:
+            return fh.read()
+
+    def test_result_key(self):
+        key = result_key("base", "seed", "template", reset_operations="defaults")
+        self.assertEqual(
+            key, result_key("base", "seed", "template", reset_operations="defaults")
+        )
+        for changed in (
+            result_key("other", "seed", "template", reset_operations="defaults"),
+            result_key("base", "other", "template", reset_operations="defaults"),
+            result_key("base", "seed", "other", reset_operations="defaults"),
+            result_key("base", "seed", "template", reset_operations="other"),
+            result_key(
+                "base",
+                "seed",
+                "template",
+                reset_operations="defaults",
+                completion_mode="channel",
+            ),
+            result_key(
+                "base",
+                "seed",
+                "template",
+                reset_operations="defaults",
+                tools={"virt-sysprep": "virt-sysprep 1.52.0"},
+            ),
+        ):
+            self.assertNotEqual(key, changed)
+
+    def test_template_digest(self):
+        template_path = join(self.tmp_dir, "template.xml.j2")
+        self.write(template_path, b"<domain>{{ num_vcpus }}</domain>")
+        digest = template_digest(template_path, {"num_vcpus": "2"})
+        self.assertEqual(digest, template_digest(template_path, {"num_vcpus": "2"}))
+        self.assertNotEqual(digest, template_digest(template_path, {"num_vcpus": "4"}))
+
+    def test_image_digest(self):
+        cache_path = join(self.tmp_dir, "image-digests.json")
+        digest = image_digest(self.image_path, cache_path=cache_path)
+        self.assertEqual(digest, file_checksum(self.image_path))
+
+        # An unchanged image is not hashed again
+        cache = load_probe_cache(cache_path)
+        cache[os.path.realpath(self.image_path)]["digest"] = "cached"
+        save_probe_cache(cache_path, cache)
+        self.assertEqual(image_digest(self.image_path, cache_path=cache_path), "cached")
+
+        # Whereas a modified image is
+        self.write(self.image_path, b"modified")
+        self.assertEqual(
+            image_digest(self.image_path, cache_path=cache_path),
+            file_checksum(self.image_path),
+        )
+
+    def test_materialize(self):
+        target = join(self.tmp_dir, "target.qcow2")
+        self.write(target, b"base")
+        link_mode = materialize(self.image_path, target)
+        self.assertIn(link_mode, (RESULT_CACHE_LINK_REFLINK, RESULT_CACHE_LINK_COPY))
+        self.assertEqual(self.read(target), b"configured")
+        self.assertNotEqual(os.stat(target).st_ino, os.stat(self.image_path).st_ino)
+
+        materialize(self.image_path, target, link_mode=RESULT_CACHE_LINK_HARDLINK)
+        self.assertEqual(os.stat(target).st_ino, os.stat(self.image_path).st_ino)
+        # No temporary files are left behind
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir)), ["image.qcow2", "target.qcow2"]
+        )
+
+    def test_store_and_restore(self):
+        key = result_key("base", "seed", "template")
+        self.assertIsNone(self.cache.lookup(key))
+        self.assertTrue(self.cache.store(key, self.image_path, {"base_digest": "base"}))
+        self.assertFalse(self.cache.store(key, self.image_path, {}))
+        self.assertEqual(self.cache.lookup(key)["base_digest"], "base")
+
+        # The cached image is independent of the image that was configured
+        self.write(self.image_path, b"base")
+        self.assertIn(
+            self.cache.restore(key, self.image_path),
+            (RESULT_CACHE_LINK_REFLINK, RESULT_CACHE_LINK_COPY),
+        )
+        self.assertEqual(self.read(self.image_path), b"configured")
+
+        # A rebuild replaces the cached result
+        self.write(self.image_path, b"rebuilt")
+        self.assertTrue(
+            self.cache.store(key, self.image_path, {"base_digest": "b"}, replace=True)
+        )
+        self.assertEqual(self.cache.lookup(key)["base_digest"], "b")
+        self.assertEqual(os.listdir(self.cache.cache_dir), [key])
+
+    def test_hardlink_restore(self):
+        key = result_key("base", "seed", "template")
+        self.cache.store(key, self.image_path, {})
+        cache = ResultCache(self.cache.cache_dir, link_mode=RESULT_CACHE_LINK_HARDLINK)
+        restored_path = join(self.tmp_dir, "restored.qcow2")
+        self.write(restored_path, b"base")
+        self.assertEqual(cache.restore(key, restored_path), RESULT_CACHE_LINK_HARDLINK)
+        self.assertEqual(self.read(restored_path), b"configured")
+        self.assertEqual(
+            ResultCache(self.cache.cache_dir).link_mode, RESULT_CACHE_LINK_AUTO
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from configure_vm_image.scratch import (
+    create_scratch_dir,
+    load_journal,
+    remove_scratch_dir,
+    reserve_path,
+    write_journal,
+)
+from configure_vm_image.utils.io import exists, join
+
+
+class TestScratch(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch_dir = join(tempfile.mkdtemp(), "scratch")
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.scratch_dir))
+
+    def test_create_scratch_dir(self):
+        first = create_scratch_dir("job", scratch_dir=self.scratch_dir)
+        second = create_scratch_dir("job", scratch_dir=self.scratch_dir)
+        self.assertNotEqual(first, second)
+        self.assertTrue(os.path.basename(first).startswith("job-"))
+        self.assertEqual(stat.S_IMODE(os.stat(first).st_mode), 0o755)
+
+        remove_scratch_dir(first)
+        self.assertFalse(exists(first))
+        self.assertTrue(exists(second))
+
+    def test_reserve_path(self):
+        os.makedirs(self.scratch_dir)
+        log_path = join(self.scratch_dir, "configure-vm.log")
+        self.assertEqual(reserve_path(log_path), log_path)
+        self.assertEqual(reserve_path(log_path), "{}.0".format(log_path))
+        self.assertEqual(reserve_path(log_path), "{}.1".format(log_path))
+
+    def test_journal(self):
+        scratch_path = create_scratch_dir("job", scratch_dir=self.scratch_dir)
+        self.assertIsNone(load_journal(scratch_path))
+
+        journal = {"phase": "create", "instance_id": None}
+        write_journal(scratch_path, journal)
+        self.assertEqual(load_journal(scratch_path), journal)
+        self.assertEqual(os.listdir(scratch_path), ["job.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
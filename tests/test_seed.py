@@ -0,0 +1,125 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.common.codes import SEED_ISO_ERROR
+from configure_vm_image.configure import create_cloud_init_disk_from_seed
+from configure_vm_image.seed import (
+    SEED_META_DATA,
+    SEED_USER_DATA,
+    render_seed,
+    render_seed_template,
+    seed_cache_path,
+    seed_digest,
+)
+from configure_vm_image.utils.io import join, write
+
+
+class TestSeedRendering(unittest.TestCase):
+
+    def setUp(self):
+        self.seed_directory = tempfile.mkdtemp()
+        self.user_data_path = join(self.seed_directory, SEED_USER_DATA)
+        self.meta_data_path = join(self.seed_directory, SEED_META_DATA)
+        self.assertTrue(
+            write(
+                self.user_data_path,
+                "#cloud-config\nhostname: {{ hostname }}\n",
+            )
+        )
+        self.assertTrue(
+            write(
+                self.meta_data_path,
+                "instance-id: {{ instance_id }}\nlocal-hostname: {{ hostname }}\n",
+            )
+        )
+
+    def tearDown(self):
+        for path in [self.user_data_path, self.meta_data_path]:
+            os.remove(path)
+        os.rmdir(self.seed_directory)
+
+    def test_render_seed_template(self):
+        rendered = render_seed_template("hostname: {{ hostname }}\n", {"hostname": "a"})
+        self.assertEqual(rendered, "hostname: a\n")
+
+    def test_render_seed_template_missing_value(self):
+        with self.assertRaises(ValueError):
+            render_seed_template("hostname: {{ hostname }}\n", {})
+
+    def test_render_seed(self):
+        seed = render_seed(
+            user_data_path=self.user_data_path,
+            meta_data_path=self.meta_data_path,
+            template_values={"hostname": "node0", "instance_id": "id0"},
+        )
+        self.assertEqual(seed[SEED_USER_DATA], b"#cloud-config\nhostname: node0\n")
+        self.assertEqual(
+            seed[SEED_META_DATA], b"instance-id: id0\nlocal-hostname: node0\n"
+        )
+
+    def test_render_seed_without_template_values(self):
+        seed = render_seed(user_data_path=self.user_data_path)
+        self.assertEqual(
+            seed[SEED_USER_DATA], b"#cloud-config\nhostname: {{ hostname }}\n"
+        )
+        self.assertNotIn(SEED_META_DATA, seed)
+
+    def test_seed_digest(self):
+        seed_a = render_seed(
+            user_data_path=self.user_data_path,
+            meta_data_path=self.meta_data_path,
+            template_values={"hostname": "node0", "instance_id": "id0"},
+        )
+        seed_b = render_seed(
+            user_data_path=self.user_data_path,
+            meta_data_path=self.meta_data_path,
+            template_values={"hostname": "node1", "instance_id": "id1"},
+        )
+        self.assertEqual(seed_digest(seed_a), seed_digest(dict(seed_a)))
+        self.assertNotEqual(seed_digest(seed_a), seed_digest(seed_b))
+        self.assertEqual(
+            seed_cache_path("cache", seed_a),
+            join("cache", "{}.iso".format(seed_digest(seed_a))),
+        )
+
+    def test_seed_iso_temporary_file_removed(self):
+        iso_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, iso_dir, ignore_errors=True)
+        seed = render_seed(user_data_path=self.user_data_path)
+        output_path = join(iso_dir, "seed.iso")
+
+        failing_command = join(iso_dir, "failing-iso")
+        with open(failing_command, "w") as fh:
+            fh.write("#!/bin/sh\necho 'no space left' >&2\nexit 1\n")
+        os.chmod(failing_command, 0o755)
+        return_code, msg = asyncio.run(
+            create_cloud_init_disk_from_seed(
+                output_path, seed, create_iso_command=failing_command
+            )
+        )
+        self.assertEqual(return_code, SEED_ISO_ERROR)
+        # The error of the iso command is part of the message
+        self.assertIn(output_path, msg)
+        self.assertIn("no space left", msg)
+        self.assertEqual(os.listdir(iso_dir), ["failing-iso"])
+
+        # A seed phase that times out leaves no temporary iso behind either
+        slow_command = join(iso_dir, "slow-iso")
+        with open(slow_command, "w") as fh:
+            fh.write("#!/bin/sh\nexec sleep 10\n")
+        os.chmod(slow_command, 0o755)
+
+        async def generate():
+            await asyncio.wait_for(
+                create_cloud_init_disk_from_seed(
+                    output_path, seed, create_iso_command=slow_command
+                ),
+                0.2,
+            )
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(generate())
+        self.assertEqual(sorted(os.listdir(iso_dir)), ["failing-iso", "slow-iso"])
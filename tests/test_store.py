@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import http.server
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+from configure_vm_image.common.codes import CHECKSUM_ERROR, DOWNLOAD_ERROR, SUCCESS
+from configure_vm_image.store import (
+    ImageStore,
+    fetch_image,
+    parse_checksum,
+    segments,
+    store_key,
+)
+from configure_vm_image.utils.io import join
+
+SEGMENT_SIZE = 64 * 1024
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the files of the server with support for range requests,
+    which the http.server module does not provide"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+        if not match:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        start, end = int(match.group(1)), int(match.group(2))
+        if start in self.server.fail_ranges:
+            self.server.fail_ranges.discard(start)
+            self.send_error(503)
+            return
+        end = min(end, len(content) - 1)
+        self.send_response(206)
+        self.send_header("ETag", '"{}"'.format(len(content)))
+        self.send_header(
+            "Content-Range", "bytes {}-{}/{}".format(start, end, len(content))
+        )
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        stop = end + 1
+        self.wfile.write(content[start:stop])
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store_dir = join(self.tmp_dir, "store")
+        self.content = os.urandom(5 * SEGMENT_SIZE + 123)
+        self.checksum = hashlib.sha256(self.content).hexdigest()
+
+        self.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), RangeRequestHandler
+        )
+        self.server.files = {
+            "/base.qcow2": self.content,
+            "/base.qcow2.CHECKSUM": "SHA256 (base.qcow2) = {}\n".format(
+                self.checksum
+            ).encode(),
+        }
+        self.server.requests = []
+        self.server.fail_ranges = set()
+        self.url = "http://127.0.0.1:{}/base.qcow2".format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def fetch(self, url=None, **kwargs):
+        kwargs.setdefault("store_dir", self.store_dir)
+        kwargs.setdefault("segment_size", SEGMENT_SIZE)
+        return asyncio.run(fetch_image(url or self.url, **kwargs))
+
+    def test_parse_checksum(self):
+        self.assertEqual(
+            parse_checksum("abc123 (of first 1048576 bytes) images/base.qcow2\n"),
+            ("abc123", 1048576),
+        )
+        self.assertEqual(parse_checksum("ABC123  base.qcow2"), ("abc123", None))
+        self.assertEqual(parse_checksum("abc123"), ("abc123", None))
+        content = "# Rocky\nSHA256 (other.qcow2) = 111\nSHA256 (base.qcow2) = 222\n"
+        self.assertEqual(parse_checksum(content, name="base.qcow2"), ("222", None))
+        self.assertEqual(parse_checksum(content), ("111", None))
+        self.assertIsNone(parse_checksum("not a checksum file"))
+
+    def test_segments(self):
+        self.assertEqual(segments(10, 4), [(0, 3), (4, 7), (8, 9)])
+        self.assertEqual(segments(8, 4), [(0, 3), (4, 7)])
+        self.assertEqual(segments(0, 4), [])
+
+    def test_fetch_is_stored_by_checksum(self):
+        output_path = join(self.tmp_dir, "image.qcow2")
+        return_code, result = self.fetch(
+            checksum_url=self.url + ".CHECKSUM", output_path=output_path
+        )
+        self.assertEqual(return_code, SUCCESS, result.msg)
+        self.assertEqual(result.image_path, output_path)
+        with open(output_path, "rb") as fh:
+            self.assertEqual(fh.read(), self.content)
+        stored_path = ImageStore(self.store_dir).image_path(store_key(self.checksum))
+        self.assertTrue(os.path.exists(stored_path))
+        # The image is fetched in concurrent ranges of the segment size
+        ranges = [
+            byte_range
+            for path, byte_range in self.server.requests
+            if path == "/base.qcow2" and byte_range != "bytes=0-0"
+        ]
+        self.assertEqual(len(ranges), 6)
+
+        # Neither the image is downloaded again, nor is it copied from
+        # the store when it is used without an output path
+        self.server.requests.clear()
+        return_code, result = self.fetch(checksum=self.checksum)
+        self.assertEqual(return_code, SUCCESS)
+        self.assertEqual(result.image_path, stored_path)
+        self.assertEqual(self.server.requests, [])
+
+    def test_fetch_without_checksum_is_found_by_url(self):
+        return_code, result = self.fetch()
+        self.assertEqual(return_code, SUCCESS, result.msg)
+        self.assertTrue(result.image_path.endswith(store_key(self.checksum)))
+
+        self.server.requests.clear()
+        return_code, _ = self.fetch()
+        self.assertEqual(return_code, SUCCESS)
+        self.assertEqual(self.server.requests, [])
+
+    def test_interrupted_fetch_is_resumed(self):
+        self.server.fail_ranges.update({SEGMENT_SIZE, 3 * SEGMENT_SIZE})
+        return_code, result = self.fetch(checksum=self.checksum, retries=0)
+        self.assertEqual(return_code, DOWNLOAD_ERROR)
+        self.assertIn(self.url, result.msg)
+
+        self.server.requests.clear()
+        return_code, result = self.fetch(checksum=self.checksum, retries=0)
+        self.assertEqual(return_code, SUCCESS, result.msg)
+        self.assertEqual(len(self.server.requests), 3)
+        with open(result.image_path, "rb") as fh:
+            self.assertEqual(fh.read(), self.content)
+        # The other segments were completed despite the failures,
+        # such that only the segments that failed are fetched again
+        self.assertEqual(
+            {byte_range for _, byte_range in self.server.requests},
+            {
+                "bytes=0-0",
+                "bytes={}-{}".format(SEGMENT_SIZE, 2 * SEGMENT_SIZE - 1),
+                "bytes={}-{}".format(3 * SEGMENT_SIZE, 4 * SEGMENT_SIZE - 1),
+            },
+        )
+
+    def test_checksum_mismatch(self):
+        return_code, result = self.fetch(checksum="0" * 64)
+        self.assertEqual(return_code, CHECKSUM_ERROR)
+        self.assertIn(self.checksum, result.msg)
+        store = ImageStore(self.store_dir)
+        self.assertEqual(store.entries(), [])
+        self.assertFalse(os.path.exists(store.partial_path(self.url)))
+
+    def test_partial_checksum_of_file_url(self):
+        image_path = join(self.tmp_dir, "base.qcow2")
+        with open(image_path, "wb") as fh:
+            fh.write(self.content)
+        read_bytes = 2 * SEGMENT_SIZE
+        with open(image_path + ".chksum.txt", "w") as fh:
+            fh.write(
+                "{} (of first {} bytes) base.qcow2".format(
+                    hashlib.sha256(self.content[:read_bytes]).hexdigest(), read_bytes
+                )
+            )
+        return_code, result = self.fetch(
+            url="file://" + image_path,
+            checksum_url="file://" + image_path + ".chksum.txt",
+        )
+        self.assertEqual(return_code, SUCCESS, result.msg)
+        self.assertTrue(result.image_path.endswith("-{}".format(read_bytes)))
+        self.assertEqual(self.server.requests, [])
+
+    def test_least_recently_used_images_are_evicted(self):
+        store = ImageStore(self.store_dir, max_size=2 * len(self.content))
+        keys = []
+        for name in ("first", "second", "third"):
+            image_path = join(self.tmp_dir, name)
+            with open(image_path, "wb") as fh:
+                fh.write(self.content)
+            keys.append(name)
+        store.create()
+        for key in keys:
+            store.add(key, join(self.tmp_dir, key), "file:///" + key, key, "sha256")
+        # The first image is used after the second was added
+        self.assertIsNotNone(store.lookup("first"))
+
+        evicted = store.evict(keep=("third",))
+        self.assertEqual([entry["key"] for entry in evicted], ["second"])
+        self.assertEqual(
+            sorted(entry["key"] for entry in store.entries()), ["first", "third"]
+        )
+        self.assertIsNone(store.lookup("second"))
+
+
+if __name__ == "__main__":
+    unittest.main()
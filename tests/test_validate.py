@@ -0,0 +1,144 @@
+import shutil
+import tempfile
+import unittest
+
+from configure_vm_image.common.codes import SEED_VALIDATION_ERROR, SUCCESS
+from configure_vm_image.completion import add_growpart, add_status_reporting
+from configure_vm_image.seed import (
+    SEED_META_DATA,
+    SEED_NETWORK_CONFIG,
+    SEED_USER_DATA,
+    SEED_VENDOR_DATA,
+)
+from configure_vm_image.utils.io import join
+from configure_vm_image.validate import (
+    _validations,
+    validate_meta_data,
+    validate_network_config,
+    validate_seed,
+    validate_seed_file,
+    validate_user_data,
+)
+
+
+class TestValidate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        _validations.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_valid_cloud_config(self):
+        user_data = b"""#cloud-config
+hostname: test
+packages:
+  - htop
+runcmd:
+  - [ls, -l]
+  - echo done
+write_files:
+  - path: /etc/test
+    content: test
+"""
+        self.assertEqual(validate_user_data(user_data), [])
+
+    def test_misspelled_key(self):
+        errors = validate_user_data(b"#cloud-config\npackges:\n  - htop\n")
+        self.assertEqual(len(errors), 1)
+        self.assertIn("'packages'", errors[0])
+        # Keys that are not close to a known key might belong to a newer cloud-init
+        self.assertEqual(validate_user_data(b"#cloud-config\nnew_module: {}\n"), [])
+
+    def test_wrong_type(self):
+        errors = validate_user_data(b"#cloud-config\nruncmd: ls\n")
+        self.assertEqual(len(errors), 1)
+        self.assertIn("'runcmd'", errors[0])
+        errors = validate_user_data(b"#cloud-config\nwrite_files:\n  - content: a\n")
+        self.assertEqual(len(errors), 1)
+        self.assertIn("'path'", errors[0])
+
+    def test_missing_header(self):
+        errors = validate_user_data(b"runcmd:\n  - ls\n")
+        self.assertEqual(len(errors), 1)
+        self.assertIn("#cloud-config", errors[0])
+        self.assertEqual(validate_user_data(b"#!/bin/bash\necho test\n"), [])
+        self.assertEqual(validate_user_data(b""), [])
+
+    def test_yaml_error(self):
+        errors = validate_user_data(b"#cloud-config\nruncmd: [ls\n")
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith("line 3"))
+        self.assertNotEqual(validate_meta_data("instance-id: [a\n"), [])
+
+    def test_multipart(self):
+        vendor_data = add_growpart(
+            add_status_reporting(b"#cloud-config\nruncmd: [ls]\n", channel_name="test")
+        )
+        self.assertEqual(validate_user_data(vendor_data), [])
+        vendor_data = add_status_reporting(
+            b"#cloud-config\nruncmd: ls\n", channel_name="test"
+        )
+        self.assertNotEqual(validate_user_data(vendor_data), [])
+
+    def test_network_config(self):
+        v1 = """network:
+  version: 1
+  config:
+    - type: physical
+      name: eth0
+      subnets:
+        - type: dhcp
+"""
+        self.assertEqual(validate_network_config(v1), [])
+        v2 = """version: 2
+ethernets:
+  eth0:
+    dhcp4: true
+"""
+        self.assertEqual(validate_network_config(v2), [])
+        self.assertEqual(len(validate_network_config("version: 3\n")), 1)
+        self.assertEqual(
+            len(validate_network_config("version: 1\nconfig:\n  - type: physical\n")),
+            1,
+        )
+        self.assertEqual(
+            len(validate_network_config("version: 2\nethernet:\n  eth0: {}\n")), 1
+        )
+
+    def test_validate_seed(self):
+        seed = {
+            SEED_USER_DATA: b"#cloud-config\nhostname: test\n",
+            SEED_META_DATA: b"instance-id: test\n",
+            SEED_VENDOR_DATA: b"#cloud-config\nruncmd: [ls]\n",
+            SEED_NETWORK_CONFIG: b"version: 2\n",
+        }
+        self.assertEqual(validate_seed(seed), (SUCCESS, None))
+        seed[SEED_VENDOR_DATA] = b"runcmd: [ls]\n"
+        return_code, msg = validate_seed(seed)
+        self.assertEqual(return_code, SEED_VALIDATION_ERROR)
+        self.assertIn(SEED_VENDOR_DATA, msg)
+
+    def test_validate_seed_paths(self):
+        user_data_path = join(self.tmp_dir, SEED_USER_DATA)
+        with open(user_data_path, "w") as fh:
+            fh.write("#cloud-config\nhostnme: test\n")
+        return_code, msg = validate_seed(user_data_path=user_data_path)
+        self.assertEqual(return_code, SEED_VALIDATION_ERROR)
+        self.assertIn("'hostname'", msg)
+        return_code, _ = validate_seed(
+            meta_data_path=join(self.tmp_dir, SEED_META_DATA)
+        )
+        self.assertEqual(return_code, SEED_VALIDATION_ERROR)
+
+    def test_validation_cache(self):
+        user_data = b"#cloud-config\npackges: [htop]\n"
+        errors = validate_seed_file(SEED_USER_DATA, user_data)
+        self.assertEqual(len(_validations), 1)
+        # The cached errors are not shared with the caller
+        errors.append("modified")
+        self.assertEqual(validate_seed_file(SEED_USER_DATA, user_data), errors[:1])
+        self.assertEqual(len(_validations), 1)
+        validate_seed_file(SEED_VENDOR_DATA, user_data)
+        self.assertEqual(len(_validations), 2)